@@ -85,6 +85,8 @@ try:
 except:
     import pickle
 import gzip
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -101,31 +103,33 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     column_stack as npcolumn_stack, in1d as npin1d, append as npappend, \
     unique as npunique, argwhere as npargwhere, concatenate as npconcatenate
 
-from numpy.polynomial.legendre import Legendre
+from numpy.polynomial.legendre import legvander
 
-from scipy.optimize import leastsq
-from scipy.signal import medfilt
+from .lazyload import lazy_module, lazy_object, use_agg_backend, \
+    module_available
+
+# these are imported on first use to keep import times down
+leastsq = lazy_object('scipy.optimize', 'leastsq')
+medfilt = lazy_object('scipy.signal', 'medfilt')
 
 # FIXME: should probably add this to setup.py requirements
-try:
-    from sklearn.ensemble import RandomForestRegressor
+if module_available('sklearn'):
+    RandomForestRegressor = lazy_object('sklearn.ensemble',
+                                        'RandomForestRegressor')
     SKLEARN = True
-except:
+else:
     SKLEARN = False
 
 
 from .lcmath import sigclip_magseries, find_lc_timegroups
 
 import os
-import matplotlib
-matplotlib.use('Agg')
-
-import matplotlib.pyplot as plt
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
 
-try:
-    from astropy.io import fits as pyfits
-except:
-    import pyfits
+if module_available('astropy'):
+    pyfits = lazy_module('astropy.io.fits')
+else:
+    pyfits = lazy_module('pyfits')
 
 
 ###########################################
@@ -185,6 +189,10 @@ def flux_ppm_to_magnitudes(ppm):
 
 
 
+# the number of workers to use for consolidating many light curves
+NCPUS = mp.cpu_count()
+
+
 ######################################################
 ## FUNCTIONS FOR READING KEPLER AND K2 LIGHT CURVES ##
 ######################################################
@@ -265,8 +273,8 @@ def read_kepler_fitslc(lcfits,
 
     '''
 
-    # read the fits file
-    hdulist = pyfits.open(lcfits)
+    # read the fits file. we memmap it so only the columns we use are read
+    hdulist = pyfits.open(lcfits, memmap=True)
     lchdr, lcdata = hdulist[1].header, hdulist[1].data
     lctophdr, lcaperturehdr, lcaperturedata = (hdulist[0].header,
                                                hdulist[2].header,
@@ -524,7 +532,7 @@ def read_kepler_fitslc(lcfits,
         ['sap.%s' % x.lower() for x in sapkeys] +
         ['pdc.%s' % x.lower() for x in pdckeys] +
         ['lc_channel','lc_skygroup','lc_module',
-         'lc_output','lc_quarter','lc_season']
+         'lc_output','lc_quarter','lc_season','lc_campaign']
     )
 
     # return the lcdict at the end
@@ -532,33 +540,9 @@ def read_kepler_fitslc(lcfits,
 
 
 
-def consolidate_kepler_fitslc(keplerid,
-                              lcfitsdir,
-                              normalize=True,
-                              headerkeys=LCHEADERKEYS,
-                              datakeys=LCDATAKEYS,
-                              sapkeys=LCSAPKEYS,
-                              pdckeys=LCPDCKEYS,
-                              topkeys=LCTOPKEYS,
-                              apkeys=LCAPERTUREKEYS):
-    '''This gets all light curves for the given keplerid in lcfitsdir.
-
-    Searches recursively in lcfitsdir for all of the files belonging to the
-    specified keplerid. Sorts the light curves by time. Returns an lcdict. This
-    is meant to be used for light curves across quarters.
-
-    NOTE: keplerid is an integer (without the leading zeros). This is usually
-    the KIC ID.
-
-    NOTE: if light curve time arrays contain nans, these and their associated
-    measurements will be sorted to the end of the final combined arrays.
-
-    If normalize == True, then each component light curve's SAP_FLUX and
-    PDCSAP_FLUX measurements will be normalized to 1.0 by dividing out the
-    median flux for the component light curve.
-
-    NOTE: The other flux related measurements, such as errors and backgrounds
-    WILL NOT be normalized (FIXME: for now).
+def _find_kepler_fitslcs(keplerid, lcfitsdir):
+    '''
+    This finds all of the light curve FITS for keplerid in lcfitsdir.
 
     '''
 
@@ -570,8 +554,8 @@ def consolidate_kepler_fitslc(keplerid,
     if sys.version_info[:2] > (3,4):
 
         matching = glob.glob(os.path.join(lcfitsdir,
-                                            '**',
-                                            'kplr%09i-*_llc.fits' % keplerid),
+                                          '**',
+                                          'kplr%09i-*_llc.fits' % keplerid),
                              recursive=True)
         LOGINFO('found %s files: %s' % (len(matching), repr(matching)))
 
@@ -593,49 +577,121 @@ def consolidate_kepler_fitslc(keplerid,
                     LOGINFO('found %s in dir: %s' % (repr(foundfiles),
                                                      os.path.join(root,sdir)))
 
-    # now that we've found everything, read them all in
-    if len(matching) > 0:
+    return matching
 
-        LOGINFO('consolidating...')
 
-        # the first file
-        consolidated = read_kepler_fitslc(matching[0],
-                                          headerkeys=headerkeys,
-                                          datakeys=datakeys,
-                                          sapkeys=sapkeys,
-                                          pdckeys=pdckeys,
-                                          topkeys=topkeys,
-                                          apkeys=apkeys,
-                                          normalize=normalize)
-
-
-        # get the rest of the files
-        for lcf in matching:
-            consolidated = read_kepler_fitslc(lcf,
-                                              appendto=consolidated,
-                                              headerkeys=headerkeys,
-                                              datakeys=datakeys,
-                                              sapkeys=sapkeys,
-                                              pdckeys=pdckeys,
-                                              topkeys=topkeys,
-                                              apkeys=apkeys,
-                                              normalize=normalize)
-
-        # get the sort indices
-        # we use time for the columns and quarters for the headers
-        LOGINFO('sorting by time...')
 
-        # NOTE: nans in time will be sorted to the end of the array
-        finiteind = npisfinite(consolidated['time'])
-        if npsum(finiteind) < consolidated['time'].size:
-            LOGWARNING('some time values are nan! '
-                       'measurements at these times will be '
-                       'sorted to the end of the column arrays.')
+def _read_kepler_quarter(task):
+    '''This reads a single Kepler LC FITS for consolidate_kepler_fitslc.
+
+    task is a tuple of the form:
+
+    (lcfits, dict of kwargs for read_kepler_fitslc)
+
+    The columns are copied out of the memmapped FITS table into native byte
+    order arrays, so only the columns we want are read from the file and they
+    can be sent back from a worker process without carrying the whole table.
+
+    '''
+
+    lcfits, readkwargs = task
+
+    try:
 
-        # get the sort index
-        column_sort_ind = npargsort(consolidated['time'])
+        lcdict = read_kepler_fitslc(lcfits, normalize=False, **readkwargs)
+
+        for col in lcdict['columns']:
+
+            if '.' in col:
+                key, subkey = col.split('.')
+                coldict = lcdict[key]
+            else:
+                subkey, coldict = col, lcdict
+
+            coldict[subkey] = np.array(
+                coldict[subkey],
+                dtype=coldict[subkey].dtype.newbyteorder('=')
+            )
+
+        return lcdict
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not read Kepler LC FITS: %s' % lcfits)
+        return None
+
+
+
+def _consolidate_quarter_lcdicts(quarterlcds):
+    '''This combines single quarter lcdicts into one lcdict sorted by time.
+
+    The columns for all quarters are filled into arrays allocated once at their
+    final size, and then sorted by time once. The per-quarter header info is
+    put in order of the quarters' start times.
+
+    '''
+
+    # put the quarters in time order. quarters with no finite times go last
+    def quarter_start(lcd):
+        finitetimes = lcd['time'][npisfinite(lcd['time'])]
+        return finitetimes.min() if finitetimes.size > 0 else np.inf
+
+    quarterlcds = sorted(quarterlcds, key=quarter_start)
+
+    consolidated = {
+        'objectid':quarterlcds[0]['objectid'],
+        'objectinfo':quarterlcds[0]['objectinfo'],
+        'lcinfo':{},
+        'varinfo':{},
+        'sap':{},
+        'pdc':{},
+        'columns':quarterlcds[0]['columns'],
+    }
+
+    # the per-quarter header info
+    for key in ('quarter','season','datarelease','campaign','obsmode'):
+        consolidated[key] = [x for lcd in quarterlcds for x in lcd[key]]
+    for key in ('lcinfo','varinfo'):
+        for subkey in quarterlcds[0][key]:
+            consolidated[key][subkey] = [
+                x for lcd in quarterlcds for x in lcd[key][subkey]
+            ]
+
+    # fill in the columns
+    ndets = [lcd['time'].size for lcd in quarterlcds]
+    offsets = np.concatenate(([0], np.cumsum(ndets)))
+
+    for col in consolidated['columns']:
+
+        if '.' in col:
+            key, subkey = col.split('.')
+            getcol = lambda lcd: lcd[key][subkey]
+        else:
+            key, subkey = None, col
+            getcol = lambda lcd: lcd[col]
+
+        coldtype = np.result_type(*[getcol(lcd) for lcd in quarterlcds])
+        colarr = np.empty(offsets[-1], dtype=coldtype)
+
+        for lcd, start, stop in zip(quarterlcds, offsets[:-1], offsets[1:]):
+            colarr[start:stop] = getcol(lcd)
+
+        if key is None:
+            consolidated[subkey] = colarr
+        else:
+            consolidated[key][subkey] = colarr
+
+    # the quarters are in order and each is sorted already, so this sort is
+    # mostly just a check
+    if npsum(npisfinite(consolidated['time'])) < consolidated['time'].size:
+        LOGWARNING('some time values are nan! '
+                   'measurements at these times will be '
+                   'sorted to the end of the column arrays.')
+
+    column_sort_ind = npargsort(consolidated['time'], kind='mergesort')
+
+    if (column_sort_ind != nparange(column_sort_ind.size)).any():
 
-        # sort the columns by time
         for col in consolidated['columns']:
             if '.' in col:
                 key, subkey = col.split('.')
@@ -645,28 +701,85 @@ def consolidate_kepler_fitslc(keplerid,
             else:
                 consolidated[col] = consolidated[col][column_sort_ind]
 
-        # now sort the headers by quarters
-        header_sort_ind = npargsort(consolidated['quarter']).tolist()
+    return consolidated
 
-        # this is a bit convoluted, but whatever: list -> array -> list
 
-        for key in ('quarter', 'season', 'datarelease', 'obsmode'):
-            consolidated[key] = (
-                nparray(consolidated[key])[header_sort_ind].tolist()
-            )
 
-        for key in ('timesys','bjdoffset','exptime','lcaperture',
-                    'aperpixused','aperpixunused','pixarcsec',
-                    'channel','skygroup','module','output','ndet'):
-            consolidated['lcinfo'][key] = (
-                nparray(consolidated['lcinfo'][key])[header_sort_ind].tolist()
-            )
+def consolidate_kepler_fitslc(keplerid,
+                              lcfitsdir,
+                              normalize=True,
+                              headerkeys=LCHEADERKEYS,
+                              datakeys=LCDATAKEYS,
+                              sapkeys=LCSAPKEYS,
+                              pdckeys=LCPDCKEYS,
+                              topkeys=LCTOPKEYS,
+                              apkeys=LCAPERTUREKEYS,
+                              lcfitsfiles=None,
+                              nworkers=1):
+    '''This gets all light curves for the given keplerid in lcfitsdir.
 
-        for key in ('cdpp3_0','cdpp6_0','cdpp12_0','pdcvar','pdcmethod',
-                    'aper_target_total_ratio','aper_target_frac'):
-            consolidated['varinfo'][key] = (
-                nparray(consolidated['varinfo'][key])[header_sort_ind].tolist()
-            )
+    Searches recursively in lcfitsdir for all of the files belonging to the
+    specified keplerid. Sorts the light curves by time. Returns an lcdict. This
+    is meant to be used for light curves across quarters.
+
+    NOTE: keplerid is an integer (without the leading zeros). This is usually
+    the KIC ID.
+
+    NOTE: if light curve time arrays contain nans, these and their associated
+    measurements will be sorted to the end of the final combined arrays.
+
+    If normalize == True, then each component light curve's SAP_FLUX and
+    PDCSAP_FLUX measurements will be normalized to 1.0 by dividing out the
+    median flux for the component light curve, using stitch_kepler_lcdict. The
+    SAP_FLUX_ERR and PDCSAP_FLUX_ERR are scaled the same way.
+
+    NOTE: The other flux related measurements, such as backgrounds WILL NOT be
+    normalized (FIXME: for now).
+
+    If lcfitsfiles is a list of the light curve FITS for keplerid, these are
+    used directly and lcfitsdir isn't searched.
+
+    nworkers is the number of processes to use to read the quarters. The
+    default of 1 reads them in this process, which is best when consolidating
+    many objects in parallel with parallel_consolidate_kepler_fitslc.
+
+    '''
+
+    if lcfitsfiles is None:
+        matching = _find_kepler_fitslcs(keplerid, lcfitsdir)
+    else:
+        matching = lcfitsfiles
+
+    # now that we've found everything, read them all in
+    if len(matching) > 0:
+
+        LOGINFO('consolidating...')
+
+        readkwargs = {'headerkeys':headerkeys,
+                      'datakeys':datakeys,
+                      'sapkeys':sapkeys,
+                      'pdckeys':pdckeys,
+                      'topkeys':topkeys,
+                      'apkeys':apkeys}
+        tasks = [(x, readkwargs) for x in sorted(set(matching))]
+
+        if nworkers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+                quarterlcds = list(executor.map(_read_kepler_quarter, tasks))
+        else:
+            quarterlcds = [_read_kepler_quarter(x) for x in tasks]
+
+        quarterlcds = [x for x in quarterlcds if x is not None]
+
+        if len(quarterlcds) == 0:
+            LOGERROR('could not read any light curves for %s' % keplerid)
+            return None
+
+        LOGINFO('sorting by time...')
+        consolidated = _consolidate_quarter_lcdicts(quarterlcds)
+
+        if normalize:
+            consolidated = stitch_kepler_lcdict(consolidated, normto=1.0)
 
         # finally, return the consolidated lcdict
         return consolidated
@@ -680,6 +793,112 @@ def consolidate_kepler_fitslc(keplerid,
         return None
 
 
+
+def _consolidate_worker(task):
+    '''
+    This is the parallel worker for parallel_consolidate_kepler_fitslc.
+
+    '''
+
+    keplerid, lcfitsfiles, outdir, outformat, consolidatekwargs = task
+
+    try:
+
+        lcdict = consolidate_kepler_fitslc(keplerid,
+                                           None,
+                                           lcfitsfiles=lcfitsfiles,
+                                           **consolidatekwargs)
+        if lcdict is None:
+            return keplerid, None
+
+        if outformat == 'npz':
+            outfile = os.path.join(outdir, 'kplr%09i-keplc.npz' % keplerid)
+            return keplerid, kepler_lcdict_to_npz(lcdict, outfile=outfile)
+        else:
+            outfile = os.path.join(outdir, 'kplr%09i-keplc.pkl' % keplerid)
+            return keplerid, kepler_lcdict_to_pkl(lcdict, outfile=outfile)
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not consolidate light curves for %s' % keplerid)
+        return keplerid, None
+
+
+
+def parallel_consolidate_kepler_fitslc(keplerids,
+                                       lcfitsdir,
+                                       outdir,
+                                       normalize=True,
+                                       outformat='pkl',
+                                       nworkers=NCPUS,
+                                       **readkwargs):
+    '''This consolidates the light curves for many Kepler IDs in parallel.
+
+    keplerids is a list of Kepler IDs (integers, usually KIC IDs). If this is
+    None, all Kepler IDs with light curves in lcfitsdir are used.
+
+    lcfitsdir is searched recursively for the light curve FITS. This is only
+    done once for all of the keplerids.
+
+    Each object is consolidated using consolidate_kepler_fitslc and written to
+    outdir as kplr<keplerid>-keplc.pkl if outformat is 'pkl' or as
+    kplr<keplerid>-keplc.npz if outformat is 'npz'. The npz files are faster to
+    write and read for large numbers of light curves; read them back with
+    read_kepler_npzlc.
+
+    readkwargs are passed to consolidate_kepler_fitslc (e.g. datakeys).
+
+    Returns a dict of the form {keplerid: output file or None if failed}.
+
+    '''
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # find all of the light curves in a single pass through the directory
+    LOGINFO('looking for Kepler light curve FITS in %s...' % lcfitsdir)
+
+    lcfitsfiles = {}
+    for root, dirs, files in os.walk(lcfitsdir):
+        for fname in fnmatch.filter(files, 'kplr*-*_llc.fits'):
+            try:
+                thiskeplerid = int(fname[4:13])
+            except ValueError:
+                continue
+            lcfitsfiles.setdefault(thiskeplerid, []).append(
+                os.path.join(root, fname)
+            )
+
+    if keplerids is None:
+        keplerids = sorted(lcfitsfiles.keys())
+
+    LOGINFO('found light curves for %s objects, consolidating %s...' %
+            (len(lcfitsfiles), len(keplerids)))
+
+    consolidatekwargs = {'normalize':normalize}
+    consolidatekwargs.update(readkwargs)
+
+    results = {}
+    tasks = []
+
+    for keplerid in keplerids:
+        if keplerid in lcfitsfiles:
+            tasks.append((keplerid, lcfitsfiles[keplerid], outdir,
+                          outformat, consolidatekwargs))
+        else:
+            LOGERROR('could not find any light curves '
+                     'for %s in %s or its subdirectories' % (keplerid,
+                                                             lcfitsdir))
+            results[keplerid] = None
+
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        for keplerid, outfile in executor.map(_consolidate_worker, tasks):
+            results[keplerid] = outfile
+
+    return results
+
+
+
 ########################
 ## READING K2 SFF LCs ##
 ########################
@@ -853,18 +1072,153 @@ def read_kepler_pklc(picklefile):
 
 
 
+def kepler_lcdict_to_npz(lcdict,
+                         outfile=None):
+    '''This writes the lcdict to an uncompressed npz file.
+
+    The light curve columns are stored as separate arrays and everything else
+    in the lcdict is pickled into a single extra array. For consolidated light
+    curves with lots of points, this is faster to write and read than a pickle.
+
+    '''
+
+    if not outfile:
+        outfile = '%s-keplc.npz' % lcdict['objectid'].replace(' ','-')
+
+    columns = {}
+    metadata = {}
+
+    for key in lcdict:
+        if key in ('sap','pdc'):
+            metadata[key] = {}
+        elif key not in lcdict['columns']:
+            metadata[key] = lcdict[key]
+
+    for col in lcdict['columns']:
+        if '.' in col:
+            key, subkey = col.split('.')
+            columns[col] = lcdict[key][subkey]
+        else:
+            columns[col] = lcdict[col]
+
+    # anything in sap and pdc that's not a column goes into the metadata
+    for key in ('sap','pdc'):
+        for subkey in lcdict.get(key, {}):
+            if '%s.%s' % (key, subkey) not in lcdict['columns']:
+                metadata[key][subkey] = lcdict[key][subkey]
+
+    columns['__lcdict_metadata__'] = np.frombuffer(
+        pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL),
+        dtype=np.uint8
+    )
+
+    # np.savez adds .npz to the file name if it's not there, so we use a file
+    # object to write exactly to outfile
+    with open(outfile,'wb') as outfd:
+        np.savez(outfd, **columns)
+
+    return os.path.abspath(outfile)
+
+
+
+def read_kepler_npzlc(npzfile):
+    '''This reads an npz light curve written by kepler_lcdict_to_npz.
+
+    Returns an lcdict.
+
+    '''
+
+    with np.load(npzfile) as npzdata:
+
+        lcdict = pickle.loads(npzdata['__lcdict_metadata__'].tobytes())
+
+        for col in lcdict['columns']:
+            if '.' in col:
+                key, subkey = col.split('.')
+                lcdict[key][subkey] = npzdata[col]
+            else:
+                lcdict[col] = npzdata[col]
+
+    return lcdict
+
+
+
 ##########################
 ## KEPLER LC PROCESSING ##
 ##########################
 
-def stitch_kepler_lcdict(lcdict):
-    '''
-    This stitches Kepler light curves together across quarters.
+def stitch_kepler_lcdict(lcdict,
+                         fluxcols=('sap.sap_flux','pdc.pdcsap_flux'),
+                         errcols=('sap.sap_flux_err','pdc.pdcsap_flux_err'),
+                         normto=None):
+    '''This stitches Kepler light curves together across quarters.
 
-    FIXME: implement this.
+    Each quarter's fluxes in fluxcols are divided by the quarter's median flux,
+    which removes the flux level offsets between quarters from the spacecraft
+    rolls and the different CCD channels the object lands on. The errs in
+    errcols are scaled the same way.
+
+    The quarters are taken from the lc_quarter column, or from the lc_campaign
+    column for K2 light curves.
+
+    If normto is None, the stitched fluxes are then multiplied by the median of
+    the quarter medians to keep them near the original flux level. Otherwise,
+    they're multiplied by normto, e.g. use normto=1.0 to get normalized fluxes.
+
+    This stitches the dict IN PLACE, and returns it as well. The quarters and
+    their median fluxes are stored in lcdict['stitchinfo'].
 
     '''
 
+    if npisfinite(lcdict['lc_quarter']).any():
+        quartercol = lcdict['lc_quarter']
+    else:
+        quartercol = lcdict['lc_campaign']
+
+    quarters = npunique(quartercol[npisfinite(quartercol)])
+    quarterinds = [quartercol == x for x in quarters]
+
+    stitchinfo = {'quarters':quarters.tolist(),
+                  'normto':normto,
+                  'medians':{}}
+
+    for fluxcol, errcol in zip(fluxcols, errcols):
+
+        fluxkey, fluxsubkey = fluxcol.split('.')
+        errkey, errsubkey = errcol.split('.')
+
+        fluxes = np.array(lcdict[fluxkey][fluxsubkey], dtype=np.float64)
+        errs = np.array(lcdict[errkey][errsubkey], dtype=np.float64)
+
+        medians = []
+
+        for qind in quarterinds:
+
+            qmedian = (np.nanmedian(fluxes[qind])
+                       if npisfinite(fluxes[qind]).any() else npnan)
+            medians.append(qmedian)
+
+            if npisfinite(qmedian) and qmedian != 0.0:
+                fluxes[qind] = fluxes[qind]/qmedian
+                errs[qind] = errs[qind]/qmedian
+
+        medians = nparray(medians)
+
+        if normto is None:
+            finitemedians = medians[npisfinite(medians)]
+            scale = (npmedian(finitemedians) if finitemedians.size > 0
+                     else 1.0)
+        else:
+            scale = normto
+
+        lcdict[fluxkey][fluxsubkey] = fluxes*scale
+        lcdict[errkey][errsubkey] = errs*scale
+
+        stitchinfo['medians'][fluxcol] = medians.tolist()
+
+    lcdict['stitchinfo'] = stitchinfo
+    return lcdict
+
 
 
 def filter_kepler_lcdict(lcdict,
@@ -1536,29 +1890,12 @@ def detrend_centroid(lcd, detrend='legendre', sigclip=None, mingap=0.5):
 
     if detrend == 'legendre':
         mingap = 0.5 # days
-        ngroups, groups = find_lc_timegroups(s_times, mingap=mingap)
-        tmpctdxlegfit, tmpctdylegfit, legdegs = [], [], []
-        for group in groups:
-            tg_times = s_times[group]
-            tg_ctd_x = s_ctd_x[group]
-            tg_ctd_x_err = s_ctd_x_err[group]
-            tg_ctd_y = s_ctd_y[group]
-            tg_ctd_y_err = s_ctd_y_err[group]
-
-            legdeg = _get_legendre_deg_ctd(len(tg_times))
-            tg_ctd_x_fit, _, _ = _legendre_dtr(tg_times,tg_ctd_x,tg_ctd_x_err,
-                                               legendredeg=legdeg)
-            tg_ctd_y_fit, _, _ = _legendre_dtr(tg_times,tg_ctd_y,tg_ctd_y_err,
-                                               legendredeg=legdeg)
-
-            tmpctdxlegfit.append(tg_ctd_x_fit)
-            tmpctdylegfit.append(tg_ctd_y_fit)
-            legdegs.append(legdeg)
-
-        fit_ctd_x, fit_ctd_y = nparray([]), nparray([])
-        for ix, _ in enumerate(tmpctdxlegfit):
-            fit_ctd_x = npappend(fit_ctd_x, tmpctdxlegfit[ix])
-            fit_ctd_y = npappend(fit_ctd_y, tmpctdylegfit[ix])
+        # both centroid axes share the same times, so they're fit together
+        ctdfit = legendre_detrend_batch(s_times,
+                                        [s_ctd_x, s_ctd_y],
+                                        errs=[s_ctd_x_err, s_ctd_y_err],
+                                        mingap=mingap)
+        fit_ctd_x, fit_ctd_y = ctdfit['fits']
 
     ctd_dtr = {'times':s_times,
                'ctd_x':s_ctd_x,
@@ -1638,34 +1975,49 @@ def get_centroid_offsets(lcd, t_ing_egr, oot_buffer_time=0.1, sample_factor=3):
     ctd_resid_x = lcd['ctd_dtr']['ctd_x'] - lcd['ctd_dtr']['fit_ctd_x']
     ctd_resid_y = lcd['ctd_dtr']['ctd_y'] - lcd['ctd_dtr']['fit_ctd_y']
 
+    # The window edges for all transits are found at once with searchsorted
+    # on the sorted times. All windows use strict inequalities, so the left
+    # edges use side='right' and the right edges use side='left'.
+    if times.size > 1 and not npall(np.diff(times) >= 0.0):
+        sortind = npargsort(times, kind='mergesort')
+        times = times[sortind]
+        ctd_resid_x = ctd_resid_x[sortind]
+        ctd_resid_y = ctd_resid_y[sortind]
+
+    t_ing_egr = np.asarray(t_ing_egr, dtype=np.float64).reshape(-1, 2)
+    t_ing, t_egr = t_ing_egr[:,0], t_ing_egr[:,1]
+
+    # Compute out of transit windows on either side of the in-transit times.
+    oot_window_len = sample_factor * (t_egr - t_ing)
+
+    tra_lo = np.searchsorted(times, t_ing, side='right')
+    tra_hi = np.searchsorted(times, t_egr, side='left')
+    before_lo = np.searchsorted(times, t_ing-oot_buffer_time-oot_window_len,
+                                side='right')
+    before_hi = np.searchsorted(times, t_ing-oot_buffer_time, side='left')
+    after_lo = np.searchsorted(times, t_egr+oot_buffer_time, side='right')
+    after_hi = np.searchsorted(times, t_egr+oot_buffer_time+oot_window_len,
+                               side='left')
+
+    # Convert to units of arcseconds.
+    ctd_x_arcsec = ctd_resid_x*arcsec_per_px
+    ctd_y_arcsec = ctd_resid_y*arcsec_per_px
+
     # Return results in "centroid dictionary" (has keys of transit number).
     cd = {}
-    for ix,(t_ing,t_egr) in enumerate(t_ing_egr):
+    for ix in range(t_ing_egr.shape[0]):
 
-        # We have in-transit times as input.
-        in_tra_times = times[(times > t_ing) & (times < t_egr)]
+        tra = slice(tra_lo[ix], max(tra_lo[ix], tra_hi[ix]))
+        before = slice(before_lo[ix], max(before_lo[ix], before_hi[ix]))
+        after = slice(after_lo[ix], max(after_lo[ix], after_hi[ix]))
 
-        # Compute out of transit times on either side of the in-transit times.
-        transit_dur = t_egr - t_ing
-        oot_window_len = sample_factor * transit_dur
+        in_tra_times = times[tra]
+        oot_times = npconcatenate([times[before], times[after]])
 
-        oot_before = times[
-                (times < (t_ing-oot_buffer_time)) &
-                (times > (t_ing-oot_buffer_time-oot_window_len))]
-        oot_after = times[
-                (times > (t_egr+oot_buffer_time)) &
-                (times < (t_egr+oot_buffer_time+oot_window_len))]
-
-        oot_times = npconcatenate([oot_before, oot_after])
-
-        mask_tra = npin1d(times, in_tra_times)
-        mask_oot = npin1d(times, oot_times)
-
-        # Convert to units of arcseconds.
-        ctd_x_in_tra = ctd_resid_x[mask_tra]*arcsec_per_px
-        ctd_y_in_tra = ctd_resid_y[mask_tra]*arcsec_per_px
-        ctd_x_oot = ctd_resid_x[mask_oot]*arcsec_per_px
-        ctd_y_oot = ctd_resid_y[mask_oot]*arcsec_per_px
+        ctd_x_in_tra = ctd_x_arcsec[tra]
+        ctd_y_in_tra = ctd_y_arcsec[tra]
+        ctd_x_oot = npconcatenate([ctd_x_arcsec[before], ctd_x_arcsec[after]])
+        ctd_y_oot = npconcatenate([ctd_y_arcsec[before], ctd_y_arcsec[after]])
 
         cd[ix] = {'ctd_x_in_tra':ctd_x_in_tra,
                   'ctd_y_in_tra':ctd_y_in_tra,
@@ -1686,16 +2038,22 @@ def get_centroid_offsets(lcd, t_ing_egr, oot_buffer_time=0.1, sample_factor=3):
 # UTILITY FUNCTION FOR CENTROID DETRENDING #
 ############################################
 def _get_legendre_deg_ctd(npts):
-    from scipy.interpolate import interp1d
+    '''
+    This returns the Legendre series degree to use for a timegroup with `npts`
+    points. `npts` can also be an array of timegroup sizes.
+    '''
 
     degs = nparray([4,5,6,10,15])
     pts = nparray([1e2,3e2,5e2,1e3,3e3])
-    fn = interp1d(pts, degs, kind='linear',
-                 bounds_error=False,
-                 fill_value=(min(degs), max(degs)))
-    legendredeg = int(npfloor(fn(npts)))
 
-    return legendredeg
+    # np.interp holds the end values outside the range of pts, which is what
+    # the scipy interp1d with fill_value=(min(degs), max(degs)) did before
+    legendredeg = npfloor(np.interp(npts, pts, degs)).astype(int)
+
+    if legendredeg.ndim == 0:
+        return int(legendredeg)
+    else:
+        return legendredeg
 
 
 #######################################
@@ -1708,18 +2066,11 @@ def _legendre_dtr(x, y, y_err, legendredeg=10):
         y (np.array): dependent variable.
         y_err (np.array): errors of y for x**2 calculation.
     '''
-    try:
-        p = Legendre.fit(x, y, legendredeg)
-        fit_y = p(x)
-    except:
-        fit_y = npzeros_like(y)
 
-    fitchisq = npsum(
-        ((fit_y - y)*(fit_y - y)) / (y_err*y_err)
-    )
-
-    nparams = legendredeg + 1
-    fitredchisq = fitchisq/(len(y) - nparams - 1)
+    dtr = legendre_detrend_batch(x, y, errs=y_err,
+                                 mingap=None, legendredeg=legendredeg)
+    fit_y = dtr['fits'][0]
+    fitchisq, fitredchisq = dtr['chisq'][0], dtr['redchisq'][0]
 
     LOGINFO(
         'legendre detrend applied. chisq = %.5f, reduced chisq = %.5f' %
@@ -1727,3 +2078,169 @@ def _legendre_dtr(x, y, y_err, legendredeg=10):
     )
 
     return fit_y, fitchisq, fitredchisq
+
+
+
+def _legendre_vander(x, legendredeg):
+    '''
+    This returns the Legendre Vandermonde matrix for x, after mapping x to the
+    [-1, 1] window the same way `Legendre.fit` does.
+    '''
+
+    xmin, xmax = npmin(x), npmax(x)
+
+    if xmax > xmin:
+        xs = (2.0*x - (xmax + xmin))/(xmax - xmin)
+    else:
+        xs = npzeros_like(x)
+
+    return legvander(xs, legendredeg)
+
+
+
+def _legendre_lstsq(vander, rhs):
+    '''
+    This solves vander . coeffs = rhs for all columns of rhs at once.
+
+    The columns of vander are scaled to unit norm first, as in `Legendre.fit`.
+    '''
+
+    colscale = npsqrt(npsum(vander*vander, axis=0))
+    colscale[colscale == 0.0] = 1.0
+
+    coeffs = np.linalg.lstsq(vander/colscale,
+                             rhs,
+                             rcond=vander.shape[0]*np.finfo(vander.dtype).eps)[0]
+
+    return coeffs/colscale[:,None]
+
+
+
+def legendre_detrend_batch(times,
+                           series,
+                           errs=None,
+                           mingap=0.5,
+                           legendredeg=None):
+    '''This fits Legendre series to many time series that share their times.
+
+    The times are split into timegroups separated by more than `mingap` days
+    and a Legendre series is fit to each timegroup. The Vandermonde matrix is
+    built once per timegroup and then all series are solved in one
+    least-squares call, so fitting the x and y centroids of a target, or the
+    same quantity for many targets observed at the same cadences, costs about
+    the same as fitting one series. Series that have non-finite values are
+    fit only at their finite points; series with the same missing points are
+    still solved together.
+
+    Args:
+        times (np.array): the times of the series, an array of length N. This
+        should be sorted in time order.
+
+        series (np.array): a K x N array (or a list of K arrays of length N) of
+        the series to fit. A single 1-D series is also OK.
+
+        errs (np.array or None): K x N errors for the series. These are only
+        used to get the chi-squared values of the fits.
+
+        mingap (float or None): the gap in days between timegroups. If this is
+        None, each series is fit as a single timegroup.
+
+        legendredeg (int or None): the degree of the Legendre series. If this
+        is None, the degree for each timegroup is chosen from its number of
+        points using the same scheme as `detrend_centroid`.
+
+    Returns:
+        dict: of the form::
+
+            {'fits': K x N array of the fit values at each time,
+             'chisq': K array of chi-squared values (NaN if errs is None),
+             'redchisq': K array of reduced chi-squared values,
+             'legendredegs': the degree used for each timegroup,
+             'groups': the timegroups as slices into times}
+
+        Series with no more than `legendredeg` finite points in a timegroup
+        get the minimum-norm least-squares fit through those points, the same
+        as `Legendre.fit` gives. Any series that couldn't be fit in a
+        timegroup (no finite points or an SVD that didn't converge) gets zeros
+        as its fit in that timegroup.
+
+    '''
+
+    times = np.asarray(times, dtype=np.float64)
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    nseries, npts = series.shape
+
+    finite = npisfinite(series) & npisfinite(times)[None,:]
+
+    if errs is not None:
+        errs = np.atleast_2d(np.asarray(errs, dtype=np.float64))
+        finite &= npisfinite(errs)
+
+    if mingap is None or npts < 2:
+        groups = [slice(0, npts)]
+    else:
+        ngroups, groups = find_lc_timegroups(times, mingap=mingap)
+
+    fits = npzeros((nseries, npts), dtype=np.float64)
+    nparams = npzeros(nseries, dtype=np.int64)
+    legendredegs = []
+
+    for group in groups:
+
+        gtimes = times[group]
+        if gtimes.size == 0:
+            legendredegs.append(None)
+            continue
+
+        if legendredeg is None:
+            legdeg = _get_legendre_deg_ctd(gtimes.size)
+        else:
+            legdeg = legendredeg
+        legendredegs.append(legdeg)
+
+        vander = _legendre_vander(gtimes, legdeg)
+        gseries = series[:,group]
+        gfinite = finite[:,group]
+
+        # series with the same finite points share the same solve. in the
+        # usual case where everything is finite, this is a single solve.
+        if npall(gfinite):
+            patterns = gfinite[:1]
+            patternind = npzeros(nseries, dtype=np.int64)
+        else:
+            patterns, patternind = npunique(gfinite,
+                                            axis=0,
+                                            return_inverse=True)
+            patternind = patternind.ravel()
+
+        for pind, pattern in enumerate(patterns):
+
+            rows = npwhere(patternind == pind)[0]
+
+            # with no more than legdeg points, lstsq gives the minimum-norm
+            # solution that goes through them, just like Legendre.fit does
+            if npsum(pattern) == 0:
+                continue
+
+            try:
+                coeffs = _legendre_lstsq(vander[pattern],
+                                         gseries[rows][:,pattern].T)
+            except np.linalg.LinAlgError:
+                continue
+
+            fits[rows, group] = np.dot(vander, coeffs).T
+            nparams[rows] += legdeg + 1
+
+    if errs is not None:
+        resid = np.where(finite, (fits - series)/errs, 0.0)
+        chisq = npsum(resid*resid, axis=1)
+        redchisq = chisq/(npsum(finite, axis=1) - nparams - 1)
+    else:
+        chisq = np.full(nseries, npnan)
+        redchisq = np.full(nseries, npnan)
+
+    return {'fits':fits,
+            'chisq':chisq,
+            'redchisq':redchisq,
+            'legendredegs':legendredegs,
+            'groups':groups}
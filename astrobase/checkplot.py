@@ -144,25 +144,50 @@ import numpy as np
 from numpy import nan as npnan, isfinite as npisfinite, \
     min as npmin, max as npmax, abs as npabs, ravel as npravel
 
-# we're going to plot using Agg only
-import matplotlib
-MPLVERSION = tuple([int(x) for x in matplotlib.__version__.split('.')])
-matplotlib.use('Agg')
+from .lazyload import lazy_module, lazy_object, use_agg_backend
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
-
-# import this to check if stimes, smags, serrs are Column objects
-from astropy.table import Column as astcolumn
+# these are heavy, so they're imported on first use. we're going to plot using
+# Agg only, so this is set before pyplot is imported.
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
+inset_axes = lazy_object('mpl_toolkits.axes_grid1.inset_locator',
+                         'inset_axes',
+                         onload=use_agg_backend)
 
 # import this to get neighbors and their x,y coords from the Skyview FITS
-from astropy.wcs import WCS
+WCS = lazy_object('astropy.wcs', 'WCS')
 
 # import from Pillow to generate pngs from checkplot dicts
-from PIL import Image, ImageDraw, ImageFont
+Image = lazy_module('PIL.Image')
+ImageDraw = lazy_module('PIL.ImageDraw')
+ImageFont = lazy_module('PIL.ImageFont')
 
 # import sps.cKDTree for external catalog xmatches
-from scipy.spatial import cKDTree
+cKDTree = lazy_object('scipy.spatial', 'cKDTree')
+
+
+def _get_mplversion():
+    '''This returns the matplotlib version as a tuple of ints.
+
+    This imports matplotlib if it hasn't been imported yet.
+
+    '''
+
+    import matplotlib
+    return tuple([int(x) for x in matplotlib.__version__.split('.')])
+
+
+
+def _is_astropy_column(x):
+    '''This checks if x is an astropy.table.Column.
+
+    If astropy.table hasn't been imported yet, x can't be a Column, so this
+    doesn't need to import it.
+
+    '''
+
+    astropy_table = sys.modules.get('astropy.table')
+    return (astropy_table is not None and
+            isinstance(x, astropy_table.Column))
 
 
 ###################
@@ -181,7 +206,12 @@ from .varclass.starfeatures import coord_features, color_features, \
 
 from .plotbase import skyview_stamp, \
     PLOTYLABELS, METHODLABELS, METHODSHORTLABELS
-from .coordutils import total_proper_motion, reduced_proper_motion
+from .plotbase import decimate_points, _get_plot_template, \
+    _layout_plot_template, _save_plot_template, _axes_pixel_columns, \
+    _padded_limits, _draw_decimated_scatter
+from .services import skyview, dust
+from .coordutils import total_proper_motion, reduced_proper_motion, \
+    make_kdtree, xmatch_bulk
 
 
 #######################
@@ -212,7 +242,7 @@ def _make_periodogram(axes,
     # make the LSP plot on the first subplot
     axes.plot(periods,lspvals)
 
-    axes.set_xscale('log',basex=10)
+    axes.set_xscale('log')
     axes.set_xlabel('Period [days]')
     axes.set_ylabel(pgramylabel)
     plottitle = '%s - %.6f d' % (METHODLABELS[lspinfo['method']],
@@ -236,6 +266,25 @@ def _make_periodogram(axes,
 
 
     # if objectinfo is present, get things from it
+    _add_periodogram_objectinfo(axes, objectinfo,
+                                findercmap, finderconvolve,
+                                verbose=verbose,
+                                findercachedir=findercachedir)
+
+
+
+def _add_periodogram_objectinfo(axes,
+                                objectinfo,
+                                findercmap,
+                                finderconvolve,
+                                verbose=True,
+                                findercachedir='~/.astrobase/stamp-cache'):
+    '''adds the objectinfo and finder chart to the periodogram tile.
+
+    This does nothing if objectinfo doesn't have an object ID and coordinates.
+
+    '''
+
     if (objectinfo and isinstance(objectinfo, dict) and
         ('objectid' in objectinfo or 'hatid' in objectinfo) and
         'ra' in objectinfo and 'decl' in objectinfo and
@@ -451,23 +500,19 @@ def _make_magseries_plot(axes,
 
 
 
-def _make_phased_magseries_plot(axes,
-                                periodind,
-                                stimes, smags, serrs,
-                                varperiod, varepoch,
-                                phasewrap, phasesort,
-                                phasebin, minbinelems,
-                                plotxlim,
-                                lspmethod,
-                                lspmethodind=0,
-                                xliminsetmode=False,
-                                twolspmode=False,
-                                magsarefluxes=False,
-                                verbose=True):
-    '''makes the phased magseries plot tile.
+def _get_phased_magseries(periodind,
+                          stimes, smags, serrs,
+                          varperiod, varepoch,
+                          phasewrap, phasesort,
+                          phasebin, minbinelems,
+                          lspmethodind=0,
+                          twolspmode=False,
+                          magsarefluxes=False,
+                          verbose=True):
+    '''gets the epoch and the phased (and binned) LC for a phased LC tile.
 
-    if xliminsetmode = True, then makes a zoomed-in plot with the provided
-    plotxlim as the main x limits, and the full plot as an inset.
+    Returns a dict with keys: 'epoch', 'phase', 'mags', 'binnedphase',
+    'binnedmags'. The binned values are None if phasebin is None.
 
     '''
 
@@ -568,6 +613,166 @@ def _make_phased_magseries_plot(axes,
         binplotphase = binphasedlc['binnedphases']
         binplotmags = binphasedlc['binnedmags']
 
+    else:
+
+        binplotphase = None
+        binplotmags = None
+
+    return {'epoch':plotvarepoch,
+            'phase':plotphase,
+            'mags':plotmags,
+            'binnedphase':binplotphase,
+            'binnedmags':binplotmags}
+
+
+
+def _phased_magseries_title(periodind,
+                            varperiod,
+                            plotvarepoch,
+                            lspmethod,
+                            twolspmode=False):
+    '''makes the title for a phased LC tile.
+
+    '''
+
+    if periodind == 0:
+        plottitle = '%s best period: %.6f d - epoch: %.5f' % (
+            METHODSHORTLABELS[lspmethod],
+            varperiod,
+            plotvarepoch
+        )
+    elif periodind == 1 and not twolspmode:
+        plottitle = '%s best period x 0.5: %.6f d - epoch: %.5f' % (
+            METHODSHORTLABELS[lspmethod],
+            varperiod,
+            plotvarepoch
+        )
+    elif periodind == 2 and not twolspmode:
+        plottitle = '%s best period x 2: %.6f d - epoch: %.5f' % (
+            METHODSHORTLABELS[lspmethod],
+            varperiod,
+            plotvarepoch
+        )
+    elif periodind > 2 and not twolspmode:
+        plottitle = '%s peak %s: %.6f d - epoch: %.5f' % (
+            METHODSHORTLABELS[lspmethod],
+            periodind-1,
+            varperiod,
+            plotvarepoch
+        )
+    elif periodind > 0:
+        plottitle = '%s peak %s: %.6f d - epoch: %.5f' % (
+            METHODSHORTLABELS[lspmethod],
+            periodind+1,
+            varperiod,
+            plotvarepoch
+        )
+
+    return plottitle
+
+
+
+def _bump_ylim_for_inset(axes, magsarefluxes=False):
+    '''bumps the ylim of a phased LC tile so an inset plot can fit in it.
+
+    '''
+
+    axesylim = axes.get_ylim()
+
+    if magsarefluxes:
+        axes.set_ylim(axesylim[0],
+                      axesylim[1] + 0.5*npabs(axesylim[1]-axesylim[0]))
+    else:
+        axes.set_ylim(axesylim[0],
+                      axesylim[1] - 0.5*npabs(axesylim[1]-axesylim[0]))
+
+
+
+def _add_phased_inset(axes,
+                      plotphase, plotmags,
+                      binplotphase, binplotmags,
+                      phasewrap,
+                      magsarefluxes=False):
+    '''adds an inset with the full phased LC to a phased LC tile.
+
+    binplotphase and binplotmags are None if there's no binned phased LC.
+
+    '''
+
+    # put the inset axes in
+    inset = inset_axes(axes, width="40%", height="40%", loc=1)
+
+    # make the scatter plot for the phased LC plot
+    inset.plot(plotphase,
+               plotmags,
+               marker='o',
+               ms=2.0, ls='None',mew=0,
+               color='gray',
+               rasterized=True)
+
+    # overlay the binned phased LC plot if we're making one
+    if binplotphase is not None:
+        inset.plot(binplotphase,
+                   binplotmags,
+                   marker='o',
+                   ms=4.0, ls='None',mew=0,
+                   color='#1c1e57',
+                   rasterized=True)
+
+    # show the full phase coverage
+    if phasewrap:
+        inset.set_xlim(-0.2,0.8)
+    else:
+        inset.set_xlim(-0.1,1.1)
+
+    # flip y axis for mags
+    if not magsarefluxes:
+        inset_ylim = inset.get_ylim()
+        inset.set_ylim((inset_ylim[1], inset_ylim[0]))
+
+    # set the plot title
+    inset.text(0.5,0.1,'full phased light curve',
+               ha='center',va='center',transform=inset.transAxes)
+    # don't show axes labels or ticks
+    inset.set_xticks([])
+    inset.set_yticks([])
+
+    return inset
+
+
+
+def _make_phased_magseries_plot(axes,
+                                periodind,
+                                stimes, smags, serrs,
+                                varperiod, varepoch,
+                                phasewrap, phasesort,
+                                phasebin, minbinelems,
+                                plotxlim,
+                                lspmethod,
+                                lspmethodind=0,
+                                xliminsetmode=False,
+                                twolspmode=False,
+                                magsarefluxes=False,
+                                verbose=True):
+    '''makes the phased magseries plot tile.
+
+    if xliminsetmode = True, then makes a zoomed-in plot with the provided
+    plotxlim as the main x limits, and the full plot as an inset.
+
+    '''
+
+    phased = _get_phased_magseries(periodind,
+                                   stimes, smags, serrs,
+                                   varperiod, varepoch,
+                                   phasewrap, phasesort,
+                                   phasebin, minbinelems,
+                                   lspmethodind=lspmethodind,
+                                   twolspmode=twolspmode,
+                                   magsarefluxes=magsarefluxes,
+                                   verbose=verbose)
+    plotvarepoch = phased['epoch']
+    plotphase, plotmags = phased['phase'], phased['mags']
+    binplotphase, binplotmags = phased['binnedphase'], phased['binnedmags']
 
     # finally, make the phased LC plot
     axes.plot(plotphase,
@@ -621,93 +826,310 @@ def _make_phased_magseries_plot(axes,
     axes.get_xaxis().get_major_formatter().set_useOffset(False)
 
     # make the plot title
-    if periodind == 0:
-        plottitle = '%s best period: %.6f d - epoch: %.5f' % (
-            METHODSHORTLABELS[lspmethod],
-            varperiod,
-            plotvarepoch
-        )
-    elif periodind == 1 and not twolspmode:
-        plottitle = '%s best period x 0.5: %.6f d - epoch: %.5f' % (
-            METHODSHORTLABELS[lspmethod],
-            varperiod,
-            plotvarepoch
-        )
-    elif periodind == 2 and not twolspmode:
-        plottitle = '%s best period x 2: %.6f d - epoch: %.5f' % (
-            METHODSHORTLABELS[lspmethod],
-            varperiod,
-            plotvarepoch
-        )
-    elif periodind > 2 and not twolspmode:
-        plottitle = '%s peak %s: %.6f d - epoch: %.5f' % (
-            METHODSHORTLABELS[lspmethod],
-            periodind-1,
-            varperiod,
-            plotvarepoch
-        )
-    elif periodind > 0:
-        plottitle = '%s peak %s: %.6f d - epoch: %.5f' % (
-            METHODSHORTLABELS[lspmethod],
-            periodind+1,
-            varperiod,
-            plotvarepoch
-        )
-
-    axes.set_title(plottitle)
+    axes.set_title(_phased_magseries_title(periodind,
+                                           varperiod,
+                                           plotvarepoch,
+                                           lspmethod,
+                                           twolspmode=twolspmode))
 
     # if we're making an inset plot showing the full range
     if (plotxlim and isinstance(plotxlim, list) and
         len(plotxlim) == 2 and xliminsetmode is True):
 
-        # bump the ylim of the plot so that the inset can fit in this axes plot
-        axesylim = axes.get_ylim()
+        _bump_ylim_for_inset(axes, magsarefluxes=magsarefluxes)
+        _add_phased_inset(axes,
+                          plotphase, plotmags,
+                          binplotphase, binplotmags,
+                          phasewrap,
+                          magsarefluxes=magsarefluxes)
 
-        if magsarefluxes:
-            axes.set_ylim(axesylim[0],
-                          axesylim[1] + 0.5*npabs(axesylim[1]-axesylim[0]))
+
+
+##################################
+## FAST CHECKPLOT PNG RENDERING ##
+##################################
+
+def _setup_checkplot_template(template, nlsp):
+    '''sets up the figure template for checkplot PNGs with nlsp periodograms.
+
+    The first nlsp tiles are periodograms, the next is the unphased LC, and the
+    rest are phased LCs. The artists for tile i are in template['artists'][i].
+
+    '''
+
+    axes = template['axes']
+    template['facecolor'] = axes[0].get_facecolor()
+
+    for axind, ax in enumerate(axes):
+
+        # periodogram tiles
+        if axind < nlsp:
+
+            template['artists'][axind] = {'lsp':ax.plot([], [])[0]}
+            ax.set_xscale('log')
+            ax.set_xlabel('Period [days]')
+
+        # the unphased LC tile
+        elif axind == nlsp:
+
+            template['artists'][axind] = {
+                'points':ax.plot([], [],
+                                 marker='o',
+                                 ms=2.0, ls='None', mew=0,
+                                 color='green')[0],
+                'envelope':ax.plot([], [],
+                                   lw=2.0, solid_capstyle='round',
+                                   color='green')[0],
+            }
+
+        # phased LC tiles
         else:
-            axes.set_ylim(axesylim[0],
-                          axesylim[1] - 0.5*npabs(axesylim[1]-axesylim[0]))
 
-        # put the inset axes in
-        inset = inset_axes(axes, width="40%", height="40%", loc=1)
+            template['artists'][axind] = {
+                'points':ax.plot([], [],
+                                 marker='o',
+                                 ms=2.0, ls='None', mew=0,
+                                 color='gray')[0],
+                'envelope':ax.plot([], [],
+                                   lw=2.0, solid_capstyle='round',
+                                   color='gray')[0],
+                'binned':ax.plot([], [],
+                                 marker='o',
+                                 ms=4.0, ls='None', mew=0,
+                                 color='#1c1e57')[0],
+            }
+            ax.set_xlabel('phase')
+
+        ax.grid(color='#a9a9a9',
+                alpha=0.9,
+                zorder=0,
+                linewidth=1.0,
+                linestyle=':')
+
+        if axind >= nlsp:
+            ax.get_yaxis().get_major_formatter().set_useOffset(False)
+            ax.get_xaxis().get_major_formatter().set_useOffset(False)
+
+
+
+def _fast_checkplot_png(plotfpath,
+                        lspinfolist,
+                        phasedtiles,
+                        stimes, smags, serrs,
+                        objectinfo=None,
+                        findercmap='gray_r',
+                        finderconvolve=None,
+                        findercachedir='~/.astrobase/stamp-cache',
+                        varepoch='min',
+                        phasewrap=True,
+                        phasesort=True,
+                        phasebin=0.002,
+                        minbinelems=7,
+                        plotxlim=[-0.8,0.8],
+                        xliminsetmode=False,
+                        magsarefluxes=False,
+                        bestperiodhighlight=None,
+                        plotdpi=100,
+                        verbose=True):
+    '''makes a checkplot PNG by updating a reused figure template.
 
-        # make the scatter plot for the phased LC plot
-        inset.plot(plotphase,
-                   plotmags,
-                   marker='o',
-                   ms=2.0, ls='None',mew=0,
-                   color='gray',
-                   rasterized=True)
+    This is the fastplot mode for checkplot_png and twolsp_checkplot_png.
 
-        # overlay the binned phased LC plot if we're making one
-        if phasebin:
-            inset.plot(binplotphase,
-                       binplotmags,
-                       marker='o',
-                       ms=4.0, ls='None',mew=0,
-                       color='#1c1e57',
-                       rasterized=True)
+    lspinfolist is a list of one or two lspinfo dicts for the periodogram
+    tiles. phasedtiles is a list of (periodind, varperiod, lspmethod,
+    lspmethodind) tuples for the phased LC tiles in order. stimes, smags, serrs are the
+    sigma-clipped and normalized LC.
 
-        # show the full phase coverage
-        # show the full phase coverage
-        if phasewrap:
-            inset.set_xlim(-0.2,0.8)
+    The periodograms are decimated to a min/median/max envelope per pixel
+    column and the LC points to their per-column envelopes before drawing.
+
+    '''
+
+    nlsp = len(lspinfolist)
+    twolspmode = nlsp == 2
+
+    # there are only enough tiles for this many phased LCs. the leftover
+    # tiles are left empty
+    phasedtiles = list(phasedtiles[:8-nlsp])
+    phasedtiles.extend([None]*(8 - nlsp - len(phasedtiles)))
+    insetmode = (plotxlim and isinstance(plotxlim, list) and
+                 len(plotxlim) == 2 and xliminsetmode is True)
+
+    template = _get_plot_template(
+        ('checkplot', nlsp),
+        nrows=3, ncols=3,
+        figsize=(30,24),
+        setupfunc=lambda x: _setup_checkplot_template(x, nlsp)
+    )
+    fig, axes = template['fig'], template['axes']
+    artists = template['artists']
+
+    # first, set up the limits, labels, and titles of all tiles. the layout is
+    # fixed from these the first time the template is used.
+
+    for axind, lspinfo in enumerate(lspinfolist):
+
+        periods = np.asarray(lspinfo['periods'])
+        lspvals = np.asarray(lspinfo['lspvals'])
+
+        axes[axind].set_xlim(_padded_limits(periods, logscale=True))
+        axes[axind].set_ylim(_padded_limits(lspvals))
+        axes[axind].set_ylabel(PLOTYLABELS[lspinfo['method']])
+        axes[axind].set_title('%s - %.6f d' % (
+            METHODLABELS[lspinfo['method']],
+            lspinfo['bestperiod']
+        ))
+
+    lcax = axes[nlsp]
+    scaledplottime = stimes - npmin(stimes)
+    lcax.set_xlim((npmin(scaledplottime)-1.0,
+                   npmax(scaledplottime)+1.0))
+    ymin, ymax = _padded_limits(smags)
+    if not magsarefluxes:
+        lcax.set_ylim((ymax, ymin))
+    else:
+        lcax.set_ylim((ymin, ymax))
+    lcax.set_xlabel('JD - %.3f' % npmin(stimes))
+    lcax.set_ylabel('flux' if magsarefluxes else 'magnitude')
+
+    phasedlcs = []
+
+    for axind, phasedtile in enumerate(phasedtiles, nlsp+1):
+
+        ax = axes[axind]
+
+        if phasedtile is None:
+
+            phasedlcs.append(None)
+            ax.set_facecolor(template['facecolor'])
+            ax.set_title('')
+            for artist in artists[axind].values():
+                artist.set_data([], [])
+            continue
+
+        periodind, varperiod, lspmethod, lspmethodind = phasedtile
+        phased = _get_phased_magseries(periodind,
+                                       stimes, smags, serrs,
+                                       varperiod, varepoch,
+                                       phasewrap, phasesort,
+                                       phasebin, minbinelems,
+                                       lspmethodind=lspmethodind,
+                                       twolspmode=twolspmode,
+                                       magsarefluxes=magsarefluxes,
+                                       verbose=verbose)
+        phasedlcs.append(phased)
+
+        # make sure the best period phased LC plot stands out
+        if periodind == 0 and bestperiodhighlight:
+            ax.set_facecolor(bestperiodhighlight)
         else:
-            inset.set_xlim(-0.1,1.1)
+            ax.set_facecolor(template['facecolor'])
 
-        # flip y axis for mags
+        ymin, ymax = _padded_limits(phased['mags'])
         if not magsarefluxes:
-            inset_ylim = inset.get_ylim()
-            inset.set_ylim((inset_ylim[1], inset_ylim[0]))
+            ax.set_ylim((ymax, ymin))
+        else:
+            ax.set_ylim((ymin, ymax))
 
-        # set the plot title
-        inset.text(0.5,0.1,'full phased light curve',
-                   ha='center',va='center',transform=inset.transAxes)
-        # don't show axes labels or ticks
-        inset.set_xticks([])
-        inset.set_yticks([])
+        if not plotxlim:
+            ax.set_xlim((npmin(phased['phase'])-0.1,
+                         npmax(phased['phase'])+0.1))
+        else:
+            ax.set_xlim((plotxlim[0],plotxlim[1]))
+
+        ax.set_ylabel('flux' if magsarefluxes else 'magnitude')
+        ax.set_title(_phased_magseries_title(periodind,
+                                             varperiod,
+                                             phased['epoch'],
+                                             lspmethod,
+                                             twolspmode=twolspmode))
+
+        if insetmode:
+            _bump_ylim_for_inset(ax, magsarefluxes=magsarefluxes)
+
+    _layout_plot_template(template)
+
+    # next, draw the decimated data now that the tile sizes are known
+
+    for axind, lspinfo in enumerate(lspinfolist):
+        artists[axind]['lsp'].set_data(
+            *decimate_points(lspinfo['periods'], lspinfo['lspvals'],
+                             _axes_pixel_columns(fig, axes[axind], plotdpi),
+                             logx=True)
+        )
+
+    _draw_decimated_scatter(fig, lcax,
+                            artists[nlsp]['points'],
+                            artists[nlsp]['envelope'],
+                            scaledplottime, smags, plotdpi)
+
+    for axind, phased in enumerate(phasedlcs, nlsp+1):
+
+        if phased is None:
+            continue
+
+        ax = axes[axind]
+        _draw_decimated_scatter(fig, ax,
+                                artists[axind]['points'],
+                                artists[axind]['envelope'],
+                                phased['phase'], phased['mags'], plotdpi)
+
+        if phased['binnedphase'] is not None:
+            artists[axind]['binned'].set_data(phased['binnedphase'],
+                                              phased['binnedmags'])
+        else:
+            artists[axind]['binned'].set_data([], [])
+
+        # the inset is removed the next time the template is used. it's made
+        # with the decimated points first so its limits are set the same way
+        # as for the full LC, then those are replaced by the envelopes.
+        if insetmode:
+
+            axpos = ax.get_position()
+            insetsize = (0.4*axpos.width*fig.get_figwidth()*plotdpi,
+                         0.4*axpos.height*fig.get_figheight()*plotdpi)
+            insetphase, insetmags = decimate_points(phased['phase'],
+                                                    phased['mags'],
+                                                    insetsize[0])
+
+            inset = _add_phased_inset(ax,
+                                      insetphase, insetmags,
+                                      phased['binnedphase'],
+                                      phased['binnedmags'],
+                                      phasewrap,
+                                      magsarefluxes=magsarefluxes)
+            insetenvelope = inset.plot([], [],
+                                       lw=2.0, solid_capstyle='round',
+                                       color='gray', zorder=1.5)[0]
+            _draw_decimated_scatter(fig, inset,
+                                    inset.lines[0], insetenvelope,
+                                    phased['phase'], phased['mags'],
+                                    plotdpi,
+                                    axessize=insetsize)
+
+    # finally, add the per-object extras. these are also removed the next time
+    # the template is used.
+
+    for axind, lspinfo in enumerate(lspinfolist):
+        for bestperiod, bestpeak in zip(lspinfo['nbestperiods'],
+                                        lspinfo['nbestlspvals']):
+            axes[axind].annotate('%.6f' % bestperiod,
+                                 xy=(bestperiod, bestpeak), xycoords='data',
+                                 xytext=(0.0,25.0), textcoords='offset points',
+                                 arrowprops=dict(arrowstyle="->"),
+                                 fontsize='14.0')
+
+    _add_periodogram_objectinfo(axes[0], objectinfo,
+                                findercmap, finderconvolve,
+                                verbose=verbose,
+                                findercachedir=findercachedir)
+
+    _save_plot_template(template, plotfpath, plotdpi=plotdpi)
+
+    if verbose:
+        LOGINFO('checkplot done -> %s' % plotfpath)
+
+    return plotfpath
 
 
 
@@ -737,7 +1159,8 @@ def checkplot_png(lspinfo,
                   xliminsetmode=False,
                   plotdpi=100,
                   bestperiodhighlight=None,
-                  verbose=True):
+                  verbose=True,
+                  fastplot=False):
     '''This makes a checkplot for an info dict from a period-finding routine.
 
     A checkplot is a 3 x 3 grid of plots like so:
@@ -868,6 +1291,14 @@ def checkplot_png(lspinfo,
     verbose = False turns off many of the informational messages. Useful for
     when an external function is driving lots of checkplot calls.
 
+    fastplot = True draws the checkplot on a figure template that's made once
+    per process and reused for all later checkplots, only updating the plotted
+    data, limits, and labels each time. The periodogram and light curve points
+    are also decimated per pixel column before drawing (see
+    plotbase.decimate_points). The output looks the same, but this is a lot
+    faster when making thousands of checkplots for long light curves. Each
+    worker in a multiprocessing pool gets its own template.
+
     '''
 
     if not outfile and isinstance(lspinfo,str):
@@ -915,6 +1346,51 @@ def checkplot_png(lspinfo,
         LOGWARNING('no best period found for this object, skipping...')
         return None
 
+    stimes, smags, serrs = sigclip_magseries(times,
+                                             mags,
+                                             errs,
+                                             magsarefluxes=magsarefluxes,
+                                             sigclip=sigclip)
+
+    # take care of the normalization
+    if normto is not False:
+        stimes, smags = normalize_magseries(stimes, smags,
+                                            normto=normto,
+                                            magsarefluxes=magsarefluxes,
+                                            mingap=normmingap)
+
+    # the fast plot mode reuses a figure template
+    if fastplot and len(stimes) >= 50:
+
+        lspbestperiods = nbestperiods[::]
+
+        lspperiodone = lspbestperiods[0]
+        lspbestperiods.insert(1,lspperiodone*2.0)
+        lspbestperiods.insert(1,lspperiodone*0.5)
+
+        return _fast_checkplot_png(
+            plotfpath,
+            [lspinfo],
+            [(periodind, varperiod, lspmethod, 0)
+             for periodind, varperiod in enumerate(lspbestperiods)],
+            stimes, smags, serrs,
+            objectinfo=objectinfo,
+            findercmap=findercmap,
+            finderconvolve=finderconvolve,
+            findercachedir=findercachedir,
+            varepoch=varepoch,
+            phasewrap=phasewrap,
+            phasesort=phasesort,
+            phasebin=phasebin,
+            minbinelems=minbinelems,
+            plotxlim=plotxlim,
+            xliminsetmode=xliminsetmode,
+            magsarefluxes=magsarefluxes,
+            bestperiodhighlight=bestperiodhighlight,
+            plotdpi=plotdpi,
+            verbose=verbose
+        )
+
     # initialize the plot
     fig, axes = plt.subplots(3,3)
     axes = npravel(axes)
@@ -935,19 +1411,6 @@ def checkplot_png(lspinfo,
     ## NOW MAKE THE PHASED LIGHT CURVES ##
     ######################################
 
-    stimes, smags, serrs = sigclip_magseries(times,
-                                             mags,
-                                             errs,
-                                             magsarefluxes=magsarefluxes,
-                                             sigclip=sigclip)
-
-    # take care of the normalization
-    if normto is not False:
-        stimes, smags = normalize_magseries(stimes, smags,
-                                            normto=normto,
-                                            magsarefluxes=magsarefluxes,
-                                            mingap=normmingap)
-
 
     # make sure we have some lightcurve points to plot after sigclip
     if len(stimes) >= 50:
@@ -975,7 +1438,7 @@ def checkplot_png(lspinfo,
 
             # make sure the best period phased LC plot stands out
             if periodind == 0 and bestperiodhighlight:
-                if MPLVERSION >= (2,0,0):
+                if _get_mplversion() >= (2,0,0):
                     axes[periodind+2].set_facecolor(bestperiodhighlight)
                 else:
                     axes[periodind+2].set_axis_bgcolor(bestperiodhighlight)
@@ -1058,7 +1521,8 @@ def twolsp_checkplot_png(lspinfo1,
                          xliminsetmode=False,
                          plotdpi=100,
                          bestperiodhighlight=None,
-                         verbose=True):
+                         verbose=True,
+                         fastplot=False):
     '''This makes a checkplot using results from two independent period-finders.
 
     Adapted from Luke Bouma's implementation of the same. This makes a special
@@ -1102,6 +1566,9 @@ def twolsp_checkplot_png(lspinfo1,
     (i.e. for each of the best 3 periods       each period from each
      from the two period-finder results)       period-finder specifically
 
+    fastplot = True reuses a figure template for this layout, as for
+    checkplot_png.
+
     '''
 
     # generate the plot filename
@@ -1168,6 +1635,53 @@ def twolsp_checkplot_png(lspinfo1,
         LOGWARNING('no best period found for this object, skipping...')
         return None
 
+    ##########################################
+    ## FIX UP THE MAGS AND REMOVE BAD STUFF ##
+    ##########################################
+
+    # sigclip first
+    stimes, smags, serrs = sigclip_magseries(times,
+                                             mags,
+                                             errs,
+                                             magsarefluxes=magsarefluxes,
+                                             sigclip=sigclip)
+
+    # take care of the normalization
+    if normto is not False:
+        stimes, smags = normalize_magseries(stimes, smags,
+                                            normto=normto,
+                                            magsarefluxes=magsarefluxes,
+                                            mingap=normmingap)
+
+    # the fast plot mode reuses a figure template
+    if fastplot and len(stimes) >= 50:
+
+        return _fast_checkplot_png(
+            plotfpath,
+            [lspinfo1, lspinfo2],
+            ([(periodind, varperiod, lspmethod1, 0)
+              for periodind, varperiod in enumerate(nbestperiods1[:3])] +
+             [None]*(3 - len(nbestperiods1[:3])) +
+             [(periodind, varperiod, lspmethod2, 1)
+              for periodind, varperiod in enumerate(nbestperiods2[:3])]),
+            stimes, smags, serrs,
+            objectinfo=objectinfo,
+            findercmap=findercmap,
+            finderconvolve=finderconvolve,
+            findercachedir=findercachedir,
+            varepoch=varepoch,
+            phasewrap=phasewrap,
+            phasesort=phasesort,
+            phasebin=phasebin,
+            minbinelems=minbinelems,
+            plotxlim=plotxlim,
+            xliminsetmode=xliminsetmode,
+            magsarefluxes=magsarefluxes,
+            bestperiodhighlight=bestperiodhighlight,
+            plotdpi=plotdpi,
+            verbose=verbose
+        )
+
     # initialize the plot
     fig, axes = plt.subplots(3,3)
     axes = npravel(axes)
@@ -1191,24 +1705,6 @@ def twolsp_checkplot_png(lspinfo1,
     _make_periodogram(axes[1], lspinfo2, None,
                       findercmap, finderconvolve)
 
-    ##########################################
-    ## FIX UP THE MAGS AND REMOVE BAD STUFF ##
-    ##########################################
-
-    # sigclip first
-    stimes, smags, serrs = sigclip_magseries(times,
-                                             mags,
-                                             errs,
-                                             magsarefluxes=magsarefluxes,
-                                             sigclip=sigclip)
-
-    # take care of the normalization
-    if normto is not False:
-        stimes, smags = normalize_magseries(stimes, smags,
-                                            normto=normto,
-                                            magsarefluxes=magsarefluxes,
-                                            mingap=normmingap)
-
 
     # make sure we have some lightcurve points to plot after sigclip
     if len(stimes) >= 50:
@@ -1234,7 +1730,7 @@ def twolsp_checkplot_png(lspinfo1,
 
             # make sure the best period phased LC plot stands out
             if periodind == 0 and bestperiodhighlight:
-                if MPLVERSION >= (2,0,0):
+                if _get_mplversion() >= (2,0,0):
                     plotaxes.set_facecolor(bestperiodhighlight)
                 else:
                     plotaxes.set_axis_bgcolor(bestperiodhighlight)
@@ -1262,7 +1758,7 @@ def twolsp_checkplot_png(lspinfo1,
 
             # make sure the best period phased LC plot stands out
             if periodind == 0 and bestperiodhighlight:
-                if MPLVERSION >= (2,0,0):
+                if _get_mplversion() >= (2,0,0):
                     plotaxes.set_facecolor(bestperiodhighlight)
                 else:
                     plotaxes.set_axis_bgcolor(bestperiodhighlight)
@@ -1386,12 +1882,18 @@ def _pkl_finder_objectinfo(objectinfo,
                            maxnumneighbors=5,
                            plotdpi=100,
                            findercachedir='~/.astrobase/stamp-cache',
+                           findermosaic=False,
                            verbose=True,
                            gaia_max_timeout=180.0,
                            gaia_mirror='cds',
-                           complete_query_later=True):
+                           complete_query_later=True,
+                           gaia_fieldcache=None):
     '''This returns the finder chart and object information as a dict.
 
+    If findermosaic is True, the finder chart is cut out of a field mosaic
+    shared with nearby objects (see services.skyview.get_stamp_from_mosaic)
+    instead of being fetched from SkyView for this object alone.
+
     '''
 
     if (isinstance(objectinfo, dict) and
@@ -1421,7 +1923,8 @@ def _pkl_finder_objectinfo(objectinfo,
                     convolvewith=finderconvolve,
                     verbose=verbose,
                     flip=False,
-                    cachedir=findercachedir
+                    cachedir=findercachedir,
+                    mosaic=findermosaic
                 )
 
             except OSError as e:
@@ -1436,7 +1939,8 @@ def _pkl_finder_objectinfo(objectinfo,
                     verbose=verbose,
                     flip=False,
                     cachedir=findercachedir,
-                    forcefetch=True
+                    forcefetch=True,
+                    mosaic=findermosaic
                 )
 
 
@@ -1685,7 +2189,8 @@ def _pkl_finder_objectinfo(objectinfo,
             verbose=False,
             gaia_max_timeout=gaia_max_timeout,
             gaia_mirror=gaia_mirror,
-            complete_query_later=complete_query_later
+            complete_query_later=complete_query_later,
+            gaia_fieldcache=gaia_fieldcache
         )
 
         # see if the objectinfo dict has pmra/pmdecl entries.  if it doesn't,
@@ -1864,7 +2369,7 @@ def _pkl_periodogram(lspinfo,
     # make the plot
     plt.plot(periods,lspvals)
 
-    plt.xscale('log',basex=10)
+    plt.xscale('log')
     plt.xlabel('Period [days]')
     plt.ylabel(pgramylabel)
     plottitle = '%s - %.6f d' % (METHODLABELS[lspinfo['method']],
@@ -2278,7 +2783,7 @@ def _pkl_phased_magseries_plot(checkplotdict,
 
     # make sure the best period phased LC plot stands out
     if (periodind == 0 or periodind == -1) and bestperiodhighlight:
-        if MPLVERSION >= (2,0,0):
+        if _get_mplversion() >= (2,0,0):
             plt.gca().set_facecolor(bestperiodhighlight)
         else:
             plt.gca().set_axis_bgcolor(bestperiodhighlight)
@@ -2416,6 +2921,11 @@ def _parse_xmatch_catalog_header(xc, xk):
         if not line.decode().startswith('#'):
             break
 
+    # go back to the start of the file so the first data line we read above
+    # isn't skipped when reading the catalog. the header lines are skipped
+    # later as comments.
+    infd.seek(0)
+
     if not len(catdef) > 0:
         LOGERROR("catalog definition not parseable "
                  "for catalog: %s, skipping..." % xc)
@@ -2493,7 +3003,8 @@ def load_xmatch_external_catalogs(xmatchto, xmatchkeys, outfile=None):
     if outfile is not None, set this to the name of the pickle to write the
     collect xmatch catalogs to. this pickle can then be loaded transparently by
     the checkplot_dict, checkplot_pickle functions to provide xmatch info the
-    _xmatch_external_catalog function below.
+    _xmatch_external_catalog function below. the kdtree for each catalog is
+    saved in the pickle as well, so it can be reused by all later xmatches.
 
     '''
 
@@ -2531,15 +3042,9 @@ def load_xmatch_external_catalogs(xmatchto, xmatchkeys, outfile=None):
         objra, objdecl = (catarr[catdefdict['colra']],
                           catarr[catdefdict['coldec']])
 
-        # get the xyz unit vectors from ra,decl
-        cosdecl = np.cos(np.radians(objdecl))
-        sindecl = np.sin(np.radians(objdecl))
-        cosra = np.cos(np.radians(objra))
-        sinra = np.sin(np.radians(objra))
-        xyz = np.column_stack((cosra*cosdecl,sinra*cosdecl, sindecl))
-
-        # generate the kdtree
-        kdt = cKDTree(xyz,copy_data=True)
+        # generate the kdtree. this is saved along with the catalog in the
+        # output pickle so it doesn't need to be made again
+        kdt = make_kdtree(objra, objdecl)
 
         # generate the outdict element for this catalog
         catoutdict = {'kdtree':kdt,
@@ -2580,6 +3085,87 @@ def load_xmatch_external_catalogs(xmatchto, xmatchkeys, outfile=None):
 
 
 
+# this holds the last xmatch pickle loaded so it's not loaded again for every
+# checkplot. the key is the pickle's path and mtime.
+XMATCH_PICKLE_CACHE = {}
+
+
+def _load_xmatch_info(xmatchinfo):
+    '''This loads the xmatch catalog dict from xmatchinfo.
+
+    xmatchinfo is either the dict produced by load_xmatch_external_catalogs or
+    the pickle produced by the same function. The last pickle loaded is kept in
+    memory.
+
+    Returns None if xmatchinfo can't be understood.
+
+    '''
+
+    if isinstance(xmatchinfo, dict):
+        return xmatchinfo
+
+    elif isinstance(xmatchinfo, str) and os.path.exists(xmatchinfo):
+
+        cachekey = (os.path.abspath(xmatchinfo),
+                    os.path.getmtime(xmatchinfo))
+
+        if cachekey not in XMATCH_PICKLE_CACHE:
+
+            with open(xmatchinfo,'rb') as infd:
+                xmatchdict = pickle.load(infd)
+
+            XMATCH_PICKLE_CACHE.clear()
+            XMATCH_PICKLE_CACHE[cachekey] = xmatchdict
+
+        return XMATCH_PICKLE_CACHE[cachekey]
+
+    else:
+        return None
+
+
+
+def _xmatch_result(catdict, matchind=None, distarcsec=None):
+    '''This makes the xmatch result dict for a match in a single catalog.
+
+    catdict is the dict for this catalog from load_xmatch_external_catalogs,
+    matchind is the index of the matching object in the catalog, and
+    distarcsec is the match distance. If matchind is None, the result is a
+    no-match.
+
+    '''
+
+    if matchind is None:
+
+        return {'name':catdict['name'],
+                'desc':catdict['desc'],
+                'found':False,
+                'distarcsec':None,
+                'info':None}
+
+    infodict = {}
+
+    for col in catdict['columns']:
+
+        coldata = catdict['data'][col][matchind]
+
+        if isinstance(coldata, str):
+            coldata = coldata.strip()
+
+        infodict[col] = coldata
+
+    return {
+        'name':catdict['name'],
+        'desc':catdict['desc'],
+        'found':True,
+        'distarcsec':distarcsec,
+        'info':infodict,
+        'colkeys':catdict['columns'],
+        'colnames':catdict['colnames'],
+        'colunit':catdict['colunits'],
+    }
+
+
+
 def xmatch_external_catalogs(checkplotdict,
                              xmatchinfo,
                              xmatchradiusarcsec=2.0,
@@ -2625,12 +3211,9 @@ def xmatch_external_catalogs(checkplotdict,
     '''
 
     # load the xmatch info
-    if isinstance(xmatchinfo, str) and os.path.exists(xmatchinfo):
-        with open(xmatchinfo,'rb') as infd:
-            xmatchdict = pickle.load(infd)
-    elif isinstance(xmatchinfo, dict):
-        xmatchdict = xmatchinfo
-    else:
+    xmatchdict = _load_xmatch_info(xmatchinfo)
+
+    if xmatchdict is None:
         LOGERROR("can't figure out xmatch info, can't xmatch, skipping...")
         return checkplotdict
 
@@ -2679,11 +3262,7 @@ def xmatch_external_catalogs(checkplotdict,
 
         if matchdists[np.isfinite(matchdists)].size == 0:
 
-            xmatchresults[ecat] = {'name':xmatchdict[ecat]['name'],
-                                   'desc':xmatchdict[ecat]['desc'],
-                                   'found':False,
-                                   'distarcsec':None,
-                                   'info':None}
+            xmatchresults[ecat] = _xmatch_result(xmatchdict[ecat])
 
         else:
 
@@ -2691,29 +3270,11 @@ def xmatch_external_catalogs(checkplotdict,
 
                 if np.isfinite(md) and md < xyzdist:
 
-                    infodict = {}
-
-                    distarcsec = _xyzdist_to_distarcsec(md)
-
-                    for col in xmatchdict[ecat]['columns']:
-
-                        coldata = xmatchdict[ecat]['data'][col][mi]
-
-                        if isinstance(coldata, str):
-                            coldata = coldata.strip()
-
-                        infodict[col] = coldata
-
-                    xmatchresults[ecat] = {
-                        'name':xmatchdict[ecat]['name'],
-                        'desc':xmatchdict[ecat]['desc'],
-                        'found':True,
-                        'distarcsec':distarcsec,
-                        'info':infodict,
-                        'colkeys':xmatchdict[ecat]['columns'],
-                        'colnames':xmatchdict[ecat]['colnames'],
-                        'colunit':xmatchdict[ecat]['colunits'],
-                    }
+                    xmatchresults[ecat] = _xmatch_result(
+                        xmatchdict[ecat],
+                        matchind=mi,
+                        distarcsec=_xyzdist_to_distarcsec(md)
+                    )
                     break
 
     #
@@ -2744,6 +3305,70 @@ def xmatch_external_catalogs(checkplotdict,
 
 
 
+def xmatch_external_catalogs_bulk(ras,
+                                  decls,
+                                  xmatchinfo,
+                                  xmatchradiusarcsec=2.0):
+    '''This matches many objects to the external catalogs in xmatchinfo at once.
+
+    ras, decls are np.arrays of the object coordinates in decimal degrees.
+
+    xmatchinfo is the either a dict produced by load_xmatch_external_catalogs or
+    the pickle produced by the same function. The kdtree saved with each catalog
+    is used to match all objects to that catalog in a single call to
+    coordutils.xmatch_bulk.
+
+    xmatchradiusarcsec is the xmatch radius in arcseconds.
+
+    Returns a list with one element per object. Each element is a dict of xmatch
+    results keyed by catalog in the same form as the one that
+    xmatch_external_catalogs adds to a checkplot dict. Returns None if
+    xmatchinfo can't be understood.
+
+    '''
+
+    xmatchdict = _load_xmatch_info(xmatchinfo)
+
+    if xmatchdict is None:
+        LOGERROR("can't figure out xmatch info, can't xmatch, skipping...")
+        return None
+
+    ras = np.atleast_1d(ras)
+    decls = np.atleast_1d(decls)
+
+    xmatchresults = [{} for _ in range(ras.size)]
+
+    # objects without valid coordinates don't match anything
+    goodcoords = np.isfinite(ras) & np.isfinite(decls)
+    goodinds = np.where(goodcoords)[0]
+
+    for ecat in sorted(xmatchdict.keys()):
+
+        matches = xmatch_bulk(ras[goodcoords], decls[goodcoords],
+                              sourcekdtree=xmatchdict[ecat]['kdtree'],
+                              match_radius=xmatchradiusarcsec,
+                              closestonly=True)
+
+        nomatch = _xmatch_result(xmatchdict[ecat])
+
+        for objind in range(ras.size):
+            xmatchresults[objind][ecat] = nomatch.copy()
+
+        for goodind, objind in enumerate(goodinds):
+
+            if matches['nmatches'][goodind] > 0:
+
+                matchpos = matches['indptr'][goodind]
+                xmatchresults[objind][ecat] = _xmatch_result(
+                    xmatchdict[ecat],
+                    matchind=matches['indices'][matchpos],
+                    distarcsec=matches['distarcsec'][matchpos]
+                )
+
+    return xmatchresults
+
+
+
 ########################
 ## READ/WRITE PICKLES ##
 ########################
@@ -2873,6 +3498,77 @@ def _read_checkplot_picklefile(checkplotpickle):
 
 
 
+#################################
+## PREFETCHING SERVICE RESULTS ##
+#################################
+
+def prefetch_checkplot_services(objectinfolist,
+                                findercachedir='~/.astrobase/stamp-cache',
+                                findermosaic=False,
+                                deredden_object=True,
+                                nworkers=None,
+                                verbose=True):
+    '''This fetches the external service results for many checkplots at once.
+
+    objectinfolist is a list of objectinfo dicts (like the ones passed to
+    checkplot_dict and checkplot_pickle) with at least the 'ra' and 'decl' keys.
+
+    The finder chart stamps from SkyView and, if deredden_object is True, the
+    extinction tables from 2MASS DUST are fetched for all of these objects at
+    the same time using skyview.get_stamps and dust.extinction_queries. These
+    end up in the same caches used by checkplot_dict, so making the checkplots
+    afterwards doesn't have to wait on these services one object at a time.
+
+    If findermosaic is True, the field mosaics covering all of the objects are
+    fetched instead of a stamp for each object (see skyview.get_mosaics). Use
+    this if the checkplots will be made with findermosaic=True as well.
+
+    nworkers is the number of requests to run at the same time. If None, the
+    default for the shared services transport is used.
+
+    Returns a dict of the form:
+
+    {'nobjects': number of objects with valid coordinates,
+     'stamps': number of stamps (or objects covered by mosaics) available,
+     'extinction': number of extinction tables available}
+
+    '''
+
+    coords = [(x['ra'], x['decl']) for x in objectinfolist
+              if (isinstance(x, dict) and
+                  x.get('ra') is not None and x.get('decl') is not None and
+                  np.isfinite(x['ra']) and np.isfinite(x['decl']))]
+
+    if len(coords) == 0:
+        LOGERROR('no objects with valid ra, decl to prefetch results for')
+        return {'nobjects':0, 'stamps':0, 'extinction':0}
+
+    ras, decls = zip(*coords)
+
+    if verbose:
+        LOGINFO('prefetching finder charts%s for %s objects' %
+                (' and extinction' if deredden_object else '', len(coords)))
+
+    if findermosaic:
+        stamps = skyview.get_mosaics(ras, decls,
+                                     cachedir=findercachedir,
+                                     nworkers=nworkers)
+    else:
+        stamps = skyview.get_stamps(ras, decls,
+                                    cachedir=findercachedir,
+                                    nworkers=nworkers)
+
+    if deredden_object:
+        extinction = dust.extinction_queries(ras, decls, nworkers=nworkers)
+    else:
+        extinction = []
+
+    return {'nobjects':len(coords),
+            'stamps':len([x for x in stamps if x is not None]),
+            'extinction':len([x for x in extinction if x is not None])}
+
+
+
 #############################
 ## CHECKPLOT DICT FUNCTION ##
 #############################
@@ -2889,6 +3585,7 @@ def checkplot_dict(lspinfolist,
                    gaia_max_timeout=180.0,
                    gaia_mirror='cds',
                    complete_query_later=True,
+                   gaia_fieldcache=None,
                    varinfo=None,
                    getvarfeatures=True,
                    lclistpkl=None,
@@ -2902,6 +3599,7 @@ def checkplot_dict(lspinfolist,
                    findercmap='gray_r',
                    finderconvolve=None,
                    findercachedir='~/.astrobase/stamp-cache',
+                   findermosaic=False,
                    normto='globalmedian',
                    normmingap=4.0,
                    sigclip=4.0,
@@ -3106,9 +3804,11 @@ def checkplot_dict(lspinfolist,
         plotdpi=plotdpi,
         verbose=verbose,
         findercachedir=findercachedir,
+        findermosaic=findermosaic,
         gaia_max_timeout=gaia_max_timeout,
         gaia_mirror=gaia_mirror,
-        complete_query_later=complete_query_later
+        complete_query_later=complete_query_later,
+        gaia_fieldcache=gaia_fieldcache
     )
 
     # try again to get the right objectid
@@ -3138,17 +3838,17 @@ def checkplot_dict(lspinfolist,
 
     # this may fix some unpickling issues for astropy.table.Column objects
     # we convert them back to ndarrays
-    if isinstance(stimes, astcolumn):
+    if _is_astropy_column(stimes):
         stimes = stimes.data
         LOGWARNING('times is an astropy.table.Column object, '
                    'changing to numpy array because of '
                    'potential unpickling issues')
-    if isinstance(smags, astcolumn):
+    if _is_astropy_column(smags):
         smags = smags.data
         LOGWARNING('mags is an astropy.table.Column object, '
                    'changing to numpy array because of '
                    'potential unpickling issues')
-    if isinstance(serrs, astcolumn):
+    if _is_astropy_column(serrs):
         serrs = serrs.data
         LOGWARNING('errs is an astropy.table.Column object, '
                    'changing to numpy array because of '
@@ -3377,6 +4077,7 @@ def checkplot_pickle(lspinfolist,
                      gaia_max_timeout=180.0,
                      gaia_mirror='cds',
                      complete_query_later=True,
+                     gaia_fieldcache=None,
                      lcfitfunc=None,
                      lcfitparams={},
                      varinfo=None,
@@ -3390,6 +4091,7 @@ def checkplot_pickle(lspinfolist,
                      findercmap='gray_r',
                      finderconvolve=None,
                      findercachedir='~/.astrobase/stamp-cache',
+                     findermosaic=False,
                      normto='globalmedian',
                      normmingap=4.0,
                      outfile=None,
@@ -3540,6 +4242,7 @@ def checkplot_pickle(lspinfolist,
         gaia_max_timeout=gaia_max_timeout,
         gaia_mirror=gaia_mirror,
         complete_query_later=complete_query_later,
+        gaia_fieldcache=gaia_fieldcache,
         varinfo=varinfo,
         getvarfeatures=getvarfeatures,
         lclistpkl=lclistpkl,
@@ -3553,6 +4256,7 @@ def checkplot_pickle(lspinfolist,
         findercmap=findercmap,
         finderconvolve=finderconvolve,
         findercachedir=findercachedir,
+        findermosaic=findermosaic,
         normto=normto,
         normmingap=normmingap,
         sigclip=sigclip,
@@ -4726,11 +5430,13 @@ def update_checkplot_objectinfo(cpf,
                                 gaia_max_timeout=180.0,
                                 gaia_mirror='cds',
                                 complete_query_later=True,
+                                gaia_fieldcache=None,
                                 lclistpkl=None,
                                 nbrradiusarcsec=60.0,
                                 maxnumneighbors=5,
                                 plotdpi=100,
                                 findercachedir='~/.astrobase/stamp-cache',
+                                findermosaic=False,
                                 verbose=True):
     '''This just updates the checkplot objectinfo dict.
 
@@ -4770,11 +5476,13 @@ def update_checkplot_objectinfo(cpf,
                                     gaia_max_timeout=gaia_max_timeout,
                                     gaia_mirror=gaia_mirror,
                                     complete_query_later=complete_query_later,
+                                    gaia_fieldcache=gaia_fieldcache,
                                     lclistpkl=lclistpkl,
                                     nbrradiusarcsec=nbrradiusarcsec,
                                     maxnumneighbors=maxnumneighbors,
                                     plotdpi=plotdpi,
                                     findercachedir=findercachedir,
+                                    findermosaic=findermosaic,
                                     verbose=verbose)
 
     cpd.update(newcpd)
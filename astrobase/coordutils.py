@@ -13,10 +13,13 @@ from math import trunc, fabs, pi as PI
 
 import numpy as np
 
-from astropy.coordinates import SkyCoord
-from astropy import units as u
+from .lazyload import lazy_module, lazy_object
 
-import scipy.spatial as sps
+# these are imported on first use to keep import times down
+SkyCoord = lazy_object('astropy.coordinates', 'SkyCoord')
+u = lazy_module('astropy.units')
+
+sps = lazy_module('scipy.spatial')
 
 #######################
 ## ANGLE CONVERSIONS ##
@@ -344,6 +347,22 @@ def xmatch_neighbors(ra1, dec1, ra2, dec2, match_radius=60.0,
 ## KDTREE FUNCTIONS ##
 ######################
 
+def _radecl_to_xyz(ra, decl):
+    '''
+    This converts ra, decl in decimal degrees to xyz unit vectors.
+
+    '''
+
+    ra = np.radians(np.atleast_1d(ra))
+    decl = np.radians(np.atleast_1d(decl))
+    cosdecl = np.cos(decl)
+
+    return np.column_stack((np.cos(ra)*cosdecl,
+                            np.sin(ra)*cosdecl,
+                            np.sin(decl)))
+
+
+
 def make_kdtree(ra, decl):
     '''
     This makes a scipy.spatial.CKDTree on ra, decl.
@@ -353,11 +372,7 @@ def make_kdtree(ra, decl):
     # get the xyz unit vectors from ra,decl
     # since i had to remind myself:
     # https://en.wikipedia.org/wiki/Equatorial_coordinate_system
-    cosdecl = np.cos(np.radians(decl))
-    sindecl = np.sin(np.radians(decl))
-    cosra = np.cos(np.radians(ra))
-    sinra = np.sin(np.radians(ra))
-    xyz = np.column_stack((cosra*cosdecl,sinra*cosdecl, sindecl))
+    xyz = _radecl_to_xyz(ra, decl)
 
     # generate the kdtree
     kdt = sps.cKDTree(xyz,copy_data=True)
@@ -450,6 +465,102 @@ def xmatch_kdtree(kdtree,
 
 
 
+def xmatch_bulk(targetra,
+                targetdecl,
+                sourcera=None,
+                sourcedecl=None,
+                sourcekdtree=None,
+                match_radius=5.0,
+                closestonly=False,
+                includeself=True):
+    '''This cross-matches N targets to M sources all at once.
+
+    targetra, targetdecl are np.arrays of the target coordinates in decimal
+    degrees.
+
+    The sources are given by either sourcera, sourcedecl as np.arrays of decimal
+    degree coordinates, or by sourcekdtree, a kdtree made by make_kdtree (e.g.
+    one saved with an external catalog). If sourcekdtree is given, it's used
+    instead of making a new kdtree.
+
+    match_radius is the match radius in arcseconds.
+
+    If closestonly is True, only the closest source is returned for each
+    target. includeself=False is for when the targets and sources are the same
+    list: each target's match to itself (the source with the same index) is
+    left out. Other sources at exactly the same position as a target
+    (e.g. duplicates or blends) are still matched.
+
+    Returns a dict with the matches in compressed sparse row form:
+
+    {'indptr': np.array of N+1 offsets,
+     'indices': np.array of matching source indices,
+     'distarcsec': np.array of great circle distances in arcsec,
+     'nmatches': np.array of the number of matches for each target}
+
+    The matches for target i are indices[indptr[i]:indptr[i+1]] with their
+    distances in distarcsec[indptr[i]:indptr[i+1]], sorted by distance.
+
+    '''
+
+    targetra = np.atleast_1d(targetra)
+    targetdecl = np.atleast_1d(targetdecl)
+
+    if sourcekdtree is None:
+        sourcekdtree = make_kdtree(sourcera, sourcedecl)
+
+    targetkdtree = sps.cKDTree(_radecl_to_xyz(targetra, targetdecl))
+
+    # this is the search distance in xyz unit vectors
+    xyzdist = 2.0 * np.sin(np.radians(match_radius/3600.0)/2.0)
+
+    # get all pairs within xyzdist in one go
+    pairs = targetkdtree.sparse_distance_matrix(sourcekdtree,
+                                                xyzdist,
+                                                output_type='ndarray')
+
+    if not includeself:
+        pairs = pairs[pairs['i'] != pairs['j']]
+
+    # sort by target, then by distance for each target
+    pairs = pairs[np.lexsort((pairs['v'], pairs['i']))]
+
+    if closestonly and pairs.size > 0:
+        firstmatch = np.ones(pairs.size, dtype=bool)
+        firstmatch[1:] = pairs['i'][1:] != pairs['i'][:-1]
+        pairs = pairs[firstmatch]
+
+    nmatches = np.bincount(pairs['i'], minlength=targetra.size)
+    indptr = np.zeros(targetra.size + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(nmatches)
+
+    return {'indptr':indptr,
+            'indices':pairs['j'],
+            'distarcsec':np.degrees(2.0*np.arcsin(pairs['v']/2.0))*3600.0,
+            'nmatches':nmatches}
+
+
+
+def neighbor_graph(ra, decl, match_radius=60.0, kdtree=None):
+    '''This finds the neighbors within match_radius arcsec of every object.
+
+    ra, decl are np.arrays of object coordinates in decimal degrees. kdtree is
+    an optional kdtree already made for these by make_kdtree.
+
+    Returns the same dict as xmatch_bulk, with each object's neighbors other
+    than itself, sorted by distance.
+
+    '''
+
+    return xmatch_bulk(ra, decl,
+                       sourcera=ra,
+                       sourcedecl=decl,
+                       sourcekdtree=kdtree,
+                       match_radius=match_radius,
+                       includeself=False)
+
+
+
 ###################
 ## PROPER MOTION ##
 ###################
@@ -9,5 +9,6 @@ characterize its reliability and completeness via simulating LCs.
 
 generation.py     - fake light curve generation and injection of variability
 recovery.py       - recovery of fake light curve variability and periodic vars
+injection.py      - in-memory injection-recovery simulations without LC files
 
 '''
@@ -134,6 +134,7 @@ import os
 import os.path
 import pickle
 import shutil
+import inspect
 
 import multiprocessing as mp
 from concurrent.futures import ProcessPoolExecutor
@@ -168,9 +169,9 @@ import matplotlib.pyplot as plt
 ###################
 
 # LC reading functions
-from ..hatlc import read_and_filter_sqlitecurve, read_csvlc, \
+from ..hatsurveys.hatlc import read_and_filter_sqlitecurve, read_csvlc, \
     normalize_lcdict_byinst
-from ..hplc import read_hatpi_textlc, read_hatpi_pklc
+from ..hatsurveys.hplc import read_hatpi_textlc, read_hatpi_pklc
 from ..astrokep import read_kepler_fitslc, read_kepler_pklc
 
 # light curve models
@@ -451,7 +452,7 @@ def generate_transit_lightcurve(
     # return a dict with everything
     modeldict = {
         'vartype':'planet',
-        'params':{x:np.asscalar(y) for x,y in zip(['transitperiod',
+        'params':{x:np.asarray(y).item() for x,y in zip(['transitperiod',
                                                    'transitepoch',
                                                    'transitdepth',
                                                    'transitduration',
@@ -550,7 +551,7 @@ def generate_eb_lightcurve(
     # return a dict with everything
     modeldict = {
         'vartype':'EB',
-        'params':{x:np.asscalar(y) for x,y in zip(['period',
+        'params':{x:np.asarray(y).item() for x,y in zip(['period',
                                                    'epoch',
                                                    'pdepth',
                                                    'pduration',
@@ -1098,6 +1099,380 @@ VARTYPE_LCGEN_MAP = {
 
 
 
+#####################################################
+## FUNCTIONS TO GENERATE FAKE LIGHT CURVES IN BULK ##
+#####################################################
+
+def _default_paramdists(lcgenfunc):
+    '''
+    This gets the default paramdists of one of the single LC generators above.
+
+    '''
+
+    return inspect.signature(lcgenfunc).parameters['paramdists'].default
+
+
+
+def _batch_epochs(times, nlcs):
+    '''This chooses an epoch for each of nlcs light curves.
+
+    These are uniformly distributed between the min and max of each time base.
+
+    '''
+
+    tmin = np.min(times, axis=-1)
+    tmax = np.max(times, axis=-1)
+
+    return npr.random(size=nlcs)*(tmax - tmin) + tmin
+
+
+
+def _fix_amplitude_sign(amplitudes, magsarefluxes):
+    '''
+    This flips the amplitudes as appropriate for mags or fluxes.
+
+    '''
+
+    if magsarefluxes:
+        return np.abs(amplitudes)
+    else:
+        return -np.abs(amplitudes)
+
+
+
+def generate_transit_lightcurve_batch(
+        times,
+        nlcs,
+        paramdists=None,
+        magsarefluxes=False,
+):
+    '''This generates nlcs fake transit light curves at once.
+
+    times is either an array of N times used as the time base for all of the
+    light curves, or an nlcs x N array with a separate time base for each.
+
+    paramdists is the same as for generate_transit_lightcurve, and its defaults
+    are used if this is None.
+
+    Returns a dict with the keys 'vartype', 'params', 'times', 'mags',
+    'varperiod', 'varamplitude'. 'mags' is an nlcs x N array of the model mags
+    in the same order as times, with a zero level of 0.0. The values in
+    'params' and 'varperiod', 'varamplitude' are arrays of nlcs values.
+
+    '''
+
+    if paramdists is None:
+        paramdists = _default_paramdists(generate_transit_lightcurve)
+
+    times = np.asarray(times, dtype=np.float64)
+
+    epoch = _batch_epochs(times, nlcs)
+    period = paramdists['transitperiod'].rvs(size=nlcs)
+    depth = paramdists['transitdepth'].rvs(size=nlcs)
+    duration = paramdists['transitduration'].rvs(size=nlcs)
+    ingduration = npr.random(size=nlcs)*0.45*duration + 0.05*duration
+
+    depth = _fix_amplitude_sign(depth, magsarefluxes)
+
+    modelmags = transits.trapezoid_transit_batch(
+        [period, epoch, depth, duration, ingduration],
+        times
+    )
+
+    return {
+        'vartype':'planet',
+        'params':{'transitperiod':period,
+                  'transitepoch':epoch,
+                  'transitdepth':depth,
+                  'transitduration':duration,
+                  'ingressduration':ingduration},
+        'times':times,
+        'mags':modelmags,
+        'varperiod':period,
+        'varamplitude':depth
+    }
+
+
+
+def generate_eb_lightcurve_batch(
+        times,
+        nlcs,
+        paramdists=None,
+        magsarefluxes=False,
+):
+    '''This generates nlcs fake EB light curves at once.
+
+    times is either an array of N times used as the time base for all of the
+    light curves, or an nlcs x N array with a separate time base for each.
+
+    paramdists is the same as for generate_eb_lightcurve, and its defaults are
+    used if this is None.
+
+    Returns a dict like generate_transit_lightcurve_batch.
+
+    '''
+
+    if paramdists is None:
+        paramdists = _default_paramdists(generate_eb_lightcurve)
+
+    times = np.asarray(times, dtype=np.float64)
+
+    epoch = _batch_epochs(times, nlcs)
+    period = paramdists['period'].rvs(size=nlcs)
+    pdepth = paramdists['pdepth'].rvs(size=nlcs)
+    pduration = paramdists['pduration'].rvs(size=nlcs)
+    depthratio = paramdists['depthratio'].rvs(size=nlcs)
+    secphase = paramdists['secphase'].rvs(size=nlcs)
+
+    pdepth = _fix_amplitude_sign(pdepth, magsarefluxes)
+
+    modelmags = eclipses.invgauss_eclipses_batch(
+        [period, epoch, pdepth, pduration, depthratio, secphase],
+        times
+    )
+
+    return {
+        'vartype':'EB',
+        'params':{'period':period,
+                  'epoch':epoch,
+                  'pdepth':pdepth,
+                  'pduration':pduration,
+                  'depthratio':depthratio,
+                  'secphase':secphase},
+        'times':times,
+        'mags':modelmags,
+        'varperiod':period,
+        'varamplitude':pdepth
+    }
+
+
+
+def generate_flare_lightcurve_batch(
+        times,
+        nlcs,
+        paramdists=None,
+        magsarefluxes=False,
+):
+    '''This generates nlcs fake flare light curves at once.
+
+    times is either an array of N times used as the time base for all of the
+    light curves, or an nlcs x N array with a separate time base for each.
+
+    paramdists is the same as for generate_flare_lightcurve, and its defaults
+    are used if this is None.
+
+    Returns a dict like generate_transit_lightcurve_batch. The flare params in
+    'params' are nlcs x F arrays, where F is the largest number of flares in
+    any light curve, and the unused flare slots are set to nan. 'varamplitude' is
+    the amplitude of the largest flare in each light curve.
+
+    '''
+
+    if paramdists is None:
+        paramdists = _default_paramdists(generate_flare_lightcurve)
+
+    times = np.asarray(times, dtype=np.float64)
+
+    nflares = npr.randint(paramdists['nflares'][0],
+                          high=paramdists['nflares'][1],
+                          size=nlcs)
+    maxflares = nflares.max()
+    flareslots = np.arange(maxflares)[None,:] < nflares[:,None]
+
+    tmin = np.min(times, axis=-1)
+    tmax = np.max(times, axis=-1)
+    peaktime = (
+        npr.random(size=(nlcs, maxflares))*np.reshape(tmax - tmin, (-1,1)) +
+        np.reshape(tmin, (-1,1))
+    )
+
+    amp = paramdists['amplitude'].rvs(size=(nlcs, maxflares))
+    risestdev = paramdists['risestdev'].rvs(size=(nlcs, maxflares))
+    decayconst = paramdists['decayconst'].rvs(size=(nlcs, maxflares))
+
+    amp = _fix_amplitude_sign(amp, magsarefluxes)
+
+    modelmags = flares.flare_model_batch(
+        [np.where(flareslots, amp, 0.0), peaktime, risestdev, decayconst],
+        times
+    )
+
+    params = {'nflares':nflares}
+    for key, val in zip(['peaktime','amplitude','risestdev','decayconst'],
+                        [peaktime, amp, risestdev, decayconst]):
+        params[key] = np.where(flareslots, val, np.nan)
+
+    return {
+        'vartype':'flare',
+        'params':params,
+        'times':times,
+        'mags':modelmags,
+        'varperiod':np.full(nlcs, np.nan),
+        'varamplitude':(np.nanmax(params['amplitude'], axis=1) if
+                        magsarefluxes else
+                        np.nanmin(params['amplitude'], axis=1))
+    }
+
+
+
+def generate_sinusoidal_lightcurve_batch(
+        times,
+        nlcs,
+        paramdists=None,
+        magsarefluxes=False,
+        vartype='sinusoidal',
+):
+    '''This generates nlcs fake sinusoidal light curves at once.
+
+    times is either an array of N times used as the time base for all of the
+    light curves, or an nlcs x N array with a separate time base for each.
+
+    paramdists is the same as for generate_sinusoidal_lightcurve. If this is
+    None, the defaults for the single light curve generator of vartype are
+    used, so this can make RRab, RRc, HADS, rotator, LPV, and cepheid light
+    curves as well.
+
+    Returns a dict like generate_transit_lightcurve_batch. The 'fourieramps'
+    and 'fourierphases' in 'params' are nlcs x X arrays, where X is the largest
+    Fourier order, and the amplitudes past each light curve's Fourier order are
+    0.0.
+
+    '''
+
+    if paramdists is None:
+        paramdists = _default_paramdists(
+            VARTYPE_LCGEN_MAP.get(vartype, generate_sinusoidal_lightcurve)
+        )
+
+    times = np.asarray(times, dtype=np.float64)
+
+    epoch = _batch_epochs(times, nlcs)
+    period = paramdists['period'].rvs(size=nlcs)
+    fourierorder = npr.randint(paramdists['fourierorder'][0],
+                               high=paramdists['fourierorder'][1],
+                               size=nlcs)
+    amplitude = paramdists['amplitude'].rvs(size=nlcs)
+
+    amplitude = _fix_amplitude_sign(amplitude, magsarefluxes)
+
+    # these are the same Fourier components as generate_sinusoidal_lightcurve
+    orders = np.arange(1, fourierorder.max()+1)
+    ampcomps = np.where(orders[None,:] <= fourierorder[:,None],
+                        np.abs(amplitude[:,None]/2.0)/orders[None,:],
+                        0.0)
+    phacomps = np.tile(paramdists['phioffset']*orders, (nlcs, 1))
+
+    modelmags = sinusoidal.sine_series_batch(
+        [period, epoch, ampcomps, phacomps],
+        times
+    )
+
+    return {
+        'vartype':vartype,
+        'params':{'period':period,
+                  'epoch':epoch,
+                  'amplitude':amplitude,
+                  'fourierorder':fourierorder,
+                  'fourieramps':ampcomps,
+                  'fourierphases':phacomps},
+        'times':times,
+        'mags':modelmags,
+        'varperiod':period,
+        'varamplitude':amplitude
+    }
+
+
+
+def generate_lightcurve_batch(vartype,
+                              times,
+                              nlcs,
+                              paramdists=None,
+                              magsarefluxes=False,
+                              chunksize=None):
+    '''This generates nlcs fake light curves of a single vartype at once.
+
+    vartype is one of the keys in VARTYPE_LCGEN_MAP.
+
+    times is either an array of N times used as the time base for all of the
+    light curves, or an nlcs x N array with a separate time base for each.
+
+    paramdists is a dict of parameter distributions for this vartype. If None,
+    the defaults of the single light curve generator are used.
+
+    If chunksize is set, the light curves are generated in chunks of this many
+    at a time and yielded as they're done, so a very large number of them can
+    be made without holding all of them in memory. Otherwise, a single dict is
+    returned. See generate_transit_lightcurve_batch for the keys in these
+    dicts.
+
+    '''
+
+    if vartype not in VARTYPE_LCGEN_MAP:
+        LOGERROR('unknown variability type: %s, choose from: %s' %
+                 (vartype, repr(list(VARTYPE_LCGEN_MAP.keys()))))
+        return None
+
+    if vartype == 'planet':
+        batchfunc = generate_transit_lightcurve_batch
+        batchkwargs = {}
+    elif vartype == 'EB':
+        batchfunc = generate_eb_lightcurve_batch
+        batchkwargs = {}
+    elif vartype == 'flare':
+        batchfunc = generate_flare_lightcurve_batch
+        batchkwargs = {}
+    else:
+        batchfunc = generate_sinusoidal_lightcurve_batch
+        batchkwargs = {'vartype':vartype}
+
+    if chunksize is None:
+        return batchfunc(times,
+                         nlcs,
+                         paramdists=paramdists,
+                         magsarefluxes=magsarefluxes,
+                         **batchkwargs)
+    else:
+        return _generate_lightcurve_chunks(batchfunc,
+                                           batchkwargs,
+                                           times,
+                                           nlcs,
+                                           paramdists,
+                                           magsarefluxes,
+                                           chunksize)
+
+
+
+def _generate_lightcurve_chunks(batchfunc,
+                                batchkwargs,
+                                times,
+                                nlcs,
+                                paramdists,
+                                magsarefluxes,
+                                chunksize):
+    '''
+    This yields the light curves from generate_lightcurve_batch in chunks.
+
+    '''
+
+    times = np.asarray(times, dtype=np.float64)
+
+    for chunkstart in range(0, nlcs, chunksize):
+
+        nchunk = min(chunksize, nlcs - chunkstart)
+
+        if times.ndim == 2:
+            chunktimes = times[chunkstart:chunkstart+nchunk]
+        else:
+            chunktimes = times
+
+        yield batchfunc(chunktimes,
+                        nchunk,
+                        paramdists=paramdists,
+                        magsarefluxes=magsarefluxes,
+                        **batchkwargs)
+
+
+
 ###############################################
 ## FUNCTIONS TO COLLECT LIGHT CURVES FOR SIM ##
 ###############################################
@@ -0,0 +1,617 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''injection.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT. See the LICENSE file for more details.
+
+This runs injection-recovery simulations entirely in memory. The usual fakelcs
+route (generation.make_fakelc_collection, add_variability_to_fakelc_collection,
+lcproc.parallel_pf, recovery.parallel_periodicvar_recovery) writes every fake
+light curve and period-finding result to disk and reads them back again, which
+takes most of the time for large completeness grids.
+
+Here, we take a set of base time grids and noise models, inject variables using
+the generators in generation.VARTYPE_LCGEN_MAP, run the requested period-finders
+on each injected light curve in the same process, and only keep a one-line
+summary of the recovery for each trial. These are streamed to a CSV file as the
+trials finish.
+
+Each trial has its own random seed derived from the base seed and the trial's
+index, so any trial can be reproduced exactly with inject_trial, no matter how
+many workers were used or what order the trials ran in.
+
+'''
+
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+                )
+            )
+
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import os.path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import md5
+
+import numpy as np
+import numpy.random as npr
+
+from .generation import VARTYPE_LCGEN_MAP
+from .recovery import check_periodrec_alias, PERIODIC_VARTYPES
+from .. import lcproc
+
+
+############
+## CONFIG ##
+############
+
+NCPUS = os.cpu_count() if hasattr(os, 'cpu_count') else 1
+
+# these are the columns in the result table, followed by the columns for each
+# period-finder: <pfmethod>_period and <pfmethod>_status
+RESULT_COLUMNS = ['trial',
+                  'seed',
+                  'timebase',
+                  'noisemodel',
+                  'vartype',
+                  'ndet',
+                  'magmedian',
+                  'sigma',
+                  'actual_period',
+                  'actual_amplitude',
+                  'best_period',
+                  'best_pfmethod',
+                  'best_status',
+                  'recovered']
+
+
+########################
+## SETTING UP TRIALS ##
+########################
+
+def trial_seed(randomseed, trialind):
+    '''This returns the random seed for a trial.
+
+    The seed depends only on the base randomseed and the trial's index, so it's
+    the same no matter which worker runs the trial.
+
+    '''
+
+    seedhash = md5(('%s-%s' % (randomseed, trialind)).encode()).hexdigest()
+    return int(seedhash[:8], 16)
+
+
+
+def make_trials(ntimebases,
+                noisemodels,
+                vartypes,
+                ntrials):
+    '''This makes the list of trials to run.
+
+    ntimebases is the number of base time grids and noisemodels is the list of
+    noise models (see inject_trial). vartypes is a list of keys in
+    generation.VARTYPE_LCGEN_MAP to inject; None means no variable is injected,
+    which can be used to get false-positive rates. ntrials is the number of
+    trials for each combination of time grid, noise model, and vartype.
+
+    Returns a list of tuples of the form:
+
+    (trial index, time grid index, noise model index, vartype)
+
+    '''
+
+    trials = []
+
+    for timebaseind in range(ntimebases):
+        for noiseind in range(len(noisemodels)):
+            for vartype in vartypes:
+                for _ in range(ntrials):
+                    trials.append((len(trials), timebaseind, noiseind, vartype))
+
+    return trials
+
+
+
+#####################
+## RUNNING A TRIAL ##
+#####################
+
+def inject_trial(times,
+                 noisemodel,
+                 vartype,
+                 seed,
+                 lcgenparams=None):
+    '''This makes a single injected light curve.
+
+    times is the base time grid.
+
+    noisemodel is a dict of the form {'mag': median mag, 'sigma': noise
+    stdev}. Gaussian noise with this stdev is added to the model light curve
+    and the errs are set to sigma.
+
+    vartype is a key in generation.VARTYPE_LCGEN_MAP or None to make a light
+    curve with no variability.
+
+    seed is the random seed for this trial.
+
+    lcgenparams is an optional dict of kwargs to pass to the light curve
+    generator function (e.g. custom paramdists).
+
+    Returns a dict with the keys 'times', 'mags', 'errs', 'vartype',
+    'varperiod', 'varamplitude', and 'params'.
+
+    '''
+
+    # the generators use the global numpy and scipy.stats random state, so we
+    # seed that here for each trial
+    npr.seed(seed)
+
+    times = np.asarray(times, dtype=np.float64)
+    magmedian, sigma = noisemodel['mag'], noisemodel['sigma']
+
+    if vartype is None:
+
+        modelmags = np.zeros_like(times)
+        varperiod, varamplitude, params = np.nan, np.nan, {}
+
+    else:
+
+        modeldict = VARTYPE_LCGEN_MAP[vartype](
+            times,
+            **(lcgenparams if lcgenparams else {})
+        )
+
+        # the generators return these sorted by time already
+        modelmags = modeldict['mags']
+        varperiod, varamplitude, params = (
+            modeldict['varperiod'],
+            modeldict['varamplitude'],
+            modeldict['params']
+        )
+
+        # some of these (e.g. for flares) have multiple values or no period
+        varperiod = (np.nan if varperiod is None else
+                     float(np.ravel(varperiod)[0]))
+        varamplitude = (np.nan if varamplitude is None else
+                        float(np.ravel(varamplitude)[0]))
+
+    mags = magmedian + modelmags + npr.normal(0.0, sigma, size=times.size)
+    errs = np.full_like(times, sigma)
+
+    return {'times':np.sort(times),
+            'mags':mags,
+            'errs':errs,
+            'vartype':vartype,
+            'varperiod':varperiod,
+            'varamplitude':varamplitude,
+            'params':params}
+
+
+
+def recover_trial(injected,
+                  pfmethods=('gls',),
+                  pfkwargs=None,
+                  sigclip=10.0,
+                  nperiodworkers=1,
+                  period_tolerance=1.0e-3):
+    '''This runs the period-finders on an injected light curve.
+
+    injected is the dict returned by inject_trial. pfmethods is a list of keys
+    in lcproc.PFMETHODS and pfkwargs is a list of kwarg dicts to pass to each of
+    these. nperiodworkers is the number of workers each period-finder uses.
+
+    Returns a dict of the form:
+
+    {'best_period': the recovered period closest to the actual one,
+     'best_pfmethod': the period-finder that got it,
+     'best_status': its alias status (see recovery.check_periodrec_alias),
+     'recovered': True if the best period is the actual period,
+     '<pfmethod>_period': the best period from each period-finder,
+     '<pfmethod>_status': the alias status of that period}
+
+    '''
+
+    if pfkwargs is None:
+        pfkwargs = [{} for _ in pfmethods]
+
+    actualperiod = injected['varperiod']
+    isperiodic = (injected['vartype'] in PERIODIC_VARTYPES and
+                  np.isfinite(actualperiod))
+
+    result = {}
+    recperiods, recpfms = [], []
+
+    for pfm, pfkw in zip(pfmethods, pfkwargs):
+
+        pfkw = dict(pfkw)
+        pfkw.update({'verbose':False,
+                     'nworkers':nperiodworkers,
+                     'sigclip':sigclip})
+
+        try:
+            pfres = lcproc.PFMETHODS[pfm](injected['times'],
+                                          injected['mags'],
+                                          injected['errs'],
+                                          **pfkw)
+            nbestperiods = np.array(pfres['nbestperiods'], dtype=np.float64)
+            nbestperiods = nbestperiods[np.isfinite(nbestperiods)]
+        except Exception as e:
+            LOGEXCEPTION('period-finder %s failed for this trial' % pfm)
+            nbestperiods = np.array([])
+
+        if nbestperiods.size > 0:
+            result['%s_period' % pfm] = nbestperiods[0]
+        else:
+            result['%s_period' % pfm] = np.nan
+
+        if isperiodic and nbestperiods.size > 0:
+            result['%s_status' % pfm] = check_periodrec_alias(
+                actualperiod,
+                nbestperiods[0],
+                tolerance=period_tolerance
+            )
+        elif nbestperiods.size > 0:
+            result['%s_status' % pfm] = 'not_variable'
+        else:
+            result['%s_status' % pfm] = 'no_finite_periods_recovered'
+
+        recperiods.extend(nbestperiods.tolist())
+        recpfms.extend([pfm]*nbestperiods.size)
+
+    # find the recovered period closest to the actual period
+    if isperiodic and len(recperiods) > 0:
+
+        bestind = np.argmin(np.abs(np.array(recperiods) - actualperiod))
+        result['best_period'] = recperiods[bestind]
+        result['best_pfmethod'] = recpfms[bestind]
+        result['best_status'] = check_periodrec_alias(
+            actualperiod,
+            recperiods[bestind],
+            tolerance=period_tolerance
+        )
+
+    else:
+
+        result['best_period'] = np.nan
+        result['best_pfmethod'] = ''
+        result['best_status'] = ('not_variable' if not isperiodic
+                                 else 'no_finite_periods_recovered')
+
+    result['recovered'] = 'actual' in result['best_status'].split(',')
+
+    return result
+
+
+
+def injrec_worker(task):
+    '''This is the parallel worker for run_injection_recovery.
+
+    task is a tuple of the form:
+
+    (times, timebase index, noisemodels, list of trials, randomseed,
+     lcgenparams, pfmethods, pfkwargs, sigclip, nperiodworkers,
+     period_tolerance)
+
+    where all the trials are for this time grid. Returns a list of result rows
+    as dicts.
+
+    '''
+
+    (times, timebaseind, noisemodels, trials, randomseed,
+     lcgenparams, pfmethods, pfkwargs, sigclip, nperiodworkers,
+     period_tolerance) = task
+
+    rows = []
+
+    for trialind, _, noiseind, vartype in trials:
+
+        seed = trial_seed(randomseed, trialind)
+
+        try:
+
+            injected = inject_trial(
+                times,
+                noisemodels[noiseind],
+                vartype,
+                seed,
+                lcgenparams=(lcgenparams.get(vartype)
+                             if lcgenparams else None)
+            )
+            recovered = recover_trial(injected,
+                                      pfmethods=pfmethods,
+                                      pfkwargs=pfkwargs,
+                                      sigclip=sigclip,
+                                      nperiodworkers=nperiodworkers,
+                                      period_tolerance=period_tolerance)
+
+        except Exception as e:
+            LOGEXCEPTION('injection-recovery failed for trial %s' % trialind)
+            continue
+
+        row = {'trial':trialind,
+               'seed':seed,
+               'timebase':timebaseind,
+               'noisemodel':noiseind,
+               'vartype':vartype if vartype else 'none',
+               'ndet':injected['times'].size,
+               'magmedian':noisemodels[noiseind]['mag'],
+               'sigma':noisemodels[noiseind]['sigma'],
+               'actual_period':injected['varperiod'],
+               'actual_amplitude':injected['varamplitude']}
+        row.update(recovered)
+        rows.append(row)
+
+    return rows
+
+
+
+##############################
+## RUNNING THE SIMULATIONS ##
+##############################
+
+def _format_row(row, columns):
+    '''
+    This turns a result row into a line for the result CSV.
+
+    '''
+
+    values = []
+
+    for col in columns:
+        val = row[col]
+        if isinstance(val, (bool, np.bool_)):
+            values.append('%i' % val)
+        elif isinstance(val, (float, np.floating)):
+            values.append('%.10g' % val)
+        else:
+            # the alias statuses are comma-separated, so we switch that here
+            values.append(('%s' % val).replace(',',';'))
+
+    return ','.join(values)
+
+
+
+def read_injrec_results(resultcsv):
+    '''This reads the result table written by run_injection_recovery.
+
+    Returns a numpy record array with one row per trial, sorted by trial. Rows
+    with the wrong number of columns (e.g. from an interrupted run) are skipped.
+
+    '''
+
+    results = np.genfromtxt(resultcsv,
+                            delimiter=',',
+                            names=True,
+                            dtype=None,
+                            encoding='utf-8',
+                            autostrip=True,
+                            invalid_raise=False)
+    results = np.atleast_1d(results)
+
+    return results[np.argsort(results['trial'])]
+
+
+
+def run_injection_recovery(timebases,
+                           noisemodels,
+                           vartypes,
+                           resultcsv,
+                           ntrials=10,
+                           randomseed=0xdecaff,
+                           lcgenparams=None,
+                           pfmethods=('gls',),
+                           pfkwargs=None,
+                           sigclip=10.0,
+                           period_tolerance=1.0e-3,
+                           nworkers=NCPUS,
+                           nperiodworkers=1,
+                           trialsperchunk=20,
+                           overwrite=False):
+    '''This runs an in-memory injection-recovery simulation.
+
+    timebases is a list of base time grids (arrays of times). Real time grids
+    from observed light curves are best here.
+
+    noisemodels is a list of dicts of the form {'mag': median mag, 'sigma':
+    noise stdev in mag}, e.g. for a few magnitude bins.
+
+    vartypes is a list of keys in generation.VARTYPE_LCGEN_MAP to inject. Use
+    None in this list to include trials with no injected variable.
+
+    ntrials is the number of trials for each combination of time grid, noise
+    model, and vartype. The seed for each trial is set by randomseed and the
+    trial's index (see trial_seed).
+
+    lcgenparams is an optional dict of the form {vartype: {kwargs for the
+    generator function}} to pass e.g. custom paramdists to the generators.
+
+    pfmethods, pfkwargs, and sigclip are the period-finders to run, their
+    kwargs, and the sigma-clip to use for them (see lcproc.runpf).
+
+    period_tolerance is the relative tolerance used to decide if a recovered
+    period matches the actual period or one of its aliases.
+
+    nworkers is the number of trial workers to run and nperiodworkers is the
+    number of workers each period-finder uses. trialsperchunk is the number of
+    trials sent to a worker at a time.
+
+    The results for each trial are appended to resultcsv as they come in. If
+    resultcsv exists already and overwrite is False, trials already in it are
+    skipped, so an interrupted run can be picked up again by running this with
+    the same arguments.
+
+    Returns the path to resultcsv. Use read_injrec_results to read it.
+
+    '''
+
+    columns = RESULT_COLUMNS[::]
+    for pfm in pfmethods:
+        columns.extend(['%s_period' % pfm, '%s_status' % pfm])
+
+    trials = make_trials(len(timebases), noisemodels, vartypes, ntrials)
+
+    # see which trials are done already
+    donetrials = set()
+
+    if os.path.exists(resultcsv) and not overwrite:
+
+        with open(resultcsv,'rb+') as infd:
+
+            header = infd.readline().decode().strip().split(',')
+            if header != columns:
+                LOGERROR('existing result table %s has different columns, '
+                         'use overwrite=True to replace it' % resultcsv)
+                return None
+
+            # this is the end of the last complete row
+            rowsend = infd.tell()
+            nbadrows = 0
+
+            for line in iter(infd.readline, b''):
+
+                # the last run may have stopped while writing this row
+                if not line.endswith(b'\n'):
+                    LOGWARNING('dropping the incomplete last row '
+                               'in %s' % resultcsv)
+                    break
+
+                rowsend = infd.tell()
+                rowvals = line.decode('utf-8', 'replace').strip().split(',')
+
+                try:
+                    if len(rowvals) != len(columns):
+                        raise ValueError
+                    donetrials.add(int(rowvals[0]))
+                except ValueError:
+                    nbadrows = nbadrows + 1
+
+            if nbadrows > 0:
+                LOGWARNING('skipped %s bad rows in %s, '
+                           'these trials will be run again' %
+                           (nbadrows, resultcsv))
+
+            # drop any incomplete row so the new rows start on their own line
+            infd.truncate(rowsend)
+
+        outfd = open(resultcsv,'a')
+
+    else:
+
+        outfd = open(resultcsv,'w')
+        outfd.write('%s\n' % ','.join(columns))
+
+    trials = [x for x in trials if x[0] not in donetrials]
+
+    LOGINFO('running %s injection-recovery trials '
+            '(%s already done) using %s workers' %
+            (len(trials), len(donetrials), nworkers))
+
+    # make the tasks so each one only needs a single time grid
+    tasks = []
+
+    for timebaseind, times in enumerate(timebases):
+
+        timebasetrials = [x for x in trials if x[1] == timebaseind]
+
+        for chunkind in range(0, len(timebasetrials), trialsperchunk):
+            tasks.append(
+                (times, timebaseind, noisemodels,
+                 timebasetrials[chunkind:chunkind+trialsperchunk],
+                 randomseed, lcgenparams, pfmethods, pfkwargs, sigclip,
+                 nperiodworkers, period_tolerance)
+            )
+
+    ndone = 0
+
+    try:
+
+        if nworkers == 1:
+
+            for task in tasks:
+                for row in injrec_worker(task):
+                    outfd.write('%s\n' % _format_row(row, columns))
+                    ndone = ndone + 1
+                outfd.flush()
+
+        else:
+
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+
+                futures = [executor.submit(injrec_worker, x) for x in tasks]
+
+                for future in as_completed(futures):
+                    for row in future.result():
+                        outfd.write('%s\n' % _format_row(row, columns))
+                        ndone = ndone + 1
+                    outfd.flush()
+
+    finally:
+
+        outfd.close()
+
+    LOGINFO('done with %s trials, results in %s' % (ndone, resultcsv))
+    return resultcsv
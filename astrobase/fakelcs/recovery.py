@@ -245,6 +245,11 @@ def matthews_correl_coeff(ntp, ntn, nfp, nfn):
 ## VARIABILITY RECOVERY (PER MAGBIN) ##
 #######################################
 
+# these are the magbins used by lcproc.variability_threshold by default, which
+# get_recovered_variables_for_magbin uses to bin objects
+VARTHRESH_MAGBINS = np.arange(8.0,16.25,0.25)
+
+
 def get_recovered_variables_for_magbin(simbasedir,
                                        magbinmedian,
                                        stetson_stdev_min=2.0,
@@ -371,7 +376,7 @@ def get_recovered_variables_for_magbin(simbasedir,
             np.array(varthresh[magcol]['binned_sdssr_median']) == magbinmedian
         )
 
-        magbinind = np.asscalar(magbinind[0])
+        magbinind = magbinind[0].item()
 
         # get the objectids, actual vars and actual notvars in this magbin
         thisbin_objectids = binned_objectids[magbinind]
@@ -608,12 +613,379 @@ def magbin_varind_gridsearch_worker(task):
 
 
 
+def _magbin_groups(sdssr, magbins):
+    '''This bins objects by sdssr the same way as lcproc.variability_threshold.
+
+    Returns a list of index arrays, one per occupied magbin in order.
+
+    '''
+
+    magbininds = np.digitize(sdssr, magbins)
+
+    return [np.where(magbininds == mbinind)[0]
+            for mbinind, magi in zip(np.unique(magbininds),
+                                     range(len(magbins)-1))]
+
+
+
+def _load_varfeature_arrays(varfeaturedir, magcols):
+    '''This loads the variability indices for all objects in varfeaturedir.
+
+    This reads each varfeatures pickle once and gets the same values that
+    lcproc.variability_threshold uses for thresholding. Returns a dict keyed by
+    magcol, each containing arrays of objectid, sdssr, stetsonj, iqr, and inveta
+    for the objects with finite values of all of these.
+
+    '''
+
+    pklist = glob.glob(os.path.join(varfeaturedir, 'varfeatures-*.pkl'))
+
+    collected = {x:[] for x in magcols}
+
+    for pkl in pklist:
+
+        with open(pkl,'rb') as infd:
+            thisfeatures = pickle.load(infd)
+
+        for magcol in magcols:
+            collected[magcol].append(
+                lcproc._varthresh_indices(thisfeatures, magcol)
+            )
+
+    featurearrays = {}
+
+    for magcol in magcols:
+
+        if len(collected[magcol]) > 0:
+            objectid, sdssr, lcmad, stetsonj, iqr, eta = [
+                np.ravel(np.array(x)) for x in zip(*collected[magcol])
+            ]
+        else:
+            objectid, sdssr, lcmad, stetsonj, iqr, eta = [
+                np.array([]) for x in range(6)
+            ]
+
+        finind = (np.isfinite(sdssr) &
+                  np.isfinite(lcmad) &
+                  np.isfinite(stetsonj) &
+                  np.isfinite(iqr) &
+                  np.isfinite(eta))
+
+        featurearrays[magcol] = {
+            'objectid':objectid[finind],
+            'sdssr':sdssr[finind],
+            'stetsonj':stetsonj[finind],
+            'iqr':iqr[finind],
+            'inveta':1.0/eta[finind]
+        }
+
+    return featurearrays
+
+
+
+def _threshold_pass_counts(values, sigmas, isvar, isnotvar):
+    '''This counts the objects above each threshold for one variability index.
+
+    values are the index values for the objects in a magbin and sigmas is the
+    grid of stdev multipliers. The threshold for each is median + sigma*stdev,
+    where the stdev is estimated from the MAD as in
+    lcproc.variability_threshold. If there are 4 or fewer objects in the magbin,
+    nothing is above the threshold.
+
+    Returns a dict with the number of objects above each threshold, the number
+    of these that are in isvar and isnotvar, and the rank of each object. An
+    object passes the threshold at grid index j if thresholdpos[j] < its rank.
+
+    '''
+
+    if values.size > 4:
+        median = np.median(values)
+        stdev = np.median(np.abs(values - median)) * 1.483
+        thresholds = median + sigmas*stdev
+    else:
+        thresholds = np.full(sigmas.size, np.inf)
+
+    # the number of objects above each threshold comes from the sorted values,
+    # so this is done for all grid points at once
+    def count_above(vals):
+        return vals.size - np.searchsorted(np.sort(vals),
+                                           thresholds,
+                                           side='right')
+
+    sortind = np.argsort(thresholds, kind='mergesort')
+    thresholdpos = np.empty(sigmas.size, dtype=np.int64)
+    thresholdpos[sortind] = np.arange(sigmas.size)
+
+    return {
+        'recovered':count_above(values),
+        'truepositives':count_above(values[isvar]),
+        'falsepositives':count_above(values[isnotvar]),
+        'ranks':np.searchsorted(thresholds[sortind], values, side='left'),
+        'thresholdpos':thresholdpos,
+    }
+
+
+
+def _missed_found_counts(counts_missed, counts_found, isvar):
+    '''This counts actual variables found by one index but missed by another.
+
+    Returns an array C where C[i,j] is the number of actual variables above
+    the threshold at grid index j for the second index but not above the
+    threshold at grid index i for the first one.
+
+    '''
+
+    ngrid = counts_missed['thresholdpos'].size
+
+    # histogram the actual variables by their ranks for both indices
+    hist = np.bincount(
+        counts_missed['ranks'][isvar]*(ngrid+1) + counts_found['ranks'][isvar],
+        minlength=(ngrid+1)*(ngrid+1)
+    ).reshape(ngrid+1, ngrid+1)
+
+    # cumulative[p,q] is the number with missed rank <= p and found rank > q
+    cumulative = np.cumsum(hist, axis=0)
+    cumulative = np.cumsum(cumulative[:,::-1], axis=1)[:,::-1]
+    cumulative = np.hstack((cumulative[:,1:],
+                            np.zeros((ngrid+1,1), dtype=cumulative.dtype)))
+
+    return cumulative[np.ix_(counts_missed['thresholdpos'],
+                             counts_found['thresholdpos'])]
+
+
+
+def _index_stats(counts, nvar, nnotvar):
+    '''
+    This turns the threshold counts into the stats for each grid point.
+
+    '''
+
+    stats = []
+
+    for ntp, nfp, nrec in zip(counts['truepositives'].tolist(),
+                              counts['falsepositives'].tolist(),
+                              counts['recovered'].tolist()):
+
+        ntn = nnotvar - nfp
+        nfn = nvar - ntp
+
+        stats.append({'recoveredvars':nrec,
+                      'truepositives':ntp,
+                      'falsepositives':nfp,
+                      'truenegatives':ntn,
+                      'falsenegatives':nfn,
+                      'precision':precision(ntp, nfp),
+                      'recall':recall(ntp, nfn),
+                      'mcc':matthews_correl_coeff(ntp, ntn, nfp, nfn)})
+
+    return stats
+
+
+
+def magbin_varind_gridsearch_vectorized(task):
+    '''This evaluates the whole variable index grid for a single magbin.
+
+    This is the parallel worker for variable_index_gridsearch_magbin when
+    vectorized=True. task is a tuple of the form:
+
+    (recdict base, (stetson_grid, inveta_grid, iqr_grid), magcol tasks)
+
+    where magcol tasks is a dict keyed by magcol. Each of these is a dict with
+    the magbinind for this magbin and the objectid, stetsonj, inveta, iqr
+    arrays of the objects with varfeatures in the magbin, as well as the
+    binobjectids and binvarflags of the simulated objects in the magbin. This
+    is None if the magbin wasn't found for the magcol.
+
+    Returns a list of results for the grid points in the same order as the
+    stet_inveta_iqr_grid, with the same stats as
+    get_recovered_variables_for_magbin(..., statsonly=True).
+
+    '''
+
+    recbase, grids, magcoltasks = task
+    stetson_grid, inveta_grid, iqr_grid = grids
+    ngridpoints = stetson_grid.size*inveta_grid.size*iqr_grid.size
+
+    if any(magcoltasks[x] is None for x in recbase['magcols']):
+        LOGERROR('magbinmedian %.3f not found for all magcols' %
+                 recbase['magbinmedian'])
+        return [None for x in range(ngridpoints)]
+
+    magcolstats = {}
+
+    for magcol in recbase['magcols']:
+
+        mctask = magcoltasks[magcol]
+
+        thisbin_actualvars = mctask['binobjectids'][mctask['binvarflags']]
+        thisbin_actualnotvars = mctask['binobjectids'][~mctask['binvarflags']]
+
+        isvar = np.in1d(mctask['objectid'], thisbin_actualvars)
+        isnotvar = np.in1d(mctask['objectid'], thisbin_actualnotvars)
+        nvar, nnotvar = thisbin_actualvars.size, thisbin_actualnotvars.size
+
+        counts = {
+            'stet':_threshold_pass_counts(mctask['stetsonj'],
+                                          stetson_grid, isvar, isnotvar),
+            'inveta':_threshold_pass_counts(mctask['inveta'],
+                                            inveta_grid, isvar, isnotvar),
+            'iqr':_threshold_pass_counts(mctask['iqr'],
+                                         iqr_grid, isvar, isnotvar),
+        }
+
+        missedfound = {}
+        for missed in ('stet','inveta','iqr'):
+            for found in ('stet','inveta','iqr'):
+                if missed != found:
+                    missedfound[(missed, found)] = _missed_found_counts(
+                        counts[missed],
+                        counts[found],
+                        isvar
+                    )
+
+        magcolstats[magcol] = {
+            'indexstats':{x:_index_stats(counts[x], nvar, nnotvar)
+                          for x in counts},
+            'missedfound':missedfound,
+            'binstats':{'actual_variables':nvar,
+                        'actual_nonvariables':nnotvar,
+                        'all_objectids':mctask['binobjectids'].size,
+                        'magbinind':mctask['magbinind']}
+        }
+
+    # now put together the results for each grid point
+    results = []
+
+    for stetind, stet in enumerate(stetson_grid):
+        for invetaind, inveta in enumerate(inveta_grid):
+            for iqrind, iqr in enumerate(iqr_grid):
+
+                recdict = recbase.copy()
+                recdict.update({'stetj_min_stdev':stet,
+                                'inveta_min_stdev':inveta,
+                                'iqr_min_stdev':iqr})
+
+                gridinds = {'stet':stetind,
+                            'inveta':invetaind,
+                            'iqr':iqrind}
+
+                for magcol in recbase['magcols']:
+
+                    mcstats = magcolstats[magcol]
+                    magcolrec = {}
+
+                    for index in ('stet','inveta','iqr'):
+                        thisstats = mcstats['indexstats'][index][
+                            gridinds[index]
+                        ]
+                        for key in thisstats:
+                            magcolrec['%s_%s' % (index, key)] = thisstats[key]
+
+                    for (missed, found), val in mcstats['missedfound'].items():
+                        magcolrec['%s_missed_%s_found' % (missed, found)] = (
+                            int(val[gridinds[missed], gridinds[found]])
+                        )
+
+                    magcolrec.update(mcstats['binstats'])
+                    recdict[magcol] = magcolrec
+
+                results.append(recdict)
+
+    return results
+
+
+
+def _vectorized_gridsearch_magbins(simbasedir,
+                                   siminfo,
+                                   magbinmedians,
+                                   grids,
+                                   ngridworkers):
+    '''This runs magbin_varind_gridsearch_vectorized for all magbins.
+
+    Returns a list with the grid-point results for each magbinmedian.
+
+    '''
+
+    magcols = siminfo['magcols']
+    objectids = siminfo['objectid']
+    varflags = siminfo['isvariable']
+
+    LOGINFO('reading varfeatures for all objects...')
+    featurearrays = _load_varfeature_arrays(
+        os.path.join(simbasedir, 'varfeatures'),
+        magcols
+    )
+
+    # bin the simulated objects and the objects with varfeatures the same way
+    # as lcproc.variability_threshold and get_recovered_variables_for_magbin
+    simbins = _magbin_groups(siminfo['sdssr'], VARTHRESH_MAGBINS)
+    featurebins = {}
+    featurebinmedians = {}
+
+    for magcol in magcols:
+        featurebins[magcol] = _magbin_groups(featurearrays[magcol]['sdssr'],
+                                             VARTHRESH_MAGBINS)
+        featurebinmedians[magcol] = np.array([
+            (VARTHRESH_MAGBINS[x] + VARTHRESH_MAGBINS[x+1])/2.0
+            for x in range(len(featurebins[magcol]))
+        ])
+
+    tasks = []
+
+    for magbinmedian in magbinmedians:
+
+        recbase = {
+            'simbasedir':simbasedir,
+            'timecols':siminfo['timecols'],
+            'magcols':magcols,
+            'errcols':siminfo['errcols'],
+            'magbinmedian':magbinmedian,
+        }
+
+        magcoltasks = {}
+
+        for magcol in magcols:
+
+            magbinind = np.where(featurebinmedians[magcol] == magbinmedian)[0]
+
+            if magbinind.size != 1 or magbinind[0] >= len(simbins):
+                magcoltasks[magcol] = None
+                continue
+
+            magbinind = magbinind[0].item()
+            featureind = featurebins[magcol][magbinind]
+            siminds = simbins[magbinind]
+
+            magcoltasks[magcol] = {
+                'magbinind':magbinind,
+                'objectid':featurearrays[magcol]['objectid'][featureind],
+                'stetsonj':featurearrays[magcol]['stetsonj'][featureind],
+                'inveta':featurearrays[magcol]['inveta'][featureind],
+                'iqr':featurearrays[magcol]['iqr'][featureind],
+                'binobjectids':objectids[siminds],
+                'binvarflags':varflags[siminds],
+            }
+
+        tasks.append((recbase, grids, magcoltasks))
+
+    LOGINFO('running vectorized stetson J-inveta-IQR grid-search '
+            'for %s magbins...' % len(tasks))
+
+    with ProcessPoolExecutor(max_workers=ngridworkers) as executor:
+        results = list(executor.map(magbin_varind_gridsearch_vectorized,
+                                    tasks))
+
+    return results
+
+
+
 def variable_index_gridsearch_magbin(simbasedir,
                                      stetson_stdev_range=[1.0,20.0],
                                      inveta_stdev_range=[1.0,20.0],
                                      iqr_stdev_range=[1.0,20.0],
                                      ngridpoints=32,
-                                     ngridworkers=None):
+                                     ngridworkers=None,
+                                     vectorized=True):
     '''This runs a variable index grid search per magbin.
 
     Similar to variable_index_gridsearch above.
@@ -653,7 +1025,14 @@ def variable_index_gridsearch_magbin(simbasedir,
 
     For the default number of grid-points and 25000 simulated light curves, this
     takes about 3 days to run on a 40 (effective) core machine with 2 x Xeon
-    E5-2650v3 CPUs.
+    E5-2650v3 CPUs if vectorized=False, which runs
+    get_recovered_variables_for_magbin for each grid-point separately.
+
+    If vectorized=True, the varfeatures are read only once and the counts for
+    all thresholds of each variable index are found at once from the sorted
+    index values. Each magbin is then run as a separate task using ngridworkers
+    workers. This gives the same results, but doesn't write the per grid-point
+    varthresh pickles to simbasedir/recvar-threshold-pkls.
 
     '''
 
@@ -707,6 +1086,24 @@ def variable_index_gridsearch_magbin(simbasedir,
                      'recovery':[]}
 
 
+    if vectorized:
+
+        grid_results['recovery'] = _vectorized_gridsearch_magbins(
+            simbasedir,
+            siminfo,
+            magbinmedians,
+            (stetson_grid, inveta_grid, iqr_grid),
+            ngridworkers
+        )
+
+        LOGINFO('done.')
+        with open(os.path.join(simbasedir,
+                               'fakevar-recovery-per-magbin.pkl'),
+                  'wb') as outfd:
+            pickle.dump(grid_results,outfd,pickle.HIGHEST_PROTOCOL)
+
+        return grid_results
+
     # set up the pool
     pool = mp.Pool(ngridworkers)
 
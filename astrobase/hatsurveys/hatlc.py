@@ -170,6 +170,14 @@ import json
 import numpy as np
 from numpy import nan
 
+# this is the fast bulk parser for CSV LCs. it's optional so hatlc can still be
+# used as a standalone module; if it's not available, we fall back to parsing
+# the CSV LC values one at a time
+try:
+    from .lcparse import parse_lc_columns
+except Exception as e:
+    parse_lc_columns = None
+
 
 #################
 ## DEFINITIONS ##
@@ -1105,12 +1113,36 @@ def parse_csv_header(header):
 
 
 
-def read_csvlc(lcfile):
+def _get_csvlc_caster(col):
+    '''
+    This returns the type to use for a CSV LC column or None if it's unknown.
+
+    '''
+
+    if (col.split('_')[0] in LC_MAG_COLUMNS or
+        col.split('_')[0] in LC_ERR_COLUMNS or
+        col.split('_')[0] in LC_FLAG_COLUMNS):
+        return COLUMNDEFS[col.split('_')[0]][2]
+
+    elif col in COLUMNDEFS:
+        return COLUMNDEFS[col][2]
+
+    else:
+        return None
+
+
+
+def read_csvlc(lcfile, usecols=None):
     '''
     This reads the HAT data server producd CSV light curve into a lcdict.
 
     lcfile is the HAT gzipped CSV LC (with a .hatlc.csv.gz extension)
 
+    usecols is an optional list of the LC columns to read, e.g. ['rjd',
+    'aep_000', 'aie_000']. If this is None, all of the columns are read. If it's
+    provided, only these columns are parsed and lcdict['columns'] will only
+    list these.
+
     '''
 
     # read in the file and split by lines
@@ -1132,29 +1164,49 @@ def read_csvlc(lcfile):
 
     # initialize the lcdict and parse the CSV header
     lcdict = parse_csv_header(lcheader)
+    allcolumns = lcdict['columns']
 
-    # tranpose the LC rows into columns
+    # figure out which columns we can read
+    readcols = []
+    for col in allcolumns:
+        if usecols is not None and col not in usecols:
+            continue
+        if _get_csvlc_caster(col) is None:
+            LOGWARNING('lcdict col %s has no formatter available' % col)
+            continue
+        readcols.append(col)
+
+    if usecols is not None:
+        lcdict['columns'] = [x for x in allcolumns if x in readcols]
+
+    # use the fast bulk parser if we can
+    if parse_lc_columns is not None:
+
+        coldict = parse_lc_columns(
+            lccolumns,
+            allcolumns,
+            [_get_csvlc_caster(x) for x in allcolumns],
+            delimiter=',',
+            usecols=readcols
+        )
+
+        if coldict is not None:
+            lcdict.update(coldict)
+            return lcdict
+
+    # otherwise, tranpose the LC rows into columns
     lccolumns = [x.split(',') for x in lccolumns]
     lccolumns = list(zip(*lccolumns))  # argh more Python 3
 
     # write the columns to the dict
-    for colind, col in enumerate(lcdict['columns']):
-
-        if (col.split('_')[0] in LC_MAG_COLUMNS or
-            col.split('_')[0] in LC_ERR_COLUMNS or
-            col.split('_')[0] in LC_FLAG_COLUMNS):
-            lcdict[col] = np.array([smartcast(x,
-                                              COLUMNDEFS[col.split('_')[0]][2])
-                                    for x in lccolumns[colind]])
-
-        elif col in COLUMNDEFS:
-            lcdict[col] = np.array([smartcast(x,COLUMNDEFS[col][2])
-                                    for x in lccolumns[colind]])
+    for colind, col in enumerate(allcolumns):
 
-        else:
-            LOGWARNING('lcdict col %s has no formatter available' % col)
+        if col not in readcols:
             continue
 
+        lcdict[col] = np.array([smartcast(x, _get_csvlc_caster(col))
+                                for x in lccolumns[colind]])
+
     return lcdict
 
 
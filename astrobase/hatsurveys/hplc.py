@@ -88,6 +88,7 @@ import re
 import glob
 import sys
 import shutil
+import fnmatch
 import multiprocessing as mp
 
 try:
@@ -97,6 +98,8 @@ except:
 
 import numpy as np
 
+from .lcparse import parse_lc_columns
+
 
 ###################
 ## USEFUL CONFIG ##
@@ -153,9 +156,9 @@ MAGCOLS = ['ifl1','irm1','iep1','itf1',
 ## READING AND WRITING TEXT LCS ##
 ##################################
 
-def read_hatpi_textlc(lcfile):
+def _get_textlc_coldefs(lcfile):
     '''
-    This reads in a textlc that is complete up to the TFA stage.
+    This returns the column definitions for the text LC based on its aperture.
 
     '''
 
@@ -165,73 +168,113 @@ def read_hatpi_textlc(lcfile):
         thiscoldefs = COLDEFS + [('itf2',float)]
     elif 'TF3' in lcfile:
         thiscoldefs = COLDEFS + [('itf3',float)]
+    else:
+        thiscoldefs = COLDEFS
+
+    return thiscoldefs
+
+
+
+def _parse_textlc_lines(lclines, thiscoldefs):
+    '''This parses the text LC lines one at a time.
+
+    This is the slow path, only used if lcparse.parse_lc_columns can't handle
+    the file (e.g. rows with a different number of columns).
+
+    '''
+
+    lclines = [x.split() for x in lclines if ('#' not in x and len(x) > 0)]
+    lccols = list(zip(*lclines))
+    lcdict = {x[0]:y for (x,y) in zip(thiscoldefs, lccols)}
+
+    # convert to ndarray
+    for col in thiscoldefs:
+        lcdict[col[0]] = np.array([col[1](x) for x in lcdict[col[0]]])
+
+    return lcdict, len(lclines)
+
+
+
+def read_hatpi_textlc(lcfile):
+    '''
+    This reads in a textlc that is complete up to the TFA stage.
+
+    The columns are parsed in bulk with lcparse.parse_lc_columns using the types
+    in COLDEFS, which is much faster than converting the values line by line for
+    large LCs.
+
+    '''
+
+    thiscoldefs = _get_textlc_coldefs(lcfile)
 
     LOGINFO('reading %s' % lcfile)
 
     if lcfile.endswith('.gz'):
-        infd = gzip.open(lcfile,'r')
+        infd = gzip.open(lcfile,'rb')
     else:
-        infd = open(lcfile,'r')
-
+        infd = open(lcfile,'rb')
 
     with infd:
-
         lclines = infd.read().decode().split('\n')
-        lclines = [x.split() for x in lclines if ('#' not in x and len(x) > 0)]
-        ndet = len(lclines)
 
-        if ndet > 0:
+    datalines = [x for x in lclines if ('#' not in x and len(x) > 0)]
 
-            lccols = list(zip(*lclines))
-            lcdict = {x[0]:y for (x,y) in zip(thiscoldefs, lccols)}
+    lcdict = parse_lc_columns(datalines,
+                              [x[0] for x in thiscoldefs],
+                              [x[1] for x in thiscoldefs],
+                              delimiter=None)
 
-            # convert to ndarray
-            for col in thiscoldefs:
-                lcdict[col[0]] = np.array([col[1](x) for x in lcdict[col[0]]])
+    if lcdict is not None:
 
-        else:
+        ndet = len(datalines)
 
-            lcdict = {}
-            LOGWARNING('no detections in %s' % lcfile)
-            # convert to empty ndarrays
-            for col in thiscoldefs:
-                lcdict[col[0]] = np.array([])
-
-        # add the object's name to the lcdict
-        hatid = HATIDREGEX.findall(lcfile)
-        lcdict['objectid'] = hatid[0] if hatid else 'unknown object'
-
-        # add the columns to the lcdict
-        lcdict['columns'] = [x[0] for x in thiscoldefs]
-
-        # add some basic info similar to usual HATLCs
-        lcdict['objectinfo'] = {
-            'ndet':ndet,
-            'hatid':hatid[0] if hatid else 'unknown object',
-            'network':'HP',
-        }
-
-        # break out the {stationid}-{framenum}{framesub}_{ccdnum} framekey
-        # into separate columns
-        framekeyelems = FRAMEREGEX.findall('\n'.join(lcdict['frk']))
-
-        lcdict['stf'] = np.array([(int(x[0]) if x[0].isdigit() else np.nan)
-                                  for x in framekeyelems])
-        lcdict['cfn'] = np.array([(int(x[1]) if x[0].isdigit() else np.nan)
-                                  for x in framekeyelems])
-        lcdict['cfs'] = np.array([x[2] for x in framekeyelems])
-        lcdict['ccd'] = np.array([(int(x[3]) if x[0].isdigit() else np.nan)
-                                  for x in framekeyelems])
-
-        # update the column list with these columns
-        lcdict['columns'].extend(['stf','cfn','cfs','ccd'])
-
-        # add more objectinfo: 'stations', etc.
-        lcdict['objectinfo']['network'] = 'HP'
-        lcdict['objectinfo']['stations'] = [
-            'HP%s' % x for x in np.unique(lcdict['stf']).tolist()
-        ]
+    else:
+
+        LOGWARNING('bulk parsing failed for %s, '
+                   'falling back to parsing it line by line' % lcfile)
+        lcdict, ndet = _parse_textlc_lines(lclines, thiscoldefs)
+
+    if ndet == 0:
+
+        LOGWARNING('no detections in %s' % lcfile)
+        # convert to empty ndarrays
+        for col in thiscoldefs:
+            lcdict[col[0]] = np.array([])
+
+    # add the object's name to the lcdict
+    hatid = HATIDREGEX.findall(lcfile)
+    lcdict['objectid'] = hatid[0] if hatid else 'unknown object'
 
+    # add the columns to the lcdict
+    lcdict['columns'] = [x[0] for x in thiscoldefs]
+
+    # add some basic info similar to usual HATLCs
+    lcdict['objectinfo'] = {
+        'ndet':ndet,
+        'hatid':hatid[0] if hatid else 'unknown object',
+        'network':'HP',
+    }
+
+    # break out the {stationid}-{framenum}{framesub}_{ccdnum} framekey
+    # into separate columns
+    framekeyelems = FRAMEREGEX.findall('\n'.join(lcdict['frk']))
+
+    lcdict['stf'] = np.array([(int(x[0]) if x[0].isdigit() else np.nan)
+                              for x in framekeyelems])
+    lcdict['cfn'] = np.array([(int(x[1]) if x[0].isdigit() else np.nan)
+                              for x in framekeyelems])
+    lcdict['cfs'] = np.array([x[2] for x in framekeyelems])
+    lcdict['ccd'] = np.array([(int(x[3]) if x[0].isdigit() else np.nan)
+                              for x in framekeyelems])
+
+    # update the column list with these columns
+    lcdict['columns'].extend(['stf','cfn','cfs','ccd'])
+
+    # add more objectinfo: 'stations', etc.
+    lcdict['objectinfo']['network'] = 'HP'
+    lcdict['objectinfo']['stations'] = [
+        'HP%s' % x for x in np.unique(lcdict['stf']).tolist()
+    ]
 
     return lcdict
 
@@ -304,6 +347,29 @@ def read_hatpi_pklc(lcfile):
 ## CONCATENATING LIGHT CURVES ##
 ################################
 
+def _normalize_textlc_magcols(lcdict):
+    '''
+    This normalizes the mag columns of the lcdict to zero and the flux columns
+    to one, in place.
+
+    '''
+
+    for col in MAGCOLS:
+
+        if col in lcdict:
+            thismedval = np.nanmedian(lcdict[col])
+
+            # handle fluxes
+            if col in ('ifl1','ifl2','ifl3'):
+                lcdict[col] = lcdict[col] / thismedval
+            # handle mags
+            else:
+                lcdict[col] = lcdict[col] - thismedval
+
+    return lcdict
+
+
+
 def concatenate_textlcs(lclist,
                         sortby='rjd',
                         normalize=True):
@@ -328,6 +394,11 @@ def concatenate_textlcs(lclist,
     curve filepath. Finally, there is an 'nconcatenated' key in the lcdict that
     contains the total number of concatenated light curves.
 
+    The input light curves are read one at a time and their columns are
+    collected, then each output column is put together in a single step once
+    all the ndets are known, and the result is sorted once at the end. This
+    keeps the run time linear in the number of input light curves.
+
     '''
 
     # read the first light curve
@@ -337,22 +408,15 @@ def concatenate_textlcs(lclist,
     # initial LC
     lccounter = 0
     lcdict['concatenated'] = {lccounter: os.path.abspath(lclist[0])}
-    lcdict['lcn'] = np.full_like(lcdict['rjd'], lccounter)
 
     # normalize if needed
     if normalize:
+        lcdict = _normalize_textlc_magcols(lcdict)
 
-        for col in MAGCOLS:
-
-            if col in lcdict:
-                thismedval = np.nanmedian(lcdict[col])
-
-                # handle fluxes
-                if col in ('ifl1','ifl2','ifl3'):
-                    lcdict[col] = lcdict[col] / thismedval
-                # handle mags
-                else:
-                    lcdict[col] = lcdict[col] - thismedval
+    # these collect the column chunks from each LC
+    colchunks = {col:[lcdict[col]] for col in lcdict['columns']}
+    lcnchunks = [np.full_like(lcdict['rjd'], lccounter)]
+    totalndet = lcdict[lcdict['columns'][0]].size
 
     # now read the rest
     for lcf in lclist[1:]:
@@ -373,38 +437,34 @@ def concatenate_textlcs(lclist,
                     % (lcf,
                        thislcd['objectinfo']['ndet'],
                        lclist[0],
-                       lcdict[lcdict['columns'][0]].size))
+                       totalndet))
+
+            # handle normalization for magnitude columns
+            if normalize:
+                thislcd = _normalize_textlc_magcols(thislcd)
 
             # update LC tracking
             lccounter = lccounter + 1
             lcdict['concatenated'][lccounter] = os.path.abspath(lcf)
-            lcdict['lcn'] = np.concatenate((
-                lcdict['lcn'],
-                np.full_like(thislcd['rjd'],lccounter)
-            ))
+            lcnchunks.append(np.full_like(thislcd['rjd'], lccounter))
 
-            # concatenate the columns
+            # collect the columns
             for col in lcdict['columns']:
+                colchunks[col].append(thislcd[col])
 
-                # handle normalization for magnitude columns
-                if normalize and col in MAGCOLS:
-
-                    thismedval = np.nanmedian(thislcd[col])
-
-                    # handle fluxes
-                    if col in ('ifl1','ifl2','ifl3'):
-                        thislcd[col] = thislcd[col] / thismedval
-                    # handle mags
-                    else:
-                        thislcd[col] = thislcd[col] - thismedval
-
-                # concatenate the values
-                lcdict[col] = np.concatenate((lcdict[col], thislcd[col]))
+            totalndet = totalndet + thislcd[lcdict['columns'][0]].size
 
     #
-    # now we're all done concatenatin'
+    # now we're all done reading, put the columns together
     #
 
+    LOGINFO('concatenating %s light curves with %s total detections...' %
+            (lccounter + 1, totalndet))
+
+    for col in lcdict['columns']:
+        lcdict[col] = np.concatenate(colchunks[col])
+    lcdict['lcn'] = np.concatenate(lcnchunks)
+
     # make sure to add up the ndet
     lcdict['objectinfo']['ndet'] = lcdict[lcdict['columns'][0]].size
 
@@ -512,7 +572,7 @@ def concatenate_textlcs_for_objectid(lcbasedir,
                                               sdir,
                                               '*%s*%s*%s' % (objectid,
                                                              aperture,
-                                                             prefix))
+                                                             postfix))
                     foundfiles = glob.glob(searchpath)
 
                     if foundfiles:
@@ -543,20 +603,33 @@ def concat_write_pklc(lcbasedir,
                       sortby='rjd',
                       normalize=True,
                       outdir=None,
-                      recursive=True):
+                      recursive=True,
+                      lclist=None):
     '''This concatenates all text LCs for the given object and writes to a pklc.
 
     Basically a rollup for the concatenate_textlcs_for_objectid and
     lcdict_to_pickle functions.
 
+    If lclist is provided, these light curves are concatenated directly instead
+    of searching for them in lcbasedir.
+
     '''
 
-    concatlcd = concatenate_textlcs_for_objectid(lcbasedir,
-                                                 objectid,
-                                                 aperture=aperture,
-                                                 sortby=sortby,
-                                                 normalize=normalize,
-                                                 recursive=recursive)
+    if lclist:
+        concatlcd = concatenate_textlcs(lclist,
+                                        sortby=sortby,
+                                        normalize=normalize)
+    else:
+        concatlcd = concatenate_textlcs_for_objectid(lcbasedir,
+                                                     objectid,
+                                                     aperture=aperture,
+                                                     postfix=postfix,
+                                                     sortby=sortby,
+                                                     normalize=normalize,
+                                                     recursive=recursive)
+
+    if concatlcd is None:
+        return None
 
     if not outdir:
         outdir = 'pklcs'
@@ -577,7 +650,8 @@ def parallel_concat_worker(task):
 
     task[0] = lcbasedir
     task[1] = objectid
-    task[2] = {'aperture','postfix','sortby','normalize','outdir','recursive'}
+    task[2] = {'aperture','postfix','sortby','normalize','outdir','recursive',
+               'lclist'}
 
     '''
 
@@ -592,6 +666,73 @@ def parallel_concat_worker(task):
 
 
 
+def find_textlcs_for_objectids(lcbasedir,
+                               objectidlist,
+                               aperture='TF1',
+                               postfix='.gz',
+                               recursive=True):
+    '''This finds the text LCs for all objects in objectidlist.
+
+    lcbasedir is searched only once (instead of once per object like
+    concatenate_textlcs_for_objectid does) and the light curves are matched to
+    the objectids by filename.
+
+    Returns a dict of the form {objectid: [list of LC files]}. Objects with no
+    matching LCs get an empty list.
+
+    '''
+
+    if recursive and sys.version_info[:2] > (3,4):
+
+        allfiles = glob.glob(os.path.join(lcbasedir,
+                                          '**',
+                                          '*%s*%s' % (aperture, postfix)),
+                             recursive=True)
+
+    elif recursive:
+
+        allfiles = []
+        for root, dirs, files in os.walk(lcbasedir):
+            allfiles.extend(
+                os.path.join(root, x) for x in
+                fnmatch.filter(files, '*%s*%s' % (aperture, postfix))
+            )
+
+    else:
+
+        allfiles = glob.glob(os.path.join(lcbasedir,
+                                          '*%s*%s' % (aperture, postfix)))
+
+    LOGINFO('found %s light curves for aperture %s in %s' %
+            (len(allfiles), aperture, lcbasedir))
+
+    # index the LCs by HATID first
+    hatidindex = {}
+    for lcf in allfiles:
+        for hatid in set(HATIDREGEX.findall(os.path.basename(lcf))):
+            if hatid not in hatidindex:
+                hatidindex[hatid] = []
+            hatidindex[hatid].append(lcf)
+
+    # then look up each object, falling back to matching the filenames for
+    # objectids that aren't HATIDs
+    objectlcs = {}
+
+    for objectid in objectidlist:
+
+        if objectid in hatidindex:
+            objectlcs[objectid] = hatidindex[objectid]
+        else:
+            objectlcs[objectid] = [
+                x for x in allfiles if
+                fnmatch.fnmatch(os.path.basename(x),
+                                '*%s*%s*%s' % (objectid, aperture, postfix))
+            ]
+
+    return objectlcs
+
+
+
 def parallel_concat_lcdir(lcbasedir,
                           objectidlist,
                           aperture='TF1',
@@ -604,6 +745,12 @@ def parallel_concat_lcdir(lcbasedir,
                           maxworkertasks=1000):
     '''This concatenates all text LCs for the given objectidlist.
 
+    lcbasedir is searched once for all the light curves with the given aperture
+    and postfix using find_textlcs_for_objectids, then the light curves for each
+    object are concatenated in parallel using concatenate_textlcs and written to
+    pickles in outdir.
+
+    Returns a dict of the form {objectid: output pickle path or None}.
 
     '''
 
@@ -613,12 +760,25 @@ def parallel_concat_lcdir(lcbasedir,
     if not os.path.exists(outdir):
         os.mkdir(outdir)
 
+    objectlcs = find_textlcs_for_objectids(lcbasedir,
+                                           objectidlist,
+                                           aperture=aperture,
+                                           postfix=postfix,
+                                           recursive=recursive)
+
+    for objectid in objectidlist:
+        if not objectlcs[objectid]:
+            LOGERROR('did not find any light curves for %s and aperture %s' %
+                     (objectid, aperture))
+
     tasks = [(lcbasedir, x, {'aperture':aperture,
                              'postfix':postfix,
                              'sortby':sortby,
                              'normalize':normalize,
                              'outdir':outdir,
-                             'recursive':recursive}) for x in objectidlist]
+                             'recursive':recursive,
+                             'lclist':objectlcs[x]})
+             for x in objectidlist if objectlcs[x]]
 
     pool = mp.Pool(nworkers, maxtasksperchild=maxworkertasks)
     results = pool.map(parallel_concat_worker, tasks)
@@ -626,7 +786,10 @@ def parallel_concat_lcdir(lcbasedir,
     pool.close()
     pool.join()
 
-    return {x:y for (x,y) in zip(objectidlist, results)}
+    resultdict = {x:None for x in objectidlist}
+    resultdict.update({x[1]:y for (x,y) in zip(tasks, results)})
+
+    return resultdict
 
 
 
@@ -126,7 +126,7 @@ import logging
 from datetime import datetime
 from traceback import format_exc
 
-import numpy as np
+from .lcparse import parse_lc_columns
 
 
 ########################
@@ -526,11 +526,15 @@ def parse_csv_header(header):
 
 
 
-def read_csv_lightcurve(lcfile):
+def read_csv_lightcurve(lcfile, usecols=None):
     '''
     This reads in a K2 lightcurve in CSV format. Transparently reads gzipped
     files.
 
+    usecols is an optional list of the LC columns to read. If this is None, all
+    of the columns are read. If it's provided, only these columns are parsed and
+    lcdict['columns'] will only list these.
+
     '''
 
     # read in the file first
@@ -548,20 +552,26 @@ def read_csv_lightcurve(lcfile):
     lcstart = lctext.index('# LIGHTCURVE\n')
     lcheader = lctext[:lcstart+12]
     lccolumns = lctext[lcstart+13:].split('\n')
-    lccolumns = [x.split(',') for x in lccolumns if len(x) > 0]
+    lccolumns = [x for x in lccolumns if len(x) > 0]
 
     # initialize the lcdict and parse the CSV header
     lcdict = parse_csv_header(lcheader)
+    allcolumns = lcdict['columns']
+
+    if usecols is not None:
+        lcdict['columns'] = [x for x in allcolumns if x in usecols]
 
-    # tranpose the LC rows into columns
-    lccolumns = list(zip(*lccolumns))
+    # parse the columns to the dict using the casters in the COLUMNDEFS dict
+    coldict = parse_lc_columns(lccolumns,
+                               allcolumns,
+                               [COLUMNDEFS[x][2] for x in allcolumns],
+                               delimiter=',',
+                               usecols=lcdict['columns'])
 
-    # write the columns to the dict
-    for colind, col in enumerate(lcdict['columns']):
+    if coldict is None:
+        LOGERROR('could not parse the light curve columns in %s' % lcfile)
+        return None
 
-        # this picks out the caster to use when reading each column using the
-        # definitions in the lcutils.COLUMNDEFS dictionary
-        lcdict[col] = np.array([COLUMNDEFS[col][2](x)
-                                for x in lccolumns[colind]])
+    lcdict.update(coldict)
 
     return lcdict
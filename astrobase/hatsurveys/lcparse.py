@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lcparse.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see LICENSE for the full text.
+
+This contains a fast parser for the delimited text and CSV light curves read by
+the other modules in astrobase.hatsurveys (hatlc.read_csvlc,
+k2hat.read_csv_lightcurve, and texthatlc.read_original_textlc).
+
+The light curve rows are parsed in bulk directly into typed numpy arrays, one
+per column, instead of splitting each row and casting each value in Python. The
+results are the same as those from the old per-value parsing: float columns
+that can't be parsed get nans, int columns with bad values turn into float
+columns with nans, and str columns are arrays of the narrowest string dtype that
+fits their values.
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+                )
+            )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os.path
+import gzip
+import warnings
+
+import numpy as np
+
+
+############
+## CONFIG ##
+############
+
+# these are the numpy dtypes used by the bulk parser for each caster
+BULK_DTYPES = {float:'f8',
+               int:'i8'}
+
+# this is the max width of str columns in the bulk parser. columns with values
+# that might be longer than this are re-parsed on the slow path.
+BULK_STRWIDTH = 32
+
+
+######################
+## READING LC FILES ##
+######################
+
+def open_lcfile(lcfile):
+    '''This opens a light curve file for reading in binary mode.
+
+    Files with '.gz' in their name are opened with gzip and decompressed as
+    they're read.
+
+    '''
+
+    if '.gz' in os.path.basename(lcfile):
+        return gzip.open(lcfile,'rb')
+    else:
+        return open(lcfile,'rb')
+
+
+
+def read_lcfile_text(lcfile):
+    '''
+    This reads the whole light curve file and returns it as decoded text.
+
+    '''
+
+    with open_lcfile(lcfile) as infd:
+        lctext = infd.read().decode()
+
+    return lctext
+
+
+
+########################
+## PARSING LC COLUMNS ##
+########################
+
+def _cast_column_slow(values, caster):
+    '''This casts each value in the list values with caster.
+
+    Follows the same rules as hatlc.smartcast: values that can't be cast to
+    float or int become nans, and values that can't be cast to str become empty
+    strings.
+
+    '''
+
+    castvals = []
+
+    for val in values:
+        try:
+            castvals.append(caster(val))
+        except Exception as e:
+            if caster is float or caster is int:
+                castvals.append(np.nan)
+            elif caster is str:
+                castvals.append('')
+            else:
+                castvals.append(None)
+
+    return np.array(castvals)
+
+
+
+def _guess_column(values):
+    '''This figures out the type of a column of str values.
+
+    Tries int, then float, then falls back to str, which is the same order
+    astropy.io.ascii uses to guess column types.
+
+    '''
+
+    strcol = np.array(values)
+
+    for dtype in (np.int64, np.float64):
+        try:
+            return strcol.astype(dtype)
+        except ValueError:
+            pass
+
+    return strcol
+
+
+
+def _guess_caster(value):
+    '''
+    This guesses the caster to use for a column from one of its values.
+
+    '''
+
+    for caster in (int, float):
+        try:
+            caster(value)
+            return caster
+        except ValueError:
+            pass
+
+    return str
+
+
+
+def _cast_column(values, caster):
+    '''This casts the list of str values to a numpy array using caster.
+
+    caster is one of float, int, str, a numpy dtype string (e.g. 'U8'), or None
+    to guess the column type.
+
+    '''
+
+    if caster is None:
+        return _guess_column(values)
+
+    # explicit numpy dtypes are used as-is
+    if not (caster is float or caster is int or caster is str):
+        return np.array(values, dtype=caster)
+
+    strcol = np.array(values)
+
+    if caster is str:
+        return strcol
+
+    try:
+        return strcol.astype(BULK_DTYPES[caster])
+    except ValueError:
+        pass
+
+    # empty values are the usual culprit for float columns
+    if caster is float:
+        try:
+            return np.where(strcol == '', 'nan', strcol).astype(np.float64)
+        except ValueError:
+            pass
+
+    return _cast_column_slow(values, caster)
+
+
+
+def _split_rows(datalines, ncols, delimiter):
+    '''This splits the data rows into a list of columns of str values.
+
+    Returns None if the rows don't all have ncols values.
+
+    '''
+
+    rows = [x.split(delimiter) for x in datalines]
+
+    if any(len(x) != ncols for x in rows):
+        return None
+
+    return list(zip(*rows))
+
+
+
+def parse_lc_columns(datalines,
+                     columns,
+                     casters,
+                     delimiter=',',
+                     usecols=None):
+    '''This parses rows of delimited text into a dict of numpy arrays.
+
+    datalines is a list of the data rows in the light curve as strings (without
+    any header or comment lines).
+
+    columns is a list of the names of all the columns in each row, in order.
+
+    casters is a list of the type to use for each column. Each of these is one
+    of: float, int, str, a numpy dtype string like 'U8' that will be used
+    directly, or None to guess the type of the column.
+
+    delimiter is the separator between values in each row. If None, any run of
+    whitespace is used, just like str.split().
+
+    usecols is an optional list of column names to parse. If None, all of the
+    columns are parsed.
+
+    Returns a dict of the form {column name: np.array of values}, or None if the
+    rows couldn't be parsed.
+
+    '''
+
+    if usecols is None:
+        usecols = list(columns)
+
+    colinds = [columns.index(x) for x in usecols]
+    colcasters = [casters[x] for x in colinds]
+    datalines = [x for x in datalines if len(x.strip()) > 0]
+
+    # for columns whose types we need to guess, make a first guess from the
+    # first row so we can try the bulk parser. if the guess is wrong for any of
+    # the other rows, the bulk parser fails and we guess properly below.
+    if any(x is None for x in colcasters) and len(datalines) > 0:
+        firstrow = datalines[0].split(delimiter)
+        if len(firstrow) == len(columns):
+            colcasters = [
+                (_guess_caster(firstrow[ind]) if caster is None else caster)
+                for ind, caster in zip(colinds, colcasters)
+            ]
+
+    coldict = {}
+    slowcols = []
+
+    # first, try to parse everything in one go with np.loadtxt. this only works
+    # for columns whose types we know ahead of time
+    if all((x is float or x is int or x is str or isinstance(x, str))
+           for x in colcasters):
+
+        bulkdtype = np.dtype([
+            (col, (caster if isinstance(caster, str) else
+                   BULK_DTYPES.get(caster, 'U%s' % BULK_STRWIDTH)))
+            for col, caster in zip(usecols, colcasters)
+        ])
+
+        try:
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                bulkarr = np.loadtxt(datalines,
+                                     dtype=bulkdtype,
+                                     delimiter=delimiter,
+                                     usecols=colinds,
+                                     comments=None,
+                                     ndmin=1)
+
+            for col, caster in zip(usecols, colcasters):
+
+                if caster is str:
+
+                    strlens = np.char.str_len(bulkarr[col])
+                    maxlen = strlens.max() if strlens.size > 0 else 0
+
+                    # these may have been truncated, so we redo them
+                    if maxlen >= BULK_STRWIDTH:
+                        slowcols.append(col)
+                    else:
+                        coldict[col] = bulkarr[col].astype(
+                            'U%s' % max(maxlen, 1)
+                        )
+
+                else:
+                    coldict[col] = bulkarr[col].copy()
+
+        except (ValueError, TypeError) as e:
+
+            LOGDEBUG('bulk parsing failed, '
+                     'falling back to parsing each column')
+            coldict = {}
+            slowcols = list(usecols)
+
+    else:
+
+        slowcols = list(usecols)
+
+    # then, handle any columns we couldn't do in bulk
+    if slowcols:
+
+        strcols = _split_rows(datalines, len(columns), delimiter)
+
+        if strcols is None:
+            LOGERROR('light curve rows do not all have %s columns, '
+                     'can\'t parse them' % len(columns))
+            return None
+
+        for col in slowcols:
+            colind = columns.index(col)
+            coldict[col] = _cast_column(list(strcols[colind]),
+                                        casters[colind])
+
+    return coldict
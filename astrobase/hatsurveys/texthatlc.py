@@ -80,14 +80,13 @@ def LOGEXCEPTION(message):
 ## IMPORTS ##
 #############
 
-import numpy as np
 from numpy import nan
 
-from astropy.io import ascii as astascii
+from .lcparse import read_lcfile_text, parse_lc_columns
 
 
 
-def read_original_textlc(lcpath):
+def read_original_textlc(lcpath, usecols=None):
     '''
     Read .epdlc, and .tfalc light curves and return a corresponding labelled
     dict (if LC from <2012) or astropy table (if >=2012). Each has different
@@ -95,7 +94,9 @@ def read_original_textlc(lcpath):
 
     Input:
     lcpath: path (string) to light curve data, which is a textfile with HAT
-    LC data.
+    LC data. This can be gzipped.
+
+    usecols: optional list of column names to read. If None, reads all columns.
 
     Example:
     dat = read_original_textlc('HAT-115-0003266.epdlc')
@@ -103,24 +104,29 @@ def read_original_textlc(lcpath):
 
     LOGINFO('reading original HAT text LC: {:s}'.format(lcpath))
 
+    lclines = read_lcfile_text(lcpath).split('\n')
+
     N_lines_to_parse_comments = 50
-    with open(lcpath, 'rb') as file:
-        head = [next(file) for ind in range(N_lines_to_parse_comments)]
+    head = lclines[:N_lines_to_parse_comments]
 
-    N_comment_lines = len([l for l in head if l.decode('UTF-8')[0]=='#'])
+    N_comment_lines = len([l for l in head if l.startswith('#')])
 
     # if there are too many comment lines, fail out
-    if N_comment_lines < N_lines_to_parse_comments:
+    if N_comment_lines == N_lines_to_parse_comments:
         LOGERROR(
             'LC file {fpath} has too many comment lines'.format(fpath=lcpath)
         )
         return None
 
     first_data_line = list(
-        filter(None, head[N_comment_lines].decode('UTF-8').split())
+        filter(None, head[N_comment_lines].split())
     )
     N_cols = len(first_data_line)
 
+    # these are the data rows
+    datalines = [l for l in lclines[N_comment_lines:]
+                 if (len(l.strip()) > 0 and not l.startswith('#'))]
+
     # There are different column formats depending on when HAT pipeline was run
     # also different formats for different types of LCs:
     # pre-2012: .epdlc -> 17 columns
@@ -155,12 +161,8 @@ def read_original_textlc(lcpath):
                       float,float,'U1',
                       float,float,float,
                       float,float,float]
-        dtype_pairs = [el for el in zip(col_names, col_dtypes)]
-        data = np.genfromtxt(lcpath, names=col_names, dtype=col_dtypes,
-            skip_header=N_comment_lines, delimiter=None)
-        out = {}
-        for ix in range(len(data.dtype.names)):
-            out[data.dtype.names[ix]] = data[data.dtype.names[ix]]
+        out = parse_lc_columns(datalines, col_names, col_dtypes,
+                               delimiter=None, usecols=usecols)
 
     elif colformat == 'pre2012-tfalc':
 
@@ -178,12 +180,8 @@ def read_original_textlc(lcpath):
                       float,float,float,
                       float,float,float,
                       float,float,float]
-        dtype_pairs = [el for el in zip(col_names, col_dtypes)]
-        data = np.genfromtxt(lcpath, names=col_names, dtype=col_dtypes,
-            skip_header=N_comment_lines, delimiter=None)
-        out = {}
-        for ix in range(len(data.dtype.names)):
-            out[data.dtype.names[ix]] = data[data.dtype.names[ix]]
+        out = parse_lc_columns(datalines, col_names, col_dtypes,
+                               delimiter=None, usecols=usecols)
 
     elif colformat == 'post2012-hatlc':
 
@@ -198,6 +196,16 @@ def read_original_textlc(lcpath):
                      'fsv', 'fdv', 'fkv',
                      'iha', 'izd', 'rjd']
 
-        out = astascii.read(lcpath, names=col_names, comment='#')
+        from astropy.table import Table
+
+        # the column types are guessed, like astropy.io.ascii.read does
+        coldict = parse_lc_columns(datalines, col_names,
+                                   [None for x in col_names],
+                                   delimiter=None, usecols=usecols)
+        if coldict is None:
+            return None
+
+        outcols = [x for x in col_names if x in coldict]
+        out = Table([coldict[x] for x in outcols], names=outcols)
 
     return out
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lazyload.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for the full text.
+
+This contains a small lazy-import mechanism for the heavy dependencies used by
+astrobase modules (matplotlib, astropy, scipy, sklearn, PIL, etc.). These are
+only imported when they're first actually used, so short-lived processes that
+only need a small part of a module (e.g. batch workers that just run period
+finders) don't pay the import time for everything else.
+
+Use it like so at the top of a module:
+
+from .lazyload import lazy_module, lazy_object, use_agg_backend
+
+# instead of: import scipy.spatial as sps
+sps = lazy_module('scipy.spatial')
+
+# instead of: import matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
+
+# instead of: from astropy.wcs import WCS
+WCS = lazy_object('astropy.wcs', 'WCS')
+
+The returned proxies import the real module or object on first attribute
+access or call. Proxies made with lazy_object can be called (so they work for
+functions and classes) and can be pickled, so they can be used in the
+LCFORM/PFMETHODS dicts in lcproc that are sent to worker processes.
+
+NOTE: isinstance() checks against a lazy_object proxy for a class won't
+work. Use resolve() to get the real object for these.
+
+'''
+
+import importlib
+
+
+#######################
+## BACKEND SELECTION ##
+#######################
+
+def use_agg_backend():
+    '''This sets the matplotlib backend to Agg.
+
+    Used as the onload function for lazily imported matplotlib.pyplot so the
+    non-interactive backend is set before pyplot is imported, just like the
+    matplotlib.use('Agg') calls that used to be at the top of the modules.
+
+    '''
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+
+#############
+## PROXIES ##
+#############
+
+class LazyModule(object):
+    '''This is a proxy for a module that's imported on first attribute access.
+
+    '''
+
+    def __init__(self, modname, onload=None):
+        '''
+        modname is the full dotted name of the module to import.
+
+        onload is an optional function to call (without args) just before the
+        module is imported for the first time.
+
+        '''
+
+        self.__dict__['_lazy_modname'] = modname
+        self.__dict__['_lazy_onload'] = onload
+        self.__dict__['_lazy_module'] = None
+
+
+    def _lazy_resolve(self):
+        '''
+        This imports the module if needed and returns it.
+
+        '''
+
+        module = self.__dict__['_lazy_module']
+
+        if module is None:
+
+            onload = self.__dict__['_lazy_onload']
+            if onload is not None:
+                onload()
+
+            module = importlib.import_module(self.__dict__['_lazy_modname'])
+            self.__dict__['_lazy_module'] = module
+
+        return module
+
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_resolve(), attr)
+
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_resolve(), attr, value)
+
+
+    def __dir__(self):
+        return dir(self._lazy_resolve())
+
+
+    def __reduce__(self):
+        return (LazyModule, (self.__dict__['_lazy_modname'],
+                             self.__dict__['_lazy_onload']))
+
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return '<lazy module %r (not loaded)>' % (
+                self.__dict__['_lazy_modname'],
+            )
+        else:
+            return repr(self.__dict__['_lazy_module'])
+
+
+
+class LazyObject(object):
+    '''This is a proxy for an object (function, class, etc.) in a module that's
+    imported on first call or attribute access.
+
+    '''
+
+    def __init__(self, modname, objname, onload=None):
+        '''
+        modname is the full dotted name of the module containing the object.
+
+        objname is the name of the object in the module. This can be a dotted
+        name to get at nested attributes.
+
+        onload is an optional function to call (without args) just before the
+        module is imported for the first time.
+
+        '''
+
+        self.__dict__['_lazy_modname'] = modname
+        self.__dict__['_lazy_objname'] = objname
+        self.__dict__['_lazy_onload'] = onload
+        self.__dict__['_lazy_object'] = None
+
+
+    def _lazy_resolve(self):
+        '''
+        This imports the module if needed and returns the object.
+
+        '''
+
+        obj = self.__dict__['_lazy_object']
+
+        if obj is None:
+
+            onload = self.__dict__['_lazy_onload']
+            if onload is not None:
+                onload()
+
+            obj = importlib.import_module(self.__dict__['_lazy_modname'])
+            for attr in self.__dict__['_lazy_objname'].split('.'):
+                obj = getattr(obj, attr)
+
+            self.__dict__['_lazy_object'] = obj
+
+        return obj
+
+
+    def __call__(self, *args, **kwargs):
+        return self._lazy_resolve()(*args, **kwargs)
+
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_resolve(), attr)
+
+
+    def __reduce__(self):
+        return (LazyObject, (self.__dict__['_lazy_modname'],
+                             self.__dict__['_lazy_objname'],
+                             self.__dict__['_lazy_onload']))
+
+
+    def __repr__(self):
+        if self.__dict__['_lazy_object'] is None:
+            return '<lazy object %s.%s (not loaded)>' % (
+                self.__dict__['_lazy_modname'],
+                self.__dict__['_lazy_objname'],
+            )
+        else:
+            return repr(self.__dict__['_lazy_object'])
+
+
+
+###########################
+## CONVENIENCE FUNCTIONS ##
+###########################
+
+def lazy_module(modname, onload=None):
+    '''This returns a proxy for the module modname that's imported on first use.
+
+    '''
+
+    return LazyModule(modname, onload=onload)
+
+
+
+def lazy_object(modname, objname, onload=None):
+    '''This returns a proxy for modname.objname that's imported on first use.
+
+    '''
+
+    return LazyObject(modname, objname, onload=onload)
+
+
+
+def resolve(obj):
+    '''This returns the real module or object behind a lazy proxy.
+
+    If obj is not a lazy proxy, returns it unchanged.
+
+    '''
+
+    if isinstance(obj, (LazyModule, LazyObject)):
+        return obj._lazy_resolve()
+    else:
+        return obj
+
+
+
+def is_loaded(obj):
+    '''This returns True if the lazy proxy obj has already been resolved.
+
+    Always returns True if obj is not a lazy proxy.
+
+    '''
+
+    if isinstance(obj, LazyModule):
+        return obj.__dict__['_lazy_module'] is not None
+    elif isinstance(obj, LazyObject):
+        return obj.__dict__['_lazy_object'] is not None
+    else:
+        return True
+
+
+
+def module_available(modname):
+    '''This checks if the top-level package for modname can be imported.
+
+    This doesn't actually import it, so it can be used to set flags for
+    optional dependencies (like SKLEARN in astrokep) without paying for the
+    import at module load time.
+
+    '''
+
+    toplevel = modname.split('.')[0]
+
+    try:
+        from importlib.util import find_spec
+        return find_spec(toplevel) is not None
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(toplevel)
+            return True
+        except ImportError:
+            return False
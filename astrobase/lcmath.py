@@ -81,11 +81,12 @@ import numpy as np
 from numpy import isfinite as npisfinite, median as npmedian, \
     mean as npmean, abs as npabs, std as npstddev
 
-from scipy.spatial import cKDTree as kdtree
+from .lazyload import lazy_module, lazy_object
 
-import scipy.stats
-
-from scipy.signal import savgol_filter
+# these are imported on first use to keep import times down
+kdtree = lazy_object('scipy.spatial', 'cKDTree')
+spstats = lazy_module('scipy.stats')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
 
 
 
@@ -1288,8 +1289,8 @@ def fill_magseries_gaps(times, mags, errs,
     gaps = np.diff(stimes)
 
     # just use scipy.stats.mode instead of our hacked together nonsense earlier.
-    gapmoderes = scipy.stats.mode(gaps)
-    gapmode = np.asscalar(gapmoderes[0])
+    gapmoderes = spstats.mode(gaps)
+    gapmode = np.asarray(gapmoderes[0]).item()
 
     LOGINFO('auto-cadence for mag series: %.5f' % gapmode)
 
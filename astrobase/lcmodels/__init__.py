@@ -13,4 +13,8 @@ eclipses.py - double inverted-gaussian shaped eclipsing binary light curves
 flares.py   - stellar flare model from Pitkin+ 2014
 sinusoidal.py  - sinusoidal light curve generation for pulsating variables
 
+Each module also has a *_batch function that evaluates its model for K sets of
+params over a K x N block of times at once, for generating lots of light
+curves quickly.
+
 '''
@@ -144,6 +144,61 @@ def invgauss_eclipses_func(ebparams, times, mags, errs):
 
 
 
+def invgauss_eclipses_batch(ebparams, times):
+    '''This evaluates the double eclipse model for many sets of params.
+
+    ebparams is the same list as for invgauss_eclipses_func, except each
+    element is an array of K values, one per model light curve.
+
+    times is either an array of N times used for all K models, or a K x N array
+    with a separate time base for each model.
+
+    Returns a K x N array of model mags (or fluxes) relative to a zero level of
+    0.0, in the same order as times.
+
+    '''
+
+    (period, epoch, pdepth,
+     pduration, depthratio, secondaryphase) = [
+         np.asarray(x, dtype=np.float64)[:,None] for x in ebparams
+     ]
+
+    phase = (times - epoch)/period
+    phase = phase - npfloor(phase)
+
+    primaryecl_amp = -pdepth
+    secondaryecl_amp = -pdepth * depthratio
+
+    ecl_std = pduration/5.0
+    halfduration = pduration/2.0
+
+    primary_eclipse_ingress = (
+        (phase >= (1.0 - halfduration)) & (phase <= 1.0)
+    )
+    primary_eclipse_egress = (
+        (phase >= 0.0) & (phase <= halfduration)
+    )
+    secondary_eclipse_phase = (
+        (phase >= (secondaryphase - halfduration)) &
+        (phase <= (secondaryphase + halfduration))
+    )
+
+    modelmags = npzeros_like(phase)
+    modelmags = npwhere(primary_eclipse_ingress,
+                        _gaussian(phase, primaryecl_amp, 1.0, ecl_std),
+                        modelmags)
+    modelmags = npwhere(primary_eclipse_egress,
+                        _gaussian(phase, primaryecl_amp, 0.0, ecl_std),
+                        modelmags)
+    modelmags = npwhere(secondary_eclipse_phase,
+                        _gaussian(phase, secondaryecl_amp,
+                                  secondaryphase, ecl_std),
+                        modelmags)
+
+    return modelmags
+
+
+
 def invgauss_eclipses_residual(ebparams, times, mags, errs):
     '''
     This returns the residual between the modelmags and the actual mags.
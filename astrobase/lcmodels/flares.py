@@ -94,6 +94,50 @@ def flare_model(flareparams, times, mags, errs):
 
 
 
+def flare_model_batch(flareparams, times):
+    '''This evaluates the flare model for many light curves at once.
+
+    flareparams is the same list as for flare_model, except each element is a K
+    x F array for K light curves with up to F flares each. Set the amplitude to
+    0.0 for the unused flare slots of light curves with fewer than F flares.
+
+    times is either an array of N times used for all K light curves, or a K x N
+    array with a separate time base for each one.
+
+    Returns a K x N array of the summed flare mags (or fluxes) relative to a
+    zero level of 0.0, in the same order as times.
+
+    '''
+
+    (amplitude, flare_peak_time,
+     rise_gaussian_stdev, decay_time_constant) = [
+         np.atleast_2d(np.asarray(x, dtype=np.float64)) for x in flareparams
+     ]
+
+    nlcs, nflares = amplitude.shape
+    modelmags = np.zeros((nlcs, np.shape(times)[-1]))
+
+    # we go through the flare slots one at a time so we only need K x N arrays
+    for flareind in range(nflares):
+
+        dt = times - flare_peak_time[:,flareind,None]
+        amp = amplitude[:,flareind,None]
+
+        rise = np.exp(
+            -(dt*dt)/(2.0*rise_gaussian_stdev[:,flareind,None]**2.0)
+        )
+        # clip dt here so the exp doesn't overflow for the rising part
+        decay = np.exp(
+            -np.maximum(dt, 0.0)/decay_time_constant[:,flareind,None]
+        )
+
+        modelmags += npwhere(dt < 0.0, amp*rise,
+                             npwhere(dt > 0.0, amp*decay, 0.0))
+
+    return modelmags
+
+
+
 def flare_model_residual(flareparams, times, mags, errs):
     '''
     This just returns the residual between model mags and the actual mags.
@@ -20,7 +20,11 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     zeros_like as npzeros_like, full_like as npfull_like, all as npall, \
     correlate as npcorrelate, nonzero as npnonzero, diag as npdiag
 
-from scipy.signal import medfilt, savgol_filter
+from ..lazyload import lazy_object
+
+# these are imported on first use to keep import times down
+medfilt = lazy_object('scipy.signal', 'medfilt')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
 
 ##################################
 ## MODEL AND RESIDUAL FUNCTIONS ##
@@ -128,3 +132,52 @@ def sine_series_sum(fourierparams, times, mags, errs):
         modelmags += fo
 
     return modelmags, phase, ptimes, pmags, perrs
+
+
+
+def sine_series_batch(fourierparams, times):
+    '''This evaluates the sine series for many light curves at once.
+
+    fourierparams is a sequence like so:
+
+    [periods, epochs, famps, fphases]
+
+    where periods and epochs are arrays of K values, one per light curve, and
+    famps and fphases are K x X arrays, where X is the largest Fourier order of
+    all K light curves. Set the famps to 0.0 past the order of each light
+    curve.
+
+    times is either an array of N times used for all K light curves, or a K x N
+    array with a separate time base for each one.
+
+    Returns a K x N array of model mags (or fluxes) relative to a zero level of
+    0.0, in the same order as times. The terms are the same as in
+    sine_series_sum.
+
+    '''
+
+    periods, epochs, famps, fphases = fourierparams
+
+    periods = np.asarray(periods, dtype=np.float64)[:,None]
+    epochs = np.asarray(epochs, dtype=np.float64)[:,None]
+    famps = np.atleast_2d(np.asarray(famps, dtype=np.float64))
+    fphases = np.atleast_2d(np.asarray(fphases, dtype=np.float64))
+
+    phase = (times - epochs)/periods
+    phase = phase - npfloor(phase)
+
+    # add up the terms one order at a time to keep the memory use to K x N. we
+    # get sin(2 pi x phase) and cos(2 pi x phase) for each order by multiplying
+    # by exp(2 pi i phase) once more instead of calling sin for every term.
+    modelmags = npzeros_like(phase)
+    phasor = np.exp(2.0j*MPI*phase)
+    harmonic = np.ones_like(phasor)
+
+    for x in range(famps.shape[1]):
+        modelmags += famps[:,x,None]*(
+            npcos(fphases[:,x,None])*harmonic.imag +
+            npsin(fphases[:,x,None])*harmonic.real
+        )
+        harmonic *= phasor
+
+    return modelmags
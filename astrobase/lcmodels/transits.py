@@ -92,6 +92,56 @@ def trapezoid_transit_func(transitparams, times, mags, errs):
 
 
 
+def trapezoid_transit_batch(transitparams, times):
+    '''This evaluates the trapezoid transit model for many sets of params.
+
+    transitparams is the same list as for trapezoid_transit_func, except each
+    element is an array of K values, one per model light curve.
+
+    times is either an array of N times used for all K models, or a K x N array
+    with a separate time base for each model.
+
+    Returns a K x N array of model mags (or fluxes) relative to a zero level of
+    0.0, in the same order as times. Unlike trapezoid_transit_func, nothing is
+    sorted by phase.
+
+    '''
+
+    (transitperiod,
+     transitepoch,
+     transitdepth,
+     transitduration,
+     ingressduration) = [np.asarray(x, dtype=np.float64)[:,None]
+                         for x in transitparams]
+
+    phase = (times - transitepoch)/transitperiod
+    phase = phase - npfloor(phase)
+
+    halftransitduration = transitduration/2.0
+    slope = transitdepth/ingressduration
+
+    firstcontact = 1.0 - halftransitduration
+    secondcontact = firstcontact + ingressduration
+    thirdcontact = halftransitduration - ingressduration
+    fourthcontact = halftransitduration
+
+    ingressind = (phase > firstcontact) & (phase < secondcontact)
+    bottomind = (phase > secondcontact) | (phase < thirdcontact)
+    egressind = (phase > thirdcontact) & (phase < fourthcontact)
+
+    # these are applied in the same order as trapezoid_transit_func so the
+    # overlapping edge cases come out the same
+    modelmags = npzeros_like(phase)
+    modelmags = npwhere(ingressind, -slope*(phase - firstcontact), modelmags)
+    modelmags = npwhere(bottomind, -transitdepth, modelmags)
+    modelmags = npwhere(egressind,
+                        -transitdepth + slope*(phase - thirdcontact),
+                        modelmags)
+
+    return modelmags
+
+
+
 def trapezoid_transit_residual(transitparams, times, mags, errs):
     '''
     This returns the residual between the modelmags and the actual mags.
@@ -97,17 +97,17 @@ import numpy as np
 import numpy.random as npr
 npr.seed(0xc0ffee)
 
-import scipy.spatial as sps
-import scipy.interpolate as spi
-from scipy import linalg as spla
+from astrobase.lazyload import lazy_module, lazy_object, use_agg_backend
 
-import astropy.io.fits as pyfits
-from astropy.wcs import WCS
-from astropy.visualization import ZScaleInterval, LinearStretch
+# these are heavy, so they're imported on first use
+sps = lazy_module('scipy.spatial')
+spi = lazy_module('scipy.interpolate')
+spla = lazy_module('scipy.linalg')
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+pyfits = lazy_module('astropy.io.fits')
+WCS = lazy_object('astropy.wcs', 'WCS')
+
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
 
 try:
     from tqdm import tqdm
@@ -133,24 +133,60 @@ def dict_get(datadict, keylist):
 from astrobase.hatsurveys.hatlc import read_and_filter_sqlitecurve, \
     read_csvlc, normalize_lcdict_byinst
 from astrobase.hatsurveys.hplc import read_hatpi_textlc, read_hatpi_pklc
-from astrobase.astrokep import read_kepler_fitslc, read_kepler_pklc
+read_kepler_fitslc = lazy_object('astrobase.astrokep', 'read_kepler_fitslc')
+read_kepler_pklc = lazy_object('astrobase.astrokep', 'read_kepler_pklc')
 
-from astrobase import periodbase, checkplot
-from astrobase.varclass import varfeatures, starfeatures, periodicfeatures
 from astrobase.lcmath import normalize_magseries, \
     time_bin_magseries_with_errs, sigclip_magseries
-from astrobase.periodbase.kbls import bls_snr
-from astrobase.plotbase import fits_finder_chart
-
-from astrobase.checkplot import _pkl_magseries_plot, \
-    _pkl_phased_magseries_plot, xmatch_external_catalogs, \
-    _read_checkplot_picklefile, _write_checkplot_picklefile
-
 from astrobase.magnitudes import jhk_to_sdssr
 
-from astrobase.varbase.trends import epd_magseries, smooth_magseries_savgol
-
-from astrobase.cpserver.checkplotlist import checkplot_infokey_worker
+# these record per-stage timings and resource use if lcproc_instrument is on
+from astrobase.lcproc_instrument import instrumented, stage, count, \
+    file_read, file_written
+
+# this is the content-addressed cache for period-finder results
+from astrobase.lcproc_pfcache import get_pfcache_key, get_cached_pfresult, \
+    cache_pfresult
+
+# this hands out tasks to the workers in the parallel drivers
+from astrobase.lcproc_sched import get_lclist_costs, get_file_costs, \
+    run_tasks, run_nested_tasks
+
+# these pull in matplotlib, astropy, sklearn, etc., so they're only imported
+# when a function that needs them is actually run
+periodbase = lazy_module('astrobase.periodbase')
+checkplot = lazy_module('astrobase.checkplot')
+varfeatures = lazy_module('astrobase.varclass.varfeatures')
+starfeatures = lazy_module('astrobase.varclass.starfeatures')
+gaia = lazy_module('astrobase.services.gaia')
+dust = lazy_module('astrobase.services.dust')
+periodicfeatures = lazy_module('astrobase.varclass.periodicfeatures')
+
+bls_snr = lazy_object('astrobase.periodbase.kbls', 'bls_snr')
+fits_finder_chart = lazy_object('astrobase.plotbase', 'fits_finder_chart')
+
+_pkl_magseries_plot = lazy_object('astrobase.checkplot',
+                                  '_pkl_magseries_plot')
+_pkl_phased_magseries_plot = lazy_object('astrobase.checkplot',
+                                         '_pkl_phased_magseries_plot')
+xmatch_external_catalogs = lazy_object('astrobase.checkplot',
+                                       'xmatch_external_catalogs')
+_read_checkplot_picklefile = lazy_object('astrobase.checkplot',
+                                         '_read_checkplot_picklefile')
+_write_checkplot_picklefile = lazy_object('astrobase.checkplot',
+                                          '_write_checkplot_picklefile')
+
+epd_magseries = lazy_object('astrobase.varbase.trends', 'epd_magseries')
+smooth_magseries_savgol = lazy_object('astrobase.varbase.trends',
+                                      'smooth_magseries_savgol')
+
+checkplot_infokey_worker = lazy_object('astrobase.cpserver.checkplotlist',
+                                       'checkplot_infokey_worker')
+
+# this marks the field_scale, field_stretch, field_colormap kwargs that weren't
+# given, so fits_finder_chart can fill in its defaults for them and None still
+# means no normalization
+_FINDER_DEFAULT = object()
 
 ############
 ## CONFIG ##
@@ -202,13 +238,15 @@ FILTEROPS = {'eq':'==',
 
 
 # used to figure out which period finder to run given a list of methods
-PFMETHODS = {'bls':periodbase.bls_parallel_pfind,
-             'gls':periodbase.pgen_lsp,
-             'aov':periodbase.aov_periodfind,
-             'mav':periodbase.aovhm_periodfind,
-             'pdm':periodbase.stellingwerf_pdm,
-             'acf':periodbase.macf_period_find,
-             'win':periodbase.specwindow_lsp}
+PFMETHODS = {
+    'bls':lazy_object('astrobase.periodbase', 'bls_parallel_pfind'),
+    'gls':lazy_object('astrobase.periodbase', 'pgen_lsp'),
+    'aov':lazy_object('astrobase.periodbase', 'aov_periodfind'),
+    'mav':lazy_object('astrobase.periodbase', 'aovhm_periodfind'),
+    'pdm':lazy_object('astrobase.periodbase', 'stellingwerf_pdm'),
+    'acf':lazy_object('astrobase.periodbase', 'macf_period_find'),
+    'win':lazy_object('astrobase.periodbase', 'specwindow_lsp'),
+}
 
 
 
@@ -472,6 +510,19 @@ def lclist_parallel_worker(task):
 
 
 
+def _get_finder_normkwargs(scale, stretch, colormap):
+    '''
+    This returns the scale, stretch, colormap kwargs for fits_finder_chart,
+    leaving out the ones that weren't given so it uses its defaults for them.
+
+    '''
+
+    normkwargs = {'scale':scale, 'stretch':stretch, 'colormap':colormap}
+    return {key:val for key, val in normkwargs.items()
+            if val is not _FINDER_DEFAULT}
+
+
+
 def make_lclist(basedir,
                 outfile,
                 lcformat='hat-sql',
@@ -483,9 +534,9 @@ def make_lclist(basedir,
                 makecoordindex=['objectinfo.ra','objectinfo.decl'],
                 field_fitsfile=None,
                 field_wcsfrom=None,
-                field_scale=ZScaleInterval(),
-                field_stretch=LinearStretch(),
-                field_colormap=plt.cm.gray_r,
+                field_scale=_FINDER_DEFAULT,
+                field_stretch=_FINDER_DEFAULT,
+                field_colormap=_FINDER_DEFAULT,
                 field_findersize=None,
                 field_pltopts={'marker':'o',
                                'markersize':10.0,
@@ -531,7 +582,10 @@ def make_lclist(basedir,
     coordinates for all of the objects in the field. A finder chart will also be
     made using astrobase.plotbase.fits_finder_chart using the corresponding
     field_scale, _stretch, _colormap, _findersize, _pltopts, _grid, and
-    _gridcolors keyword arguments for that function.
+    _gridcolors keyword arguments for that function. If field_scale,
+    field_stretch, field_colormap are not given, astropy's ZScaleInterval(),
+    LinearStretch(), and matplotlib's gray_r colormap are used. If field_scale
+    or field_stretch is None, the FITS image isn't normalized.
 
     maxlcs sets how many light curves to process in the input LC list generated
     by searching for LCs in `basedir`.
@@ -776,16 +830,16 @@ def make_lclist(basedir,
                     field_fitsfile,
                     finder_outfile,
                     wcsfrom=field_wcsfrom,
-                    scale=field_scale,
-                    stretch=field_stretch,
-                    colormap=field_colormap,
                     findersize=field_findersize,
                     overlay_ra=objra,
                     overlay_decl=objdecl,
                     overlay_pltopts=field_pltopts,
                     overlay_zoomcontain=field_zoomcontain,
                     grid=field_grid,
-                    gridcolor=field_gridcolor
+                    gridcolor=field_gridcolor,
+                    **_get_finder_normkwargs(field_scale,
+                                             field_stretch,
+                                             field_colormap)
                 )
 
                 if finder_png is not None:
@@ -824,9 +878,9 @@ def filter_lclist(listpickle,
                   conesearchworkers=1,
                   field_fitsfile=None,
                   field_wcsfrom=None,
-                  field_scale=ZScaleInterval(),
-                  field_stretch=LinearStretch(),
-                  field_colormap=plt.cm.gray_r,
+                  field_scale=_FINDER_DEFAULT,
+                  field_stretch=_FINDER_DEFAULT,
+                  field_colormap=_FINDER_DEFAULT,
                   field_findersize=None,
                   field_pltopts={'marker':'o',
                                  'markersize':10.0,
@@ -916,7 +970,10 @@ def filter_lclist(listpickle,
     made for the objects matching all the filters. This will use
     astrobase.plotbase.fits_finder_chart using the corresponding field_scale,
     _stretch, _colormap, _findersize, _pltopts, _grid, and _gridcolors keyword
-    arguments for that function.
+    arguments for that function. If field_scale, field_stretch, field_colormap
+    are not given, astropy's ZScaleInterval(), LinearStretch(), and matplotlib's
+    gray_r colormap are used. If field_scale or field_stretch is None, the FITS
+    image isn't normalized.
 
     If copylcsto is not None, it is interpreted as a directory target to copy
     all the light curves that match the specified conditions.
@@ -1157,16 +1214,16 @@ def filter_lclist(listpickle,
             field_fitsfile,
             finder_outfile,
             wcsfrom=field_wcsfrom,
-            scale=field_scale,
-            stretch=field_stretch,
-            colormap=field_colormap,
             findersize=field_findersize,
             overlay_ra=matching_ra,
             overlay_decl=matching_decl,
             overlay_pltopts=field_pltopts,
             field_zoomcontain=field_zoomcontain,
             grid=field_grid,
-            gridcolor=field_gridcolor
+            gridcolor=field_gridcolor,
+            **_get_finder_normkwargs(field_scale,
+                                     field_stretch,
+                                     field_colormap)
         )
 
         if finder_png is not None:
@@ -1339,6 +1396,7 @@ def timebinlc_worker(task):
 
 
 
+@instrumented('parallel_timebin')
 def parallel_timebin(lclist,
                      binsizesec,
                      maxobjects=None,
@@ -1353,13 +1411,19 @@ def parallel_timebin(lclist,
     '''
     This bins all the light curves in lclist using binsizesec.
 
+    lclist is either a list of LC files or the lclist dict (or pickle) made by
+    make_lclist. See lcproc_sched.get_lclist_costs.
+
     '''
 
     if outdir and not os.path.exists(outdir):
         os.mkdir(outdir)
 
+    lclist, costs = get_lclist_costs(lclist)
+
     if maxobjects is not None:
         lclist = lclist[:maxobjects]
+        costs = costs[:maxobjects]
 
     tasks = [(x, binsizesec, {'outdir':outdir,
                               'lcformat':lcformat,
@@ -1368,10 +1432,8 @@ def parallel_timebin(lclist,
                               'errcols':errcols,
                               'minbinelems':minbinelems}) for x in lclist]
 
-    pool = mp.Pool(nworkers, maxtasksperchild=maxworkertasks)
-    results = pool.map(timebinlc_worker, tasks)
-    pool.close()
-    pool.join()
+    results = run_tasks(timebinlc_worker, tasks, costs, nworkers,
+                        maxworkertasks=maxworkertasks)
 
     resdict = {os.path.basename(x):y for (x,y) in zip(lclist, results)}
 
@@ -1423,6 +1485,7 @@ def parallel_timebin_lcdir(lcdir,
 ## VARIABILITY FEATURES ##
 ##########################
 
+@instrumented('get_varfeatures')
 def get_varfeatures(lcfile,
                     outdir,
                     timecols=None,
@@ -1454,7 +1517,9 @@ def get_varfeatures(lcfile,
     try:
 
         # get the LC into a dict
-        lcdict = readerfunc(lcfile)
+        with stage('read'):
+            lcdict = readerfunc(lcfile)
+        file_read(lcfile)
 
         # this should handle lists/tuples being returned by readerfunc
         # we assume that the first element is the actual lcdict
@@ -1470,7 +1535,8 @@ def get_varfeatures(lcfile,
 
         # normalize using the special function if specified
         if normfunc is not None:
-            lcdict = normfunc(lcdict)
+            with stage('normalize'):
+                lcdict = normfunc(lcdict)
 
         for tcol, mcol, ecol in zip(timecols, magcols, errcols):
 
@@ -1495,13 +1561,16 @@ def get_varfeatures(lcfile,
 
             # normalize here if not using special normalization
             if normfunc is None:
-                ntimes, nmags = normalize_magseries(
-                    times, mags,
-                    magsarefluxes=magsarefluxes
-                )
+                with stage('normalize'):
+                    ntimes, nmags = normalize_magseries(
+                        times, mags,
+                        magsarefluxes=magsarefluxes
+                    )
 
                 times, mags, errs = ntimes, nmags, errs
 
+            count('ndet', len(times))
+
 
             # make sure we have finite values
             finind = np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs)
@@ -1516,9 +1585,10 @@ def get_varfeatures(lcfile,
             else:
 
                 # get the features for this magcol
-                lcfeatures = varfeatures.all_nonperiodic_features(
-                    times, mags, errs
-                )
+                with stage('varfeatures'):
+                    lcfeatures = varfeatures.all_nonperiodic_features(
+                        times, mags, errs
+                    )
                 resultdict[mcol] = lcfeatures
 
         # now that we've collected all the magcols, we can choose which is the
@@ -1545,8 +1615,9 @@ def get_varfeatures(lcfile,
         outfile = os.path.join(outdir,
                                'varfeatures-%s.pkl' % resultdict['objectid'])
 
-        with open(outfile, 'wb') as outfd:
+        with stage('write'), open(outfile, 'wb') as outfd:
             pickle.dump(resultdict, outfd, protocol=4)
+        file_written(outfile)
 
         return outfile
 
@@ -1600,6 +1671,7 @@ def serial_varfeatures(lclist,
 
 
 
+@instrumented('parallel_varfeatures')
 def parallel_varfeatures(lclist,
                          outdir,
                          maxobjects=None,
@@ -1612,21 +1684,24 @@ def parallel_varfeatures(lclist,
     '''
     This runs varfeatures in parallel for all light curves in lclist.
 
+    lclist is either a list of LC files or the lclist dict (or pickle) made by
+    make_lclist. See lcproc_sched.get_lclist_costs.
+
     '''
     # make sure to make the output directory if it doesn't exist
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
+    lclist, costs = get_lclist_costs(lclist)
+
     if maxobjects:
         lclist = lclist[:maxobjects]
+        costs = costs[:maxobjects]
 
     tasks = [(x, outdir, timecols, magcols, errcols, mindet, lcformat)
              for x in lclist]
 
-    with ProcessPoolExecutor(max_workers=nworkers) as executor:
-        resultfutures = executor.map(varfeatures_worker, tasks)
-
-    results = [x for x in resultfutures]
+    results = run_tasks(varfeatures_worker, tasks, costs, nworkers)
     resdict = {os.path.basename(x):y for (x,y) in zip(lclist, results)}
 
     return resdict
@@ -1986,6 +2061,13 @@ def get_periodicfeatures(pfpickle,
                 featkey = 'periodicfeatures-%s' % mcol
                 resultdict[featkey] = {}
 
+                # this holds the phased LCs and fits for this magcol so each
+                # distinct period is only phased and fit once
+                pfcontext = periodicfeatures.PeriodicFeatureContext(
+                    times, mags, errs,
+                    magsarefluxes=magsarefluxes
+                )
+
                 # first, handle the periodogram features
                 pgramfeat = periodicfeatures.periodogram_features(
                     available_pgrams, times, mags, errs,
@@ -1995,7 +2077,8 @@ def get_periodicfeatures(pfpickle,
                     sampling_peak_multiplier=sampling_peak_multiplier,
                     sampling_startp=sampling_startp,
                     sampling_endp=sampling_endp,
-                    verbose=verbose
+                    verbose=verbose,
+                    context=pfcontext
                 )
                 resultdict[featkey].update(pgramfeat)
 
@@ -2013,14 +2096,16 @@ def get_periodicfeatures(pfpickle,
                         ebparams=ebparams,
                         sigclip=sigclip,
                         magsarefluxes=magsarefluxes,
-                        verbose=verbose
+                        verbose=verbose,
+                        context=pfcontext
                     )
 
                     phasedlcfeat = periodicfeatures.phasedlc_features(
                         times, mags, errs, bp,
                         nbrtimes=nbrtimes,
                         nbrmags=nbrmags,
-                        nbrerrs=nbrerrs
+                        nbrerrs=nbrerrs,
+                        context=pfcontext
                     )
 
                     resultdict[featkey][pfm].update(phasedlcfeat)
@@ -2173,6 +2258,7 @@ def serial_periodicfeatures(pfpkl_list,
 
 
 
+@instrumented('parallel_periodicfeatures')
 def parallel_periodicfeatures(pfpkl_list,
                               lcbasedir,
                               outdir,
@@ -2259,10 +2345,9 @@ def parallel_periodicfeatures(pfpkl_list,
 
     LOGINFO('processing periodfinding pickles...')
 
-    with ProcessPoolExecutor(max_workers=nworkers) as executor:
-        resultfutures = executor.map(periodicfeatures_worker, tasks)
-
-    results = [x for x in resultfutures]
+    # the larger pickles usually come from LCs with more points
+    results = run_tasks(periodicfeatures_worker, tasks,
+                        get_file_costs(pfpkl_list), nworkers)
     resdict = {os.path.basename(x):y for (x,y) in zip(pfpkl_list, results)}
 
     return resdict
@@ -2388,7 +2473,10 @@ def get_starfeatures(lcfile,
                      neighbor_radius_arcsec,
                      deredden=True,
                      custom_bandpasses=None,
-                     lcformat='hat-sql'):
+                     lcformat='hat-sql',
+                     gaia_fieldcache=None,
+                     extinction=None,
+                     extinction_grid=False):
     '''This runs the functions from astrobase.varclass.starfeatures on a single
     light curve file.
 
@@ -2412,6 +2500,15 @@ def get_starfeatures(lcfile,
 
     lcformat is a key in LCFORM specifying the type of light curve lcfile is
 
+    gaia_fieldcache is the dict returned by services.gaia.get_field_catalog for
+    the field. If this is provided, the GAIA neighbors for the object are found
+    using this instead of a GAIA TAP query for this object alone.
+
+    extinction is the object's extinction dict from
+    services.dust.grid_extinction_queries, if it was found for the whole field
+    at once. If this is None, starfeatures.color_features looks it up for this
+    object alone, using extinction_grid as described there.
+
     '''
 
     if lcformat not in LCFORM or lcformat is None:
@@ -2444,7 +2541,9 @@ def get_starfeatures(lcfile,
         colorfeat = starfeatures.color_features(
             lcdict['objectinfo'],
             deredden=deredden,
-            custom_bandpasses=custom_bandpasses
+            custom_bandpasses=custom_bandpasses,
+            extinction_grid=extinction_grid,
+            extinction=extinction
         )
 
         # run a rough color classification
@@ -2452,9 +2551,12 @@ def get_starfeatures(lcfile,
                                                        coordfeat)
 
         # finally, run the neighbor features
-        nbrfeat = starfeatures.neighbor_features(lcdict['objectinfo'],
-                                                 kdtree,
-                                                 neighbor_radius_arcsec)
+        nbrfeat = starfeatures.neighbor_gaia_features(
+            lcdict['objectinfo'],
+            kdtree,
+            neighbor_radius_arcsec,
+            gaia_fieldcache=gaia_fieldcache
+        )
 
         # get the objectids of the neighbors found if any
         if nbrfeat['nbrindices'].size > 0:
@@ -2502,18 +2604,95 @@ def starfeatures_worker(task):
     try:
         (lcfile, outdir, kdtree, objlist,
          lcflist, neighbor_radius_arcsec,
-         deredden, custom_bandpasses, lcformat) = task
+         deredden, custom_bandpasses, lcformat,
+         gaia_fieldcache, extinction) = task
 
         return get_starfeatures(lcfile, outdir,
                                 kdtree, objlist, lcflist,
                                 neighbor_radius_arcsec,
                                 deredden=deredden,
                                 custom_bandpasses=custom_bandpasses,
-                                lcformat=lcformat)
+                                lcformat=lcformat,
+                                gaia_fieldcache=gaia_fieldcache,
+                                extinction=extinction)
     except:
         return None
 
 
+def _starfeatures_gaia_fieldcache(kdt_dict,
+                                  neighbor_radius_arcsec,
+                                  gaia_mirror=None):
+    '''This gets the GAIA field-level tile cache for all objects in an lclist.
+
+    kdt_dict is the dict produced by lcproc.make_lclist. The ra and decl columns
+    in kdt_dict['objects'] are used to figure out which tiles to fetch.
+
+    Returns the dict from services.gaia.get_field_catalog, or None if the
+    coordinates of the objects aren't available.
+
+    '''
+
+    if 'ra' not in kdt_dict['objects'] or 'decl' not in kdt_dict['objects']:
+        LOGWARNING('no ra, decl columns in the lclist pickle, '
+                   'will run GAIA queries for each object instead')
+        return None
+
+    return gaia.get_field_catalog(
+        np.array(kdt_dict['objects']['ra'], dtype=np.float64),
+        np.array(kdt_dict['objects']['decl'], dtype=np.float64),
+        neighbor_radius_arcsec,
+        gaia_mirror=gaia_mirror
+    )
+
+
+
+def _starfeatures_extinctions(kdt_dict, lclist, extinction_grid=True):
+    '''This gets the extinction for all objects in lclist from extinction grids.
+
+    kdt_dict is the dict produced by lcproc.make_lclist. The ra and decl columns
+    in kdt_dict['objects'] are used to look up the extinction for all objects
+    at once with services.dust.grid_extinction_queries, instead of once for
+    each object in the starfeatures workers.
+
+    extinction_grid is True to use the grids in the default grid directory, or
+    the path to a grid file.
+
+    Returns a list with the extinction dict for each LC in lclist, with None for
+    objects that aren't covered by a grid (these are looked up by
+    color_features as usual).
+
+    '''
+
+    if ('ra' not in kdt_dict['objects'] or
+        'decl' not in kdt_dict['objects'] or
+        'lcfname' not in kdt_dict['objects']):
+        return [None]*len(lclist)
+
+    # match the LCs to the objects in the lclist by filename
+    lcfinds = {os.path.basename(x):ind for ind, x in
+               enumerate(kdt_dict['objects']['lcfname'])}
+    objinds = [lcfinds.get(os.path.basename(x)) for x in lclist]
+    matched = [x for x in objinds if x is not None]
+
+    if not matched:
+        return [None]*len(lclist)
+
+    try:
+        extinctions = dust.grid_extinction_queries(
+            np.array(kdt_dict['objects']['ra'], dtype=np.float64)[matched],
+            np.array(kdt_dict['objects']['decl'], dtype=np.float64)[matched],
+            grid=(None if extinction_grid is True else extinction_grid)
+        )
+    except Exception as e:
+        LOGEXCEPTION('could not get extinctions from the grids for the field, '
+                     'will look them up for each object instead')
+        return [None]*len(lclist)
+
+    extinctions = iter(extinctions)
+    return [next(extinctions) if x is not None else None for x in objinds]
+
+
+
 def serial_starfeatures(lclist,
                         outdir,
                         lclistpickle,
@@ -2522,7 +2701,10 @@ def serial_starfeatures(lclist,
                         deredden=True,
                         custom_bandpasses=None,
                         lcformat='hat-sql',
-                        nworkers=NCPUS):
+                        nworkers=NCPUS,
+                        gaia_field=False,
+                        gaia_mirror=None,
+                        extinction_grid=False):
     '''This drives the starfeatures function for a collection of LCs.
 
     lclistpickle is a pickle containing at least:
@@ -2536,6 +2718,21 @@ def serial_starfeatures(lclist,
 
     This pickle can be produced using lcproc.make_lclist.
 
+    If gaia_field is True, the GAIA sources for all of the objects in
+    lclistpickle are fetched once using services.gaia.get_field_catalog, and
+    the GAIA neighbors for each object are found from this local field-level
+    cache instead of a GAIA TAP query for each object.
+
+    If deredden is True, the extinction for each object is looked up by
+    starfeatures.color_features using the 2MASS DUST service. If
+    extinction_grid is also True (to use the grids in the default grid
+    directory) or the path to a grid file, the extinction for all of the
+    objects covered by the local extinction grids (see
+    services.dust.make_extinction_grid) is found at once with
+    services.dust.grid_extinction_queries before running the workers. The
+    rest are looked up by starfeatures.color_features for each object as
+    usual.
+
     '''
     # make sure to make the output directory if it doesn't exist
     if not os.path.exists(outdir):
@@ -2552,9 +2749,25 @@ def serial_starfeatures(lclist,
     objlist = kdt_dict['objects']['objectid']
     objlcfl = kdt_dict['objects']['lcfname']
 
+    # fetch the GAIA sources for the whole field once if we're told to
+    if gaia_field:
+        gaia_fieldcache = _starfeatures_gaia_fieldcache(kdt_dict,
+                                                        neighbor_radius_arcsec,
+                                                        gaia_mirror=gaia_mirror)
+    else:
+        gaia_fieldcache = None
+
+    # get the extinctions for the whole field at once from the local grids
+    if deredden and extinction_grid is not False:
+        extinctions = _starfeatures_extinctions(kdt_dict, lclist,
+                                                extinction_grid=extinction_grid)
+    else:
+        extinctions = [None]*len(lclist)
+
     tasks = [(x, outdir, kdt, objlist, objlcfl,
               neighbor_radius_arcsec,
-              deredden, custom_bandpasses, lcformat) for x in lclist]
+              deredden, custom_bandpasses, lcformat, gaia_fieldcache, y)
+             for x, y in zip(lclist, extinctions)]
 
     for task in tqdm(tasks):
         result = starfeatures_worker(task)
@@ -2563,6 +2776,7 @@ def serial_starfeatures(lclist,
 
 
 
+@instrumented('parallel_starfeatures')
 def parallel_starfeatures(lclist,
                           outdir,
                           lclistpickle,
@@ -2571,9 +2785,17 @@ def parallel_starfeatures(lclist,
                           deredden=True,
                           custom_bandpasses=None,
                           lcformat='hat-sql',
-                          nworkers=NCPUS):
-    '''
-    This runs starfeatures in parallel for all light curves in lclist.
+                          nworkers=NCPUS,
+                          gaia_field=False,
+                          gaia_mirror=None,
+                          extinction_grid=False):
+    '''This runs starfeatures in parallel for all light curves in lclist.
+
+    If gaia_field is True, the GAIA sources for all of the objects in
+    lclistpickle are fetched once before starting the workers. If
+    extinction_grid is True or the path to a grid file, the extinction for all
+    objects covered by local extinction grids is also found once before
+    starting the workers. See serial_starfeatures for details.
 
     '''
 
@@ -2585,8 +2807,11 @@ def parallel_starfeatures(lclist,
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
+    lclist, costs = get_lclist_costs(lclist)
+
     if maxobjects:
         lclist = lclist[:maxobjects]
+        costs = costs[:maxobjects]
 
     # read in the kdtree pickle
     with open(lclistpickle, 'rb') as infd:
@@ -2596,14 +2821,27 @@ def parallel_starfeatures(lclist,
     objlist = kdt_dict['objects']['objectid']
     objlcfl = kdt_dict['objects']['lcfname']
 
+    # fetch the GAIA sources for the whole field once if we're told to
+    if gaia_field:
+        gaia_fieldcache = _starfeatures_gaia_fieldcache(kdt_dict,
+                                                        neighbor_radius_arcsec,
+                                                        gaia_mirror=gaia_mirror)
+    else:
+        gaia_fieldcache = None
+
+    # get the extinctions for the whole field at once from the local grids
+    if deredden and extinction_grid is not False:
+        extinctions = _starfeatures_extinctions(kdt_dict, lclist,
+                                                extinction_grid=extinction_grid)
+    else:
+        extinctions = [None]*len(lclist)
+
     tasks = [(x, outdir, kdt, objlist, objlcfl,
               neighbor_radius_arcsec,
-              deredden, custom_bandpasses, lcformat) for x in lclist]
-
-    with ProcessPoolExecutor(max_workers=nworkers) as executor:
-        resultfutures = executor.map(starfeatures_worker, tasks)
+              deredden, custom_bandpasses, lcformat, gaia_fieldcache, y)
+             for x, y in zip(lclist, extinctions)]
 
-    results = [x for x in resultfutures]
+    results = run_tasks(starfeatures_worker, tasks, costs, nworkers)
     resdict = {os.path.basename(x):y for (x,y) in zip(lclist, results)}
 
     return resdict
@@ -2619,7 +2857,10 @@ def parallel_starfeatures_lcdir(lcdir,
                                 custom_bandpasses=None,
                                 lcformat='hat-sql',
                                 nworkers=NCPUS,
-                                recursive=True):
+                                recursive=True,
+                                gaia_field=False,
+                                gaia_mirror=None,
+                                extinction_grid=False):
     '''
     This runs parallel star feature extraction for a directory of LCs.
 
@@ -2677,7 +2918,10 @@ def parallel_starfeatures_lcdir(lcdir,
                                      custom_bandpasses=custom_bandpasses,
                                      maxobjects=maxobjects,
                                      lcformat=lcformat,
-                                     nworkers=nworkers)
+                                     nworkers=nworkers,
+                                     gaia_field=gaia_field,
+                                     gaia_mirror=gaia_mirror,
+                                     extinction_grid=extinction_grid)
 
     else:
 
@@ -2691,6 +2935,87 @@ def parallel_starfeatures_lcdir(lcdir,
 ## VARIABILITY THRESHOLD ##
 ###########################
 
+def _varthresh_indices(thisfeatures, magcol):
+    '''This gets the values used by variability_threshold from a varfeatures
+    dict for a single magcol.
+
+    Returns a tuple of the form:
+
+    (objectid, sdssr, lcmad, stetsonj, iqr, eta)
+
+    Any of these that aren't available are set to nan.
+
+    '''
+
+    objectid = thisfeatures['objectid']
+
+    # the object magnitude
+    if ('info' in thisfeatures and
+        thisfeatures['info'] and
+        'sdssr' in thisfeatures['info']):
+
+        if (thisfeatures['info']['sdssr'] and
+            thisfeatures['info']['sdssr'] > 3.0):
+
+            sdssr = thisfeatures['info']['sdssr']
+
+        elif (magcol in thisfeatures and
+              thisfeatures[magcol] and
+              'median' in thisfeatures[magcol] and
+              thisfeatures[magcol]['median'] > 3.0):
+
+            sdssr = thisfeatures[magcol]['median']
+
+        elif (thisfeatures['info']['jmag'] and
+              thisfeatures['info']['hmag'] and
+              thisfeatures['info']['kmag']):
+
+            sdssr = jhk_to_sdssr(thisfeatures['info']['jmag'],
+                                 thisfeatures['info']['hmag'],
+                                 thisfeatures['info']['kmag'])
+
+        else:
+            sdssr = np.nan
+
+    else:
+        sdssr = np.nan
+
+    # the MAD of the light curve
+    if (magcol in thisfeatures and
+        thisfeatures[magcol] and
+        thisfeatures[magcol]['mad']):
+        lcmad = thisfeatures[magcol]['mad']
+    else:
+        lcmad = np.nan
+
+    # stetson index
+    if (magcol in thisfeatures and
+        thisfeatures[magcol] and
+        thisfeatures[magcol]['stetsonj']):
+        stetsonj = thisfeatures[magcol]['stetsonj']
+    else:
+        stetsonj = np.nan
+
+    # IQR
+    if (magcol in thisfeatures and
+        thisfeatures[magcol] and
+        thisfeatures[magcol]['mag_iqr']):
+        iqr = thisfeatures[magcol]['mag_iqr']
+    else:
+        iqr = np.nan
+
+    # eta
+    if (magcol in thisfeatures and
+        thisfeatures[magcol] and
+        thisfeatures[magcol]['eta_normal']):
+        eta = thisfeatures[magcol]['eta_normal']
+    else:
+        eta = np.nan
+
+    return objectid, sdssr, lcmad, stetsonj, iqr, eta
+
+
+
 def variability_threshold(featuresdir,
                           outfile,
                           magbins=np.arange(8.0,16.25,0.25),
@@ -2795,70 +3120,8 @@ def variability_threshold(featuresdir,
             with open(pkl,'rb') as infd:
                 thisfeatures = pickle.load(infd)
 
-            objectid = thisfeatures['objectid']
-
-            # the object magnitude
-            if ('info' in thisfeatures and
-                thisfeatures['info'] and
-                'sdssr' in thisfeatures['info']):
-
-                if (thisfeatures['info']['sdssr'] and
-                    thisfeatures['info']['sdssr'] > 3.0):
-
-                    sdssr = thisfeatures['info']['sdssr']
-
-                elif (magcol in thisfeatures and
-                      thisfeatures[magcol] and
-                      'median' in thisfeatures[magcol] and
-                      thisfeatures[magcol]['median'] > 3.0):
-
-                    sdssr = thisfeatures[magcol]['median']
-
-                elif (thisfeatures['info']['jmag'] and
-                      thisfeatures['info']['hmag'] and
-                      thisfeatures['info']['kmag']):
-
-                    sdssr = jhk_to_sdssr(thisfeatures['info']['jmag'],
-                                         thisfeatures['info']['hmag'],
-                                         thisfeatures['info']['kmag'])
-
-                else:
-                    sdssr = np.nan
-
-            else:
-                sdssr = np.nan
-
-            # the MAD of the light curve
-            if (magcol in thisfeatures and
-                thisfeatures[magcol] and
-                thisfeatures[magcol]['mad']):
-                lcmad = thisfeatures[magcol]['mad']
-            else:
-                lcmad = np.nan
-
-            # stetson index
-            if (magcol in thisfeatures and
-                thisfeatures[magcol] and
-                thisfeatures[magcol]['stetsonj']):
-                stetsonj = thisfeatures[magcol]['stetsonj']
-            else:
-                stetsonj = np.nan
-
-            # IQR
-            if (magcol in thisfeatures and
-                thisfeatures[magcol] and
-                thisfeatures[magcol]['mag_iqr']):
-                iqr = thisfeatures[magcol]['mag_iqr']
-            else:
-                iqr = np.nan
-
-            # eta
-            if (magcol in thisfeatures and
-                thisfeatures[magcol] and
-                thisfeatures[magcol]['eta_normal']):
-                eta = thisfeatures[magcol]['eta_normal']
-            else:
-                eta = np.nan
+            (objectid, sdssr, lcmad,
+             stetsonj, iqr, eta) = _varthresh_indices(thisfeatures, magcol)
 
             allobjects[magcol]['objectid'].append(objectid)
             allobjects[magcol]['sdssr'].append(sdssr)
@@ -3389,6 +3652,7 @@ def plot_variability_thresholds(varthreshpkl,
 ## RUNNING PERIOD SEARCHES ##
 #############################
 
+@instrumented('runpf')
 def runpf(lcfile,
           outdir,
           timecols=None,
@@ -3400,7 +3664,8 @@ def runpf(lcfile,
           sigclip=10.0,
           getblssnr=False,
           nworkers=NCPUS,
-          excludeprocessed=False):
+          excludeprocessed=False,
+          pfcachedir=None):
     '''This runs the period-finding for a single LC.
 
     pfmethods is a list of period finding methods to run. Each element is a
@@ -3413,6 +3678,12 @@ def runpf(lcfile,
     If excludeprocessing is True, light curves that have existing periodfinding
     result pickles in outdir will not be processed.
 
+    If pfcachedir is not None, each period-finder result is cached there by a
+    hash of the LC arrays, the method, its kwargs, and the astrobase version
+    (see astrobase.lcproc_pfcache). Period-finders whose inputs haven't changed
+    since the last run are then not run again; their results are read from the
+    cache instead. The output pickle is always written.
+
     FIXME: currently, this uses a dumb method of excluding already-processed
     files. A smarter way to do this is to (i) generate a SHA512 cachekey based
     on a repr of {'lcfile', 'timecols', 'magcols', 'errcols', 'lcformat',
@@ -3443,7 +3714,9 @@ def runpf(lcfile,
     try:
 
         # get the LC into a dict
-        lcdict = readerfunc(lcfile)
+        with stage('read'):
+            lcdict = readerfunc(lcfile)
+        file_read(lcfile)
 
         # this should handle lists/tuples being returned by readerfunc
         # we assume that the first element is the actual lcdict
@@ -3496,7 +3769,8 @@ def runpf(lcfile,
 
         # normalize using the special function if specified
         if normfunc is not None:
-            lcdict = normfunc(lcdict)
+            with stage('normalize'):
+                lcdict = normfunc(lcdict)
 
         for tcol, mcol, ecol in zip(timecols, magcols, errcols):
 
@@ -3522,13 +3796,16 @@ def runpf(lcfile,
 
             # normalize here if not using special normalization
             if normfunc is None:
-                ntimes, nmags = normalize_magseries(
-                    times, mags,
-                    magsarefluxes=magsarefluxes
-                )
+                with stage('normalize'):
+                    ntimes, nmags = normalize_magseries(
+                        times, mags,
+                        magsarefluxes=magsarefluxes
+                    )
 
                 times, mags, errs = ntimes, nmags, errs
 
+            count('ndet', len(times))
+
             # run each of the requested period-finder functions
             resultdict[mcol] = {}
 
@@ -3553,11 +3830,32 @@ def runpf(lcfile,
                 pfmkey = '%s-%s' % (pfmind, pfm)
                 pfmkeys.append(pfmkey)
 
+                # check the cache for the result of this period-finder
+                pfresult = None
+
+                if pfcachedir is not None:
+                    cachekey = get_pfcache_key(times, mags, errs,
+                                               pfm, pf_kwargs)
+                    pfresult = get_cached_pfresult(pfcachedir,
+                                                   lcdict['objectid'],
+                                                   mcol, pfm, cachekey)
+                    count('pfcache-%s' % ('miss' if pfresult is None
+                                          else 'hit'))
+
                 # run this period-finder and save its results to the output dict
-                resultdict[mcol][pfmkey] = pf_func(
-                    times, mags, errs,
-                    **pf_kwargs
-                )
+                if pfresult is None:
+
+                    with stage('pf-%s' % pfm):
+                        pfresult = pf_func(
+                            times, mags, errs,
+                            **pf_kwargs
+                        )
+
+                    if pfcachedir is not None and pfresult is not None:
+                        cache_pfresult(pfcachedir, lcdict['objectid'],
+                                       mcol, pfm, cachekey, pfresult)
+
+                resultdict[mcol][pfmkey] = pfresult
 
 
             #
@@ -3579,9 +3877,10 @@ def runpf(lcfile,
                             bls = resultdict[mcol][pfmk]
 
                             # calculate the SNR for the BLS as well
-                            blssnr = bls_snr(bls, times, mags, errs,
-                                             magsarefluxes=magsarefluxes,
-                                             verbose=False)
+                            with stage('blssnr'):
+                                blssnr = bls_snr(bls, times, mags, errs,
+                                                 magsarefluxes=magsarefluxes,
+                                                 verbose=False)
 
                             # add the SNR results to the BLS result dict
                             resultdict[mcol][pfmk].update({
@@ -3624,8 +3923,9 @@ def runpf(lcfile,
 
 
         # once all mag cols have been processed, write out the pickle
-        with open(outfile, 'wb') as outfd:
+        with stage('write'), open(outfile, 'wb') as outfd:
             pickle.dump(resultdict, outfd, protocol=pickle.HIGHEST_PROTOCOL)
+        file_written(outfile)
 
         return outfile
 
@@ -3643,7 +3943,11 @@ def runpf_worker(task):
     '''
 
     (lcfile, outdir, timecols, magcols, errcols, lcformat,
-     pfmethods, pfkwargs, getblssnr, sigclip, nworkers, excludeprocessed) = task
+     pfmethods, pfkwargs, getblssnr, sigclip, nworkers,
+     excludeprocessed) = task[:12]
+
+    # the cache dir is optional so older task tuples still work
+    pfcachedir = task[12] if len(task) > 12 else None
 
     if os.path.exists(lcfile):
         pfresult = runpf(lcfile,
@@ -3657,7 +3961,8 @@ def runpf_worker(task):
                          getblssnr=getblssnr,
                          sigclip=sigclip,
                          nworkers=nworkers,
-                         excludeprocessed=excludeprocessed)
+                         excludeprocessed=excludeprocessed,
+                         pfcachedir=pfcachedir)
         return pfresult
     else:
         LOGERROR('LC does not exist for requested file %s' % lcfile)
@@ -3665,6 +3970,17 @@ def runpf_worker(task):
 
 
 
+def _set_runpf_task_workers(task, nworkers):
+    '''
+    This returns a copy of a runpf_worker task with nworkers period workers.
+
+    '''
+
+    return task[:10] + (nworkers,) + task[11:]
+
+
+
+@instrumented('parallel_pf')
 def parallel_pf(lclist,
                 outdir,
                 timecols=None,
@@ -3679,7 +3995,8 @@ def parallel_pf(lclist,
                 ncontrolworkers=1,
                 liststartindex=None,
                 listmaxobjects=None,
-                excludeprocessed=True):
+                excludeprocessed=True,
+                pfcachedir=None):
     '''This drives the overall parallel period processing.
 
     Use pfmethods to specify which periodfinders to run. These must be in
@@ -3697,6 +4014,15 @@ def parallel_pf(lclist,
 
     ncontrolworkers is the number of controlling processes to launch.
 
+    With the default dynamic scheduler (see astrobase.lcproc_sched),
+    ncontrolworkers x nperiodworkers is used as the total number of cores
+    instead. LCs that would take longer than the average work per core are run
+    first, one at a time with all of the cores as period workers. The rest are
+    then run one per core, largest first. The cost of each LC is its number of
+    detections if lclist is the lclist dict (or pickle) made by make_lclist, or
+    its file size if lclist is a list of LC files. Note that this can keep up to
+    ncontrolworkers x nperiodworkers LCs in memory at the same time.
+
     liststartindex sets the index from where to start in lclist. listmaxobjects
     sets the maximum number of objects in lclist to run periodfinding for in
     this invocation. Together, these can be used to distribute processing over
@@ -3706,6 +4032,11 @@ def parallel_pf(lclist,
     and have existing corresponding periodfinding-<objectid-suffix>.pkl[.gz]
     files in outdir will be ignored.
 
+    If pfcachedir is not None, the results of each period-finder are cached
+    there for each object and magcol. On reruns (with excludeprocessed=False),
+    only the period-finders whose LC or kwargs changed are run again. See
+    runpf for details.
+
     As a rough benchmark, 25000 HATNet light curves with up to 50000 points per
     LC take about 26 days in total for an invocation of this function using
     GLS+PDM+BLS, 10 periodworkers, and 4 controlworkers (so all 40 'cores') on a
@@ -3717,24 +4048,28 @@ def parallel_pf(lclist,
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
+    lclist, costs = get_lclist_costs(lclist)
+
     if (liststartindex is not None) and (listmaxobjects is None):
         lclist = lclist[liststartindex:]
+        costs = costs[liststartindex:]
 
     elif (liststartindex is None) and (listmaxobjects is not None):
         lclist = lclist[:listmaxobjects]
+        costs = costs[:listmaxobjects]
 
     elif (liststartindex is not None) and (listmaxobjects is not None):
         lclist = lclist[liststartindex:liststartindex+listmaxobjects]
+        costs = costs[liststartindex:liststartindex+listmaxobjects]
 
     tasklist = [(x, outdir, timecols, magcols, errcols, lcformat,
                  pfmethods, pfkwargs, getblssnr, sigclip, nperiodworkers,
-                 excludeprocessed)
+                 excludeprocessed, pfcachedir)
                 for x in lclist]
 
-    with ProcessPoolExecutor(max_workers=ncontrolworkers) as executor:
-        resultfutures = executor.map(runpf_worker, tasklist)
-
-    results = [x for x in resultfutures]
+    results = run_nested_tasks(runpf_worker, tasklist, costs,
+                               ncontrolworkers, nperiodworkers,
+                               _set_runpf_task_workers)
     return results
 
 
@@ -3754,7 +4089,8 @@ def parallel_pf_lcdir(lcdir,
                       ncontrolworkers=1,
                       liststartindex=None,
                       listmaxobjects=None,
-                      excludeprocessed=True):
+                      excludeprocessed=True,
+                      pfcachedir=None):
     '''
     This runs parallel light curve period finding for directory of LCs.
 
@@ -3821,7 +4157,8 @@ def parallel_pf_lcdir(lcdir,
                            ncontrolworkers=ncontrolworkers,
                            liststartindex=liststartindex,
                            listmaxobjects=listmaxobjects,
-                           excludeprocessed=excludeprocessed)
+                           excludeprocessed=excludeprocessed,
+                           pfcachedir=pfcachedir)
 
     else:
 
@@ -4100,6 +4437,7 @@ def update_checkplotdict_nbrlcs(
 ## RUNNING CHECKPLOTS ##
 ########################
 
+@instrumented('runcp', fallbackkwargs=('lcfname',))
 def runcp(pfpickle,
           outdir,
           lcbasedir,
@@ -4110,6 +4448,8 @@ def runcp(pfpickle,
           maxnumneighbors=5,
           gaia_max_timeout=60.0,
           gaia_mirror='cds',
+          gaia_fieldcache=None,
+          findermosaic=False,
           xmatchinfo=None,
           xmatchradiusarcsec=3.0,
           minobservations=1000,
@@ -4153,6 +4493,14 @@ def runcp(pfpickle,
 
     `maxnumneighbors` is the maximum number of neighbors that will be processed.
 
+    `gaia_fieldcache` is the dict returned by services.gaia.get_field_catalog
+    for the field. If this is provided, GAIA neighbors are found using the local
+    field-level tile cache instead of a GAIA TAP query for each object.
+
+    `findermosaic` is True if the finder chart should be cut out of a SkyView
+    field mosaic shared with nearby objects instead of fetched for this object
+    alone. See services.skyview.get_stamp_from_mosaic.
+
     `xmatchinfo` is the pickle or the actual dict containing external catalog
     information for cross-matching.
 
@@ -4197,9 +4545,11 @@ def runcp(pfpickle,
         else:
             infd = open(pfpickle,'rb')
 
-        pfresults = pickle.load(infd)
+        with stage('read-pfpickle'):
+            pfresults = pickle.load(infd)
 
         infd.close()
+        file_read(pfpickle)
 
     (fileglob, readerfunc, dtimecols, dmagcols,
      derrcols, magsarefluxes, normfunc) = LCFORM[lcformat]
@@ -4241,7 +4591,9 @@ def runcp(pfpickle,
                      "can't continue")
             return None
 
-    lcdict = readerfunc(lcfpath)
+    with stage('read'):
+        lcdict = readerfunc(lcfpath)
+    file_read(lcfpath)
 
     # this should handle lists/tuples being returned by readerfunc
     # we assume that the first element is the actual lcdict
@@ -4267,7 +4619,8 @@ def runcp(pfpickle,
 
     # normalize using the special function if specified
     if normfunc is not None:
-        lcdict = normfunc(lcdict)
+        with stage('normalize'):
+            lcdict = normfunc(lcdict)
 
     cpfs = []
 
@@ -4324,49 +4677,59 @@ def runcp(pfpickle,
 
         # normalize here if not using special normalization
         if normfunc is None:
-            ntimes, nmags = normalize_magseries(
-                times, mags,
-                magsarefluxes=magsarefluxes
-            )
+            with stage('normalize'):
+                ntimes, nmags = normalize_magseries(
+                    times, mags,
+                    magsarefluxes=magsarefluxes
+                )
             xtimes, xmags, xerrs = ntimes, nmags, errs
         else:
             xtimes, xmags, xerrs = times, mags, errs
 
+        count('ndet', len(xtimes))
+
         # generate the checkplotdict
-        cpd = checkplot.checkplot_dict(
-            pflist,
-            xtimes, xmags, xerrs,
-            objectinfo=lcdict['objectinfo'],
-            gaia_max_timeout=gaia_max_timeout,
-            gaia_mirror=gaia_mirror,
-            lclistpkl=lclistpkl,
-            nbrradiusarcsec=nbrradiusarcsec,
-            maxnumneighbors=maxnumneighbors,
-            xmatchinfo=xmatchinfo,
-            xmatchradiusarcsec=xmatchradiusarcsec,
-            sigclip=sigclip,
-            mindet=minobservations,
-            verbose=False,
-            normto=cprenorm  # we've done the renormalization already, so this
-                             # should be False by default. just messes up the
-                             # plots otherwise, destroying LPVs in particular
-        )
+        with stage('checkplot'):
+            cpd = checkplot.checkplot_dict(
+                pflist,
+                xtimes, xmags, xerrs,
+                objectinfo=lcdict['objectinfo'],
+                gaia_max_timeout=gaia_max_timeout,
+                gaia_mirror=gaia_mirror,
+                gaia_fieldcache=gaia_fieldcache,
+                findermosaic=findermosaic,
+                lclistpkl=lclistpkl,
+                nbrradiusarcsec=nbrradiusarcsec,
+                maxnumneighbors=maxnumneighbors,
+                xmatchinfo=xmatchinfo,
+                xmatchradiusarcsec=xmatchradiusarcsec,
+                sigclip=sigclip,
+                mindet=minobservations,
+                verbose=False,
+                normto=cprenorm  # we've done the renormalization already, so
+                                 # this should be False by default. just messes
+                                 # up the plots otherwise, destroying LPVs in
+                                 # particular
+            )
 
         # include any neighbor information as well
-        cpdupdated = update_checkplotdict_nbrlcs(
-            cpd,
-            tcol, mcol, ecol,
-            lcformat=lcformat,
-            verbose=False
-        )
+        with stage('neighbors'):
+            cpdupdated = update_checkplotdict_nbrlcs(
+                cpd,
+                tcol, mcol, ecol,
+                lcformat=lcformat,
+                verbose=False
+            )
 
         # write the update checkplot dict to disk
-        cpf = checkplot._write_checkplot_picklefile(
-            cpdupdated,
-            outfile=outfile,
-            protocol=pickle.HIGHEST_PROTOCOL,
-            outgzip=False
-        )
+        with stage('write'):
+            cpf = checkplot._write_checkplot_picklefile(
+                cpdupdated,
+                outfile=outfile,
+                protocol=pickle.HIGHEST_PROTOCOL,
+                outgzip=False
+            )
+        file_written(cpf)
 
         cpfs.append(cpf)
 
@@ -4375,6 +4738,52 @@ def runcp(pfpickle,
 
 
 
+def _prefetch_cp_services(pfpicklelist, lclistpkl, findermosaic=False):
+    '''This prefetches checkplot service results for the objects in pfpicklelist.
+
+    The objectids are taken from the periodfinding-<objectid>.pkl[.gz] names of
+    the pickles and their coordinates are looked up in lclistpkl, which is the
+    pickle (or the dict) produced by make_lclist.
+
+    '''
+
+    if isinstance(lclistpkl, dict):
+        lclist = lclistpkl
+    else:
+        with open(lclistpkl,'rb') as infd:
+            lclist = pickle.load(infd)
+
+    objects = lclist['objects']
+
+    if ('objectid' not in objects or
+        'ra' not in objects or 'decl' not in objects):
+        LOGWARNING('lclistpkl has no objectid, ra, decl columns, '
+                   'not prefetching checkplot service results')
+        return None
+
+    objectinds = {x:i for i, x in enumerate(objects['objectid'])}
+    objectinfolist = []
+
+    for pfpickle in pfpicklelist:
+
+        if pfpickle is None:
+            continue
+
+        objectid = os.path.basename(pfpickle)
+        objectid = objectid.replace('periodfinding-','')
+        objectid = objectid.replace('.gz','').replace('.pkl','')
+
+        if objectid in objectinds:
+            objectinfolist.append(
+                {'ra':objects['ra'][objectinds[objectid]],
+                 'decl':objects['decl'][objectinds[objectid]]}
+            )
+
+    return checkplot.prefetch_checkplot_services(objectinfolist,
+                                                 findermosaic=findermosaic)
+
+
+
 def runcp_worker(task):
     '''
     This is the worker for running checkplots.
@@ -4394,6 +4803,7 @@ def runcp_worker(task):
 
 
 
+@instrumented('parallel_cp')
 def parallel_cp(pfpicklelist,
                 outdir,
                 lcbasedir,
@@ -4402,6 +4812,8 @@ def parallel_cp(pfpicklelist,
                 lclistpkl=None,
                 gaia_max_timeout=60.0,
                 gaia_mirror='cds',
+                gaia_fieldcache=None,
+                findermosaic=False,
                 nbrradiusarcsec=60.0,
                 maxnumneighbors=5,
                 xmatchinfo=None,
@@ -4414,10 +4826,19 @@ def parallel_cp(pfpicklelist,
                 magcols=None,
                 errcols=None,
                 skipdone=False,
-                nworkers=NCPUS):
+                nworkers=NCPUS,
+                prefetch_services=False):
     '''This drives the parallel execution of runcp for a list of periodfinding
     result pickles.
 
+    If prefetch_services is True and lclistpkl is provided, the finder chart
+    stamps and extinction tables for all objects are fetched at the same time
+    before making any checkplots. See checkplot.prefetch_checkplot_services.
+
+    If findermosaic is True, the finder charts are cut out of SkyView field
+    mosaics shared by nearby objects, so only one mosaic is fetched for each
+    part of the field instead of a stamp for each object.
+
     '''
 
     if not os.path.exists(outdir):
@@ -4428,6 +4849,10 @@ def parallel_cp(pfpicklelist,
         if lcfnamelist:
             lcfnamelist = lcfnamelist[:maxobjects]
 
+    if prefetch_services and lclistpkl is not None:
+        _prefetch_cp_services(pfpicklelist, lclistpkl,
+                              findermosaic=findermosaic)
+
     if lcfnamelist is None:
         lcfnamelist = [None]*len(pfpicklelist)
 
@@ -4440,6 +4865,8 @@ def parallel_cp(pfpicklelist,
                   'lclistpkl':lclistpkl,
                   'gaia_max_timeout':gaia_max_timeout,
                   'gaia_mirror':gaia_mirror,
+                  'gaia_fieldcache':gaia_fieldcache,
+                  'findermosaic':findermosaic,
                   'nbrradiusarcsec':nbrradiusarcsec,
                   'maxnumneighbors':maxnumneighbors,
                   'xmatchinfo':xmatchinfo,
@@ -4450,15 +4877,9 @@ def parallel_cp(pfpicklelist,
                   'cprenorm':cprenorm}) for
                 x,y in zip(pfpicklelist, lcfnamelist)]
 
-    resultfutures = []
-    results = []
-
-    with ProcessPoolExecutor(max_workers=nworkers) as executor:
-        resultfutures = executor.map(runcp_worker, tasklist)
-
-    results = [x for x in resultfutures]
+    results = run_tasks(runcp_worker, tasklist,
+                        get_file_costs(pfpicklelist), nworkers)
 
-    executor.shutdown()
     return results
 
 
@@ -4526,7 +4947,8 @@ def xmatch_cplist_external_catalogs(cplist,
                                     xmatchpkl,
                                     xmatchradiusarcsec=2.0,
                                     updateexisting=True,
-                                    resultstodir=None):
+                                    resultstodir=None,
+                                    chunksize=1000):
     '''This xmatches external catalogs to a collection of checkplots in cpdir.
 
     cplist is a list of checkplot files to process.
@@ -4544,52 +4966,77 @@ def xmatch_cplist_external_catalogs(cplist,
     resulting checkplots after xmatch is done to. This can be used to keep the
     original checkplots in pristine condition for some reason.
 
+    The checkplots are read chunksize at a time. All objects in a chunk are
+    matched to each external catalog at once using the kdtree saved with the
+    catalog (see checkplot.xmatch_external_catalogs_bulk), then the results are
+    written back to their checkplots.
+
     '''
 
     # load the external catalog
     with open(xmatchpkl,'rb') as infd:
         xmd = pickle.load(infd)
 
-    # match each object. this is fairly fast, so this is not parallelized at the
-    # moment
-
     status_dict = {}
 
-    for cpf in cplist:
+    for chunkstart in range(0, len(cplist), chunksize):
 
-        cpd = _read_checkplot_picklefile(cpf)
+        chunkcpfs, chunkcpds = [], []
 
-        try:
+        for cpf in cplist[chunkstart:chunkstart+chunksize]:
+
+            try:
+                chunkcpds.append(_read_checkplot_picklefile(cpf))
+                chunkcpfs.append(cpf)
+            except Exception as e:
+                LOGEXCEPTION('could not read checkplot %s' % cpf)
+                status_dict[cpf] = None
+
+        if not chunkcpds:
+            continue
+
+        ras = np.array([x['objectinfo'].get('ra') for x in chunkcpds],
+                       dtype=np.float64)
+        decls = np.array([x['objectinfo'].get('decl') for x in chunkcpds],
+                         dtype=np.float64)
+
+        # match all objects in this chunk at once
+        xmatchresults = checkplot.xmatch_external_catalogs_bulk(
+            ras, decls, xmd,
+            xmatchradiusarcsec=xmatchradiusarcsec
+        )
+
+        for cpf, cpd, xmr in zip(chunkcpfs, chunkcpds, xmatchresults):
+
+            try:
 
-            # match in place
-            xmatch_external_catalogs(cpd, xmd,
-                                     xmatchradiusarcsec=xmatchradiusarcsec,
-                                     updatexmatch=updateexisting)
+                if updateexisting and 'xmatch' in cpd:
+                    cpd['xmatch'].update(xmr)
+                else:
+                    cpd['xmatch'] = xmr
 
-            for xmi in cpd['xmatch']:
+                for xmi in cpd['xmatch']:
 
-                if cpd['xmatch'][xmi]['found']:
-                    LOGINFO('checkplot %s: %s matched to %s, '
-                            'match dist: %s arcsec' %
-                            (os.path.basename(cpf),
-                             cpd['objectid'],
-                             cpd['xmatch'][xmi]['name'],
-                             cpd['xmatch'][xmi]['distarcsec']))
+                    if cpd['xmatch'][xmi]['found']:
+                        LOGINFO('checkplot %s: %s matched to %s, '
+                                'match dist: %s arcsec' %
+                                (os.path.basename(cpf),
+                                 cpd['objectid'],
+                                 cpd['xmatch'][xmi]['name'],
+                                 cpd['xmatch'][xmi]['distarcsec']))
 
                 if not resultstodir:
-                    outcpf = checkplot._write_checkplot_picklefile(cpd,
-                                                                   outfile=cpf)
+                    outcpf = _write_checkplot_picklefile(cpd, outfile=cpf)
                 else:
                     xcpf = os.path.join(resultstodir, os.path.basename(cpf))
-                    outcpf = checkplot._write_checkplot_picklefile(cpd,
-                                                                   outfile=xcpf)
+                    outcpf = _write_checkplot_picklefile(cpd, outfile=xcpf)
 
-            status_dict[cpf] = outcpf
+                status_dict[cpf] = outcpf
 
-        except Exception as e:
+            except Exception as e:
 
-            LOGEXCEPTION('failed to match objects for %s' % cpf)
-            status_dict[cpf] = None
+                LOGEXCEPTION('failed to match objects for %s' % cpf)
+                status_dict[cpf] = None
 
     return status_dict
 
@@ -5440,6 +5887,7 @@ def parallel_epd_worker(task):
 
 
 
+@instrumented('parallel_epd_lclist')
 def parallel_epd_lclist(lclist,
                         externalparams,
                         timecols=None,
@@ -5471,6 +5919,8 @@ def parallel_epd_lclist(lclist,
     if errcols is None:
         errcols = derrcols
 
+    lclist, costs = get_lclist_costs(lclist)
+
     outdict = {}
 
     # run by magcol
@@ -5481,10 +5931,8 @@ def parallel_epd_lclist(lclist,
                   epdsmooth_func, epdsmooth_extraparams) for
                  x in lclist]
 
-        pool = mp.Pool(nworkers, maxtasksperchild=maxworkertasks)
-        results = pool.map(parallel_epd_worker, tasks)
-        pool.close()
-        pool.join()
+        results = run_tasks(parallel_epd_worker, tasks, costs, nworkers,
+                            maxworkertasks=maxworkertasks)
 
         outdict[m] = results
 
@@ -6284,6 +6732,7 @@ def tfa_templates_lclist(
 
 
 
+@instrumented('apply_tfa_magseries')
 def apply_tfa_magseries(lcfile,
                         timecol,
                         magcol,
@@ -6328,7 +6777,9 @@ def apply_tfa_magseries(lcfile,
             templateinfo = pickle.load(infd)
 
     readerfunc = LCFORM[lcformat][1]
-    lcdict = readerfunc(lcfile)
+    with stage('read'):
+        lcdict = readerfunc(lcfile)
+    file_read(lcfile)
 
     if ((isinstance(lcdict, tuple) or isinstance(lcdict, list)) and
         isinstance(lcdict[0], dict)):
@@ -6360,39 +6811,46 @@ def apply_tfa_magseries(lcfile,
             'template_magseries'
         ][::]
 
-    # this is the normal matrix
-    normal_matrix = np.dot(tmagseries, tmagseries.T)
+    with stage('tfa-normal-matrix'):
+
+        # this is the normal matrix
+        normal_matrix = np.dot(tmagseries, tmagseries.T)
 
-    # get the inverse of the matrix
-    normal_matrix_inverse = spla.pinv2(normal_matrix)
+        # get the inverse of the matrix
+        normal_matrix_inverse = spla.pinv2(normal_matrix)
 
     # get the timebase from the template
     timebase = templateinfo[magcol]['timebase']
 
     # use this to reform the target lc in the same manner as that for a TFA
     # template LC
-    reformed_targetlc = reform_templatelc_for_tfa((
-        lcfile,
-        lcformat,
-        timecol,
-        magcol,
-        errcol,
-        timebase,
-        interp,
-        sigclip
-    ))
-
-    # calculate the scalar products of the target and template magseries
-    scalar_products = np.dot(tmagseries, reformed_targetlc['mags'])
-
-    # calculate the corrections
-    corrections = np.dot(normal_matrix_inverse, scalar_products)
-
-    # finally, get the corrected time series for the target object
-    corrected_magseries = (
-        reformed_targetlc['origmags'] -
-        np.dot(tmagseries.T, corrections)
-    )
+    with stage('reform'):
+        reformed_targetlc = reform_templatelc_for_tfa((
+            lcfile,
+            lcformat,
+            timecol,
+            magcol,
+            errcol,
+            timebase,
+            interp,
+            sigclip
+        ))
+
+    count('ndet', len(timebase))
+
+    with stage('tfa-correct'):
+
+        # calculate the scalar products of the target and template magseries
+        scalar_products = np.dot(tmagseries, reformed_targetlc['mags'])
+
+        # calculate the corrections
+        corrections = np.dot(normal_matrix_inverse, scalar_products)
+
+        # finally, get the corrected time series for the target object
+        corrected_magseries = (
+            reformed_targetlc['origmags'] -
+            np.dot(tmagseries.T, corrections)
+        )
 
     outdict = {
         'times':timebase,
@@ -6414,8 +6872,9 @@ def apply_tfa_magseries(lcfile,
     lcdict['tfa'] = outdict
     outfile = os.path.join(os.path.dirname(lcfile),
                            '%s-tfa-%s-pklc.pkl' % (objectid, magcol))
-    with open(outfile,'wb') as outfd:
+    with stage('write'), open(outfile,'wb') as outfd:
         pickle.dump(lcdict, outfd, pickle.HIGHEST_PROTOCOL)
+    file_written(outfile)
 
     return outfile
 
@@ -6456,6 +6915,7 @@ def parallel_tfa_worker(task):
 
 
 
+@instrumented('parallel_tfa_lclist')
 def parallel_tfa_lclist(lclist,
                         templateinfo,
                         timecols=None,
@@ -6468,7 +6928,8 @@ def parallel_tfa_lclist(lclist,
                         maxworkertasks=1000):
     '''This applies TFA in parallel to all LCs in lclist.
 
-    lclist is a list of light curve files to apply the TFA correction to.
+    lclist is a list of light curve files to apply the TFA correction to, or the
+    lclist dict (or pickle) made by make_lclist for them.
 
     templateinfo is either the dict produced by tfa_templates_lclist or the
     pickle produced by the same function.
@@ -6510,6 +6971,8 @@ def parallel_tfa_lclist(lclist,
     if errcols is None:
         errcols = templateinfo['errcols']
 
+    lclist, costs = get_lclist_costs(lclist)
+
     outdict = {}
 
     # run by magcol
@@ -6518,10 +6981,8 @@ def parallel_tfa_lclist(lclist,
         tasks = [(x, t, m, e, templateinfo, lcformat, interp, sigclip) for
                  x in lclist]
 
-        pool = mp.Pool(nworkers, maxtasksperchild=maxworkertasks)
-        results = pool.map(parallel_tfa_worker, tasks)
-        pool.close()
-        pool.join()
+        results = run_tasks(parallel_tfa_worker, tasks, costs, nworkers,
+                            maxworkertasks=maxworkertasks)
 
         outdict[m] = results
 
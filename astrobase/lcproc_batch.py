@@ -20,7 +20,7 @@ possible, and defer the imports until we've decided which function to run.
 List of CLI commands
 --------------------
 
-lcpbatch help
+lcpbatch --help
 
 lcpbatch register-lcformat --lcformat specifications
 
@@ -29,20 +29,78 @@ lcpbatch make-lclist /path/to/lc/basedir outfile.pkl --options
 lcpbatch filter-lclist /path/to/lc/list.pkl outfile.pkl --options
                                                         --copyto
 
-lcpbatch varfeatures /path/to/lc.file outfile.pkl --options
+lcpbatch varfeatures /path/to/lc.file --outdir outdir --options
 
 lcpbatch varthreshold /path/to/varfeature/dir --options
                                               --plot to plot all selections
                                               --copyto dir to copy selected vars
 
-lcpbatch periodfind /path/to/lc.file outdir --options
+lcpbatch periodfind /path/to/lc.file --outdir outdir --options
+                                                     --pfcachedir cachedir
 
-lcpbatch checkplot /path/to/lc.file outdir --options
-                                           --all-lclist to pick up neighbors
+lcpbatch checkplot /path/to/pfresult.pkl --outdir outdir
+                                         --lcbasedir /path/to/lcs --options
 
 lcpbatch cp-png /path/to/checkplot.pkl
 
-lcpbatch timebin /path/to/lc.file outdir --options
+lcpbatch timebin /path/to/lc.file --binsizesec 300 --outdir outdir
+
+NOTE: filter-lclist and varthreshold aren't wired up to the CLI yet; use the
+filter_lclist and variability_threshold functions directly for now.
+
+
+Running workers from a task queue
+---------------------------------
+
+For processing lots of light curves, add tasks to a queue and run one or more
+long-lived workers that pull from it. Workers load the LC format and import
+everything they need once at startup, then keep processing tasks until the
+queue has been empty for --maxidle seconds. The built-in queue backend is a
+SQLite database, which also keeps the status and results of all tasks.
+
+lcpbatch enqueue queue.sqlite periodfind /path/to/lcs/*.sqlite --outdir pfdir
+
+lcpbatch enqueue queue.sqlite checkplot pfdir/*.pkl --outdir cpdir
+                                                    --lcbasedir /path/to/lcs
+
+lcpbatch worker queue.sqlite --lcformat hat-sql --maxidle 300
+
+lcpbatch queue-status queue.sqlite --show-failed
+                                   --requeue-stale 3600
+
+Task types are: periodfind, varfeatures, checkplot, timebin, cp-png. Other
+queue backends can be added with register_queue_backend.
+
+
+Caching period-finder results
+-----------------------------
+
+If periodfind is run with --pfcachedir, the result of each period-finder for
+each object and magcol is cached there, keyed by a hash of the LC arrays, the
+method, and its kwargs. Reruns only run the period-finders whose inputs
+changed. To see what's in a cache and remove old entries:
+
+lcpbatch pfcache cachedir
+
+lcpbatch pfcache cachedir --prune --keep-latest 1 --max-age-days 90
+                                  --max-size-gb 50 --dry-run
+
+
+Resumable pipeline runs
+-----------------------
+
+To run several stages for each LC with a SQLite manifest that keeps track of
+what's done, so the run can be resumed after it's interrupted (see
+astrobase.lcproc_pipeline):
+
+lcpbatch pipeline-create run.sqlite /path/to/lcs/*.sqlite --outdir outdir
+                         --stages varfeatures,periodfind,checkplot
+                         --stagekwargs '{"periodfind": {"pfmethods": ["gls"]}}'
+
+lcpbatch pipeline-run run.sqlite --nworkers 16
+
+lcpbatch pipeline-status run.sqlite --show-failed
+                                    --retry-failed
 
 '''
 #############
@@ -130,6 +188,10 @@ from concurrent.futures import ProcessPoolExecutor
 import argparse
 import json
 import importlib
+import sqlite3
+import socket
+import signal
+import time
 
 import numpy as np
 
@@ -181,6 +243,9 @@ def read_pklc(lcfile):
 
 
 
+# this caches lcformat specs read by get_lcformat_spec below
+LCFORMAT_SPECS = {}
+
 # these translate filter operators given as strings to Python operators
 FILTEROPS = {'eq':'==',
              'gt':'>',
@@ -226,8 +291,17 @@ def get_lcformat_spec(lcformatkey, lcformatdir=None):
     If lcformatdir is None, then this function will search in the data subdir of
     the astrobase installation.
 
+    Format specs are cached in-process after they're read for the first time, so
+    long-running workers don't re-read the JSON for every light curve. Calling
+    this with an explicit lcformatdir always reads the JSON from that directory
+    and replaces any cached spec for lcformatkey, so later calls without
+    lcformatdir will pick up the custom one.
+
     '''
 
+    if lcformatdir is None and lcformatkey in LCFORMAT_SPECS:
+        return LCFORMAT_SPECS[lcformatkey].copy()
+
     if lcformatdir is None:
         lcformatdir = os.path.join(os.path.dirname(__file__),
                                    'data',
@@ -247,7 +321,56 @@ def get_lcformat_spec(lcformatkey, lcformatdir=None):
     with open(lcformatjson,'rb') as infd:
         formatspec = json.load(infd)
 
-    return formatspec
+    LCFORMAT_SPECS[lcformatkey] = formatspec
+    return formatspec.copy()
+
+
+
+def preload_lcformat(lcformatkey, lcformatdir=None):
+    '''This reads the spec for an LC format and imports its reader and
+    normalization functions.
+
+    Used by the batch workers so the spec and the modules it refers to are
+    already loaded before the first task arrives. lcformatkey can also be the
+    path to a lcformat JSON file, in which case the key is taken from the
+    filename (e.g. /path/to/my-format.json -> 'my-format').
+
+    Returns a dict with the formatspec, the readerfunc, and the normfunc (None
+    if the format doesn't specify one), or None if the format can't be loaded.
+
+    '''
+
+    if lcformatkey.endswith('.json') and os.path.exists(lcformatkey):
+        lcformatdir = os.path.dirname(os.path.abspath(lcformatkey))
+        lcformatkey = os.path.basename(lcformatkey).replace('.json','')
+
+    formatspec = get_lcformat_spec(lcformatkey, lcformatdir=lcformatdir)
+    if formatspec is None:
+        return None
+
+    try:
+
+        check_extmodule(formatspec['lcreader_module'], lcformatkey)
+        readermod = importlib.import_module(formatspec['lcreader_module'])
+        readerfunc = getattr(readermod, formatspec['lcreader_func'])
+
+        if formatspec['lcnorm_module'] is not None:
+            check_extmodule(formatspec['lcnorm_module'], lcformatkey)
+            normmod = importlib.import_module(formatspec['lcnorm_module'])
+            normfunc = getattr(normmod, formatspec['lcnorm_func'])
+        else:
+            normfunc = None
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not load the reader/normalization functions '
+                     'for LC format: %s' % lcformatkey)
+        return None
+
+    return {'lcformat':lcformatkey,
+            'formatspec':formatspec,
+            'readerfunc':readerfunc,
+            'normfunc':normfunc}
 
 
 
@@ -336,7 +459,7 @@ def register_custom_lcformat(formatkey,
     # get the lcformatdir
     if lcformatdir is None:
         lcformatdir = os.path.abspath(os.path.join(os.path.dirname(__file__),
-                                                   '../data',
+                                                   'data',
                                                    'lcformats'))
 
     formatdict = {'fileglob':fileglob,
@@ -355,6 +478,9 @@ def register_custom_lcformat(formatkey,
     with open(formatfile,'w') as outfd:
         json.dump(formatdict, outfd, indent=2)
 
+    # drop any stale cached spec for this format
+    LCFORMAT_SPECS.pop(formatkey, None)
+
     return formatfile
 
 
@@ -1168,7 +1294,7 @@ def get_varfeatures(lcfile,
             else:
 
                 # get the features for this magcol
-                lcfeatures = features.all_nonperiodic_features(
+                lcfeatures = varfeatures.all_nonperiodic_features(
                     times, mags, errs
                 )
                 resultdict[mcolget[-1]] = lcfeatures
@@ -1970,7 +2096,8 @@ def runpf(lcfile,
           sigclip=10.0,
           getblssnr=False,
           nworkers=None,
-          excludeprocessed=False):
+          excludeprocessed=False,
+          pfcachedir=None):
     '''This runs the period-finding for a single LC.
 
     pfmethods is a list of period finding methods to run. Each element is a
@@ -1983,6 +2110,10 @@ def runpf(lcfile,
     If excludeprocessing is True, light curves that have existing periodfinding
     result pickles in outdir will not be processed.
 
+    If pfcachedir is not None, each period-finder result is cached there and
+    only recomputed if the LC, the method, or its kwargs change. See
+    astrobase.lcproc_pfcache for details.
+
     FIXME: currently, this uses a dumb method of excluding already-processed
     files. A smarter way to do this is to (i) generate a SHA512 cachekey based
     on a repr of {'lcfile', 'timecols', 'magcols', 'errcols', 'lcformat',
@@ -1996,6 +2127,8 @@ def runpf(lcfile,
 
     from astrobase import periodbase
     from astrobase.periodbase.kbls import bls_snr
+    from astrobase.lcproc_pfcache import get_pfcache_key, \
+        get_cached_pfresult, cache_pfresult
 
     # used to figure out which period finder to run given a list of methods
     PFMETHODS = {'bls':periodbase.bls_parallel_pfind,
@@ -2142,11 +2275,29 @@ def runpf(lcfile,
                                   'magsarefluxes':magsarefluxes,
                                   'sigclip':sigclip})
 
+                # check the cache for the result of this period-finder
+                pfresult = None
+
+                if pfcachedir is not None:
+                    cachekey = get_pfcache_key(times, mags, errs,
+                                               pfm, pf_kwargs)
+                    pfresult = get_cached_pfresult(pfcachedir,
+                                                   lcdict['objectid'],
+                                                   mcolget[-1], pfm, cachekey)
+
                 # run this period-finder and save its results to the output dict
-                resultdict[mcolget[-1]][pfm] = pf_func(
-                    times, mags, errs,
-                    **pf_kwargs
-                )
+                if pfresult is None:
+
+                    pfresult = pf_func(
+                        times, mags, errs,
+                        **pf_kwargs
+                    )
+
+                    if pfcachedir is not None and pfresult is not None:
+                        cache_pfresult(pfcachedir, lcdict['objectid'],
+                                       mcolget[-1], pfm, cachekey, pfresult)
+
+                resultdict[mcolget[-1]][pfm] = pfresult
 
 
             #
@@ -2731,6 +2882,617 @@ def timebinlc(lcfile,
 
 
 
+###############################
+## QUEUE-DRIVEN BATCH WORKER ##
+###############################
+
+# these are the task types a worker can run. each task is stored in the queue
+# as a list of positional args and a dict of kwargs for the function below:
+#
+# periodfind:  args = [lcfile, outdir]
+# varfeatures: args = [lcfile, outdir]
+# checkplot:   args = [pfpickle, outdir, lcbasedir]
+# timebin:     args = [lcfile, binsizesec]
+# cp-png:      args = [checkplotpickle]
+TASKFUNCS = {
+    'periodfind':runpf,
+    'varfeatures':get_varfeatures,
+    'checkplot':runcp,
+    'timebin':timebinlc,
+    'cp-png':cp2png,
+}
+
+# these are the task types that take a lcformat kwarg
+LCFORMAT_TASKS = ('periodfind','varfeatures','checkplot','timebin')
+
+# this is the SQL used to set up a local task queue
+SQLITE_QUEUE_SCHEMA = '''\
+create table if not exists tasks (
+  taskid integer primary key autoincrement,
+  tasktype text not null,
+  args text not null,
+  kwargs text,
+  status text not null default 'queued',
+  attempts integer not null default 0,
+  workerid text,
+  queued_at real,
+  started_at real,
+  finished_at real,
+  result text,
+  error text
+);
+create index if not exists tasks_status_idx on tasks (status, taskid);
+'''
+
+
+class LocalTaskQueue(object):
+    '''This is a task queue and status store backed by a SQLite database.
+
+    This is the built-in queue backend for run_worker. It's meant for running
+    many workers on a single machine or on machines that share a filesystem
+    where SQLite locking works (i.e. not most NFS mounts). Workers claim tasks
+    atomically, so any number of them can pull from the same queue file.
+
+    Other backends (e.g. for AWS SQS + DynamoDB) can be used with run_worker by
+    providing an object with the same methods:
+
+    get_task(workerid) -> task dict or None if there's nothing left to do
+    finish_task(taskid, result)
+    fail_task(taskid, error)
+
+    and registering its class with register_queue_backend. The task dicts
+    returned by get_task must have the keys: taskid, tasktype, args, kwargs.
+
+    '''
+
+    def __init__(self, queuefile, maxattempts=3, timeout=60.0):
+        '''
+        queuefile is the path to the SQLite database to use. This is created if
+        it doesn't exist.
+
+        maxattempts is the number of times a task will be tried before it's
+        marked as failed for good.
+
+        timeout is the number of seconds to wait for a lock on the database.
+
+        '''
+
+        self.queuefile = os.path.abspath(queuefile)
+        self.maxattempts = maxattempts
+        self.timeout = timeout
+
+        db = self._connect()
+        try:
+            db.executescript(SQLITE_QUEUE_SCHEMA)
+        finally:
+            db.close()
+
+
+    def _connect(self):
+        '''
+        This opens a new connection to the queue database.
+
+        We use a new connection for every operation so the queue object can be
+        passed to forked worker processes safely.
+
+        '''
+
+        db = sqlite3.connect(self.queuefile,
+                             timeout=self.timeout,
+                             isolation_level=None)
+        db.execute('pragma journal_mode = wal')
+        return db
+
+
+    def add_tasks(self, tasktype, arglist, kwargs=None):
+        '''This adds tasks of type tasktype to the queue.
+
+        arglist is a list of lists of positional args, one per task. kwargs is a
+        dict of kwargs used for all of these tasks.
+
+        Returns the number of tasks added.
+
+        '''
+
+        if tasktype not in TASKFUNCS:
+            LOGERROR('unknown task type: %s, must be one of: %s' %
+                     (tasktype, ', '.join(sorted(TASKFUNCS.keys()))))
+            return 0
+
+        kwargsjson = json.dumps(kwargs if kwargs else {})
+        queuedat = time.time()
+
+        db = self._connect()
+        try:
+            db.execute('begin immediate')
+            db.executemany(
+                'insert into tasks (tasktype, args, kwargs, queued_at) '
+                'values (?, ?, ?, ?)',
+                [(tasktype, json.dumps(list(args)), kwargsjson, queuedat)
+                 for args in arglist]
+            )
+            db.execute('commit')
+        finally:
+            db.close()
+
+        return len(arglist)
+
+
+    def get_task(self, workerid):
+        '''This claims the next queued task for workerid.
+
+        Returns a dict with the task's taskid, tasktype, args, kwargs, and
+        attempts, or None if there are no queued tasks.
+
+        '''
+
+        db = self._connect()
+
+        try:
+
+            db.execute('begin immediate')
+            row = db.execute(
+                'select taskid, tasktype, args, kwargs, attempts from tasks '
+                'where status = ? order by taskid asc limit 1',
+                ('queued',)
+            ).fetchone()
+
+            if row is None:
+                db.execute('commit')
+                return None
+
+            db.execute(
+                'update tasks set status = ?, workerid = ?, started_at = ?, '
+                'attempts = attempts + 1 where taskid = ?',
+                ('running', workerid, time.time(), row[0])
+            )
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return {'taskid':row[0],
+                'tasktype':row[1],
+                'args':json.loads(row[2]),
+                'kwargs':json.loads(row[3]) if row[3] else {},
+                'attempts':row[4] + 1}
+
+
+    def finish_task(self, taskid, result):
+        '''
+        This marks the task as done and stores its result.
+
+        '''
+
+        db = self._connect()
+        try:
+            db.execute(
+                'update tasks set status = ?, finished_at = ?, result = ?, '
+                'error = null where taskid = ?',
+                ('done', time.time(), json.dumps(result, default=str), taskid)
+            )
+        finally:
+            db.close()
+
+
+    def fail_task(self, taskid, error):
+        '''This records a failure for the task.
+
+        If the task hasn't been tried maxattempts times yet, it goes back into
+        the queue. Otherwise, it's marked as failed.
+
+        '''
+
+        db = self._connect()
+        try:
+            db.execute('begin immediate')
+            attempts = db.execute(
+                'select attempts from tasks where taskid = ?', (taskid,)
+            ).fetchone()
+
+            if attempts is not None and attempts[0] < self.maxattempts:
+                newstatus = 'queued'
+            else:
+                newstatus = 'failed'
+
+            db.execute(
+                'update tasks set status = ?, finished_at = ?, error = ? '
+                'where taskid = ?',
+                (newstatus, time.time(), error, taskid)
+            )
+            db.execute('commit')
+        finally:
+            db.close()
+
+
+    def requeue_stale(self, maxruntime):
+        '''This puts tasks that have been running for longer than maxruntime
+        seconds back into the queue.
+
+        Use this to recover tasks claimed by workers that died or were killed
+        before they could report back. Returns the number of tasks requeued.
+
+        '''
+
+        db = self._connect()
+        try:
+            cursor = db.execute(
+                'update tasks set status = ?, workerid = null '
+                'where status = ? and started_at < ?',
+                ('queued', 'running', time.time() - maxruntime)
+            )
+            nrequeued = cursor.rowcount
+        finally:
+            db.close()
+
+        return nrequeued
+
+
+    def get_status(self):
+        '''
+        This returns a dict of task counts by status and by task type.
+
+        '''
+
+        db = self._connect()
+        try:
+            rows = db.execute(
+                'select tasktype, status, count(*) from tasks '
+                'group by tasktype, status'
+            ).fetchall()
+        finally:
+            db.close()
+
+        statusdict = {'queued':0, 'running':0, 'done':0, 'failed':0,
+                      'tasktypes':{}}
+
+        for tasktype, status, count in rows:
+            statusdict[status] = statusdict.get(status, 0) + count
+            if tasktype not in statusdict['tasktypes']:
+                statusdict['tasktypes'][tasktype] = {}
+            statusdict['tasktypes'][tasktype][status] = count
+
+        return statusdict
+
+
+    def get_results(self, status='done', tasktype=None):
+        '''This returns a list of task dicts with the given status.
+
+        Each dict has the taskid, tasktype, args, kwargs, attempts, workerid,
+        result, and error for the task.
+
+        '''
+
+        query = ('select taskid, tasktype, args, kwargs, attempts, workerid, '
+                 'result, error from tasks where status = ?')
+        params = [status]
+
+        if tasktype is not None:
+            query = query + ' and tasktype = ?'
+            params.append(tasktype)
+
+        db = self._connect()
+        try:
+            rows = db.execute(query + ' order by taskid asc',
+                              params).fetchall()
+        finally:
+            db.close()
+
+        return [{'taskid':x[0],
+                 'tasktype':x[1],
+                 'args':json.loads(x[2]),
+                 'kwargs':json.loads(x[3]) if x[3] else {},
+                 'attempts':x[4],
+                 'workerid':x[5],
+                 'result':json.loads(x[6]) if x[6] else None,
+                 'error':x[7]} for x in rows]
+
+
+
+# these map queue URL schemes to queue backend classes
+QUEUE_BACKENDS = {'sqlite':LocalTaskQueue}
+
+
+def register_queue_backend(scheme, backendclass):
+    '''This registers a queue backend class for queue URLs like scheme://...
+
+    backendclass is called with the rest of the queue URL (after scheme://) as
+    its only positional arg and must return an object with the get_task,
+    finish_task, and fail_task methods described in LocalTaskQueue.
+
+    '''
+
+    QUEUE_BACKENDS[scheme] = backendclass
+
+
+
+def get_task_queue(queueurl, **backendkwargs):
+    '''This returns a task queue object for queueurl.
+
+    queueurl is either a path to a SQLite database file, in which case a
+    LocalTaskQueue is used, or a URL of the form scheme://location, where
+    scheme is one of the keys in QUEUE_BACKENDS. Any backendkwargs are passed to
+    the backend class.
+
+    '''
+
+    if '://' in queueurl:
+        scheme, location = queueurl.split('://', 1)
+    else:
+        scheme, location = 'sqlite', queueurl
+
+    if scheme not in QUEUE_BACKENDS:
+        LOGERROR('no queue backend registered for scheme: %s' % scheme)
+        return None
+
+    return QUEUE_BACKENDS[scheme](location, **backendkwargs)
+
+
+
+def enqueue_tasks(queue,
+                  tasktype,
+                  inputfiles,
+                  outdir=None,
+                  lcbasedir=None,
+                  binsizesec=None,
+                  taskkwargs=None):
+    '''This adds a task of type tasktype for each file in inputfiles to the
+    queue.
+
+    queue is a task queue object or a queue URL for get_task_queue.
+
+    inputfiles are light curve files for the periodfind, varfeatures, and
+    timebin tasks, period-finding result pickles for checkplot tasks, and
+    checkplot pickles for cp-png tasks.
+
+    outdir is required for periodfind, varfeatures, and checkplot tasks. For
+    timebin tasks, the binned LCs are written next to the input LCs if outdir
+    is None.
+
+    lcbasedir is required for checkplot tasks and is where the light curves
+    for the period-finding results will be looked up.
+
+    binsizesec is required for timebin tasks.
+
+    taskkwargs is a dict of any other kwargs to pass to the task function
+    (e.g. {'pfmethods':['gls','bls'], 'pfkwargs':[{}, {}]} for periodfind).
+
+    Returns the number of tasks added.
+
+    '''
+
+    if isinstance(queue, str):
+        queue = get_task_queue(queue)
+
+    if tasktype not in TASKFUNCS:
+        LOGERROR('unknown task type: %s, must be one of: %s' %
+                 (tasktype, ', '.join(sorted(TASKFUNCS.keys()))))
+        return 0
+
+    kwargs = dict(taskkwargs) if taskkwargs else {}
+    inputfiles = [os.path.abspath(x) for x in inputfiles]
+
+    if tasktype in ('periodfind', 'varfeatures'):
+
+        if outdir is None:
+            LOGERROR('an outdir is required for %s tasks' % tasktype)
+            return 0
+        arglist = [[x, os.path.abspath(outdir)] for x in inputfiles]
+
+    elif tasktype == 'checkplot':
+
+        if outdir is None or lcbasedir is None:
+            LOGERROR('an outdir and lcbasedir are required for checkplot tasks')
+            return 0
+        arglist = [[x, os.path.abspath(outdir), os.path.abspath(lcbasedir)]
+                   for x in inputfiles]
+
+    elif tasktype == 'timebin':
+
+        if binsizesec is None:
+            LOGERROR('binsizesec is required for timebin tasks')
+            return 0
+        if outdir is not None:
+            kwargs['outdir'] = os.path.abspath(outdir)
+        arglist = [[x, binsizesec] for x in inputfiles]
+
+    else:
+
+        arglist = [[x] for x in inputfiles]
+
+    return queue.add_tasks(tasktype, arglist, kwargs=kwargs)
+
+
+
+# these are the modules that each task type needs. most of these are imported
+# lazily by the astrobase modules, so we import them explicitly to warm them up
+WORKER_IMPORTS = {
+    'periodfind':['astrobase.periodbase',
+                  'astrobase.periodbase.kbls',
+                  'scipy.signal'],
+    'varfeatures':['scipy.stats',
+                   'scipy.signal'],
+    'checkplot':['astrobase.checkplot',
+                 'matplotlib.pyplot',
+                 'astropy.wcs',
+                 'scipy.spatial',
+                 'PIL.Image'],
+    'cp-png':['astrobase.checkplot',
+              'matplotlib.pyplot',
+              'PIL.Image'],
+    'timebin':[],
+}
+
+
+def warm_worker_imports(tasktypes):
+    '''This imports everything needed to run the given task types.
+
+    Done once when a worker starts so the first task doesn't pay for the
+    imports and so missing dependencies show up before any tasks are claimed.
+
+    '''
+
+    from astrobase.lazyload import use_agg_backend
+
+    for tasktype in tasktypes:
+        for module in WORKER_IMPORTS.get(tasktype, []):
+            if module.startswith('matplotlib'):
+                use_agg_backend()
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                LOGEXCEPTION('could not import %s needed for %s tasks' %
+                             (module, tasktype))
+
+
+
+def run_worker(queue,
+               lcformat='hat-sql',
+               lcformatdir=None,
+               tasktypes=None,
+               maxtasks=None,
+               maxidle=60.0,
+               pollinterval=5.0,
+               workerid=None):
+    '''This runs a long-lived worker that processes tasks from a queue.
+
+    queue is a task queue object or a queue URL for get_task_queue.
+
+    lcformat is the LC format to preload and use for tasks that don't specify
+    their own lcformat kwarg. This can also be the path to a lcformat JSON file
+    for formats that aren't registered. lcformatdir is the directory to look
+    for the lcformat JSON in if it isn't the default one.
+
+    tasktypes is a list of the task types to warm up imports for. If None, all
+    of them are imported. Tasks of other types are still run if they show up.
+
+    The worker stops after maxtasks tasks if that's not None, or if there
+    haven't been any queued tasks for maxidle seconds (use maxidle=None to wait
+    forever). The queue is checked every pollinterval seconds while it's empty.
+
+    The worker also stops after its current task when it gets a SIGTERM or
+    SIGINT (e.g. when a container is being shut down).
+
+    Returns a dict with the workerid and the number of tasks that succeeded and
+    failed.
+
+    '''
+
+    if isinstance(queue, str):
+        queue = get_task_queue(queue)
+
+    if workerid is None:
+        workerid = '%s-%s' % (socket.gethostname(), os.getpid())
+
+    if tasktypes is None:
+        tasktypes = list(TASKFUNCS.keys())
+
+    # load the LC format and its functions before we start pulling tasks
+    lcformatinfo = preload_lcformat(lcformat, lcformatdir=lcformatdir)
+    if lcformatinfo is None:
+        LOGERROR("could not load LC format: %s, worker can't continue" %
+                 lcformat)
+        return None
+    lcformat = lcformatinfo['lcformat']
+
+    warm_worker_imports(tasktypes)
+
+    # stop cleanly on SIGTERM/SIGINT after the current task is done
+    stopflag = {'stop':False}
+
+    def _stop_handler(signum, frame):
+        LOGWARNING('worker %s got signal %s, '
+                   'will stop after the current task' % (workerid, signum))
+        stopflag['stop'] = True
+
+    oldhandlers = {}
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            oldhandlers[signum] = signal.signal(signum, _stop_handler)
+        except ValueError:
+            # not in the main thread, so we can't install handlers
+            pass
+
+    LOGINFO('worker %s started, LC format: %s' % (workerid, lcformat))
+
+    nsucceeded, nfailed = 0, 0
+    idlestart = time.time()
+
+    try:
+
+        while not stopflag['stop']:
+
+            if maxtasks is not None and (nsucceeded + nfailed) >= maxtasks:
+                LOGINFO('worker %s reached maxtasks = %s, stopping' %
+                        (workerid, maxtasks))
+                break
+
+            task = queue.get_task(workerid)
+
+            if task is None:
+
+                if (maxidle is not None and
+                    (time.time() - idlestart) > maxidle):
+                    LOGINFO('worker %s: no tasks in queue for %.1f sec, '
+                            'stopping' % (workerid, maxidle))
+                    break
+
+                time.sleep(pollinterval)
+                continue
+
+            taskid, tasktype = task['taskid'], task['tasktype']
+
+            if tasktype not in TASKFUNCS:
+
+                LOGERROR('task %s has unknown task type: %s' %
+                         (taskid, tasktype))
+                queue.fail_task(taskid, 'unknown task type: %s' % tasktype)
+                nfailed = nfailed + 1
+                idlestart = time.time()
+                continue
+
+            taskkwargs = task['kwargs']
+            if tasktype in LCFORMAT_TASKS and 'lcformat' not in taskkwargs:
+                taskkwargs['lcformat'] = lcformat
+
+            LOGINFO('worker %s: running %s task %s for %s' %
+                    (workerid, tasktype, taskid, task['args'][0]))
+
+            try:
+
+                result = TASKFUNCS[tasktype](*task['args'], **taskkwargs)
+
+                # all of the task functions return None if they failed
+                if result is None:
+                    queue.fail_task(taskid, '%s returned no result' % tasktype)
+                    nfailed = nfailed + 1
+                else:
+                    queue.finish_task(taskid, result)
+                    nsucceeded = nsucceeded + 1
+
+            except Exception as e:
+
+                LOGEXCEPTION('worker %s: %s task %s failed' %
+                             (workerid, tasktype, taskid))
+                queue.fail_task(taskid, format_exc())
+                nfailed = nfailed + 1
+
+            idlestart = time.time()
+
+    finally:
+
+        for signum, handler in oldhandlers.items():
+            signal.signal(signum, handler)
+
+    LOGINFO('worker %s done: %s tasks succeeded, %s failed' %
+            (workerid, nsucceeded, nfailed))
+
+    return {'workerid':workerid,
+            'nsucceeded':nsucceeded,
+            'nfailed':nfailed}
+
+
+
 #####################################
 ## SUPPORT FOR EXECUTION AS SCRIPT ##
 #####################################
@@ -2833,6 +3595,447 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
 
+    # options common to all commands that read light curves
+    lcparser = argparse.ArgumentParser(add_help=False)
+    lcparser.add_argument(
+        '--lcformat',
+        action='store',
+        type=str,
+        default='hat-sql',
+        help=("the LC format key to use [default: %(default)s]")
+    )
+    lcparser.add_argument(
+        '--lcformat-json',
+        action='store',
+        type=str,
+        default=None,
+        help=("path to a lcformat JSON for an unregistered LC format. "
+              "this overrides --lcformat")
+    )
+    lcparser.add_argument(
+        '--kwargs',
+        action='store',
+        type=str,
+        default=None,
+        help=("a JSON dict of any other kwargs to pass "
+              "to the function for this command")
+    )
+
+    # options common to all commands that use a task queue
+    qparser = argparse.ArgumentParser(add_help=False)
+    qparser.add_argument(
+        'queue',
+        action='store',
+        type=str,
+        help=("the task queue to use: either a path to a SQLite file, "
+              "or a queue URL like scheme://location "
+              "for a registered queue backend")
+    )
+
+    subparsers = aparser.add_subparsers(dest='command')
+
+    # register-lcformat
+    sp = subparsers.add_parser('register-lcformat',
+                               help='register a custom LC format')
+    for opt in ('formatkey','fileglob','timecols','magcols','errcols',
+                'readermodule','readerfunc'):
+        sp.add_argument('--%s' % opt, action='store', type=str, required=True)
+    for opt in ('readerkwargs','normmodule','normfunc','normkwargs',
+                'lcformatdir'):
+        sp.add_argument('--%s' % opt, action='store', type=str, default=None)
+    sp.add_argument('--magsarefluxes', action='store_true', default=False)
+
+    # make-lclist
+    sp = subparsers.add_parser('make-lclist', parents=[lcparser],
+                               help='make a light curve list pickle')
+    sp.add_argument('basedir', action='store', type=str)
+    sp.add_argument('outfile', action='store', type=str)
+    sp.add_argument('--fileglob', action='store', type=str, default=None)
+    sp.add_argument('--nworkers', action='store', type=int, default=4)
+
+    # the single LC commands
+    sp = subparsers.add_parser('varfeatures', parents=[lcparser],
+                               help='get variability features for LCs')
+    sp.add_argument('lcfiles', action='store', type=str, nargs='+')
+    sp.add_argument('--outdir', action='store', type=str, required=True)
+
+    sp = subparsers.add_parser('periodfind', parents=[lcparser],
+                               help='run period-finding for LCs')
+    sp.add_argument('lcfiles', action='store', type=str, nargs='+')
+    sp.add_argument('--outdir', action='store', type=str, required=True)
+    sp.add_argument('--pfcachedir', action='store', type=str, default=None,
+                    help=("directory to cache period-finder results in"))
+
+    sp = subparsers.add_parser('checkplot', parents=[lcparser],
+                               help='make checkplots from period-finding '
+                               'result pickles')
+    sp.add_argument('pfpickles', action='store', type=str, nargs='+')
+    sp.add_argument('--outdir', action='store', type=str, required=True)
+    sp.add_argument('--lcbasedir', action='store', type=str, required=True)
+
+    sp = subparsers.add_parser('cp-png',
+                               help='make PNGs from checkplot pickles')
+    sp.add_argument('cpfiles', action='store', type=str, nargs='+')
+
+    sp = subparsers.add_parser('timebin', parents=[lcparser],
+                               help='bin LCs in time')
+    sp.add_argument('lcfiles', action='store', type=str, nargs='+')
+    sp.add_argument('--binsizesec', action='store', type=float, required=True)
+    sp.add_argument('--outdir', action='store', type=str, default=None)
+
+    # the queue commands
+    sp = subparsers.add_parser('enqueue', parents=[qparser],
+                               help='add tasks to a task queue')
+    sp.add_argument('tasktype', action='store', type=str,
+                    choices=sorted(TASKFUNCS.keys()))
+    sp.add_argument('inputfiles', action='store', type=str, nargs='+',
+                    help=("the input files: LCs for periodfind, varfeatures, "
+                          "timebin; period-finding pickles for checkplot; "
+                          "checkplot pickles for cp-png"))
+    sp.add_argument('--outdir', action='store', type=str, default=None)
+    sp.add_argument('--lcbasedir', action='store', type=str, default=None)
+    sp.add_argument('--binsizesec', action='store', type=float, default=None)
+    sp.add_argument('--kwargs', action='store', type=str, default=None,
+                    help=("a JSON dict of any other kwargs "
+                          "to pass to the task function"))
+
+    sp = subparsers.add_parser('worker', parents=[qparser],
+                               help='run a worker that processes tasks '
+                               'from a task queue')
+    sp.add_argument('--lcformat', action='store', type=str, default='hat-sql',
+                    help=("the LC format to preload and use for tasks that "
+                          "don't specify one [default: %(default)s]"))
+    sp.add_argument('--lcformat-json', action='store', type=str, default=None,
+                    help=("path to a lcformat JSON for an unregistered "
+                          "LC format. this overrides --lcformat"))
+    sp.add_argument('--tasktypes', action='store', type=str, default=None,
+                    help=("comma-separated list of task types to warm up "
+                          "imports for [default: all]"))
+    sp.add_argument('--maxtasks', action='store', type=int, default=None,
+                    help=("stop after this many tasks [default: no limit]"))
+    sp.add_argument('--maxidle', action='store', type=float, default=60.0,
+                    help=("stop if the queue has been empty for this many "
+                          "seconds. use a negative value to wait forever "
+                          "[default: %(default)s]"))
+    sp.add_argument('--pollinterval', action='store', type=float, default=5.0,
+                    help=("seconds to wait between checks of an empty queue "
+                          "[default: %(default)s]"))
+    sp.add_argument('--maxattempts', action='store', type=int, default=3,
+                    help=("number of tries before a task is marked failed "
+                          "(SQLite queues only) [default: %(default)s]"))
+
+    sp = subparsers.add_parser('queue-status', parents=[qparser],
+                               help='show the status of a task queue')
+    sp.add_argument('--requeue-stale', action='store', type=float,
+                    default=None,
+                    help=("put tasks running longer than this many seconds "
+                          "back into the queue"))
+    sp.add_argument('--show-failed', action='store_true', default=False,
+                    help=("print the errors for all failed tasks"))
+
+    # the period-finder cache command
+    sp = subparsers.add_parser('pfcache',
+                               help='inspect and prune a period-finder '
+                               'result cache')
+    sp.add_argument('cachedir', action='store', type=str)
+    sp.add_argument('--prune', action='store_true', default=False,
+                    help=("remove cache entries using the options below"))
+    sp.add_argument('--keep-latest', action='store', type=int, default=None,
+                    help=("keep only this many of the most recently used "
+                          "entries for each object, magcol, and method"))
+    sp.add_argument('--max-age-days', action='store', type=float,
+                    default=None,
+                    help=("remove entries not used for this many days"))
+    sp.add_argument('--max-size-gb', action='store', type=float, default=None,
+                    help=("remove the least recently used entries until the "
+                          "cache is smaller than this"))
+    sp.add_argument('--dry-run', action='store_true', default=False,
+                    help=("only list the entries that would be removed"))
+
+    # the pipeline commands
+    sp = subparsers.add_parser('pipeline-create',
+                               help='set up a resumable pipeline run')
+    sp.add_argument('manifest', action='store', type=str)
+    sp.add_argument('lcfiles', action='store', type=str, nargs='+',
+                    help=("the LC files, or a single lclist pickle made by "
+                          "make-lclist"))
+    sp.add_argument('--outdir', action='store', type=str, required=True)
+    sp.add_argument('--lcformat', action='store', type=str, default='hat-sql',
+                    help=("the lcproc.LCFORM key of the LC format; custom "
+                          "formats must be registered with "
+                          "lcproc.register_custom_lcformat in Python "
+                          "[default: %(default)s]"))
+    sp.add_argument('--stages', action='store', type=str,
+                    default='varfeatures,periodfind,checkplot',
+                    help=("comma-separated list of stages to run "
+                          "[default: %(default)s]"))
+    sp.add_argument('--stagekwargs', action='store', type=str, default=None,
+                    help=("a JSON dict of kwargs for each stage, "
+                          "keyed by stage name"))
+    sp.add_argument('--maxattempts', action='store', type=int, default=3,
+                    help=("number of tries for each stage of each object "
+                          "[default: %(default)s]"))
+
+    sp = subparsers.add_parser('pipeline-run',
+                               help='run or resume a pipeline')
+    sp.add_argument('manifest', action='store', type=str)
+    sp.add_argument('--nworkers', action='store', type=int, default=4)
+    sp.add_argument('--maxtasks', action='store', type=int, default=None,
+                    help=("stop after starting this many stage tasks"))
+
+    sp = subparsers.add_parser('pipeline-status',
+                               help='show the status of a pipeline')
+    sp.add_argument('manifest', action='store', type=str)
+    sp.add_argument('--show-failed', action='store_true', default=False,
+                    help=("print the errors for all failed stages"))
+    sp.add_argument('--retry-failed', action='store_true', default=False,
+                    help=("retry the failed stages on the next run"))
+
+    args = aparser.parse_args()
+
+    if args.command is None:
+        aparser.print_help()
+        sys.exit(0)
+
+    # get the LC format for commands that need it
+    if getattr(args, 'lcformat_json', None):
+        lcformatinfo = preload_lcformat(args.lcformat_json)
+        if lcformatinfo is None:
+            sys.exit(1)
+        args.lcformat = lcformatinfo['lcformat']
+
+    if getattr(args, 'kwargs', None):
+        cmdkwargs = json.loads(args.kwargs)
+    else:
+        cmdkwargs = {}
+
+    ##############
+    ## DISPATCH ##
+    ##############
+
+    if args.command == 'register-lcformat':
+
+        formatfile = register_custom_lcformat(
+            args.formatkey,
+            args.fileglob,
+            json.loads(args.timecols),
+            json.loads(args.magcols),
+            json.loads(args.errcols),
+            args.readermodule,
+            args.readerfunc,
+            readerkwargs=(json.loads(args.readerkwargs)
+                          if args.readerkwargs else None),
+            normmodule=args.normmodule,
+            normfunc=args.normfunc,
+            normkwargs=(json.loads(args.normkwargs)
+                        if args.normkwargs else None),
+            magsarefluxes=args.magsarefluxes,
+            lcformatdir=args.lcformatdir
+        )
+        LOGINFO('registered LC format %s -> %s' % (args.formatkey,
+                                                    formatfile))
+
+    elif args.command == 'make-lclist':
+
+        make_lclist(args.basedir,
+                    args.outfile,
+                    lcformat=args.lcformat,
+                    fileglob=args.fileglob,
+                    nworkers=args.nworkers,
+                    **cmdkwargs)
+
+    elif args.command in ('varfeatures', 'periodfind'):
+
+        if getattr(args, 'pfcachedir', None):
+            cmdkwargs['pfcachedir'] = args.pfcachedir
+
+        for lcf in args.lcfiles:
+            result = TASKFUNCS[args.command](lcf,
+                                             args.outdir,
+                                             lcformat=args.lcformat,
+                                             **cmdkwargs)
+            LOGINFO('%s -> %s' % (lcf, result))
+
+    elif args.command == 'checkplot':
+
+        for pfpkl in args.pfpickles:
+            result = runcp(pfpkl,
+                           args.outdir,
+                           args.lcbasedir,
+                           lcformat=args.lcformat,
+                           **cmdkwargs)
+            LOGINFO('%s -> %s' % (pfpkl, result))
+
+    elif args.command == 'cp-png':
+
+        for cpf in args.cpfiles:
+            result = cp2png(cpf)
+            LOGINFO('%s -> %s' % (cpf, result))
+
+    elif args.command == 'timebin':
+
+        for lcf in args.lcfiles:
+            result = timebinlc(lcf,
+                               args.binsizesec,
+                               outdir=args.outdir,
+                               lcformat=args.lcformat,
+                               **cmdkwargs)
+            LOGINFO('%s -> %s' % (lcf, result))
+
+    elif args.command == 'enqueue':
+
+        ntasks = enqueue_tasks(args.queue,
+                               args.tasktype,
+                               args.inputfiles,
+                               outdir=args.outdir,
+                               lcbasedir=args.lcbasedir,
+                               binsizesec=args.binsizesec,
+                               taskkwargs=cmdkwargs)
+        LOGINFO('added %s %s tasks to queue: %s' % (ntasks,
+                                                    args.tasktype,
+                                                    args.queue))
+
+    elif args.command == 'worker':
+
+        if '://' in args.queue:
+            queue = get_task_queue(args.queue)
+        else:
+            queue = get_task_queue(args.queue, maxattempts=args.maxattempts)
+
+        if args.tasktypes:
+            tasktypes = [x.strip() for x in args.tasktypes.split(',')]
+        else:
+            tasktypes = None
+
+        workerinfo = run_worker(
+            queue,
+            lcformat=args.lcformat,
+            tasktypes=tasktypes,
+            maxtasks=args.maxtasks,
+            maxidle=args.maxidle if args.maxidle >= 0.0 else None,
+            pollinterval=args.pollinterval
+        )
+
+        if workerinfo is None:
+            sys.exit(1)
+
+    elif args.command == 'queue-status':
+
+        queue = get_task_queue(args.queue)
+
+        if args.requeue_stale is not None:
+            nrequeued = queue.requeue_stale(args.requeue_stale)
+            LOGINFO('requeued %s stale tasks' % nrequeued)
+
+        queuestatus = queue.get_status()
+
+        print('queued: %s, running: %s, done: %s, failed: %s' %
+              (queuestatus['queued'], queuestatus['running'],
+               queuestatus['done'], queuestatus['failed']))
+        for tasktype in sorted(queuestatus['tasktypes']):
+            print('  %s: %s' % (
+                tasktype,
+                ', '.join('%s: %s' % (k, v) for k, v in
+                          sorted(queuestatus['tasktypes'][tasktype].items()))
+            ))
+
+        if args.show_failed:
+            for task in queue.get_results(status='failed'):
+                print('\ntask %s (%s) %s failed after %s attempts:\n%s' %
+                      (task['taskid'], task['tasktype'], task['args'][0],
+                       task['attempts'], task['error']))
+
+    elif args.command == 'pfcache':
+
+        from astrobase.lcproc_pfcache import inspect_pfcache, prune_pfcache
+
+        if args.prune:
+
+            pruned = prune_pfcache(args.cachedir,
+                                   keeplatest=args.keep_latest,
+                                   maxage_days=args.max_age_days,
+                                   maxsize_gb=args.max_size_gb,
+                                   dryrun=args.dry_run)
+            if args.dry_run:
+                for cachef in pruned['removed']:
+                    print(cachef)
+
+        cacheinfo = inspect_pfcache(args.cachedir)
+
+        print('entries: %s, objects: %s, size: %.1f MB' %
+              (cacheinfo['nentries'], cacheinfo['nobjects'],
+               cacheinfo['nbytes']/1.0e6))
+        print('superseded entries: %s (%.1f MB)' %
+              (cacheinfo['nsuperseded'],
+               cacheinfo['superseded_nbytes']/1.0e6))
+        for pfm in sorted(cacheinfo['methods']):
+            print('  %s: %s entries (%.1f MB)' %
+                  (pfm, cacheinfo['methods'][pfm]['nentries'],
+                   cacheinfo['methods'][pfm]['nbytes']/1.0e6))
+
+    elif args.command == 'pipeline-create':
+
+        from astrobase.lcproc_pipeline import create_pipeline
+
+        if len(args.lcfiles) == 1 and args.lcfiles[0].endswith('.pkl'):
+            lclist = args.lcfiles[0]
+        else:
+            lclist = args.lcfiles
+
+        manifest = create_pipeline(
+            args.manifest,
+            lclist,
+            args.outdir,
+            stages=[x.strip() for x in args.stages.split(',')],
+            lcformat=args.lcformat,
+            stagekwargs=(json.loads(args.stagekwargs)
+                         if args.stagekwargs else None),
+            maxattempts=args.maxattempts
+        )
+
+        if manifest is None:
+            sys.exit(1)
+
+    elif args.command == 'pipeline-run':
+
+        from astrobase.lcproc_pipeline import run_pipeline
+
+        status = run_pipeline(args.manifest,
+                              nworkers=args.nworkers,
+                              maxtasks=args.maxtasks)
+        if status is None:
+            sys.exit(1)
+
+    elif args.command == 'pipeline-status':
+
+        from astrobase.lcproc_pipeline import PipelineManifest
+
+        manifest = PipelineManifest(args.manifest)
+        if manifest.config is None:
+            LOGERROR('pipeline manifest %s is not set up' % args.manifest)
+            sys.exit(1)
+
+        if args.retry_failed:
+            nretried = manifest.retry_failed()
+            LOGINFO('%s failed stage tasks will be retried' % nretried)
+
+        pipestatus = manifest.get_status()
+
+        print('objects: %s, complete: %s' % (pipestatus['nobjects'],
+                                             pipestatus['ncomplete']))
+        for stage in manifest.config['stages']:
+            print('  %s: %s' % (
+                stage,
+                ', '.join('%s: %s' % (k, v) for k, v in
+                          sorted(pipestatus['stages'][stage].items()))
+            ))
+
+        if args.show_failed:
+            for task in manifest.get_results(status='failed'):
+                print('\n%s stage for %s failed after %s attempts:\n%s' %
+                      (task['stage'], task['lcfile'],
+                       task['attempts'], task['error']))
+
 
 
 if __name__ == '__main__':
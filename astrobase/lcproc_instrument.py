@@ -0,0 +1,728 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lcproc_instrument.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This contains timing and resource instrumentation for the lcproc drivers. When
+it's turned on, the functions that process a single object (runpf, runcp,
+get_varfeatures, apply_tfa_magseries, etc.) record the following for each
+object they process:
+
+- wall and CPU time spent in each stage (LC reading, normalization, each
+  period-finder, plotting, writing the output pickle, etc.)
+- total wall and CPU time for the object; CPU time includes any child processes
+  that finished while processing it, e.g. the period-finder worker pools
+- the peak RSS of the process (and its finished children) so far; this is a
+  high-water mark for the whole process, so it includes any objects processed
+  before this one by the same worker
+- how much this object raised the process's peak RSS; this is zero unless the
+  object needed more memory than anything the process did before it
+- bytes read and written
+- other per-object counters, e.g. the number of LC points
+
+The parallel_* drivers record a single entry for the whole run with their total
+wall time, so the per-object times can be compared against it.
+
+Each process appends its records as JSON lines to its own file in a report
+directory, so this works across all of the worker processes used by the
+parallel drivers (including workers on other machines if the report directory
+is on a shared filesystem). make_run_report collects these into a run report
+with per-driver and per-stage totals and writes it out as JSON and CSV.
+
+A fraction of the objects can also be run under cProfile. Their profiles are
+written to the profiles subdirectory of the report directory, and can be read
+with the pstats module or tools like snakeviz.
+
+Usage:
+
+>>> from astrobase import lcproc, lcproc_instrument
+>>> lcproc_instrument.enable_instrumentation('/path/to/report-dir',
+...                                         profilefraction=0.01)
+>>> lcproc.parallel_pf(lclist, pfdir, ...)
+>>> lcproc_instrument.disable_instrumentation()
+>>> report = lcproc_instrument.make_run_report('/path/to/report-dir')
+
+The settings are also put into the ASTROBASE_LCPROC_INSTRUMENT environment
+variable so worker processes started with the 'spawn' method (or started
+separately with the variable set) pick them up when this module is imported.
+
+When instrumentation is off, the stage() context manager and instrumented()
+decorator used in lcproc do a single check of a module global and nothing else,
+so the overhead is negligible.
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+            )
+        )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import os.path
+import sys
+import time
+import json
+import glob
+import csv
+import socket
+import functools
+from hashlib import md5
+
+try:
+    import resource
+    HAVE_RESOURCE = True
+except ImportError:
+    HAVE_RESOURCE = False
+
+import numpy as np
+
+
+
+############
+## CONFIG ##
+############
+
+# the settings are passed to worker processes in this environment variable
+INSTRUMENT_ENVVAR = 'ASTROBASE_LCPROC_INSTRUMENT'
+
+# this is None when instrumentation is off. when it's on, it's a dict with the
+# report directory and the fraction of objects to profile.
+INSTRUMENT = None
+
+# this is the stack of records for the objects being processed in this process
+# right now. the drivers call each other (e.g. parallel_pf -> runpf when
+# running serially), so these can be nested.
+_RECORDS = []
+
+# this is the cProfile.Profile running for the current object if it's sampled,
+# and the PID of the process running it
+_PROFILER = [None, None]
+
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+_MAXRSS_TO_MB = (1.0/1048576.0 if sys.platform == 'darwin' else 1.0/1024.0)
+
+
+
+def enable_instrumentation(reportdir, profilefraction=0.0):
+    '''This turns on instrumentation for the lcproc drivers.
+
+    reportdir is the directory where the per-process record files and the run
+    report will be written. profilefraction is the fraction of objects to run
+    under cProfile; objects are picked deterministically using a hash of the
+    driver and object names, so the same objects are profiled on reruns.
+
+    '''
+
+    reportdir = os.path.abspath(reportdir)
+    if not os.path.exists(reportdir):
+        os.makedirs(reportdir)
+
+    settings = {'reportdir':reportdir,
+                'profilefraction':float(profilefraction)}
+
+    globals()['INSTRUMENT'] = settings
+    os.environ[INSTRUMENT_ENVVAR] = json.dumps(settings)
+
+    LOGINFO('lcproc instrumentation enabled, writing records to %s' %
+            reportdir)
+
+    return settings
+
+
+
+def disable_instrumentation():
+    '''
+    This turns off instrumentation for the lcproc drivers.
+
+    '''
+
+    globals()['INSTRUMENT'] = None
+    os.environ.pop(INSTRUMENT_ENVVAR, None)
+    del _RECORDS[:]
+
+
+
+# pick up the settings from the environment in worker processes
+if os.environ.get(INSTRUMENT_ENVVAR):
+    try:
+        INSTRUMENT = json.loads(os.environ[INSTRUMENT_ENVVAR])
+    except Exception as e:
+        INSTRUMENT = None
+
+
+
+##################################
+## RESOURCE USAGE AND PROFILING ##
+##################################
+
+def _cputime():
+    '''
+    This returns the CPU time used by this process and its finished children.
+
+    '''
+
+    if HAVE_RESOURCE:
+        selfusage = resource.getrusage(resource.RUSAGE_SELF)
+        childusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (selfusage.ru_utime + selfusage.ru_stime +
+                childusage.ru_utime + childusage.ru_stime)
+    else:
+        return time.process_time()
+
+
+
+def _peakrss_mb():
+    '''
+    This returns the peak RSS of this process and its children in MB.
+
+    These are high-water marks over the lifetime of the processes, not the RSS
+    used by the current object.
+
+    '''
+
+    if HAVE_RESOURCE:
+        return (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*_MAXRSS_TO_MB,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*_MAXRSS_TO_MB
+        )
+    else:
+        return None, None
+
+
+
+def _profile_this(driver, objectname):
+    '''
+    This decides if the object should be profiled.
+
+    '''
+
+    fraction = INSTRUMENT['profilefraction']
+
+    if fraction <= 0.0:
+        return False
+    elif fraction >= 1.0:
+        return True
+
+    objhash = md5(('%s-%s' % (driver, objectname)).encode()).hexdigest()
+    return int(objhash[:8], 16)/float(0xffffffff) < fraction
+
+
+
+def _safe_filename(objectname):
+    '''
+    This turns an object name into something usable in a filename.
+
+    '''
+
+    return ''.join(x if (x.isalnum() or x in '-_.') else '_'
+                   for x in objectname)[:100]
+
+
+
+#########################
+## RECORDING FUNCTIONS ##
+#########################
+
+class _NullContext(object):
+    '''
+    This is the context manager returned by stage() when there's nothing to
+    record.
+
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULLCONTEXT = _NullContext()
+
+
+
+class _StageTimer(object):
+    '''
+    This times a single stage and adds it to the current object's record.
+
+    '''
+
+    __slots__ = ('record', 'name', 'wallstart', 'cpustart')
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.wallstart = time.time()
+        self.cpustart = _cputime()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        stageinfo = self.record['stages'].setdefault(
+            self.name, {'wall':0.0, 'cpu':0.0, 'calls':0}
+        )
+        stageinfo['wall'] += time.time() - self.wallstart
+        stageinfo['cpu'] += _cputime() - self.cpustart
+        stageinfo['calls'] += 1
+
+        return False
+
+
+
+def stage(name):
+    '''This returns a context manager that times the stage called name.
+
+    The time is added to the record of the object currently being processed. If
+    instrumentation is off or no object is being processed, this does nothing.
+
+    '''
+
+    if INSTRUMENT is None or not _RECORDS:
+        return _NULLCONTEXT
+
+    return _StageTimer(_RECORDS[-1], name)
+
+
+
+def count(name, value=1):
+    '''
+    This adds value to the counter called name for the current object.
+
+    '''
+
+    if INSTRUMENT is None or not _RECORDS:
+        return
+
+    counters = _RECORDS[-1]['counters']
+    counters[name] = counters.get(name, 0) + value
+
+
+
+def file_read(path):
+    '''
+    This adds the size of the file at path to the bytes read by the current
+    object.
+
+    '''
+
+    if INSTRUMENT is None or not _RECORDS:
+        return
+
+    try:
+        _RECORDS[-1]['bytesread'] += os.path.getsize(path)
+    except Exception as e:
+        pass
+
+
+
+def file_written(path):
+    '''
+    This adds the size of the file at path to the bytes written by the current
+    object.
+
+    '''
+
+    if INSTRUMENT is None or not _RECORDS:
+        return
+
+    try:
+        _RECORDS[-1]['byteswritten'] += os.path.getsize(path)
+    except Exception as e:
+        pass
+
+
+
+def _object_name(args, kwargs, fallbackkwargs):
+    '''
+    This gets the name to use for the object from the function's arguments.
+
+    '''
+
+    objectarg = args[0] if args else None
+
+    if objectarg is None:
+        for key in fallbackkwargs:
+            if kwargs.get(key) is not None:
+                objectarg = kwargs[key]
+                break
+
+    if isinstance(objectarg, str):
+        return os.path.basename(objectarg)
+    elif isinstance(objectarg, (list, tuple)):
+        return '%s objects' % len(objectarg)
+    else:
+        return repr(objectarg)[:100]
+
+
+
+def _write_record(record):
+    '''
+    This appends a finished record to this process' record file.
+
+    '''
+
+    recordfile = os.path.join(
+        INSTRUMENT['reportdir'],
+        'records-%s-%s.jsonl' % (socket.gethostname(), os.getpid())
+    )
+
+    try:
+        with open(recordfile,'a') as outfd:
+            outfd.write(json.dumps(record) + '\n')
+    except Exception as e:
+        LOGEXCEPTION('could not write instrumentation record to %s' %
+                     recordfile)
+
+
+
+def instrumented(driver, fallbackkwargs=()):
+    '''This is a decorator that records the processing of an object by a driver.
+
+    The object name is taken from the first positional argument of the
+    function: the basename if it's a file path, or the number of objects if
+    it's a list. If the first argument is None, the first of the kwargs in
+    fallbackkwargs that's not None is used instead.
+
+    The object is counted as failed if the function returns None or raises an
+    exception.
+
+    '''
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if INSTRUMENT is None:
+                return func(*args, **kwargs)
+
+            # forked worker processes inherit the records and profiler of the
+            # parent's parallel driver, which are never finished in the worker
+            if _RECORDS and _RECORDS[0]['pid'] != os.getpid():
+                del _RECORDS[:]
+            if _PROFILER[1] != os.getpid():
+                _PROFILER[0], _PROFILER[1] = None, None
+
+            objectname = _object_name(args, kwargs, fallbackkwargs)
+
+            record = {'driver':driver,
+                      'object':objectname,
+                      'host':socket.gethostname(),
+                      'pid':os.getpid(),
+                      'start':time.time(),
+                      'stages':{},
+                      'counters':{},
+                      'bytesread':0,
+                      'byteswritten':0,
+                      'profile':None}
+
+            profiler = None
+            if _PROFILER[0] is None and _profile_this(driver, objectname):
+                import cProfile
+                profiler = cProfile.Profile()
+                _PROFILER[0], _PROFILER[1] = profiler, os.getpid()
+
+            _RECORDS.append(record)
+            cpustart = _cputime()
+            peakrssstart = _peakrss_mb()[0]
+            result = None
+
+            try:
+
+                if profiler is not None:
+                    profiler.enable()
+
+                result = func(*args, **kwargs)
+                return result
+
+            finally:
+
+                if profiler is not None:
+
+                    profiler.disable()
+                    _PROFILER[0], _PROFILER[1] = None, None
+
+                    profiledir = os.path.join(INSTRUMENT['reportdir'],
+                                              'profiles')
+                    profilefile = os.path.join(
+                        profiledir,
+                        '%s-%s-%s.prof' % (driver,
+                                           _safe_filename(objectname),
+                                           os.getpid())
+                    )
+                    try:
+                        if not os.path.exists(profiledir):
+                            os.makedirs(profiledir)
+                        profiler.dump_stats(profilefile)
+                        record['profile'] = profilefile
+                    except Exception as e:
+                        LOGEXCEPTION('could not write profile for %s' %
+                                     objectname)
+
+                if _RECORDS and _RECORDS[-1] is record:
+                    _RECORDS.pop()
+
+                record['end'] = time.time()
+                record['wall'] = record['end'] - record['start']
+                record['cpu'] = _cputime() - cpustart
+                record['procpeakrss_mb'], record['childpeakrss_mb'] = (
+                    _peakrss_mb()
+                )
+                record['peakrssgrowth_mb'] = (
+                    record['procpeakrss_mb'] - peakrssstart
+                    if peakrssstart is not None else None
+                )
+                record['failed'] = result is None
+
+                _write_record(record)
+
+        return wrapper
+
+    return decorator
+
+
+
+####################
+## THE RUN REPORT ##
+####################
+
+def read_run_records(reportdir):
+    '''
+    This reads all of the records in reportdir into a list of dicts.
+
+    '''
+
+    records = []
+
+    for recordfile in sorted(glob.glob(os.path.join(reportdir,
+                                                    'records-*.jsonl'))):
+
+        with open(recordfile,'r') as infd:
+            for line in infd:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except Exception as e:
+                    # a process may have been killed while writing a line
+                    LOGWARNING('skipping a bad record in %s' % recordfile)
+
+    return records
+
+
+
+def _summarize(values):
+    '''
+    This returns the total, mean, median, and max of a list of values.
+
+    '''
+
+    values = np.array(values, dtype=np.float64)
+
+    if values.size == 0:
+        return {'total':0.0, 'mean':None, 'median':None, 'max':None}
+
+    return {'total':float(values.sum()),
+            'mean':float(values.mean()),
+            'median':float(np.median(values)),
+            'max':float(values.max())}
+
+
+
+def make_run_report(reportdir, outjson=None, outcsv=None):
+    '''This collects the records in reportdir into a run report.
+
+    The report has a summary for each driver with:
+
+    - the number of objects processed and the number that failed
+    - the number of processes and hosts that processed them
+    - the elapsed time from the start of the first object to the end of the last
+    - the total, mean, median, and max wall and CPU times per object
+    - the total wall and CPU time for each stage, the number of times it ran,
+      and its fraction of the total wall time of all objects
+    - the peak RSS of any process, in MB, and the largest increase in a
+      process's peak RSS caused by a single object
+    - the total bytes read and written, and the totals of all counters
+    - the profiles written for sampled objects
+
+    The report is written to outjson (by default run-report.json in
+    reportdir). One row per object is written to outcsv (by default
+    run-report.csv in reportdir), with a wall time column for each stage.
+
+    Returns the report dict, or None if there aren't any records.
+
+    '''
+
+    records = read_run_records(reportdir)
+
+    if len(records) == 0:
+        LOGERROR('no instrumentation records found in %s' % reportdir)
+        return None
+
+    drivers = {}
+
+    for record in records:
+        drivers.setdefault(record['driver'], []).append(record)
+
+    report = {'reportdir':os.path.abspath(reportdir),
+              'nrecords':len(records),
+              'drivers':{}}
+
+    for driver, driverrecords in drivers.items():
+
+        stages = {}
+        counters = {}
+
+        for record in driverrecords:
+
+            for stagename, stageinfo in record['stages'].items():
+                stagetotal = stages.setdefault(
+                    stagename, {'wall':0.0, 'cpu':0.0, 'calls':0}
+                )
+                stagetotal['wall'] += stageinfo['wall']
+                stagetotal['cpu'] += stageinfo['cpu']
+                stagetotal['calls'] += stageinfo['calls']
+
+            for countername, countervalue in record['counters'].items():
+                counters[countername] = (counters.get(countername, 0) +
+                                         countervalue)
+
+        totalwall = sum(x['wall'] for x in driverrecords)
+        for stagetotal in stages.values():
+            stagetotal['wallfrac'] = (stagetotal['wall']/totalwall
+                                      if totalwall > 0.0 else None)
+
+        peakrss = [x['procpeakrss_mb'] for x in driverrecords
+                   if x.get('procpeakrss_mb') is not None]
+        peakrssgrowth = [x['peakrssgrowth_mb'] for x in driverrecords
+                         if x.get('peakrssgrowth_mb') is not None]
+
+        report['drivers'][driver] = {
+            'nobjects':len(driverrecords),
+            'nfailed':len([x for x in driverrecords if x['failed']]),
+            'nprocesses':len(set((x['host'], x['pid'])
+                                 for x in driverrecords)),
+            'hosts':sorted(set(x['host'] for x in driverrecords)),
+            'elapsed':(max(x['end'] for x in driverrecords) -
+                       min(x['start'] for x in driverrecords)),
+            'wall':_summarize([x['wall'] for x in driverrecords]),
+            'cpu':_summarize([x['cpu'] for x in driverrecords]),
+            'stages':stages,
+            'procpeakrss_mb':max(peakrss) if peakrss else None,
+            'peakrssgrowth_mb':max(peakrssgrowth) if peakrssgrowth else None,
+            'bytesread':sum(x['bytesread'] for x in driverrecords),
+            'byteswritten':sum(x['byteswritten'] for x in driverrecords),
+            'counters':counters,
+            'profiles':sorted(x['profile'] for x in driverrecords
+                              if x['profile']),
+        }
+
+    if outjson is None:
+        outjson = os.path.join(reportdir, 'run-report.json')
+    if outcsv is None:
+        outcsv = os.path.join(reportdir, 'run-report.csv')
+
+    with open(outjson,'w') as outfd:
+        json.dump(report, outfd, indent=2, sort_keys=True)
+
+    stagenames = sorted(set(y for x in records for y in x['stages']))
+    counternames = sorted(set(y for x in records for y in x['counters']))
+
+    with open(outcsv,'w') as outfd:
+
+        writer = csv.writer(outfd)
+        writer.writerow(
+            ['driver','object','host','pid','start','wall','cpu',
+             'procpeakrss_mb','peakrssgrowth_mb',
+             'bytesread','byteswritten','failed'] +
+            ['stage_%s_wall' % x for x in stagenames] +
+            ['count_%s' % x for x in counternames]
+        )
+
+        for record in sorted(records, key=lambda x: x['start']):
+            writer.writerow(
+                [record['driver'], record['object'], record['host'],
+                 record['pid'], '%.3f' % record['start'],
+                 '%.4f' % record['wall'], '%.4f' % record['cpu'],
+                 record['procpeakrss_mb'], record['peakrssgrowth_mb'],
+                 record['bytesread'],
+                 record['byteswritten'], record['failed']] +
+                ['%.4f' % record['stages'][x]['wall']
+                 if x in record['stages'] else ''
+                 for x in stagenames] +
+                [record['counters'].get(x, '') for x in counternames]
+            )
+
+    report['outjson'] = outjson
+    report['outcsv'] = outcsv
+
+    LOGINFO('wrote run report for %s objects to %s and %s' %
+            (len(records), outjson, outcsv))
+
+    return report
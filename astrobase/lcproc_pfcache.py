@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lcproc_pfcache.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This is a content-addressed cache for period-finder results, used by
+lcproc.runpf and lcproc_batch.runpf when they're called with a pfcachedir.
+
+Each period-finder result is stored separately for each (object, magcol,
+period-finder method) combination. The cache key is a hash of:
+
+- the times, mags, and errs arrays actually passed to the period-finder (after
+  any normalization)
+- the name of the period-finder method
+- the kwargs passed to it, except ones that don't change the result (nworkers,
+  verbose, workchunksize)
+- the astrobase version
+
+so rerunning period-finding on a set of LCs only recomputes the results for the
+method/magcol combinations where the LC, the method, or its kwargs changed.
+
+The cache is laid out on disk like so:
+
+<cachedir>/<objectid>/<magcol>/<method>-<cachekey>.pkl
+
+and doesn't need any locking, so it can be shared between processes and
+machines. Cache entries are written to a temporary file first and renamed into
+place. Reading an entry updates its modification time, which is used as the last
+access time when pruning the cache.
+
+Use inspect_pfcache and prune_pfcache to look at and clean up the cache, or use
+the lcpbatch CLI:
+
+lcpbatch pfcache /path/to/cachedir
+lcpbatch pfcache /path/to/cachedir --prune --keep-latest 1 --max-age-days 90
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+            )
+        )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import os.path
+import glob
+import time
+import hashlib
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+
+from astrobase import __version__
+
+
+
+############
+## CONFIG ##
+############
+
+# these kwargs don't change the period-finder results, so they're left out of
+# the cache key
+IGNORED_PFKWARGS = ('nworkers', 'verbose', 'workchunksize')
+
+
+
+##################
+## CACHE ACCESS ##
+##################
+
+def _safe_path_component(name):
+    '''
+    This turns an objectid or magcol into something usable as a directory name.
+
+    '''
+
+    safename = ''.join(x if (x.isalnum() or x in '-_.+') else '_'
+                       for x in str(name))
+    # don't make hidden or empty directory names
+    if safename == '' or safename.startswith('.'):
+        safename = '_%s' % safename
+    return safename
+
+
+
+def _kwarg_repr(value):
+    '''
+    This returns a stable representation of a kwarg value for the cache key.
+
+    '''
+
+    if isinstance(value, np.ndarray):
+        return 'ndarray-%s-%s-%s' % (
+            value.dtype.str, value.shape,
+            hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        )
+    elif isinstance(value, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, _kwarg_repr(value[k]))
+                                  for k in sorted(value))
+    elif isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_kwarg_repr(x) for x in value)
+    elif callable(value):
+        return '%s.%s' % (getattr(value, '__module__', None),
+                          getattr(value, '__name__', repr(value)))
+    else:
+        return repr(value)
+
+
+
+def get_pfcache_key(times, mags, errs, pfmethod, pfkwargs):
+    '''This returns the cache key for a period-finder run.
+
+    times, mags, errs are the arrays passed to the period-finder, pfmethod is
+    its name in lcproc.PFMETHODS, and pfkwargs are the kwargs passed to it.
+
+    '''
+
+    keyhash = hashlib.sha256()
+
+    for arr in (times, mags, errs):
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        keyhash.update(('%s;' % arr.size).encode())
+        keyhash.update(arr.tobytes())
+
+    kwargsrepr = ', '.join(
+        '%s=%s' % (k, _kwarg_repr(pfkwargs[k]))
+        for k in sorted(pfkwargs) if k not in IGNORED_PFKWARGS
+    )
+    keyhash.update(('%s;%s;%s' % (pfmethod, kwargsrepr, __version__)).encode())
+
+    return keyhash.hexdigest()
+
+
+
+def _pfcache_path(cachedir, objectid, magcol, pfmethod, cachekey):
+    '''
+    This returns the path to a cache entry.
+
+    '''
+
+    return os.path.join(os.path.abspath(os.path.expanduser(cachedir)),
+                        _safe_path_component(objectid),
+                        _safe_path_component(magcol),
+                        '%s-%s.pkl' % (_safe_path_component(pfmethod),
+                                       cachekey[:32]))
+
+
+
+def get_cached_pfresult(cachedir, objectid, magcol, pfmethod, cachekey):
+    '''This returns a cached period-finder result.
+
+    Returns None if there's no entry in cachedir for this objectid, magcol,
+    pfmethod, and cachekey, or if it can't be read.
+
+    '''
+
+    cachepath = _pfcache_path(cachedir, objectid, magcol, pfmethod, cachekey)
+
+    if not os.path.exists(cachepath):
+        return None
+
+    try:
+
+        with open(cachepath,'rb') as infd:
+            cacheentry = pickle.load(infd)
+
+        # make sure this isn't a collision of the shortened key
+        if cacheentry['cachekey'] != cachekey:
+            return None
+
+        # this marks the entry as recently used for prune_pfcache
+        os.utime(cachepath, None)
+
+        return cacheentry['result']
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not read period-finder cache entry: %s, '
+                     'will recompute' % cachepath)
+        return None
+
+
+
+def cache_pfresult(cachedir, objectid, magcol, pfmethod, cachekey, pfresult):
+    '''This adds a period-finder result to the cache.
+
+    Returns the path to the cache entry, or None if it couldn't be written.
+
+    '''
+
+    cachepath = _pfcache_path(cachedir, objectid, magcol, pfmethod, cachekey)
+    tempfile = '%s.tmp-%s' % (cachepath, os.getpid())
+
+    try:
+
+        if not os.path.exists(os.path.dirname(cachepath)):
+            try:
+                os.makedirs(os.path.dirname(cachepath))
+            except OSError:
+                # another process may have made it already
+                pass
+
+        with open(tempfile,'wb') as outfd:
+            pickle.dump({'cachekey':cachekey,
+                         'objectid':objectid,
+                         'magcol':magcol,
+                         'pfmethod':pfmethod,
+                         'astrobase':__version__,
+                         'created':time.time(),
+                         'result':pfresult},
+                        outfd, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.rename(tempfile, cachepath)
+        return cachepath
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not write period-finder cache entry: %s' %
+                     cachepath)
+        if os.path.exists(tempfile):
+            os.remove(tempfile)
+        return None
+
+
+
+###############################
+## INSPECTING AND PRUNING IT ##
+###############################
+
+def _list_pfcache_entries(cachedir):
+    '''
+    This lists all of the cache entries with their size and last access time.
+
+    '''
+
+    cachedir = os.path.abspath(os.path.expanduser(cachedir))
+    entries = []
+
+    for cachepath in glob.glob(os.path.join(cachedir, '*', '*', '*.pkl')):
+
+        try:
+            filestat = os.stat(cachepath)
+        except OSError:
+            # removed by another process
+            continue
+
+        objectdir, magcoldir = os.path.split(os.path.dirname(cachepath))
+        pfmethod = os.path.basename(cachepath).rsplit('-', 1)[0]
+
+        entries.append({'path':cachepath,
+                        'objectid':os.path.basename(objectdir),
+                        'magcol':magcoldir,
+                        'pfmethod':pfmethod,
+                        'nbytes':filestat.st_size,
+                        'accessed':filestat.st_mtime})
+
+    return entries
+
+
+
+def _superseded_entries(entries, keeplatest):
+    '''
+    This returns the entries that aren't among the keeplatest most recently
+    used ones for their (objectid, magcol, pfmethod).
+
+    '''
+
+    groups = {}
+    for entry in entries:
+        groups.setdefault(
+            (entry['objectid'], entry['magcol'], entry['pfmethod']), []
+        ).append(entry)
+
+    superseded = []
+    for group in groups.values():
+        group.sort(key=lambda x: x['accessed'], reverse=True)
+        superseded.extend(group[keeplatest:])
+
+    return superseded
+
+
+
+def inspect_pfcache(cachedir):
+    '''This summarizes the contents of a period-finder cache.
+
+    Returns a dict with the number of entries, objects, and bytes in the cache,
+    the oldest and newest access times, a breakdown by period-finder method,
+    and the number of entries (and bytes) that have been superseded by a more
+    recently used entry for the same objectid, magcol, and method. These are
+    usually results for older versions of an LC or different pfkwargs.
+
+    '''
+
+    entries = _list_pfcache_entries(cachedir)
+
+    methods = {}
+    for entry in entries:
+        methodinfo = methods.setdefault(entry['pfmethod'],
+                                        {'nentries':0, 'nbytes':0})
+        methodinfo['nentries'] += 1
+        methodinfo['nbytes'] += entry['nbytes']
+
+    superseded = _superseded_entries(entries, 1)
+    accesstimes = [x['accessed'] for x in entries]
+
+    return {
+        'cachedir':os.path.abspath(os.path.expanduser(cachedir)),
+        'nentries':len(entries),
+        'nobjects':len(set(x['objectid'] for x in entries)),
+        'nbytes':sum(x['nbytes'] for x in entries),
+        'oldest_access':min(accesstimes) if accesstimes else None,
+        'newest_access':max(accesstimes) if accesstimes else None,
+        'methods':methods,
+        'nsuperseded':len(superseded),
+        'superseded_nbytes':sum(x['nbytes'] for x in superseded),
+    }
+
+
+
+def prune_pfcache(cachedir,
+                  keeplatest=None,
+                  maxage_days=None,
+                  maxsize_gb=None,
+                  dryrun=False):
+    '''This removes entries from a period-finder cache.
+
+    keeplatest: if not None, keep only this many of the most recently used
+    entries for each (objectid, magcol, method) and remove the rest.
+
+    maxage_days: if not None, remove entries that haven't been used for this
+    many days.
+
+    maxsize_gb: if not None, remove the least recently used entries until the
+    cache is smaller than this many GB.
+
+    The criteria are applied in this order. If dryrun is True, nothing is
+    removed.
+
+    Returns a dict with the number of entries and bytes removed and the list of
+    removed paths.
+
+    '''
+
+    entries = _list_pfcache_entries(cachedir)
+    toremove = {}
+
+    if keeplatest is not None:
+        for entry in _superseded_entries(entries, keeplatest):
+            toremove[entry['path']] = entry
+
+    if maxage_days is not None:
+        oldest = time.time() - maxage_days*86400.0
+        for entry in entries:
+            if entry['accessed'] < oldest:
+                toremove[entry['path']] = entry
+
+    if maxsize_gb is not None:
+
+        remaining = sorted((x for x in entries if x['path'] not in toremove),
+                           key=lambda x: x['accessed'])
+        cachesize = sum(x['nbytes'] for x in remaining)
+        maxbytes = maxsize_gb*1.0e9
+
+        for entry in remaining:
+            if cachesize <= maxbytes:
+                break
+            toremove[entry['path']] = entry
+            cachesize -= entry['nbytes']
+
+    if not dryrun:
+
+        for cachepath in toremove:
+            try:
+                os.remove(cachepath)
+            except OSError:
+                pass
+
+        # clean up any empty directories
+        for entry in toremove.values():
+            magcoldir = os.path.dirname(entry['path'])
+            for emptydir in (magcoldir, os.path.dirname(magcoldir)):
+                try:
+                    os.rmdir(emptydir)
+                except OSError:
+                    break
+
+    LOGINFO('%s %s entries (%.1f MB) from period-finder cache %s' %
+            ('would remove' if dryrun else 'removed',
+             len(toremove),
+             sum(x['nbytes'] for x in toremove.values())/1.0e6,
+             cachedir))
+
+    return {'nremoved':len(toremove),
+            'nbytes':sum(x['nbytes'] for x in toremove.values()),
+            'removed':sorted(toremove),
+            'dryrun':dryrun}
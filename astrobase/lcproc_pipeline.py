@@ -0,0 +1,1351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lcproc_pipeline.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This contains a resumable pipeline runner for the lcproc per-object functions.
+A pipeline is a list of stages (EPD, TFA, varfeatures, period-finding,
+checkplots, or any registered custom stage) to run for every light curve in a
+list. The status, inputs, outputs, and errors for each object and stage are kept
+in a SQLite manifest, so a run that was interrupted (e.g. when the node running
+it died) can be restarted from the manifest alone and will pick up exactly where
+it stopped:
+
+- stages that finished aren't run again, unless their output files have since
+  gone missing
+- stages that were running when the run stopped are run again
+- failed stages are retried up to maxattempts times. Stages that fail for good
+  cause the stages that depend on them to be skipped for that object.
+
+The stages run as a streaming DAG: each object moves on to its next stage as
+soon as the stages it depends on are done, instead of waiting for every other
+object to finish the current stage. By default each stage depends on the one
+before it in the list.
+
+Usage:
+
+>>> from astrobase import lcproc_pipeline
+>>> lcproc_pipeline.create_pipeline(
+...     'run.sqlite', lclist, '/path/to/outdir',
+...     stages=['varfeatures','periodfind','checkplot'],
+...     lcformat='hat-sql',
+...     stagekwargs={'periodfind':{'pfmethods':['gls','bls'],
+...                                'pfkwargs':[{}, {}]}}
+... )
+>>> lcproc_pipeline.run_pipeline('run.sqlite', nworkers=16)
+
+and after an interruption, just run the last line again. The same thing from
+the command line:
+
+$ lcpbatch pipeline-run run.sqlite --nworkers 16
+$ lcpbatch pipeline-status run.sqlite --show-failed
+
+The EPD and TFA stages write a pickle next to each LC with its detrended mags
+for each magcol. The stages that depend on them work on these instead of the
+original LC: TFA is applied to the EPD mags, and the varfeatures, periodfind,
+and checkplot stages use the TFA mags (or the EPD mags if there's no tfa
+stage). So the full chain is:
+
+>>> lcproc_pipeline.create_pipeline(
+...     'run.sqlite', lclist, '/path/to/outdir',
+...     stages=['epd','tfa','varfeatures','periodfind','checkplot'],
+...     lcformat='hat-sql',
+...     stagekwargs={'tfa':{'templateinfo':'/path/to/tfa-templates.pkl'}}
+... )
+
+The TFA stage needs the templateinfo pickle made by lcproc.tfa_templates_lclist
+for the whole collection in its stage kwargs, since the templates depend on all
+of the objects. checkplot.finalize_checkplot isn't implemented yet, so there's
+no finalize stage; one can be added with register_pipeline_stage when it is.
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+            )
+        )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import os.path
+import time
+import json
+import pickle
+import socket
+import signal
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from astrobase import lcproc
+from astrobase.lcproc_sched import get_lclist_costs
+
+
+
+#####################
+## PIPELINE STAGES ##
+#####################
+
+def _get_lcformat_columns(lcformat, timecols, magcols, errcols):
+    '''
+    This fills in the default columns for lcformat.
+
+    '''
+
+    (fileglob, readerfunc, dtimecols, dmagcols,
+     derrcols, magsarefluxes, normfunc) = lcproc.LCFORM[lcformat]
+
+    return (timecols if timecols is not None else dtimecols,
+            magcols if magcols is not None else dmagcols,
+            errcols if errcols is not None else derrcols)
+
+
+
+def _detrended_lcformat(stage, lcformat):
+    '''This registers the lcformat for the EPD or TFA LC pickles of lcformat LCs.
+
+    These pickles are made by epd_stage and tfa_stage. Returns the lcformat key.
+
+    '''
+
+    formatkey = 'pipeline-%s-%s' % (stage, lcformat)
+
+    if formatkey not in lcproc.LCFORM:
+
+        (fileglob, readerfunc, dtimecols, dmagcols,
+         derrcols, magsarefluxes, normfunc) = lcproc.LCFORM[lcformat]
+
+        lcproc.LCFORM[formatkey] = [
+            '*-pipeline-%s-pklc.pkl' % stage,
+            lcproc.read_pklc,
+            [_detrended_column(stage, x, 'times') for x in dmagcols],
+            [_detrended_column(stage, x, 'mags') for x in dmagcols],
+            [_detrended_column(stage, x, 'errs') for x in dmagcols],
+            magsarefluxes,
+            None,
+        ]
+
+    return formatkey
+
+
+
+def _detrended_column(stage, magcol, col):
+    '''This returns the column key for a detrended magcol in the LC pickles.
+
+    The dots in composite magcols are replaced so these are single keys.
+
+    '''
+
+    return '%s.%s.%s' % (stage, magcol.replace('.','-'), col)
+
+
+
+def _collect_detrended_lcs(stage, lcfiles, lcformat, magcols):
+    '''This collects the EPD or TFA LC pickles for each magcol into one pickle.
+
+    lcfiles are the pickles written by apply_epd_magseries or
+    apply_tfa_magseries, one per magcol. They're removed once their detrended
+    times, mags, and errs are copied to lcdict[stage][magcol] of the combined
+    pickle, which is written next to them.
+
+    Returns the outputs of the stage: a dict with the path to the combined
+    pickle, its lcformat, and its columns for each magcol.
+
+    '''
+
+    if len(lcfiles) == 0:
+        LOGERROR('no magcols to run the %s stage for' % stage)
+        return None
+
+    lcdict = None
+    detrended = {}
+
+    for lcf, magcol in zip(lcfiles, magcols):
+
+        thislcdict = lcproc.read_pklc(lcf)
+        detrended[magcol.replace('.','-')] = {
+            x:thislcdict[stage][x] for x in ('times','mags','errs')
+        }
+
+        if lcdict is None:
+            lcdict = thislcdict
+
+    lcdict[stage] = detrended
+
+    outfile = os.path.join(
+        os.path.dirname(lcfiles[0]),
+        '%s-pipeline-%s-pklc.pkl' % (lcdict['objectid'], stage)
+    )
+    with open(outfile,'wb') as outfd:
+        pickle.dump(lcdict, outfd, protocol=pickle.HIGHEST_PROTOCOL)
+
+    for lcf in lcfiles:
+        if os.path.abspath(lcf) != os.path.abspath(outfile):
+            os.remove(lcf)
+
+    return {'lcfile':os.path.abspath(outfile),
+            'lcformat':_detrended_lcformat(stage, lcformat),
+            'baselcformat':lcformat,
+            'basemagcols':list(magcols),
+            'timecols':[_detrended_column(stage, x, 'times') for x in magcols],
+            'magcols':[_detrended_column(stage, x, 'mags') for x in magcols],
+            'errcols':[_detrended_column(stage, x, 'errs') for x in magcols]}
+
+
+
+def _stage_lcinput(lcfile, upstream, lcformat, timecols, magcols, errcols):
+    '''This picks the LC and columns a stage works on.
+
+    If the stage depends on the tfa or epd stages, it works on their detrended
+    LC pickle (TFA if both ran). magcols, if given, picks which of the original
+    magcols to use from it. Otherwise, the stage works on lcfile as usual.
+
+    Returns (lcfile, lcformat, timecols, magcols, errcols).
+
+    '''
+
+    for stage in ('tfa','epd'):
+
+        detrended = upstream.get(stage)
+
+        if isinstance(detrended, dict) and 'lcfile' in detrended:
+
+            # make sure the detrended lcformat is known in this process
+            _detrended_lcformat(stage, detrended['baselcformat'])
+
+            inds = [ind for ind, x in enumerate(detrended['basemagcols'])
+                    if magcols is None or x in magcols]
+
+            return (detrended['lcfile'],
+                    detrended['lcformat'],
+                    [detrended['timecols'][x] for x in inds],
+                    [detrended['magcols'][x] for x in inds],
+                    [detrended['errcols'][x] for x in inds])
+
+    return lcfile, lcformat, timecols, magcols, errcols
+
+
+
+def epd_stage(lcfile,
+              upstream,
+              lcformat='hat-sql',
+              timecols=None,
+              magcols=None,
+              errcols=None,
+              externalparams=None,
+              **kwargs):
+    '''This runs lcproc.apply_epd_magseries for each magcol of lcfile.
+
+    The EPD LCs are collected into a single pickle next to lcfile, which the
+    later stages work on instead of lcfile (see _collect_detrended_lcs).
+
+    '''
+
+    if lcformat not in lcproc.LCFORM:
+        LOGERROR('unknown light curve format specified: %s' % lcformat)
+        return None
+
+    timecols, magcols, errcols = _get_lcformat_columns(lcformat,
+                                                       timecols,
+                                                       magcols,
+                                                       errcols)
+    outfiles = []
+
+    for t, m, e in zip(timecols, magcols, errcols):
+
+        outfile = lcproc.apply_epd_magseries(lcfile, t, m, e,
+                                             externalparams,
+                                             lcformat=lcformat,
+                                             **kwargs)
+        if outfile is None:
+            return None
+        outfiles.append(outfile)
+
+    return _collect_detrended_lcs('epd', outfiles, lcformat, magcols)
+
+
+
+def tfa_stage(lcfile,
+              upstream,
+              templateinfo=None,
+              lcformat='hat-sql',
+              timecols=None,
+              magcols=None,
+              errcols=None,
+              **kwargs):
+    '''This runs lcproc.apply_tfa_magseries for each magcol of lcfile.
+
+    templateinfo is the path to the pickle made by lcproc.tfa_templates_lclist.
+    The columns default to the ones used for the templates.
+
+    If the epd stage ran before this one, TFA is applied to its EPD mags, using
+    the templates for the original magcols. These should then be made from LCs
+    detrended the same way. The TFA LCs are collected into a single pickle next
+    to lcfile, which the later stages work on instead of lcfile.
+
+    '''
+
+    if templateinfo is None:
+        LOGERROR('the tfa stage needs a templateinfo pickle '
+                 'made by lcproc.tfa_templates_lclist')
+        return None
+
+    with open(templateinfo,'rb') as infd:
+        templateinfo = pickle.load(infd)
+
+    magcols = magcols if magcols is not None else templateinfo['magcols']
+    basecols = list(zip(
+        timecols if timecols is not None else templateinfo['timecols'],
+        magcols,
+        errcols if errcols is not None else templateinfo['errcols']
+    ))
+
+    inlcfile, inlcformat, timecols, inmagcols, errcols = _stage_lcinput(
+        lcfile, upstream, lcformat, None, magcols, None
+    )
+
+    if inlcfile == lcfile:
+        timecols, inmagcols, errcols = [list(x) for x in zip(*basecols)]
+    else:
+        # the templates are for the original magcols
+        templateinfo = dict(templateinfo)
+        for magcol, inmagcol in zip(magcols, inmagcols):
+            templateinfo[inmagcol] = templateinfo[magcol]
+
+    outfiles = []
+
+    for t, m, e in zip(timecols, inmagcols, errcols):
+
+        outfile = lcproc.apply_tfa_magseries(inlcfile, t, m, e,
+                                             templateinfo,
+                                             lcformat=inlcformat,
+                                             **kwargs)
+        if outfile is None:
+            return None
+        outfiles.append(outfile)
+
+    return _collect_detrended_lcs('tfa', outfiles, lcformat, magcols)
+
+
+
+def varfeatures_stage(lcfile,
+                      upstream,
+                      outdir=None,
+                      lcformat='hat-sql',
+                      timecols=None,
+                      magcols=None,
+                      errcols=None,
+                      **kwargs):
+    '''
+    This runs lcproc.get_varfeatures for lcfile or its EPD/TFA LC.
+
+    '''
+
+    lcfile, lcformat, timecols, magcols, errcols = _stage_lcinput(
+        lcfile, upstream, lcformat, timecols, magcols, errcols
+    )
+
+    return lcproc.get_varfeatures(lcfile, outdir,
+                                  timecols=timecols,
+                                  magcols=magcols,
+                                  errcols=errcols,
+                                  lcformat=lcformat,
+                                  **kwargs)
+
+
+
+def periodfind_stage(lcfile,
+                     upstream,
+                     outdir=None,
+                     nworkers=1,
+                     lcformat='hat-sql',
+                     timecols=None,
+                     magcols=None,
+                     errcols=None,
+                     **kwargs):
+    '''This runs lcproc.runpf for lcfile or its EPD/TFA LC.
+
+    Each object runs its period-finders with nworkers processes. This defaults
+    to 1 because the pipeline already runs one object per worker.
+
+    '''
+
+    lcfile, lcformat, timecols, magcols, errcols = _stage_lcinput(
+        lcfile, upstream, lcformat, timecols, magcols, errcols
+    )
+
+    return lcproc.runpf(lcfile, outdir,
+                        timecols=timecols,
+                        magcols=magcols,
+                        errcols=errcols,
+                        lcformat=lcformat,
+                        nworkers=nworkers,
+                        **kwargs)
+
+
+
+def checkplot_stage(lcfile,
+                    upstream,
+                    outdir=None,
+                    lcformat='hat-sql',
+                    timecols=None,
+                    magcols=None,
+                    errcols=None,
+                    **kwargs):
+    '''
+    This runs lcproc.runcp for the period-finding result of lcfile.
+
+    '''
+
+    lcfile, lcformat, timecols, magcols, errcols = _stage_lcinput(
+        lcfile, upstream, lcformat, timecols, magcols, errcols
+    )
+
+    return lcproc.runcp(upstream['periodfind'],
+                        outdir,
+                        os.path.dirname(lcfile),
+                        lcfname=lcfile,
+                        lcformat=lcformat,
+                        timecols=timecols,
+                        magcols=magcols,
+                        errcols=errcols,
+                        **kwargs)
+
+
+
+# each stage has the function to run, the stages whose outputs it needs, and
+# whether it gets its own output directory
+PIPELINE_STAGES = {
+    'epd':{'func':epd_stage,
+           'needs':(),
+           'outdir':False},
+    'tfa':{'func':tfa_stage,
+           'needs':(),
+           'outdir':False},
+    'varfeatures':{'func':varfeatures_stage,
+                   'needs':(),
+                   'outdir':True},
+    'periodfind':{'func':periodfind_stage,
+                  'needs':(),
+                  'outdir':True},
+    'checkplot':{'func':checkplot_stage,
+                 'needs':('periodfind',),
+                 'outdir':True},
+}
+
+
+
+def register_pipeline_stage(stagename, stagefunc, needs=(), outdir=False):
+    '''This registers a custom pipeline stage.
+
+    stagefunc must have the signature:
+
+    stagefunc(lcfile, upstream, lcformat=..., **stagekwargs)
+
+    where upstream is a dict of the outputs of the stages this one depends on
+    (directly or not) that are done for this object, keyed by stage name. It
+    must return its outputs as something that can be serialized to JSON
+    (usually the output file path or a list of them), or None if it failed. The
+    outputs are passed on to later stages and any absolute file paths in them
+    are checked for when a run is resumed.
+
+    needs is a list of stages that must be in any pipeline using this one. If
+    outdir is True, the stage gets an outdir kwarg for its own subdirectory of
+    the pipeline's output directory.
+
+    Stages must be registered before the pipeline is run, in every process that
+    runs it.
+
+    '''
+
+    PIPELINE_STAGES[stagename] = {'func':stagefunc,
+                                  'needs':tuple(needs),
+                                  'outdir':outdir}
+
+
+
+def _pipeline_worker(task):
+    '''
+    This runs a single stage for a single object in a worker process.
+
+    '''
+
+    try:
+
+        stagefunc = PIPELINE_STAGES[task['stage']]['func']
+        outputs = stagefunc(task['lcfile'], task['upstream'], **task['kwargs'])
+
+        if outputs is None:
+            return None, '%s stage returned no result' % task['stage']
+
+        # make sure the manifest can store it
+        json.dumps(outputs)
+        return outputs, None
+
+    except Exception as e:
+
+        LOGEXCEPTION('%s stage failed for %s' % (task['stage'],
+                                                 task['lcfile']))
+        return None, format_exc()
+
+
+
+#######################
+## PIPELINE MANIFEST ##
+#######################
+
+# this is the SQL used to set up a pipeline manifest. the status of each stage
+# task is one of: waiting (for the stages it depends on), ready, running, done,
+# failed (after maxattempts tries), skipped (a stage it depends on failed).
+SQLITE_PIPELINE_SCHEMA = '''\
+create table if not exists pipeline (
+  key text primary key,
+  value text
+);
+create table if not exists objects (
+  objectind integer primary key,
+  lcfile text not null unique,
+  cost real not null default 0.0,
+  added_at real
+);
+create table if not exists stagetasks (
+  objectind integer not null,
+  stage text not null,
+  stageind integer not null,
+  status text not null,
+  attempts integer not null default 0,
+  workerid text,
+  started_at real,
+  finished_at real,
+  inputs text,
+  outputs text,
+  error text,
+  primary key (objectind, stage)
+);
+create index if not exists stagetasks_status_idx on stagetasks
+  (status, stageind, objectind);
+'''
+
+
+class PipelineManifest(object):
+    '''This is the SQLite manifest that keeps the state of a pipeline run.
+
+    Only one runner should use a manifest at a time. The status can be read by
+    other processes while it's running.
+
+    '''
+
+    def __init__(self, manifestfile, timeout=60.0):
+        '''
+        manifestfile is the path to the SQLite database to use. This is created
+        if it doesn't exist. timeout is the number of seconds to wait for a lock
+        on the database.
+
+        '''
+
+        self.manifestfile = os.path.abspath(manifestfile)
+        self.timeout = timeout
+
+        db = self._connect()
+        try:
+            db.executescript(SQLITE_PIPELINE_SCHEMA)
+        finally:
+            db.close()
+
+        self.config = self.get_config()
+
+
+    def _connect(self):
+        '''
+        This opens a new connection to the manifest database.
+
+        '''
+
+        db = sqlite3.connect(self.manifestfile,
+                             timeout=self.timeout,
+                             isolation_level=None)
+        db.execute('pragma journal_mode = wal')
+        return db
+
+
+    def get_config(self):
+        '''
+        This returns the pipeline config dict or None if it's not set up yet.
+
+        '''
+
+        db = self._connect()
+        try:
+            row = db.execute('select value from pipeline where key = ?',
+                             ('config',)).fetchone()
+        finally:
+            db.close()
+
+        return json.loads(row[0]) if row else None
+
+
+    def set_config(self, config):
+        '''
+        This stores the pipeline config dict.
+
+        '''
+
+        db = self._connect()
+        try:
+            db.execute('insert or replace into pipeline (key, value) '
+                       'values (?, ?)', ('config', json.dumps(config)))
+        finally:
+            db.close()
+
+        self.config = config
+
+
+    def _upstream(self, stage):
+        '''
+        This returns all of the stages that stage depends on, directly or not.
+
+        '''
+
+        upstream = set()
+        tocheck = list(self.config['dependencies'][stage])
+
+        while tocheck:
+            depstage = tocheck.pop()
+            if depstage not in upstream:
+                upstream.add(depstage)
+                tocheck.extend(self.config['dependencies'][depstage])
+
+        return upstream
+
+
+    def _downstream(self, stage):
+        '''
+        This returns all of the stages that depend on stage, directly or not.
+
+        '''
+
+        downstream = []
+        for stagename in self.config['stages']:
+            deps = self.config['dependencies'][stagename]
+            if stage in deps or any(x in downstream for x in deps):
+                downstream.append(stagename)
+
+        return downstream
+
+
+    def add_objects(self, lcfiles, costs):
+        '''This adds objects and their stage tasks to the manifest.
+
+        LC files already in the manifest are ignored. Returns the number of new
+        objects added.
+
+        '''
+
+        stages = self.config['stages']
+        addedat = time.time()
+
+        db = self._connect()
+        try:
+
+            db.execute('begin immediate')
+
+            nobjects = 0
+
+            for lcf, cost in zip(lcfiles, costs):
+
+                cursor = db.execute(
+                    'insert or ignore into objects (lcfile, cost, added_at) '
+                    'values (?, ?, ?)', (lcf, float(cost), addedat)
+                )
+                if cursor.rowcount == 0:
+                    continue
+
+                db.executemany(
+                    'insert into stagetasks '
+                    '(objectind, stage, stageind, status) values (?, ?, ?, ?)',
+                    [(cursor.lastrowid, x, ind,
+                      'waiting' if self.config['dependencies'][x] else 'ready')
+                     for ind, x in enumerate(stages)]
+                )
+                nobjects = nobjects + 1
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return nobjects
+
+
+    def recover(self, checkoutputs=True):
+        '''This gets the manifest ready to resume a run.
+
+        Stage tasks left running by a runner that stopped are made ready again,
+        or failed if they've used up all of their attempts. If checkoutputs is
+        True, stages that are done but whose output files are gone are made
+        ready again, along with the stages that depend on them.
+
+        Returns a dict with the number of tasks recovered and reset.
+
+        '''
+
+        maxattempts = self.config['maxattempts']
+
+        db = self._connect()
+        try:
+
+            db.execute('begin immediate')
+
+            interrupted = db.execute(
+                'select objectind, stage, attempts from stagetasks '
+                'where status = ?', ('running',)
+            ).fetchall()
+
+            for objectind, stage, attempts in interrupted:
+                if attempts < maxattempts:
+                    db.execute('update stagetasks set status = ? '
+                               'where objectind = ? and stage = ?',
+                               ('ready', objectind, stage))
+                else:
+                    self._fail(db, objectind, stage,
+                               'interrupted after %s attempts' % attempts)
+
+            nreset = 0
+            resettasks = set()
+
+            if checkoutputs:
+
+                done = db.execute(
+                    'select objectind, stage, outputs from stagetasks '
+                    'where status = ? order by stageind asc', ('done',)
+                ).fetchall()
+
+                for objectind, stage, outputs in done:
+
+                    # this was already reset because an earlier stage was
+                    if ((objectind, stage) in resettasks or
+                        not _missing_outputs(json.loads(outputs))):
+                        continue
+
+                    LOGWARNING('outputs for object %s stage %s are missing, '
+                               'will run it again' % (objectind, stage))
+
+                    db.execute('update stagetasks set status = ?, '
+                               'attempts = 0, outputs = null '
+                               'where objectind = ? and stage = ?',
+                               ('ready', objectind, stage))
+                    self._reset_downstream(db, objectind, stage)
+                    resettasks.update((objectind, x)
+                                      for x in self._downstream(stage))
+                    nreset = nreset + 1
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return {'interrupted':len(interrupted), 'missingoutputs':nreset}
+
+
+    def _reset_downstream(self, db, objectind, stage):
+        '''
+        This puts all of the stages depending on stage back to waiting.
+
+        '''
+
+        for downstage in self._downstream(stage):
+            db.execute('update stagetasks set status = ?, attempts = 0, '
+                       'outputs = null, error = null '
+                       'where objectind = ? and stage = ?',
+                       ('waiting', objectind, downstage))
+
+
+    def claim_tasks(self, ntasks, workerid):
+        '''This claims up to ntasks ready stage tasks for workerid.
+
+        Tasks for later stages are handed out first, so objects move through
+        the pipeline as soon as they can. Within a stage, the most expensive
+        objects go first.
+
+        Returns a list of task dicts for _pipeline_worker.
+
+        '''
+
+        db = self._connect()
+
+        try:
+
+            db.execute('begin immediate')
+
+            rows = db.execute(
+                'select t.objectind, t.stage, o.lcfile from stagetasks t '
+                'join objects o on t.objectind = o.objectind '
+                'where t.status = ? '
+                'order by t.stageind desc, o.cost desc, t.objectind asc '
+                'limit ?', ('ready', ntasks)
+            ).fetchall()
+
+            tasks = []
+
+            for objectind, stage, lcfile in rows:
+
+                depstages = self._upstream(stage)
+                upstream = dict(
+                    (x, json.loads(y)) for x, y in db.execute(
+                        'select stage, outputs from stagetasks '
+                        'where objectind = ? and status = ?',
+                        (objectind, 'done')
+                    ) if x in depstages
+                )
+
+                db.execute(
+                    'update stagetasks set status = ?, workerid = ?, '
+                    'started_at = ?, attempts = attempts + 1, inputs = ? '
+                    'where objectind = ? and stage = ?',
+                    ('running', workerid, time.time(),
+                     json.dumps({'lcfile':lcfile, 'upstream':upstream}),
+                     objectind, stage)
+                )
+
+                tasks.append({'objectind':objectind,
+                              'stage':stage,
+                              'lcfile':lcfile,
+                              'upstream':upstream,
+                              'kwargs':self.config['stagekwargs'][stage]})
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return tasks
+
+
+    def finish_task(self, objectind, stage, outputs):
+        '''This marks a stage task as done and stores its outputs.
+
+        Any stages for this object that were only waiting on this one are made
+        ready.
+
+        '''
+
+        db = self._connect()
+        try:
+
+            db.execute('begin immediate')
+            db.execute(
+                'update stagetasks set status = ?, finished_at = ?, '
+                'outputs = ?, error = null where objectind = ? and stage = ?',
+                ('done', time.time(), json.dumps(outputs), objectind, stage)
+            )
+
+            donestages = set(x[0] for x in db.execute(
+                'select stage from stagetasks '
+                'where objectind = ? and status = ?', (objectind, 'done')
+            ))
+
+            for nextstage in self.config['stages']:
+                deps = self.config['dependencies'][nextstage]
+                if stage in deps and all(x in donestages for x in deps):
+                    db.execute('update stagetasks set status = ? '
+                               'where objectind = ? and stage = ? '
+                               'and status = ?',
+                               ('ready', objectind, nextstage, 'waiting'))
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+
+    def _fail(self, db, objectind, stage, error):
+        '''
+        This marks a stage task as failed and skips the ones depending on it.
+
+        '''
+
+        db.execute('update stagetasks set status = ?, finished_at = ?, '
+                   'error = ? where objectind = ? and stage = ?',
+                   ('failed', time.time(), error, objectind, stage))
+
+        for downstage in self._downstream(stage):
+            db.execute('update stagetasks set status = ? '
+                       'where objectind = ? and stage = ?',
+                       ('skipped', objectind, downstage))
+
+
+    def fail_task(self, objectind, stage, error):
+        '''This records a failure for a stage task.
+
+        If the task hasn't been tried maxattempts times yet, it's made ready
+        again. Otherwise, it's marked as failed and the stages that depend on it
+        are skipped for this object.
+
+        Returns True if the task will be retried.
+
+        '''
+
+        db = self._connect()
+        try:
+
+            db.execute('begin immediate')
+
+            attempts = db.execute(
+                'select attempts from stagetasks '
+                'where objectind = ? and stage = ?', (objectind, stage)
+            ).fetchone()[0]
+
+            retry = attempts < self.config['maxattempts']
+
+            if retry:
+                db.execute('update stagetasks set status = ?, error = ? '
+                           'where objectind = ? and stage = ?',
+                           ('ready', error, objectind, stage))
+            else:
+                self._fail(db, objectind, stage, error)
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return retry
+
+
+    def retry_failed(self, stages=None):
+        '''This gives failed stage tasks another maxattempts tries.
+
+        If stages is not None, only failed tasks for these stages are retried.
+        The skipped stages depending on them will run once they're done.
+        Returns the number of tasks that will be retried.
+
+        '''
+
+        if stages is None:
+            stages = self.config['stages']
+
+        db = self._connect()
+        try:
+
+            db.execute('begin immediate')
+
+            failed = db.execute(
+                'select objectind, stage from stagetasks where status = ? '
+                'and stage in (%s)' % ','.join('?' for x in stages),
+                ['failed'] + list(stages)
+            ).fetchall()
+
+            for objectind, stage in failed:
+                db.execute('update stagetasks set status = ?, attempts = 0 '
+                           'where objectind = ? and stage = ?',
+                           ('ready', objectind, stage))
+                for downstage in self._downstream(stage):
+                    db.execute('update stagetasks set status = ? '
+                               'where objectind = ? and stage = ? '
+                               'and status = ?',
+                               ('waiting', objectind, downstage, 'skipped'))
+
+            db.execute('commit')
+
+        finally:
+            db.close()
+
+        return len(failed)
+
+
+    def get_status(self):
+        '''This returns a dict of stage task counts by stage and status.
+
+        Also included are the total number of objects and the number of objects
+        that are done with all of their stages.
+
+        '''
+
+        db = self._connect()
+        try:
+
+            rows = db.execute(
+                'select stage, status, count(*) from stagetasks '
+                'group by stage, status'
+            ).fetchall()
+
+            nobjects = db.execute('select count(*) from objects').fetchone()[0]
+
+            ncomplete = db.execute(
+                'select count(*) from (select objectind from stagetasks '
+                'group by objectind having sum(status != ?) = 0)', ('done',)
+            ).fetchone()[0]
+
+        finally:
+            db.close()
+
+        statusdict = {'nobjects':nobjects,
+                      'ncomplete':ncomplete,
+                      'stages':dict((x, {}) for x in self.config['stages'])}
+
+        for stage, status, count in rows:
+            statusdict['stages'].setdefault(stage, {})[status] = count
+
+        return statusdict
+
+
+    def get_results(self, status='done', stage=None):
+        '''This returns a list of stage task dicts with the given status.
+
+        Each dict has the objectind, lcfile, stage, attempts, workerid, inputs,
+        outputs, and error for the task.
+
+        '''
+
+        query = ('select t.objectind, o.lcfile, t.stage, t.attempts, '
+                 't.workerid, t.inputs, t.outputs, t.error from stagetasks t '
+                 'join objects o on t.objectind = o.objectind '
+                 'where t.status = ?')
+        params = [status]
+
+        if stage is not None:
+            query = query + ' and t.stage = ?'
+            params.append(stage)
+
+        db = self._connect()
+        try:
+            rows = db.execute(query + ' order by t.objectind, t.stageind',
+                              params).fetchall()
+        finally:
+            db.close()
+
+        return [{'objectind':x[0],
+                 'lcfile':x[1],
+                 'stage':x[2],
+                 'attempts':x[3],
+                 'workerid':x[4],
+                 'inputs':json.loads(x[5]) if x[5] else None,
+                 'outputs':json.loads(x[6]) if x[6] else None,
+                 'error':x[7]} for x in rows]
+
+
+
+def _missing_outputs(outputs):
+    '''
+    This returns True if any absolute file paths in outputs don't exist.
+
+    '''
+
+    if isinstance(outputs, str):
+        return os.path.isabs(outputs) and not os.path.exists(outputs)
+    elif isinstance(outputs, (list, tuple)):
+        return any(_missing_outputs(x) for x in outputs)
+    elif isinstance(outputs, dict):
+        return any(_missing_outputs(x) for x in outputs.values())
+    else:
+        return False
+
+
+
+#######################
+## RUNNING PIPELINES ##
+#######################
+
+def create_pipeline(manifestfile,
+                    lclist,
+                    outdir,
+                    stages=('varfeatures','periodfind','checkplot'),
+                    lcformat='hat-sql',
+                    stagekwargs=None,
+                    dependencies=None,
+                    maxattempts=3):
+    '''This sets up a pipeline manifest.
+
+    lclist is a list of LC files, or the lclist dict (or pickle) made by
+    lcproc.make_lclist. This is also used to run the most expensive objects
+    first in each stage (see lcproc_sched.get_lclist_costs).
+
+    outdir is the base output directory. Stages that write their own outputs
+    (varfeatures, periodfind, checkplot) write them to a subdirectory named
+    after the stage. The EPD and TFA stages write theirs next to each LC, and
+    the stages depending on them work on these detrended LCs.
+
+    stages is the list of stages to run, from the keys of PIPELINE_STAGES.
+
+    stagekwargs is a dict of kwargs for each stage, keyed by stage name. These
+    must be serializable to JSON, since they're kept in the manifest.
+
+    dependencies is a dict of the stages each stage depends on, keyed by stage
+    name. By default, each stage depends on the one before it. Each stage gets
+    the outputs of the stages it depends on, directly or not.
+
+    maxattempts is the number of times a stage is tried for an object before
+    it's marked as failed.
+
+    If the manifest already exists, any new LCs in lclist are added to it and
+    its other settings are kept. Returns the PipelineManifest.
+
+    '''
+
+    lcfiles, costs = get_lclist_costs(lclist)
+    lcfiles = [os.path.abspath(x) for x in lcfiles]
+
+    manifest = PipelineManifest(manifestfile)
+
+    if manifest.config is None:
+
+        if lcformat not in lcproc.LCFORM:
+            LOGERROR('unknown light curve format specified: %s' % lcformat)
+            return None
+
+        stages = list(stages)
+        stagekwargs = stagekwargs if stagekwargs else {}
+
+        if dependencies is None:
+            dependencies = dict((x, stages[ind-1:ind])
+                                for ind, x in enumerate(stages))
+        else:
+            dependencies = dict(dependencies)
+
+        for ind, stage in enumerate(stages):
+
+            if stage not in PIPELINE_STAGES:
+                LOGERROR('unknown pipeline stage: %s, must be one of: %s' %
+                         (stage, ', '.join(sorted(PIPELINE_STAGES.keys()))))
+                return None
+
+            dependencies[stage] = list(dependencies.get(stage, []))
+            needed = (set(dependencies[stage]) |
+                      set(PIPELINE_STAGES[stage]['needs']))
+
+            if not needed.issubset(stages[:ind]):
+                LOGERROR('pipeline stage %s needs stages %s to come before it' %
+                         (stage, sorted(needed)))
+                return None
+
+            dependencies[stage] = sorted(needed, key=stages.index)
+
+        config = {'stages':stages,
+                  'dependencies':dependencies,
+                  'outdir':os.path.abspath(outdir),
+                  'lcformat':lcformat,
+                  'maxattempts':maxattempts,
+                  'stagekwargs':{}}
+
+        for stage in stages:
+
+            kwargs = {'lcformat':lcformat}
+            if PIPELINE_STAGES[stage]['outdir']:
+                kwargs['outdir'] = os.path.join(config['outdir'], stage)
+            kwargs.update(stagekwargs.get(stage, {}))
+            config['stagekwargs'][stage] = kwargs
+
+        try:
+            manifest.set_config(config)
+        except TypeError:
+            LOGEXCEPTION("the stagekwargs can't be stored in the manifest "
+                         "because they can't be serialized to JSON")
+            return None
+
+    nadded = manifest.add_objects(lcfiles, costs)
+    LOGINFO('added %s objects to pipeline manifest %s' %
+            (nadded, manifest.manifestfile))
+
+    return manifest
+
+
+
+def run_pipeline(manifestfile,
+                 nworkers=lcproc.NCPUS,
+                 maxtasks=None,
+                 checkoutputs=True):
+    '''This runs or resumes the pipeline in a manifest.
+
+    manifestfile is the path to the manifest made by create_pipeline, or a
+    PipelineManifest.
+
+    nworkers is the number of stage tasks to run at the same time.
+
+    If maxtasks is not None, no more stage tasks are started after this many.
+    The run can then be resumed later.
+
+    If checkoutputs is True, the outputs of stages that are already done are
+    checked and the stages are run again if they're missing.
+
+    The runner stops starting new stage tasks when it gets a SIGTERM or SIGINT,
+    and waits for the running ones to finish.
+
+    Returns the status dict from PipelineManifest.get_status, or None if the
+    manifest isn't set up.
+
+    '''
+
+    if isinstance(manifestfile, PipelineManifest):
+        manifest = manifestfile
+    else:
+        manifest = PipelineManifest(manifestfile)
+
+    if manifest.config is None:
+        LOGERROR('pipeline manifest %s is not set up, '
+                 'use create_pipeline first' % manifest.manifestfile)
+        return None
+
+    for stage in manifest.config['stages']:
+        if stage not in PIPELINE_STAGES:
+            LOGERROR('pipeline stage %s is not registered in this process' %
+                     stage)
+            return None
+        stageoutdir = manifest.config['stagekwargs'][stage].get('outdir')
+        if stageoutdir and not os.path.exists(stageoutdir):
+            os.makedirs(stageoutdir)
+
+    recovered = manifest.recover(checkoutputs=checkoutputs)
+    if recovered['interrupted'] > 0 or recovered['missingoutputs'] > 0:
+        LOGINFO('resuming pipeline: %s interrupted stage tasks, '
+                '%s with missing outputs' %
+                (recovered['interrupted'], recovered['missingoutputs']))
+
+    workerid = '%s-%s' % (socket.gethostname(), os.getpid())
+
+    # stop starting new tasks on SIGTERM/SIGINT
+    stopflag = {'stop':False}
+
+    def _stop_handler(signum, frame):
+        LOGWARNING('pipeline runner got signal %s, will stop after '
+                   'the running stage tasks are done' % signum)
+        stopflag['stop'] = True
+
+    oldhandlers = {}
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            oldhandlers[signum] = signal.signal(signum, _stop_handler)
+        except ValueError:
+            # not in the main thread
+            pass
+
+    running = {}
+    nstarted, nsucceeded, nfailed = 0, 0, 0
+    executor = ProcessPoolExecutor(max_workers=nworkers)
+
+    try:
+
+        while True:
+
+            nfree = nworkers - len(running)
+            if maxtasks is not None:
+                nfree = min(nfree, maxtasks - nstarted)
+
+            if nfree > 0 and not stopflag['stop']:
+                for task in manifest.claim_tasks(nfree, workerid):
+                    running[executor.submit(_pipeline_worker, task)] = task
+                    nstarted = nstarted + 1
+
+            if len(running) == 0:
+                break
+
+            donefutures = wait(list(running.keys()),
+                               return_when=FIRST_COMPLETED)[0]
+            poolbroken = False
+
+            for future in donefutures:
+
+                task = running.pop(future)
+
+                try:
+                    outputs, error = future.result()
+                except BrokenProcessPool:
+                    outputs, error = None, 'worker process died'
+                    poolbroken = True
+                except Exception as e:
+                    outputs, error = None, format_exc()
+
+                if outputs is not None:
+                    manifest.finish_task(task['objectind'], task['stage'],
+                                         outputs)
+                    nsucceeded = nsucceeded + 1
+                else:
+                    retry = manifest.fail_task(task['objectind'],
+                                               task['stage'],
+                                               error)
+                    LOGERROR('%s stage failed for %s%s' %
+                             (task['stage'], task['lcfile'],
+                              ', will retry' if retry else ''))
+                    nfailed = nfailed + 1
+
+            # a worker dying takes down the whole pool, so start a new one
+            if poolbroken:
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=nworkers)
+
+    finally:
+
+        executor.shutdown(wait=True)
+
+        for signum, handler in oldhandlers.items():
+            signal.signal(signum, handler)
+
+    status = manifest.get_status()
+
+    LOGINFO('pipeline run done: %s stage tasks succeeded, %s failed; '
+            '%s/%s objects complete' %
+            (nsucceeded, nfailed, status['ncomplete'], status['nobjects']))
+
+    return status
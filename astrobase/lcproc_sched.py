@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''lcproc_sched.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This contains the task scheduler for the lcproc parallel_* drivers. LCs in a
+single run can have anywhere from a few hundred to ~10^5 points, so handing out
+tasks in fixed chunks in the order of the input list leaves most of the workers
+idle at the end of the run while a few large LCs finish. Instead, the scheduler:
+
+- estimates the cost of each task from the number of detections in its LC. This
+  is taken from the '<magcol>.ndet' columns if the drivers are given the
+  lclist dict (or pickle) made by lcproc.make_lclist, and from the size of each
+  file otherwise.
+
+- hands out tasks one at a time, largest first, to whichever worker is free.
+
+- for the drivers that can also parallelize within a single object
+  (parallel_pf), gives objects that would take longer than the average work
+  per core all of the cores one at a time, then runs the rest of the objects
+  with one core each.
+
+The drivers keep their signatures. The old behavior (tasks in input order with
+the default chunking, and ncontrolworkers x nperiodworkers for parallel_pf) can
+be restored by setting the environment variable ASTROBASE_LCPROC_SCHEDULER to
+'static' or by calling set_scheduler('static').
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+            )
+        )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import os.path
+import pickle
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+
+############
+## CONFIG ##
+############
+
+SCHEDULER_ENVVAR = 'ASTROBASE_LCPROC_SCHEDULER'
+
+# this is either 'dynamic' or 'static'
+SCHEDULER = os.environ.get(SCHEDULER_ENVVAR, 'dynamic')
+
+
+
+def set_scheduler(mode):
+    '''This sets the scheduler used by the lcproc parallel drivers.
+
+    mode is 'dynamic' to hand out the most expensive tasks first and pick
+    per-object or within-object parallelism automatically, or 'static' to run
+    tasks in input order with fixed chunking like older versions.
+
+    '''
+
+    if mode not in ('dynamic', 'static'):
+        LOGERROR("unknown scheduler mode: %s, "
+                 "must be 'dynamic' or 'static'" % mode)
+        return None
+
+    globals()['SCHEDULER'] = mode
+    os.environ[SCHEDULER_ENVVAR] = mode
+
+    return mode
+
+
+
+#####################
+## ESTIMATING COST ##
+#####################
+
+def get_file_costs(filelist):
+    '''This returns the sizes of the files in filelist as their task costs.
+
+    Files that don't exist get zero cost; the workers will report them.
+
+    '''
+
+    costs = np.zeros(len(filelist), dtype=np.float64)
+
+    for ind, fpath in enumerate(filelist):
+        try:
+            costs[ind] = os.path.getsize(fpath)
+        except (OSError, TypeError):
+            pass
+
+    return costs
+
+
+
+def get_lclist_costs(lclist):
+    '''This returns the LC files in lclist and the cost of processing each.
+
+    lclist is one of:
+
+    - a list of LC file paths. The costs are the file sizes.
+
+    - the lclist dict made by lcproc.make_lclist or the path to its pickle. The
+      costs are the sum of the '<magcol>.ndet' columns for each object. If
+      these are all missing, the file sizes are used instead.
+
+    Returns a tuple of (list of LC files, array of costs).
+
+    '''
+
+    if isinstance(lclist, str):
+        with open(lclist,'rb') as infd:
+            lclist = pickle.load(infd)
+
+    if isinstance(lclist, dict) and 'objects' in lclist:
+
+        objects = lclist['objects']
+        lcfiles = [str(x) for x in objects['lcfname']]
+
+        ndetcols = [np.asarray(objects[x], dtype=np.float64)
+                    for x in sorted(objects) if x.endswith('.ndet')]
+
+        if len(ndetcols) > 0 and len(lcfiles) > 0:
+
+            costs = np.nansum(np.column_stack(ndetcols), axis=1)
+
+            if np.any(costs > 0.0):
+                return lcfiles, costs
+
+        return lcfiles, get_file_costs(lcfiles)
+
+    lcfiles = list(lclist)
+    return lcfiles, get_file_costs(lcfiles)
+
+
+
+def order_by_cost(costs):
+    '''This returns the task indices sorted by decreasing cost.
+
+    Tasks with the same cost stay in their input order.
+
+    '''
+
+    return np.argsort(-np.asarray(costs, dtype=np.float64), kind='mergesort')
+
+
+
+def split_by_cost(costs, ncores):
+    '''This returns a bool array that's True for tasks to run on all cores.
+
+    A task that costs more than the average work per core (the total cost
+    divided by ncores) would finish after everything else if it ran on one core,
+    so it's better off using all of the cores by itself.
+
+    '''
+
+    costs = np.asarray(costs, dtype=np.float64)
+
+    if ncores < 2 or costs.size == 0:
+        return np.zeros(costs.size, dtype=bool)
+
+    return costs > costs.sum()/ncores
+
+
+
+################
+## RUNNING IT ##
+################
+
+def run_tasks(workerfunc,
+              tasks,
+              costs,
+              nworkers,
+              maxworkertasks=None):
+    '''This runs workerfunc on all tasks in parallel.
+
+    costs is the list of costs for each task. If the scheduler is 'dynamic',
+    the tasks are handed out one at a time in order of decreasing cost.
+
+    If maxworkertasks is not None, a multiprocessing.Pool is used with this
+    many tasks per worker process before it's replaced. Otherwise, a
+    ProcessPoolExecutor is used.
+
+    Returns the results in the same order as tasks.
+
+    '''
+
+    if SCHEDULER == 'dynamic':
+        order = order_by_cost(costs)
+    else:
+        order = np.arange(len(tasks))
+
+    orderedtasks = [tasks[x] for x in order]
+
+    if maxworkertasks is not None:
+
+        pool = mp.Pool(nworkers, maxtasksperchild=maxworkertasks)
+
+        if SCHEDULER == 'dynamic':
+            orderedresults = list(pool.imap(workerfunc,
+                                            orderedtasks,
+                                            chunksize=1))
+        else:
+            orderedresults = pool.map(workerfunc, orderedtasks)
+
+        pool.close()
+        pool.join()
+
+    else:
+
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            orderedresults = list(executor.map(workerfunc, orderedtasks))
+
+    results = [None]*len(tasks)
+    for ind, result in zip(order, orderedresults):
+        results[ind] = result
+
+    return results
+
+
+
+def run_nested_tasks(workerfunc,
+                     tasks,
+                     costs,
+                     nouterworkers,
+                     ninnerworkers,
+                     set_task_workers):
+    '''This runs tasks that can also be parallelized within each object.
+
+    nouterworkers x ninnerworkers is the total number of cores to use.
+    set_task_workers is a function with the signature:
+
+    set_task_workers(task, nworkers) -> new task
+
+    that returns a copy of task that will use nworkers processes for its
+    object, e.g. by setting the nworkers kwarg of the period-finders.
+
+    If the scheduler is 'dynamic', the tasks that cost more than the average
+    work per core (see split_by_cost) are run one at a time with all of the
+    cores each, largest first. The rest of the tasks are then run with one core
+    each on all of the cores, also largest first.
+
+    If the scheduler is 'static', the tasks are run as they are on
+    nouterworkers processes.
+
+    Returns the results in the same order as tasks.
+
+    '''
+
+    if SCHEDULER != 'dynamic':
+        with ProcessPoolExecutor(max_workers=nouterworkers) as executor:
+            return list(executor.map(workerfunc, tasks))
+
+    ncores = max(nouterworkers*ninnerworkers, 1)
+
+    order = order_by_cost(costs)
+    large = split_by_cost(costs, ncores)
+
+    largeinds = [x for x in order if large[x]]
+    smallinds = [x for x in order if not large[x]]
+
+    LOGINFO('scheduling %s tasks on %s cores: '
+            '%s with %s cores each, %s with one core each' %
+            (len(tasks), ncores, len(largeinds), ncores, len(smallinds)))
+
+    results = [None]*len(tasks)
+
+    if len(largeinds) > 0:
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            largeresults = executor.map(
+                workerfunc,
+                [set_task_workers(tasks[x], ncores) for x in largeinds]
+            )
+            for ind, result in zip(largeinds, largeresults):
+                results[ind] = result
+
+    if len(smallinds) > 0:
+
+        with ProcessPoolExecutor(
+                max_workers=min(ncores, len(smallinds))
+        ) as executor:
+            smallresults = executor.map(
+                workerfunc,
+                [set_task_workers(tasks[x], 1) for x in smallinds]
+            )
+            for ind, result in zip(smallinds, smallresults):
+                results[ind] = result
+
+    return results
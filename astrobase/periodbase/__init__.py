@@ -19,7 +19,8 @@ TO BE IMPLEMENTED:
 
 periodbase.gcep -> Graham et al. (2013) conditional entropy period search
 
-FIXME: add an iterative peak-removal and refit mode to all period-finders here.
+An iterative peak-removal and refit mode for all of the period-finders here is
+available as varbase.signals.iterative_prewhiten.
 
 '''
 
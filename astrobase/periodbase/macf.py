@@ -95,8 +95,14 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     digitize as npdigitize, unique as npunique, \
     argmax as npargmax, argmin as npargmin
 
-from scipy.signal import argrelmax, argrelmin, savgol_filter
-from astropy.convolution import convolve, Gaussian1DKernel
+from ..lazyload import lazy_object
+
+# these are imported on first use to keep import times down
+argrelmax = lazy_object('scipy.signal', 'argrelmax')
+argrelmin = lazy_object('scipy.signal', 'argrelmin')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
+convolve = lazy_object('astropy.convolution', 'convolve')
+Gaussian1DKernel = lazy_object('astropy.convolution', 'Gaussian1DKernel')
 
 
 ###################
@@ -599,3 +599,157 @@ def specwindow_lsp(
             lspres['bestlspval'] = lspres['bestlspval']/lspmax
 
     return lspres
+
+
+
+############################################################
+## GLS WITH PRECOMPUTED TRIG SUMS FOR REPEATED EVALUATION ##
+############################################################
+
+def glsp_prepare(times,
+                 errs,
+                 omegas,
+                 cachetrig=True,
+                 maxcachebytes=268435456,
+                 chunksize=1024):
+    '''This precomputes all of the data-independent GLS terms for a fixed set of
+    times, errs, and angular frequencies.
+
+    The terms calculated here depend only on the times and the weights:
+
+    W = sum (1.0/(errs*errs) )
+    w_i = (1/W)*(1/(errs*errs))
+
+    C = sum( w_i*cos(wt_i) )
+    S = sum( w_i*sin(wt_i) )
+    CpC = sum( w_i*cos(w_t_i)*cos(w_t_i) )
+    CpS = sum( w_i*cos(w_t_i)*sin(w_t_i) )
+
+    so they can be reused across many evaluations of the periodogram for
+    different mags (e.g. during iterative pre-whitening, where only the mags
+    change between rounds). Use glsp_evaluate below to get the periodogram
+    values for a set of mags.
+
+    times, errs must be finite, have no zero errs, and must be the same points
+    that will be used for all mags passed to glsp_evaluate.
+
+    omegas is the array of angular frequencies to use.
+
+    If cachetrig is True and the cos(wt_i) and sin(wt_i) matrices for all omegas
+    fit into maxcachebytes, these are also kept around so later evaluations are
+    just two matrix-vector products. Otherwise, the trig terms are recomputed in
+    chunks of chunksize frequencies for each evaluation.
+
+    Returns a dict with the precomputed terms.
+
+    '''
+
+    times = np.asarray(times, dtype=np.float64)
+    errs = np.asarray(errs, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+
+    one_over_errs2 = 1.0/(errs*errs)
+    W = npsum(one_over_errs2)
+    wi = one_over_errs2/W
+
+    nfreq = omegas.size
+
+    C = npempty(nfreq)
+    S = npempty(nfreq)
+    CpC = npempty(nfreq)
+    CpS = npempty(nfreq)
+
+    # figure out if we can keep the trig matrices around
+    trigbytes = 2*nfreq*times.size*8
+    if cachetrig and trigbytes <= maxcachebytes:
+        cosmat = npempty((nfreq, times.size))
+        sinmat = npempty((nfreq, times.size))
+    else:
+        cosmat, sinmat = None, None
+
+    for chunkstart in range(0, nfreq, chunksize):
+
+        chunkslice = slice(chunkstart, chunkstart + chunksize)
+        omegat = np.outer(omegas[chunkslice], times)
+
+        cos_omegat = npcos(omegat)
+        sin_omegat = npsin(omegat)
+
+        C[chunkslice] = cos_omegat.dot(wi)
+        S[chunkslice] = sin_omegat.dot(wi)
+        CpC[chunkslice] = (cos_omegat*cos_omegat).dot(wi)
+        CpS[chunkslice] = (cos_omegat*sin_omegat).dot(wi)
+
+        if cosmat is not None:
+            cosmat[chunkslice] = cos_omegat
+            sinmat[chunkslice] = sin_omegat
+
+    return {'times':times,
+            'errs':errs,
+            'wi':wi,
+            'omegas':omegas,
+            'periods':2.0*MPI/omegas,
+            'C':C,
+            'S':S,
+            'CC':CpC - C*C,
+            'SS':1.0 - CpC - S*S, # use SpS = 1 - CpC
+            'CS':CpS - C*S,
+            'cosmat':cosmat,
+            'sinmat':sinmat,
+            'chunksize':chunksize}
+
+
+
+def glsp_evaluate(glspstate, mags, notau=False):
+    '''This evaluates the GLS periodogram for mags using precomputed terms.
+
+    glspstate is the dict returned by glsp_prepare above. mags must correspond
+    point-by-point to the times and errs used to make glspstate.
+
+    Only the data-dependent terms (Y, YY, YC, YS) are calculated here. If
+    notau is True, uses the expression from generalized_lsp_value_notau,
+    otherwise uses the one from generalized_lsp_value (the default for
+    pgen_lsp).
+
+    Returns an array of periodogram values, one per omega in glspstate.
+
+    '''
+
+    mags = np.asarray(mags, dtype=np.float64)
+    wi = glspstate['wi']
+    wimags = wi*mags
+
+    Y = npsum(wimags)
+    YY = npsum(wimags*mags) - Y*Y
+
+    if glspstate['cosmat'] is not None:
+
+        YpC = glspstate['cosmat'].dot(wimags)
+        YpS = glspstate['sinmat'].dot(wimags)
+
+    else:
+
+        omegas = glspstate['omegas']
+        chunksize = glspstate['chunksize']
+        YpC = npempty(omegas.size)
+        YpS = npempty(omegas.size)
+
+        for chunkstart in range(0, omegas.size, chunksize):
+            chunkslice = slice(chunkstart, chunkstart + chunksize)
+            omegat = np.outer(omegas[chunkslice], glspstate['times'])
+            YpC[chunkslice] = npcos(omegat).dot(wimags)
+            YpS[chunkslice] = npsin(omegat).dot(wimags)
+
+    YC = YpC - Y*glspstate['C']
+    YS = YpS - Y*glspstate['S']
+    CC, SS, CS = glspstate['CC'], glspstate['SS'], glspstate['CS']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        if notau:
+            Domega = CC*SS - CS*CS
+            lspvals = (SS*YC*YC + CC*YS*YS - 2.0*CS*YC*YS)/(YY*Domega)
+        else:
+            lspvals = (YC*YC/CC + YS*YS/SS)/YY
+
+    return lspvals
@@ -92,23 +92,33 @@ from numpy import nan as npnan, median as npmedian, \
     ravel as npravel
 
 # FIXME: enforce no display for now
-import matplotlib
-matplotlib.use('Agg')
+from .lazyload import lazy_module, lazy_object, use_agg_backend
 dispok = False
 
-import matplotlib.axes
-import matplotlib.pyplot as plt
+# these are heavy, so they're imported on first use. pyplot is always
+# imported with the Agg backend.
+mplaxes = lazy_module('matplotlib.axes', onload=use_agg_backend)
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
+
+# these are used to make the figure templates for the fastplot mode
+mplfigure = lazy_module('matplotlib.figure', onload=use_agg_backend)
+FigureCanvasAgg = lazy_object('matplotlib.backends.backend_agg',
+                              'FigureCanvasAgg',
+                              onload=use_agg_backend)
 
 # for convolving DSS stamps to simulate seeing effects
-import astropy.convolution as aconv
+aconv = lazy_module('astropy.convolution')
 
-try:
-    from astropy.io import fits as pyfits
-except:
-    import pyfits
-from astropy.wcs import WCS
-from astropy.visualization import MinMaxInterval, ZScaleInterval, \
-    ImageNormalize, LinearStretch
+pyfits = lazy_module('astropy.io.fits')
+WCS = lazy_object('astropy.wcs', 'WCS')
+MinMaxInterval = lazy_object('astropy.visualization', 'MinMaxInterval')
+ZScaleInterval = lazy_object('astropy.visualization', 'ZScaleInterval')
+ImageNormalize = lazy_object('astropy.visualization', 'ImageNormalize')
+LinearStretch = lazy_object('astropy.visualization', 'LinearStretch')
+
+# this marks the fits_finder_chart kwargs that weren't given, so we can fill in
+# the defaults there without taking away the meaning of None
+_FINDER_DEFAULT = object()
 
 try:
     from urllib.parse import urljoin
@@ -133,12 +143,389 @@ from .lcmath import phase_magseries, phase_magseries_with_errs, \
 
 from .varbase.lcfit import spline_fit_magseries
 
-from .services.skyview import get_stamp
+from .services.skyview import get_stamp, get_stamp_from_mosaic
+
+
+####################
+## FAST RENDERING ##
+####################
+
+# these are the figure templates used by the fastplot mode of the plotting
+# functions here and in astrobase.checkplot. they're kept per process, so each
+# worker in a pool making lots of plots gets its own set and reuses them for
+# every plot it makes.
+PLOT_TEMPLATES = {}
+
+
+def _sort_into_columns(xvals, yvals, ncolumns, xlim=None, logx=False):
+    '''This sorts points into ncolumns columns evenly spaced in x.
+
+    Returns a dict with the indices of the finite points inside xlim sorted by
+    column then by y ('sortinds'), the number of points in each non-empty
+    column in the same order ('colcounts'), the start of each column's run in
+    sortinds ('colstarts'), and the center of each non-empty column in x
+    ('colx').
+
+    '''
+
+    goodinds = np.isfinite(xvals) & np.isfinite(yvals)
+    if logx:
+        goodinds = goodinds & (xvals > 0.0)
+    goodinds = np.where(goodinds)[0]
+
+    if logx:
+        colx = np.log10(xvals[goodinds])
+    else:
+        colx = xvals[goodinds]
+
+    if xlim is not None:
+
+        xmin, xmax = min(xlim), max(xlim)
+        if logx:
+            xmin, xmax = np.log10(xmin), np.log10(xmax)
+
+        inrange = (colx >= xmin) & (colx <= xmax)
+        goodinds, colx = goodinds[inrange], colx[inrange]
+
+    elif goodinds.size > 0:
+        xmin, xmax = colx.min(), colx.max()
+
+    else:
+        xmin, xmax = 0.0, 1.0
+
+    colwidth = (xmax - xmin)/ncolumns
+    if colwidth > 0.0:
+        cols = ((colx - xmin)/colwidth).astype(np.int64)
+        cols = np.clip(cols, 0, ncolumns-1)
+    else:
+        cols = np.zeros(colx.size, dtype=np.int64)
+
+    colorder = np.lexsort((yvals[goodinds], cols))
+    colcounts = np.bincount(cols, minlength=ncolumns)
+    colnums = np.where(colcounts > 0)[0]
+    colcounts = colcounts[colnums]
+    colstarts = np.concatenate(([0], np.cumsum(colcounts)[:-1])).astype(
+        np.int64
+    )
+
+    colcenters = xmin + (colnums + 0.5)*colwidth
+    if logx:
+        colcenters = 10.0**colcenters
+
+    return {'sortinds':goodinds[colorder],
+            'colcounts':colcounts,
+            'colstarts':colstarts,
+            'colx':colcenters}
+
+
+
+def decimate_points(xvals, yvals, ncolumns, xlim=None, logx=False):
+    '''This decimates a series of points before plotting.
+
+    The x range is split into ncolumns columns (usually the number of pixel
+    columns the points will be drawn into). In each column, only the points
+    with the minimum, median, and maximum y values are kept, so the envelope
+    of the points and any outliers look the same at the plot resolution. If
+    there are fewer than 3 x ncolumns points to begin with, all of them are
+    kept.
+
+    xlim is a (min, max) tuple for the x range to split into columns. Points
+    outside this range are dropped. If xlim is None, the full range of xvals is
+    used.
+
+    If logx is True, the columns are evenly spaced in log10(x) instead. Use
+    this for plots with a log x-axis.
+
+    Non-finite points are always dropped.
+
+    Returns a tuple of (decimated xvals, decimated yvals). These are in the
+    same order as the input points, so the points of a line plot with sorted
+    xvals remain sorted.
+
+    '''
+
+    xvals, yvals = np.asarray(xvals), np.asarray(yvals)
+    ncolumns = max(int(ncolumns), 1)
+
+    columns = _sort_into_columns(xvals, yvals, ncolumns, xlim=xlim, logx=logx)
+    sortinds = columns['sortinds']
+
+    # nothing to do if there are only a few points per column anyway
+    if sortinds.size <= 3*ncolumns:
+        keepinds = np.sort(sortinds)
+        return xvals[keepinds], yvals[keepinds]
+
+    # the first, middle, and last points of each column's run are its min,
+    # median, and max
+    colstarts, colcounts = columns['colstarts'], columns['colcounts']
+    keep = np.unique(np.concatenate((colstarts,
+                                     colstarts + (colcounts - 1)//2,
+                                     colstarts + colcounts - 1)))
+    keepinds = np.sort(sortinds[keep])
+
+    return xvals[keepinds], yvals[keepinds]
+
+
+
+def _draw_decimated_scatter(fig, ax, points, envelope,
+                            xvals, yvals, plotdpi, axessize=None):
+    '''This draws a scatter plot of many points using per-column envelopes.
+
+    points and envelope are Line2D artists: points draws markers with no line,
+    and envelope draws lines with the same color, a linewidth equal to the
+    marker size, and round caps. This must be called after the axes limits are
+    set.
+
+    The points are sorted into pixel columns, then by y in each column. A run
+    of three or more points in a column whose markers overlap at the plot
+    resolution is drawn as a single vertical bar from the run's min to max
+    y. All other points are drawn as they are. This looks the same as drawing
+    all of the points, but is a lot faster for long light curves.
+
+    axessize is the (width, height) of the axes in pixels at plotdpi. If this is
+    None, it's worked out from the axes position. Use this for axes whose
+    position isn't known until they're drawn (e.g. inset axes).
+
+    '''
+
+    xvals, yvals = np.asarray(xvals), np.asarray(yvals)
+
+    if axessize is None:
+        axpos = ax.get_position()
+        axessize = (axpos.width*fig.get_figwidth()*plotdpi,
+                    axpos.height*fig.get_figheight()*plotdpi)
+    axwidth, axheight = axessize
+
+    columns = _sort_into_columns(xvals, yvals,
+                                 max(int(axwidth), 1),
+                                 xlim=ax.get_xlim())
+    sortinds = columns['sortinds']
+    colstarts = columns['colstarts']
+    sortedy = yvals[sortinds]
+
+    # the marker size in y units at the plot resolution
+    ylim = ax.get_ylim()
+    markery = (points.get_markersize()*plotdpi/72.0 *
+               npabs(ylim[1] - ylim[0])/axheight)
+
+    # a new run starts at each column and wherever there's a gap between
+    # markers
+    runbreaks = np.ones(sortedy.size, dtype=bool)
+    runbreaks[1:] = np.diff(sortedy) > markery
+    runbreaks[colstarts] = True
+
+    runstarts = np.where(runbreaks)[0]
+    runcounts = np.diff(np.append(runstarts, sortedy.size))
+    isbar = runcounts >= 3
+
+    # the bars are separated by NaNs so they can be drawn as one line
+    barstarts = runstarts[isbar]
+    barends = barstarts + runcounts[isbar] - 1
+    barx = np.repeat(xvals[sortinds[barstarts]], 3)
+    bary = np.column_stack((sortedy[barstarts],
+                            sortedy[barends],
+                            np.full(barstarts.size, npnan))).ravel()
+    envelope.set_data(barx, bary)
+
+    pointinds = sortinds[np.repeat(~isbar, runcounts)]
+    points.set_data(xvals[pointinds], yvals[pointinds])
+
+
+
+def _get_plot_template(key, nrows=1, ncols=1, figsize=(7.5,4.8),
+                       setupfunc=None):
+    '''This gets a figure template for the fastplot mode, making it if needed.
+
+    A template is a dict with keys: 'fig' (the figure), 'axes' (a flat array of
+    its nrows x ncols axes), and 'artists' (a dict of artists reused for every
+    plot). setupfunc(template) is called once when the template is made to add
+    the artists and anything else that doesn't change between plots.
+
+    The figure isn't registered with pyplot, so calls to plt.close() elsewhere
+    don't affect it. Anything added to the figure after setup (annotations,
+    text, inset axes) is removed when the template is fetched again.
+
+    '''
+
+    if key in PLOT_TEMPLATES:
+        template = PLOT_TEMPLATES[key]
+        _clear_plot_template(template)
+        return template
+
+    fig = mplfigure.Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows, ncols, squeeze=False).ravel()
+
+    template = {'fig':fig,
+                'axes':axes,
+                'artists':{},
+                'laidout':False}
+
+    if setupfunc is not None:
+        setupfunc(template)
+
+    # note what's in the figure after setup so extras can be removed later
+    template['nfigaxes'] = len(fig.axes)
+    template['naxtexts'] = [len(x.texts) for x in fig.axes]
+    template['nfigtexts'] = len(fig.texts)
+
+    PLOT_TEMPLATES[key] = template
+    return template
+
+
+
+def _clear_plot_template(template):
+    '''This removes the extras added to a template's figure since its setup.
+
+    '''
+
+    fig = template['fig']
+
+    for extraax in fig.axes[template['nfigaxes']:]:
+        extraax.remove()
+
+    for ax, naxtexts in zip(fig.axes, template['naxtexts']):
+        for extratext in list(ax.texts)[naxtexts:]:
+            extratext.remove()
+
+    for extratext in list(fig.texts)[template['nfigtexts']:]:
+        extratext.remove()
+
+
+
+def _layout_plot_template(template):
+    '''This fixes the layout of a template's figure the first time it's used.
+
+    The subplot positions are then reused for all later plots to avoid redoing
+    the layout every time.
+
+    '''
+
+    if not template['laidout']:
+
+        fig = template['fig']
+        fig.tight_layout()
+
+        # newer matplotlib leaves a placeholder layout engine on the figure
+        # after this, which makes savefig draw the figure twice
+        if hasattr(fig, 'set_layout_engine'):
+            fig.set_layout_engine(None)
+
+        template['laidout'] = True
+
+
+
+def _axes_pixel_columns(fig, ax, plotdpi):
+    '''This returns the number of pixel columns an axes covers at plotdpi.
+
+    '''
+
+    return int(ax.get_position().width * fig.get_figwidth() * plotdpi)
+
+
+
+def _padded_limits(vals, pad=0.05, logscale=False):
+    '''This returns plot limits for vals with pad x range on each side.
+
+    This is the same as the default matplotlib autoscaling margins.
+
+    '''
+
+    if logscale:
+        vals = np.log10(vals[vals > 0.0])
+
+    vals = vals[np.isfinite(vals)]
+    if vals.size == 0:
+        return (0.0, 1.0)
+
+    vmin, vmax = vals.min(), vals.max()
+    vpad = pad*(vmax - vmin) if vmax > vmin else 0.5
+    limits = (vmin - vpad, vmax + vpad)
+
+    if logscale:
+        limits = (10.0**limits[0], 10.0**limits[1])
+
+    return limits
+
+
+
+def _save_plot_template(template, outfile, plotdpi=100):
+    '''This writes a template's figure to outfile.
+
+    outfile is a filename or a StringIO/BytesIO object. PNGs and file objects
+    are written at plotdpi.
+
+    '''
+
+    fig = template['fig']
+
+    if isinstance(outfile, str) and not outfile.endswith('.png'):
+        fig.savefig(outfile)
+    else:
+        fig.savefig(outfile, dpi=plotdpi, format='png')
+
+    return outfile
 
 #########################
 ## SIMPLE LIGHT CURVES ##
 #########################
 
+def _setup_magseries_template(template):
+    '''This sets up the figure template for plot_mag_series.
+
+    '''
+
+    ax = template['axes'][0]
+
+    template['artists']['points'], = ax.plot([], [], 'go',
+                                             markersize=2.0,
+                                             markeredgewidth=0.0)
+    template['artists']['envelope'], = ax.plot([], [], 'g-',
+                                               linewidth=2.0,
+                                               solid_capstyle='round')
+
+    ax.grid(color='#a9a9a9',
+            alpha=0.9,
+            zorder=0,
+            linewidth=1.0,
+            linestyle=':')
+
+    ax.get_yaxis().get_major_formatter().set_useOffset(False)
+    ax.get_xaxis().get_major_formatter().set_useOffset(False)
+
+
+
+def _fastplot_mag_series(btimes, bmags, btimeorigin, ymin, ymax,
+                         magsarefluxes, out, plotdpi):
+    '''This makes the plot for plot_mag_series in fastplot mode.
+
+    '''
+
+    template = _get_plot_template('magseries',
+                                  setupfunc=_setup_magseries_template)
+    fig, ax = template['fig'], template['axes'][0]
+
+    ax.set_xlim(_padded_limits(btimes))
+    ax.set_xlabel('JD - %.3f' % btimeorigin)
+
+    if not magsarefluxes:
+        ax.set_ylim(ymax, ymin)
+        ax.set_ylabel('magnitude')
+    else:
+        ax.set_ylim(ymin, ymax)
+        ax.set_ylabel('flux')
+
+    _layout_plot_template(template)
+
+    _draw_decimated_scatter(fig, ax,
+                            template['artists']['points'],
+                            template['artists']['envelope'],
+                            btimes, bmags, plotdpi)
+
+    return _save_plot_template(template, out, plotdpi=plotdpi)
+
+
+
 def plot_mag_series(times,
                     mags,
                     magsarefluxes=False,
@@ -150,7 +537,8 @@ def plot_mag_series(times,
                     timebin=None,
                     yrange=None,
                     segmentmingap=100.0,
-                    plotdpi=100):
+                    plotdpi=100,
+                    fastplot=False):
     '''This plots a magnitude time series.
 
     If magsarefluxes = False, then this function reverses the y-axis as is
@@ -182,6 +570,14 @@ def plot_mag_series(times,
 
     plotdpi sets the DPI for PNG plots (default = 100).
 
+    If fastplot is True, the plot is drawn on a figure template reused for all
+    plots made by this process instead of a new figure, and the points are
+    decimated to a min/median/max envelope per pixel column before drawing (see
+    decimate_points). Error bars aren't drawn in this mode. Segmented plots
+    (see segmentmingap) are decimated but still use a new figure each time,
+    because their layout depends on the number of segments. This is much faster
+    when making lots of plots of long light curves.
+
     out is one of:
 
     - string name of a file to where the plot will be written
@@ -254,7 +650,25 @@ def plot_mag_series(times,
 
     # if we're supposed to make the plot segment-aware (i.e. gaps longer than
     # segmentmingap will be cut out)
-    if segmentmingap and ntimegroups > 1:
+    segmented = segmentmingap and ntimegroups > 1
+
+    # the fast plot mode uses its own figure
+    if fastplot and not segmented:
+
+        if not out:
+            LOGWARNING('no output file specified, '
+                       'saving to magseries-plot.png in current directory')
+            out = 'magseries-plot.png'
+
+        _fastplot_mag_series(btimes, bmags, btimeorigin, ymin, ymax,
+                             magsarefluxes, out, plotdpi)
+
+        if isinstance(out, str):
+            return os.path.abspath(out)
+        else:
+            return out
+
+    if segmented:
 
         LOGINFO('%s time groups found' % ntimegroups)
 
@@ -282,9 +696,18 @@ def plot_mag_series(times,
                 btimeorigin + tgtimes.max())
             )
 
-            ax.errorbar(tgtimes, tgmags, fmt='go', yerr=tgerrs,
-                        markersize=2.0, markeredgewidth=0.0, ecolor='grey',
-                        capsize=0)
+            # in the fast plot mode, decimate the points to the pixel
+            # columns this segment covers
+            if fastplot:
+                plottimes, plotmags = decimate_points(
+                    tgtimes, tgmags, 10.0*plotdpi/ntimegroups
+                )
+                ax.plot(plottimes, plotmags, 'go',
+                        markersize=2.0, markeredgewidth=0.0)
+            else:
+                ax.errorbar(tgtimes, tgmags, fmt='go', yerr=tgerrs,
+                            markersize=2.0, markeredgewidth=0.0,
+                            ecolor='grey', capsize=0)
 
             # don't use offsets on any xaxis
             ax.get_xaxis().get_major_formatter().set_useOffset(False)
@@ -429,6 +852,96 @@ def plot_mag_series(times,
 ## PHASED LIGHT CURVES ##
 #########################
 
+def _setup_phased_template(template):
+    '''This sets up the figure template for plot_phased_mag_series.
+
+    '''
+
+    ax = template['axes'][0]
+
+    template['artists']['points'], = ax.plot([], [], 'o',
+                                             markersize=3.0,
+                                             markeredgewidth=0.0)
+    template['artists']['envelope'], = ax.plot([], [], '-',
+                                               linewidth=3.0,
+                                               solid_capstyle='round')
+    template['artists']['binned'], = ax.plot([], [], 'bo',
+                                             markersize=5.0,
+                                             markeredgewidth=0.0)
+
+    ax.grid(color='#a9a9a9',
+            alpha=0.9,
+            zorder=0,
+            linewidth=1.0,
+            linestyle=':')
+
+    ax.axvline(0.0,alpha=0.9,linestyle='dashed',color='g')
+    ax.axvline(-0.5,alpha=0.9,linestyle='dashed',color='g')
+    ax.axvline(0.5,alpha=0.9,linestyle='dashed',color='g')
+
+    ax.get_yaxis().get_major_formatter().set_useOffset(False)
+    ax.get_xaxis().get_major_formatter().set_useOffset(False)
+    ax.set_xlabel('phase')
+
+
+
+def _fastplot_phased_mag_series(plotphase, plotmags,
+                                binplotphase, binplotmags,
+                                period, epoch,
+                                magsarefluxes, plotphaselim, yrange,
+                                outfile, plotdpi):
+    '''This makes the plot for plot_phased_mag_series in fastplot mode.
+
+    binplotphase and binplotmags are None if there's no phase-binned LC.
+
+    '''
+
+    template = _get_plot_template('phasedlc',
+                                  setupfunc=_setup_phased_template)
+    fig, ax = template['fig'], template['axes'][0]
+    points = template['artists']['points']
+    envelope = template['artists']['envelope']
+    binned = template['artists']['binned']
+
+    if binplotphase is not None:
+        pointcolor = '#B2BEB5'
+        binned.set_data(binplotphase, binplotmags)
+    else:
+        pointcolor = 'k'
+        binned.set_data([], [])
+
+    points.set_color(pointcolor)
+    envelope.set_color(pointcolor)
+
+    if yrange and isinstance(yrange,list) and len(yrange) == 2:
+        ymin, ymax = yrange
+    else:
+        ymin, ymax = _padded_limits(plotmags)
+
+    if not magsarefluxes:
+        ax.set_ylim(ymax, ymin)
+        ax.set_ylabel('magnitude')
+    else:
+        ax.set_ylim(ymin, ymax)
+        ax.set_ylabel('flux')
+
+    if not plotphaselim:
+        ax.set_xlim((npmin(plotphase)-0.1,
+                     npmax(plotphase)+0.1))
+    else:
+        ax.set_xlim((plotphaselim[0],plotphaselim[1]))
+
+    ax.set_title('period: %.6f d - epoch: %.6f' % (period, epoch))
+
+    _layout_plot_template(template)
+
+    _draw_decimated_scatter(fig, ax, points, envelope,
+                            plotphase, plotmags, plotdpi)
+
+    return _save_plot_template(template, outfile, plotdpi=plotdpi)
+
+
+
 def plot_phased_mag_series(times,
                            mags,
                            period,
@@ -445,7 +958,8 @@ def plot_phased_mag_series(times,
                            plotphaselim=[-0.8,0.8],
                            fitknotfrac=0.01,
                            yrange=None,
-                           plotdpi=100):
+                           plotdpi=100,
+                           fastplot=False):
     '''This plots a phased magnitude time series using the period provided.
 
     If epoch is None, uses the min(times) as the epoch.
@@ -462,6 +976,11 @@ def plot_phased_mag_series(times,
 
     plotdpi sets the DPI for PNG plots.
 
+    If fastplot is True, the plot is drawn on a figure template reused for all
+    plots made by this process, and the phased points are decimated per pixel
+    column before drawing. Error bars aren't drawn in this mode. This is
+    ignored if outfile is an Axes object. See plot_mag_series for details.
+
     outfile is one of:
 
     - a string filename for the file where the plot will be written
@@ -555,10 +1074,33 @@ def plot_phased_mag_series(times,
             binploterrs = None
 
 
+    # the fast plot mode uses its own figure
+    if fastplot and not isinstance(outfile, mplaxes.Axes):
+
+        if not outfile:
+            LOGWARNING('no output file specified, saving to '
+                       'magseries-phased-plot.png in current directory')
+            outfile = 'magseries-phased-plot.png'
+
+        _fastplot_phased_mag_series(
+            plotphase, plotmags,
+            binplotphase if phasebin else None,
+            binplotmags if phasebin else None,
+            period, epoch,
+            magsarefluxes, plotphaselim, yrange,
+            outfile, plotdpi
+        )
+        LOGINFO('using period: %.6f d and epoch: %.6f' % (period, epoch))
+
+        if isinstance(outfile, str):
+            return period, epoch, os.path.abspath(outfile)
+        else:
+            return outfile
+
     # finally, make the plots
 
     # check if the outfile is actually an Axes object
-    if isinstance(outfile, matplotlib.axes.Axes):
+    if isinstance(outfile, mplaxes.Axes):
 
         ax = outfile
 
@@ -645,7 +1187,7 @@ def plot_phased_mag_series(times,
     # make the figure
     if (outfile and
         not is_strio and
-        not isinstance(outfile, matplotlib.axes.Axes)):
+        not isinstance(outfile, mplaxes.Axes)):
 
         if outfile.endswith('.png'):
             fig.savefig(outfile, bbox_inches='tight', dpi=plotdpi)
@@ -659,7 +1201,7 @@ def plot_phased_mag_series(times,
         fig.savefig(outfile, bbox_inches='tight', dpi=plotdpi, format='png')
         return outfile
 
-    elif outfile and isinstance(outfile, matplotlib.axes.Axes):
+    elif outfile and isinstance(outfile, mplaxes.Axes):
 
         return outfile
 
@@ -693,7 +1235,8 @@ def skyview_stamp(ra, decl,
                   cachedir='~/.astrobase/stamp-cache',
                   timeout=10.0,
                   savewcsheader=True,
-                  verbose=False):
+                  verbose=False,
+                  mosaic=False):
     '''This is the internal version of the astroquery_skyview_stamp function.
 
     Why this exists:
@@ -714,25 +1257,44 @@ def skyview_stamp(ra, decl,
 
     cachedir points to the astrobase stamp-cache directory.
 
+    mosaic = True will cut the stamp out of a larger field mosaic shared with
+    other nearby objects instead of getting a separate stamp for this object
+    (see services.skyview.get_stamp_from_mosaic).
+
     '''
 
-    stampdict = get_stamp(ra, decl,
-                          survey=survey,
-                          scaling=scaling,
-                          forcefetch=forcefetch,
-                          cachedir=cachedir,
-                          timeout=timeout,
-                          verbose=verbose)
+    if mosaic:
+        stampdict = get_stamp_from_mosaic(ra, decl,
+                                          survey=survey,
+                                          scaling=scaling,
+                                          forcefetch=forcefetch,
+                                          cachedir=cachedir,
+                                          timeout=timeout,
+                                          verbose=verbose)
+    else:
+        stampdict = get_stamp(ra, decl,
+                              survey=survey,
+                              scaling=scaling,
+                              forcefetch=forcefetch,
+                              cachedir=cachedir,
+                              timeout=timeout,
+                              verbose=verbose)
     #
     # DONE WITH FETCHING STUFF
     #
     if stampdict:
 
-        # open the frame
-        stampfits = pyfits.open(stampdict['fitsfile'])
-        header = stampfits[0].header
-        frame = stampfits[0].data
-        stampfits.close()
+        # the mosaic stamps come with their frame and header already
+        if 'stamp' in stampdict:
+            header = stampdict['header']
+            frame = stampdict['stamp']
+
+        # otherwise, open the frame
+        else:
+            stampfits = pyfits.open(stampdict['fitsfile'])
+            header = stampfits[0].header
+            frame = stampfits[0].data
+            stampfits.close()
 
         # finally, we can process the frame
         if flip:
@@ -767,9 +1329,9 @@ def fits_finder_chart(
         fitsfile,
         outfile,
         wcsfrom=None,
-        scale=ZScaleInterval(),
-        stretch=LinearStretch(),
-        colormap=plt.cm.gray_r,
+        scale=_FINDER_DEFAULT,
+        stretch=_FINDER_DEFAULT,
+        colormap=_FINDER_DEFAULT,
         findersize=None,
         finder_coordlimits=None,
         overlay_ra=None,
@@ -799,15 +1361,22 @@ def fits_finder_chart(
     FITS or similar file that contains a WCS header in its first extension.
 
     `scale` sets the normalization for the FITS pixel values. This is an
-    astropy.visualization Interval object.
+    astropy.visualization Interval object. If not given, ZScaleInterval() is
+    used.
 
     `stretch` sets the stretch function for mapping FITS pixel values to output
-    pixel values. This is an astropy.visualization Stretch object.
+    pixel values. This is an astropy.visualization Stretch object. If not given,
+    LinearStretch() is used.
+
+    If either `scale` or `stretch` is None (or False), the FITS pixel values are
+    plotted without any normalization.
 
     See http://docs.astropy.org/en/stable/visualization/normalization.html for
     details on `scale` and `stretch` objects.
 
-    `colormap` is a matplotlib color map object to use for the output image.
+    `colormap` is a matplotlib color map object to use for the output image. If
+    not given, plt.cm.gray_r is used. If None, matplotlib's default color map is
+    used.
 
     If `findersize` is None, the output image size will be set by the NAXIS1 and
     NAXIS2 keywords in the input `fitsfile` FITS header. Otherwise, `findersize`
@@ -925,7 +1494,15 @@ def fits_finder_chart(
     # appropriately above for these
     fig.add_subplot(111,projection=w)
 
-    if scale is not None and stretch is not None:
+    if colormap is _FINDER_DEFAULT:
+        colormap = plt.cm.gray_r
+    if scale is _FINDER_DEFAULT:
+        scale = ZScaleInterval()
+    if stretch is _FINDER_DEFAULT:
+        stretch = LinearStretch()
+
+    if (scale is not None and scale is not False and
+        stretch is not None and stretch is not False):
 
         norm = ImageNormalize(img,
                               interval=scale,
@@ -1019,7 +1596,65 @@ METHODSHORTLABELS = {'gls':'Generalized L-S',
                      'win':'Sampling L-S'}
 
 
-def plot_periodbase_lsp(lspinfo, outfile=None, plotdpi=100):
+def _setup_lsp_template(template):
+    '''This sets up the figure template for plot_periodbase_lsp.
+
+    '''
+
+    ax = template['axes'][0]
+
+    template['artists']['lsp'], = ax.plot([], [])
+
+    ax.set_xscale('log')
+    ax.set_xlabel('Period [days]')
+    ax.grid(color='#a9a9a9',
+            alpha=0.9,
+            zorder=0,
+            linewidth=1.0,
+            linestyle=':')
+
+
+
+def _fastplot_periodbase_lsp(lspinfo, outfile, plotdpi):
+    '''This makes the plot for plot_periodbase_lsp in fastplot mode.
+
+    '''
+
+    template = _get_plot_template('lsp', setupfunc=_setup_lsp_template)
+    fig, ax = template['fig'], template['axes'][0]
+
+    periods = np.asarray(lspinfo['periods'])
+    lspvals = np.asarray(lspinfo['lspvals'])
+    lspmethod = lspinfo['method']
+
+    ax.set_xlim(_padded_limits(periods, logscale=True))
+    ax.set_ylim(_padded_limits(lspvals))
+    ax.set_ylabel(PLOTYLABELS[lspmethod])
+    ax.set_title('%s best period: %.6f d' % (METHODSHORTLABELS[lspmethod],
+                                             lspinfo['bestperiod']))
+
+    # these are removed the next time the template is used
+    for bestperiod, bestpeak in zip(lspinfo['nbestperiods'],
+                                    lspinfo['nbestlspvals']):
+
+        ax.annotate('%.6f' % bestperiod,
+                    xy=(bestperiod, bestpeak), xycoords='data',
+                    xytext=(0.0,25.0), textcoords='offset points',
+                    arrowprops=dict(arrowstyle="->"),fontsize='x-small')
+
+    _layout_plot_template(template)
+
+    template['artists']['lsp'].set_data(
+        *decimate_points(periods, lspvals,
+                         _axes_pixel_columns(fig, ax, plotdpi),
+                         logx=True)
+    )
+
+    return _save_plot_template(template, outfile, plotdpi=plotdpi)
+
+
+
+def plot_periodbase_lsp(lspinfo, outfile=None, plotdpi=100, fastplot=False):
 
     '''Makes a plot of periodograms obtained from periodbase functions.
 
@@ -1027,6 +1662,10 @@ def plot_periodbase_lsp(lspinfo, outfile=None, plotdpi=100):
     filename string ending with .pkl, then this assumes it's a periodbase LSP
     pickle and loads the corresponding info from it.
 
+    If fastplot is True, the plot is drawn on a figure template reused for all
+    plots made by this process, and the periodogram is decimated per pixel
+    column before drawing. See plot_mag_series for details.
+
     '''
 
     # get the lspinfo from a pickle file transparently
@@ -1043,9 +1682,20 @@ def plot_periodbase_lsp(lspinfo, outfile=None, plotdpi=100):
         bestperiod = lspinfo['bestperiod']
         lspmethod = lspinfo['method']
 
+        # the fast plot mode uses its own figure
+        if fastplot:
+
+            if not outfile or not isinstance(outfile, str):
+                LOGWARNING('no output file specified, '
+                           'saving to lsp-plot.png in current directory')
+                outfile = 'lsp-plot.png'
+
+            _fastplot_periodbase_lsp(lspinfo, outfile, plotdpi)
+            return os.path.abspath(outfile)
+
         # make the LSP plot on the first subplot
         plt.plot(periods, lspvals)
-        plt.xscale('log',basex=10)
+        plt.xscale('log')
         plt.xlabel('Period [days]')
         plt.ylabel(PLOTYLABELS[lspmethod])
         plottitle = '%s best period: %.6f d' % (METHODSHORTLABELS[lspmethod],
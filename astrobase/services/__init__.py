@@ -11,6 +11,7 @@ dust.py       - interface to the 2MASS DUST extinction/emission service
 gaia.py       - interface to the GAIA TAP+ ADQL query service
 hatds.py      - interface to the new-generation HAT data server
 skyview.py    - interface to the NASA GSFC SkyView cutout service
+transport.py  - shared HTTP transport with pooling, rate limits, and retries
 trilegal.py   - interface to the TRILEGAL galaxy model service
 
 For a much broader interface to online data services, use the astroquery package
@@ -16,6 +16,10 @@ http://www.adsabs.harvard.edu/abs/2011ApJ...737..103S
 
 http://irsa.ipac.caltech.edu/applications/DUST/docs/background.html
 
+For large fields, use make_extinction_grid to sample the DUST service once on a
+grid covering the field, then extinction_from_grid to get the extinction for
+all objects in the field at once by interpolating on the grid.
+
 '''
 
 #############
@@ -88,6 +92,7 @@ def LOGEXCEPTION(message):
 
 import os
 import os.path
+import glob
 import gzip
 import hashlib
 import time
@@ -95,12 +100,16 @@ import re
 
 import numpy as np
 
-# to do the queries
-import requests
-import requests.exceptions
+from ..lazyload import lazy_module, lazy_object
+
+# to do the queries. this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+# the shared HTTP transport with connection pooling, rate limits, and retries
+from . import transport
 
 # to read IPAC tables
-from astropy.table import Table
+Table = lazy_object('astropy.table', 'Table')
 
 
 ##############################
@@ -186,7 +195,7 @@ def extinction_query(lon, lat,
                         'lon = %.3f, lat = %.3f, type = %s, size = %.1f' %
                         (lon, lat, coordtype, sizedeg))
 
-            req = requests.get(DUST_URL, dustparams, timeout=timeout)
+            req = transport.get(DUST_URL, dustparams, timeout=timeout)
             resp = req.text
 
             # see if we got an extinction table URL in the response
@@ -197,7 +206,7 @@ def extinction_query(lon, lat,
 
                 tableurl = tableurl[0]
 
-                req2 = requests.get(tableurl, timeout=timeout)
+                req2 = transport.get(tableurl, timeout=timeout)
 
                 # write the table to the cache directory
                 with open(cachefname,'wb') as outfd:
@@ -256,3 +265,517 @@ def extinction_query(lon, lat,
                                                                sizedeg)}
 
     return extdict
+
+
+
+def extinction_queries(lons,
+                       lats,
+                       coordtype='equatorial',
+                       sizedeg=5.0,
+                       forcefetch=False,
+                       cachedir='~/.astrobase/dust-cache',
+                       verbose=False,
+                       timeout=10.0,
+                       nworkers=None):
+    '''This queries the 2MASS DUST service for many coordinates at once.
+
+    lons, lats are lists or arrays of coordinates of the type given by
+    coordtype. The queries are run at the same time using up to nworkers
+    threads of the shared services transport, which also keeps the request
+    rate to the DUST service in check. Results already in cachedir aren't
+    fetched again unless forcefetch is True.
+
+    The other kwargs are the same as for extinction_query.
+
+    Returns a list of the dicts returned by extinction_query, one per
+    coordinate, in the same order as lons, lats. Failed queries get None.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    def _extinction_worker(coords):
+        return extinction_query(coords[0], coords[1],
+                                coordtype=coordtype,
+                                sizedeg=sizedeg,
+                                forcefetch=forcefetch,
+                                cachedir=cachedir,
+                                verbose=verbose,
+                                timeout=timeout)
+
+    return transport.batch(_extinction_worker,
+                           list(zip(lons, lats)),
+                           nworkers=nworkers)
+
+
+
+#############################
+## OFFLINE EXTINCTION GRID ##
+#############################
+
+# E(B-V) varies smoothly on arcminute scales, so instead of a DUST query for
+# every object in a field, we can sample the field once on a regular RA/Dec grid
+# and interpolate the extinction for all objects from that. The per-band
+# A_lambda/E(B-V) coefficients used by the DUST service are the same everywhere,
+# so a grid only needs the E(B-V) values at each node and a single table of
+# these coefficients. Grids are stored as .npz files.
+
+# this is where grids go by default. grids found here are used automatically by
+# grid_extinction_query, and by varclass.starfeatures.color_features if it's
+# called with extinction_grid=True.
+EXTINCTION_GRID_DIR = '~/.astrobase/dust-grids'
+
+# these hold the grids loaded so far keyed by their path (a grid is loaded again
+# if its file's mtime changes), and the list of grid files in each grid
+# directory along with the directory's mtime
+EXTINCTION_GRIDS = {}
+EXTINCTION_GRID_FILES = {}
+
+
+def write_extinction_grid(outfile,
+                          ramin,
+                          rastep,
+                          declmin,
+                          declstep,
+                          ebv_sf11,
+                          ebv_sfd98,
+                          filters,
+                          a_over_ebv_sf11,
+                          a_over_ebv_sfd98):
+    '''This writes an extinction grid to an .npz file.
+
+    ramin, rastep, declmin, declstep define the grid nodes in decimal
+    degrees. The node at row j, column i is at:
+
+    RA = ramin + i*rastep, Dec = declmin + j*declstep
+
+    ramin + (nra - 1)*rastep may be larger than 360.0 for grids crossing RA = 0.
+
+    ebv_sf11, ebv_sfd98 are 2D arrays of shape (ndecl, nra) with the E(B-V)
+    values from Schlafly & Finkbeiner (2011) and Schlegel et al. (1998) at each
+    node. Nodes without values should be nan.
+
+    filters is a list of the filter names from the DUST result table, and
+    a_over_ebv_sf11, a_over_ebv_sfd98 are the A_lambda/E(B-V) coefficients for
+    each of these filters.
+
+    Returns the path to the output file.
+
+    '''
+
+    ebv_sf11 = np.atleast_2d(np.asarray(ebv_sf11, dtype=np.float64))
+    ebv_sfd98 = np.atleast_2d(np.asarray(ebv_sfd98, dtype=np.float64))
+
+    if ebv_sf11.shape != ebv_sfd98.shape or min(ebv_sf11.shape) < 2:
+        LOGERROR('E(B-V) arrays must have the same shape '
+                 'and at least 2 nodes along each axis')
+        return None
+
+    if '~' in outfile:
+        outfile = os.path.expanduser(outfile)
+    if (os.path.dirname(outfile) and
+        not os.path.exists(os.path.dirname(outfile))):
+        os.makedirs(os.path.dirname(outfile))
+
+    with open(outfile,'wb') as outfd:
+        np.savez_compressed(
+            outfd,
+            ramin=ramin,
+            rastep=rastep,
+            declmin=declmin,
+            declstep=declstep,
+            ebv_sf11=ebv_sf11,
+            ebv_sfd98=ebv_sfd98,
+            filters=np.array(filters, dtype='U'),
+            a_over_ebv_sf11=np.asarray(a_over_ebv_sf11, dtype=np.float64),
+            a_over_ebv_sfd98=np.asarray(a_over_ebv_sfd98, dtype=np.float64)
+        )
+
+    # drop any older version of this grid loaded in this process
+    EXTINCTION_GRIDS.pop(os.path.abspath(outfile), None)
+
+    return outfile
+
+
+
+def load_extinction_grid(gridfile):
+    '''This loads an extinction grid written by write_extinction_grid.
+
+    Grids are kept in memory after they're loaded the first time, and are only
+    read again if the grid file's mtime changes.
+
+    Returns a dict with the grid arrays and the keys 'nra', 'ndecl', 'ramax',
+    'declmax', 'gridfile', and 'mtime'.
+
+    '''
+
+    gridfile = os.path.abspath(os.path.expanduser(gridfile))
+    gridmtime = os.stat(gridfile).st_mtime
+
+    if (gridfile in EXTINCTION_GRIDS and
+        EXTINCTION_GRIDS[gridfile]['mtime'] == gridmtime):
+        return EXTINCTION_GRIDS[gridfile]
+
+    with np.load(gridfile) as npzf:
+        grid = {x:npzf[x] for x in npzf.files}
+
+    for key in ('ramin','rastep','declmin','declstep'):
+        grid[key] = float(grid[key])
+
+    grid['filters'] = [str(x) for x in grid['filters']]
+    grid['ndecl'], grid['nra'] = grid['ebv_sf11'].shape
+    grid['ramax'] = grid['ramin'] + (grid['nra'] - 1)*grid['rastep']
+    grid['declmax'] = grid['declmin'] + (grid['ndecl'] - 1)*grid['declstep']
+    grid['gridfile'] = gridfile
+    grid['mtime'] = gridmtime
+
+    EXTINCTION_GRIDS[gridfile] = grid
+    return grid
+
+
+
+def _extinction_grid_indices(grid, ras, decls):
+    '''This returns the fractional grid indices for the coordinates.
+
+    Also returns a boolean array indicating which coordinates are inside the
+    grid.
+
+    '''
+
+    ras = np.atleast_1d(np.asarray(ras, dtype=np.float64))
+    decls = np.atleast_1d(np.asarray(decls, dtype=np.float64))
+
+    # wrap the RAs into the RA range of the grid
+    ras = (ras - grid['ramin']) % 360.0 + grid['ramin']
+
+    fra = (ras - grid['ramin'])/grid['rastep']
+    fdecl = (decls - grid['declmin'])/grid['declstep']
+
+    # allow for a bit of roundoff at the grid edges
+    inside = (
+        (fra > -1.0e-9) & (fra < grid['nra'] - 1 + 1.0e-9) &
+        (fdecl > -1.0e-9) & (fdecl < grid['ndecl'] - 1 + 1.0e-9)
+    )
+
+    return fra, fdecl, inside
+
+
+
+def extinction_from_grid(grid, ras, decls):
+    '''This interpolates the extinction for many coordinates from a grid.
+
+    grid is the path to a grid file or a grid dict from load_extinction_grid.
+
+    ras, decls are scalars or arrays of decimal equatorial coordinates. The
+    E(B-V) values at these are found by bilinear interpolation between the grid
+    nodes, then multiplied by the A_lambda/E(B-V) coefficients for each filter.
+
+    Returns a dict of the form:
+
+    {'ebv':{'sf11':array, 'sfd98':array},
+     'Amag':{filter name:{'sf11':array, 'sfd98':array}, ...},
+     'inside':boolean array, True where the coordinate is inside the grid}
+
+    with one element in each array per coordinate. Coordinates outside the grid
+    get nans.
+
+    '''
+
+    if not isinstance(grid, dict):
+        grid = load_extinction_grid(grid)
+
+    fra, fdecl, inside = _extinction_grid_indices(grid, ras, decls)
+
+    # the lower-left node of the cell each coordinate is in
+    ira = np.clip(np.floor(fra), 0, grid['nra'] - 2)
+    idecl = np.clip(np.floor(fdecl), 0, grid['ndecl'] - 2)
+    ira[~inside], idecl[~inside] = 0, 0
+    tra, tdecl = fra - ira, fdecl - idecl
+    ira, idecl = ira.astype(np.int64), idecl.astype(np.int64)
+
+    ebv = {}
+
+    for key in ('sf11','sfd98'):
+
+        ebvgrid = grid['ebv_%s' % key]
+
+        interp = (
+            ebvgrid[idecl, ira]*(1.0 - tra)*(1.0 - tdecl) +
+            ebvgrid[idecl, ira + 1]*tra*(1.0 - tdecl) +
+            ebvgrid[idecl + 1, ira]*(1.0 - tra)*tdecl +
+            ebvgrid[idecl + 1, ira + 1]*tra*tdecl
+        )
+        interp[~inside] = np.nan
+        ebv[key] = interp
+
+    amag = {
+        filt:{'sf11':sf11coeff*ebv['sf11'],
+              'sfd98':sfd98coeff*ebv['sfd98']}
+        for filt, sf11coeff, sfd98coeff in zip(grid['filters'],
+                                               grid['a_over_ebv_sf11'],
+                                               grid['a_over_ebv_sfd98'])
+    }
+
+    return {'ebv':ebv,
+            'Amag':amag,
+            'inside':inside}
+
+
+
+def _get_extinction_grids(griddir=None):
+    '''This returns all of the grids in griddir.
+
+    If griddir is None, looks in EXTINCTION_GRID_DIR. The grids are loaded with
+    load_extinction_grid, so only new or changed grid files are actually read.
+
+    '''
+
+    if griddir is None:
+        griddir = EXTINCTION_GRID_DIR
+    if '~' in griddir:
+        griddir = os.path.expanduser(griddir)
+
+    if not os.path.isdir(griddir):
+        return []
+
+    # only list the directory again if it changed
+    dirmtime = os.stat(griddir).st_mtime
+
+    if (griddir not in EXTINCTION_GRID_FILES or
+        EXTINCTION_GRID_FILES[griddir][0] != dirmtime):
+        EXTINCTION_GRID_FILES[griddir] = (
+            dirmtime,
+            sorted(glob.glob(os.path.join(griddir, '*.npz')))
+        )
+
+    grids = []
+
+    for gridfile in EXTINCTION_GRID_FILES[griddir][1]:
+
+        try:
+            grids.append(load_extinction_grid(gridfile))
+        except Exception as e:
+            LOGEXCEPTION('could not read extinction grid: %s' % gridfile)
+
+    return grids
+
+
+
+def find_extinction_grid(ra, decl, griddir=None):
+    '''This finds a grid in griddir that covers the given coordinates.
+
+    If griddir is None, looks in EXTINCTION_GRID_DIR.
+
+    Returns the grid dict from load_extinction_grid or None if there are no
+    grids covering ra, decl.
+
+    '''
+
+    for grid in _get_extinction_grids(griddir=griddir):
+        if _extinction_grid_indices(grid, ra, decl)[2][0]:
+            return grid
+
+    return None
+
+
+
+def grid_extinction_queries(ras,
+                            decls,
+                            grid=None,
+                            griddir=None):
+    '''This gets the extinction for many objects from extinction grids at once.
+
+    ras, decls are arrays of decimal equatorial coordinates.
+
+    If grid is None, uses the grids in griddir (EXTINCTION_GRID_DIR if griddir
+    is None). Each object gets its extinction from the first grid covering it,
+    like find_extinction_grid. Otherwise, grid is the path to a grid file or a
+    grid dict from load_extinction_grid.
+
+    Each grid is interpolated once for all of the objects it covers using
+    extinction_from_grid, so this is much faster than calling
+    grid_extinction_query for each object in a large field.
+
+    Returns a list with one item per object: a dict in the same form as the one
+    returned by grid_extinction_query, or None if there isn't a grid covering
+    the object or the grid has no values there.
+
+    '''
+
+    ras = np.atleast_1d(np.asarray(ras, dtype=np.float64))
+    decls = np.atleast_1d(np.asarray(decls, dtype=np.float64))
+
+    if grid is None:
+        grids = _get_extinction_grids(griddir=griddir)
+    elif isinstance(grid, dict):
+        grids = [grid]
+    else:
+        grids = [load_extinction_grid(grid)]
+
+    results = [None]*ras.size
+    remaining = np.isfinite(ras) & np.isfinite(decls)
+
+    for grid in grids:
+
+        inds = np.flatnonzero(remaining)
+        if inds.size == 0:
+            break
+
+        extinction = extinction_from_grid(grid, ras[inds], decls[inds])
+        good = extinction['inside'] & np.isfinite(extinction['ebv']['sf11'])
+
+        for gind in np.flatnonzero(good):
+
+            objind = inds[gind]
+            results[objind] = {
+                'Amag':{x:{'sf11':y['sf11'][gind], 'sfd98':y['sfd98'][gind]}
+                        for x, y in extinction['Amag'].items()},
+                'ebv':{x:y[gind] for x, y in extinction['ebv'].items()},
+                'gridfile':grid['gridfile'],
+                'provenance':'grid',
+                'request':'equatorial (%.3f, %.3f) from grid' % (ras[objind],
+                                                                 decls[objind])
+            }
+
+        # objects covered by this grid don't go on to the next one, even if
+        # the grid has no values for them
+        remaining[inds[extinction['inside']]] = False
+
+    return results
+
+
+
+def grid_extinction_query(ra,
+                          decl,
+                          grid=None,
+                          griddir=None):
+    '''This gets the extinction for a single object from an extinction grid.
+
+    If grid is None, looks for a grid covering ra, decl in griddir. Otherwise,
+    grid is the path to a grid file or a grid dict from load_extinction_grid.
+
+    Returns a dict with an 'Amag' key in the same form as the one returned by
+    extinction_query, so this can be used in place of it. Returns None if there
+    isn't a grid covering the object or the grid has no values there.
+
+    To get the extinction for many objects, use grid_extinction_queries instead.
+
+    '''
+
+    return grid_extinction_queries([ra], [decl],
+                                   grid=grid,
+                                   griddir=griddir)[0]
+
+
+
+def make_extinction_grid(ramin,
+                         ramax,
+                         declmin,
+                         declmax,
+                         gridstep_arcmin=6.0,
+                         outfile=None,
+                         sizedeg=5.0,
+                         forcefetch=False,
+                         cachedir='~/.astrobase/dust-cache',
+                         verbose=True,
+                         timeout=10.0,
+                         nworkers=None):
+    '''This samples the 2MASS DUST service on a grid covering a field.
+
+    ramin, ramax, declmin, declmax define the field in decimal degrees. If the
+    field crosses RA = 0, use ramin > ramax, e.g. ramin = 355.0, ramax = 5.0.
+
+    gridstep_arcmin is the spacing between the grid nodes along RA and Dec in
+    arcminutes.
+
+    The DUST queries for all nodes are run at the same time using up to
+    nworkers threads (see extinction_queries). The rest of the kwargs are
+    passed to extinction_query.
+
+    outfile is where the grid will be written. If None, the grid is written to
+    EXTINCTION_GRID_DIR, where it will be found automatically by
+    grid_extinction_query.
+
+    Returns the path to the grid file.
+
+    '''
+
+    if ramax < ramin:
+        ramax = ramax + 360.0
+
+    gridstep = gridstep_arcmin/60.0
+
+    nra = max(int(np.ceil((ramax - ramin)/gridstep)) + 1, 2)
+    ndecl = max(int(np.ceil((declmax - declmin)/gridstep)) + 1, 2)
+
+    noderas = ramin + np.arange(nra)*gridstep
+    nodedecls = declmin + np.arange(ndecl)*gridstep
+
+    gridras, griddecls = np.meshgrid(noderas, nodedecls)
+    gridras, griddecls = gridras.ravel(), griddecls.ravel()
+
+    LOGINFO('getting DUST extinction for %s x %s grid nodes' % (nra, ndecl))
+
+    results = extinction_queries(gridras % 360.0,
+                                 np.clip(griddecls, -90.0, 90.0),
+                                 sizedeg=sizedeg,
+                                 forcefetch=forcefetch,
+                                 cachedir=cachedir,
+                                 verbose=verbose,
+                                 timeout=timeout,
+                                 nworkers=nworkers)
+
+    ebv_sf11 = np.full(gridras.size, np.nan)
+    ebv_sfd98 = np.full(gridras.size, np.nan)
+    coefftable = None
+
+    for ind, res in enumerate(results):
+
+        if res is None:
+            continue
+
+        table = res['table']
+
+        # E(B-V) is the same for all filters, so take the median to be safe
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ebv_sf11[ind] = np.nanmedian(
+                table['A_SandF']/table['A_over_E_B_V_SandF']
+            )
+            ebv_sfd98[ind] = np.nanmedian(
+                table['A_SFD']/table['A_over_E_B_V_SFD']
+            )
+
+        if coefftable is None:
+            coefftable = table
+
+    if coefftable is None:
+        LOGERROR('all DUST queries failed, could not make an extinction grid')
+        return None
+
+    nfailed = np.sum(~np.isfinite(ebv_sf11))
+    if nfailed > 0:
+        LOGWARNING('DUST queries failed for %s of %s grid nodes, '
+                   'the extinction near these will be nan' %
+                   (nfailed, gridras.size))
+
+    if outfile is None:
+        gridkey = hashlib.sha256(
+            ('%.6f-%.6f-%.6f-%.6f-%.3f-%.3f' %
+             (ramin, ramax, declmin, declmax,
+              gridstep_arcmin, sizedeg)).encode()
+        ).hexdigest()[:16]
+        outfile = os.path.join(EXTINCTION_GRID_DIR, 'dustgrid-%s.npz' % gridkey)
+
+    return write_extinction_grid(
+        outfile,
+        ramin, gridstep,
+        declmin, gridstep,
+        ebv_sf11.reshape(ndecl, nra),
+        ebv_sfd98.reshape(ndecl, nra),
+        [str(x).strip() for x in coefftable['Filter_name']],
+        coefftable['A_over_E_B_V_SandF'],
+        coefftable['A_over_E_B_V_SFD']
+    )
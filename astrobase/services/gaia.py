@@ -103,9 +103,16 @@ import numpy as np
 
 import random
 
-# to do the queries
-import requests
-import requests.exceptions
+from ..lazyload import lazy_module
+
+# to do the queries. this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+# the requests are sent using the shared services transport
+from . import transport
+
+# for the spatial index of the field-level cache
+sps = lazy_module('scipy.spatial')
 
 # to read the XML returned by the TAP service
 from xml.dom.minidom import parseString
@@ -276,8 +283,8 @@ def tap_query(querystr,
 
             try:
 
-                resreq = requests.get(status_url,
-                                      timeout=timeout)
+                resreq = transport.get(status_url,
+                                       timeout=timeout)
 
                 resreq.raise_for_status()
 
@@ -367,7 +374,7 @@ def tap_query(querystr,
 
         try:
 
-            resreq = requests.get(result_url, timeout=timeout)
+            resreq = transport.get(result_url, timeout=timeout)
             resreq.raise_for_status()
 
             if cachefname.endswith('.gz'):
@@ -500,9 +507,9 @@ def tap_query(querystr,
 
                 try:
 
-                    req = requests.post(tapurl,
-                                        data=inputparams,
-                                        timeout=timeout)
+                    req = transport.post(tapurl,
+                                         data=inputparams,
+                                         timeout=timeout)
                     resp_status = req.status_code
                     req.raise_for_status()
 
@@ -671,7 +678,7 @@ def tap_query(querystr,
 
                     try:
 
-                        resreq = requests.get(status_url, timeout=timeout)
+                        resreq = transport.get(status_url, timeout=timeout)
                         resreq.raise_for_status()
 
                         # parse the response XML and get the job status
@@ -732,7 +739,7 @@ def tap_query(querystr,
 
             try:
 
-                resreq = requests.get(result_url, timeout=timeout)
+                resreq = transport.get(result_url, timeout=timeout)
                 resreq.raise_for_status()
 
                 if cachefname.endswith('.gz'):
@@ -1002,3 +1009,463 @@ def objectlist_radeclbox(radeclbox,
                      refresh=refresh,
                      maxtimeout=maxtimeout,
                      complete_query_later=complete_query_later)
+
+
+
+#################################
+## FIELD-LEVEL GAIA TILE CACHE ##
+#################################
+
+# These functions fetch the GAIA sources for a whole field at once, tiled on a
+# fixed grid on the sky, and answer cone searches for objects in the field from
+# a local spatially indexed cache of these tiles. This replaces one TAP query
+# per object with a few queries per field. Use it like so:
+#
+# fieldcat = get_field_catalog(field_ras, field_decls, 30.0)
+# for ra, decl in zip(field_ras, field_decls):
+#     objlist = field_conesearch(fieldcat, ra, decl, 30.0)
+
+# these are the columns fetched for each tile. these are the same as the ones
+# returned by objectlist_conesearch (field_conesearch adds dist_arcsec)
+FIELD_TILE_COLUMNS = ['source_id',
+                      'ra','dec',
+                      'phot_g_mean_mag',
+                      'l','b',
+                      'parallax','parallax_error',
+                      'pmra','pmra_error',
+                      'pmdec','pmdec_error']
+
+# the default size of each tile on the sky grid in degrees
+FIELD_TILE_SIZE = 0.5
+
+# this holds the tiles loaded in this process so far, keyed by their pickle
+# path. call FIELD_TILE_CACHE.clear() to free up memory when done with a field.
+FIELD_TILE_CACHE = {}
+
+
+def _radecl_to_xyz(ra, decl):
+    '''
+    This converts ra, decl in decimal degrees to an array of xyz unit vectors.
+
+    '''
+
+    ra, decl = np.radians(ra), np.radians(decl)
+    cosdecl = np.cos(decl)
+
+    return np.column_stack((np.cos(ra)*cosdecl,
+                            np.sin(ra)*cosdecl,
+                            np.sin(decl)))
+
+
+
+def _field_grid(tilesize):
+    '''This returns the number of tiles along RA and Dec on the sky grid.
+
+    The grid is the same for all fields, so tiles fetched for one field are
+    reused for any other field that overlaps it.
+
+    '''
+
+    nra = max(int(round(360.0/tilesize)), 1)
+    ndecl = max(int(round(180.0/tilesize)), 1)
+
+    return nra, ndecl
+
+
+
+def field_tiles_for_coords(ras,
+                           decls,
+                           searchradiusarcsec,
+                           tilesize=FIELD_TILE_SIZE):
+    '''This finds the tiles on the sky grid covering cones around coordinates.
+
+    ras, decls are scalars or arrays of coordinates in decimal degrees.
+
+    searchradiusarcsec is the radius of the cone around each coordinate.
+
+    tilesize is the size of each tile on the sky grid in degrees.
+
+    Returns a sorted list of (ra index, decl index) tuples, one for each tile.
+
+    '''
+
+    ras = np.atleast_1d(np.asarray(ras, dtype=np.float64))
+    decls = np.atleast_1d(np.asarray(decls, dtype=np.float64))
+    finiteind = np.isfinite(ras) & np.isfinite(decls)
+    ras, decls = ras[finiteind] % 360.0, decls[finiteind]
+
+    nra, ndecl = _field_grid(tilesize)
+    rawidth, declheight = 360.0/nra, 180.0/ndecl
+    radius = searchradiusarcsec/3600.0
+
+    decl_lo = np.clip(decls - radius, -90.0, 90.0)
+    decl_hi = np.clip(decls + radius, -90.0, 90.0)
+
+    # the cone is wider in RA away from the equator. cones that get too close
+    # to the poles need the whole ring of tiles in RA
+    maxabsdecl = np.maximum(np.abs(decl_lo), np.abs(decl_hi))
+    with np.errstate(divide='ignore'):
+        rahalfwidth = radius/np.cos(np.radians(maxabsdecl))
+    allra = (maxabsdecl >= 90.0) | (rahalfwidth >= 180.0)
+    rahalfwidth[allra] = 0.0
+
+    ira_lo = np.floor((ras - rahalfwidth)/rawidth).astype(np.int64)
+    ira_hi = np.floor((ras + rahalfwidth)/rawidth).astype(np.int64)
+    ira_lo[allra], ira_hi[allra] = 0, nra - 1
+
+    idecl_lo = np.clip(np.floor((decl_lo + 90.0)/declheight),
+                       0, ndecl - 1).astype(np.int64)
+    idecl_hi = np.clip(np.floor((decl_hi + 90.0)/declheight),
+                       0, ndecl - 1).astype(np.int64)
+
+    if ras.size == 0:
+        return []
+
+    # most cones in a field fall in the same few tile ranges
+    tileranges = np.unique(np.column_stack((ira_lo, ira_hi,
+                                            idecl_lo, idecl_hi)),
+                           axis=0)
+
+    tiles = set()
+
+    for ralo, rahi, decllo, declhi in tileranges:
+        for ira in range(ralo, rahi + 1):
+            for idecl in range(decllo, declhi + 1):
+                tiles.add((int(ira % nra), int(idecl)))
+
+    return sorted(tiles)
+
+
+
+def _field_tile_pickle(tilekey, tilesize, columns, cachedir):
+    '''
+    This returns the path to the pickle for a tile in cachedir.
+
+    '''
+
+    tilehash = hashlib.sha256(
+        repr((float(tilesize), list(columns))).encode()
+    ).hexdigest()[:12]
+
+    return os.path.join(
+        cachedir,
+        'field-tiles',
+        'tile-%s-%05i-%05i.pkl' % (tilehash, tilekey[0], tilekey[1])
+    )
+
+
+
+def _read_field_tile_csv(csvfile):
+    '''This reads the gzipped CSV result of a tile query.
+
+    Returns a structured array with one field for each column in the CSV.
+
+    '''
+
+    with gzip.open(csvfile,'rb') as infd:
+        lines = infd.read().decode().splitlines()
+
+    colnames = [x.strip().strip('"') for x in lines[0].split(',')]
+    dtype = [(x, 'U20' if x == 'source_id' else 'f8') for x in colnames]
+    datalines = [x for x in lines[1:] if len(x.strip()) > 0]
+
+    if len(datalines) == 0:
+        return np.array([], dtype=dtype)
+
+    # empty values in the float columns become nans
+    objects = np.genfromtxt(datalines,
+                            delimiter=',',
+                            dtype=dtype,
+                            autostrip=True)
+
+    return np.atleast_1d(objects)
+
+
+
+def get_field_tile(tilekey,
+                   tilesize=FIELD_TILE_SIZE,
+                   columns=FIELD_TILE_COLUMNS,
+                   gaia_mirror=None,
+                   forcefetch=False,
+                   cachedir='~/.astrobase/gaia-cache',
+                   verbose=True,
+                   timeout=60.0,
+                   refresh=2.0,
+                   maxtimeout=700.0,
+                   complete_query_later=True):
+    '''This gets a single tile on the sky grid from the GAIA TAP service.
+
+    tilekey is an (ra index, decl index) tuple from field_tiles_for_coords.
+
+    The GAIA sources in the tile are written to a pickle in the field-tiles
+    subdirectory of cachedir, and the tile is only fetched again if forcefetch
+    is True. The other kwargs are passed to tap_query.
+
+    Returns the path to the tile pickle or None if the query failed.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+
+    tilepkl = _field_tile_pickle(tilekey, tilesize, columns, cachedir)
+
+    if not forcefetch and os.path.exists(tilepkl):
+        return tilepkl
+
+    if not os.path.exists(os.path.dirname(tilepkl)):
+        try:
+            os.makedirs(os.path.dirname(tilepkl))
+        except OSError:
+            pass
+
+    nra, ndecl = _field_grid(tilesize)
+    rawidth, declheight = 360.0/nra, 180.0/ndecl
+
+    ra_min = tilekey[0]*rawidth
+    decl_min = -90.0 + tilekey[1]*declheight
+
+    # NOTE: we use plain RA/Dec ranges here instead of BOX so the tiles don't
+    # overlap each other. the top row of tiles includes the pole itself.
+    query = (
+        "select {columns} from {{table}} where "
+        "{{table}}.ra >= {ra_min:.8f} and {{table}}.ra < {ra_max:.8f} and "
+        "{{table}}.dec >= {decl_min:.8f} and {{table}}.dec {decl_op} "
+        "{decl_max:.8f}"
+    )
+
+    formatted_query = query.format(
+        columns=', '.join(columns),
+        ra_min=ra_min,
+        ra_max=ra_min + rawidth,
+        decl_min=decl_min,
+        decl_max=decl_min + declheight,
+        decl_op='<=' if tilekey[1] == (ndecl - 1) else '<'
+    )
+
+    tileres = tap_query(formatted_query,
+                        gaia_mirror=gaia_mirror,
+                        returnformat='csv',
+                        forcefetch=forcefetch,
+                        cachedir=cachedir,
+                        verbose=verbose,
+                        timeout=timeout,
+                        refresh=refresh,
+                        maxtimeout=maxtimeout,
+                        complete_query_later=complete_query_later)
+
+    if not tileres:
+        LOGERROR('GAIA query failed for field tile: %s' % repr(tilekey))
+        return None
+
+    try:
+
+        objects = _read_field_tile_csv(tileres['result'])
+
+        tiledict = {'tilekey':tilekey,
+                    'tilesize':tilesize,
+                    'box':[ra_min, ra_min + rawidth,
+                           decl_min, decl_min + declheight],
+                    'columns':list(columns),
+                    'query':formatted_query,
+                    'objects':objects}
+
+        # write to a temp file first so other processes never see half a tile
+        tmppkl = '%s.tmp-%s' % (tilepkl, os.getpid())
+        with open(tmppkl,'wb') as outfd:
+            pickle.dump(tiledict, outfd, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppkl, tilepkl)
+
+        if verbose:
+            LOGINFO('GAIA field tile %s: %s objects' % (repr(tilekey),
+                                                        objects.size))
+
+        return tilepkl
+
+    except Exception as e:
+
+        LOGEXCEPTION('could not read GAIA result for field tile: %s from %s' %
+                     (repr(tilekey), tileres['result']))
+        return None
+
+
+
+def load_field_tile(tilepkl):
+    '''This loads a tile pickle and builds its spatial index.
+
+    Tiles are kept in FIELD_TILE_CACHE after they're loaded, so repeated cone
+    searches in the same field only read each tile from disk once.
+
+    Returns the tile dict with a 'kdtree' key added. This is a cKDTree built on
+    the xyz unit vectors of the objects in the tile, or None if the tile is
+    empty.
+
+    '''
+
+    if tilepkl in FIELD_TILE_CACHE:
+        return FIELD_TILE_CACHE[tilepkl]
+
+    with open(tilepkl,'rb') as infd:
+        tiledict = pickle.load(infd)
+
+    objects = tiledict['objects']
+
+    if objects.size > 0:
+        tiledict['kdtree'] = sps.cKDTree(
+            _radecl_to_xyz(objects['ra'], objects['dec'])
+        )
+    else:
+        tiledict['kdtree'] = None
+
+    FIELD_TILE_CACHE[tilepkl] = tiledict
+    return tiledict
+
+
+
+def get_field_catalog(ras,
+                      decls,
+                      searchradiusarcsec,
+                      tilesize=FIELD_TILE_SIZE,
+                      columns=FIELD_TILE_COLUMNS,
+                      gaia_mirror=None,
+                      forcefetch=False,
+                      cachedir='~/.astrobase/gaia-cache',
+                      verbose=True,
+                      timeout=60.0,
+                      refresh=2.0,
+                      maxtimeout=700.0,
+                      complete_query_later=True,
+                      nworkers=4):
+    '''This gets the GAIA sources for a field from the tiled local cache.
+
+    ras, decls are arrays of the coordinates of the objects in the field in
+    decimal degrees.
+
+    searchradiusarcsec is the largest cone search radius that will be used with
+    field_conesearch for these objects.
+
+    All tiles on the sky grid needed to cover the cones around the objects are
+    fetched from the GAIA TAP service if they're not in cachedir already. Up to
+    nworkers tiles are fetched at the same time. The rest of the kwargs are
+    passed to get_field_tile.
+
+    Returns a dict of the form:
+
+    {'tilesize': tile size in degrees,
+     'columns': list of columns in each tile,
+     'searchradiusarcsec': the input search radius,
+     'tiles': {(ra index, decl index): path to tile pickle},
+     'failedtiles': list of (ra index, decl index) of tiles that failed}
+
+    This is passed to field_conesearch and can be sent to worker processes
+    cheaply, since the tiles themselves are only loaded when needed.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+
+    tiles = field_tiles_for_coords(ras, decls, searchradiusarcsec,
+                                   tilesize=tilesize)
+
+    LOGINFO('%s objects in field are covered by %s GAIA tiles '
+            'of size %.3f deg' % (np.size(ras), len(tiles), tilesize))
+
+    def _tile_worker(tilekey):
+        return get_field_tile(tilekey,
+                              tilesize=tilesize,
+                              columns=columns,
+                              gaia_mirror=gaia_mirror,
+                              forcefetch=forcefetch,
+                              cachedir=cachedir,
+                              verbose=verbose,
+                              timeout=timeout,
+                              refresh=refresh,
+                              maxtimeout=maxtimeout,
+                              complete_query_later=complete_query_later)
+
+    # the tile queries spend most of their time waiting on the TAP service, so
+    # threads are enough to run them at the same time
+    tilepkls = transport.batch(_tile_worker, tiles, nworkers=nworkers)
+
+    fieldcat = {'tilesize':tilesize,
+                'columns':list(columns),
+                'searchradiusarcsec':searchradiusarcsec,
+                'tiles':{x:y for x, y in zip(tiles, tilepkls) if y is not None},
+                'failedtiles':[x for x, y in zip(tiles, tilepkls) if y is None]}
+
+    if fieldcat['failedtiles']:
+        LOGWARNING('%s GAIA tiles could not be fetched, cone searches '
+                   'that need these will fail' % len(fieldcat['failedtiles']))
+
+    return fieldcat
+
+
+
+def field_conesearch(fieldcat,
+                     racenter,
+                     declcenter,
+                     searchradiusarcsec):
+    '''This does a cone search using the field-level tile cache.
+
+    fieldcat is the dict returned by get_field_catalog.
+
+    Uses a conesearch around racenter, declcenter with radius in arcsec of
+    searchradiusarcsec.
+
+    Returns a structured array of the objects in the cone with the same columns
+    as the result of objectlist_conesearch, including the dist_arcsec column,
+    sorted by distance from the center of the cone. Returns None if the cone
+    isn't completely covered by the tiles in fieldcat.
+
+    '''
+
+    tiles = field_tiles_for_coords(racenter, declcenter, searchradiusarcsec,
+                                   tilesize=fieldcat['tilesize'])
+
+    if len(tiles) == 0 or any(x not in fieldcat['tiles'] for x in tiles):
+        LOGINFO('GAIA field cache does not cover cone of radius %.3f arcsec '
+                'around (%.5f, %.5f)' % (searchradiusarcsec,
+                                         racenter, declcenter))
+        return None
+
+    xyz = _radecl_to_xyz(racenter, declcenter)[0]
+    xyzdist = 2.0*np.sin(np.radians(searchradiusarcsec/3600.0)/2.0)
+
+    matches = []
+    dtype = None
+
+    for tilekey in tiles:
+
+        tiledict = load_field_tile(fieldcat['tiles'][tilekey])
+        dtype = tiledict['objects'].dtype
+
+        if tiledict['kdtree'] is None:
+            continue
+
+        matchind = tiledict['kdtree'].query_ball_point(xyz, xyzdist)
+
+        if len(matchind) > 0:
+            matches.append(tiledict['objects'][np.array(matchind)])
+
+    if matches:
+        objects = np.concatenate(matches)
+    else:
+        objects = np.array([], dtype=dtype)
+
+    objlist = np.empty(objects.size,
+                       dtype=dtype.descr + [('dist_arcsec','f8')])
+
+    for col in dtype.names:
+        objlist[col] = objects[col]
+
+    if objects.size > 0:
+        chorddist = np.sqrt(
+            np.sum((_radecl_to_xyz(objects['ra'], objects['dec']) - xyz)**2,
+                   axis=1)
+        )
+        objlist['dist_arcsec'] = (
+            np.degrees(2.0*np.arcsin(np.clip(chorddist/2.0, 0.0, 1.0)))*3600.0
+        )
+
+    return objlist[np.argsort(objlist['dist_arcsec'], kind='mergesort')]
@@ -195,6 +195,13 @@ except:
     from urllib.request import urlretrieve, urlopen
     from urllib.parse import urlencode
 
+# if this module is used as part of astrobase, we'll use the shared services
+# transport to get light curves for lists of objects at the same time
+try:
+    from .transport import batch
+except Exception as e:
+    batch = None
+
 
 ####################
 ## API KEY CONFIG ##
@@ -311,9 +318,10 @@ def hatlcs_for_objectlist(objectidlist,
     All args and kwargs are the same as for get_hatlc, except for:
 
     nworkers: the total number of parallel workers to use when getting the light
-    curves. By default, this is equal to the number of visible CPUs on your
-    machine. There will be a random delay enforced for each worker's download
-    job.
+    curves. By default, this is the number of threads used by the shared
+    services transport (see astrobase.services.transport).
+
+    Returns a dict of the form {objectid: result of hatlc_for_object}.
 
     '''
 
@@ -323,6 +331,22 @@ def hatlcs_for_objectlist(objectidlist,
             LOGERROR("no API key available, can't continue")
             return None
 
+    def _hatlc_worker(objectid):
+        return hatlc_for_object(objectid,
+                                hatproject,
+                                datarelease=datarelease,
+                                anonmode=anonmode,
+                                outdir=outdir,
+                                lcformat=lcformat)
+
+    # if we're running standalone, there's no transport, so do these one by one
+    if batch is not None:
+        results = batch(_hatlc_worker, objectidlist, nworkers=nworkers)
+    else:
+        results = [_hatlc_worker(x) for x in objectidlist]
+
+    return {x:y for x, y in zip(objectidlist, results)}
+
 
 
 def hatlcs_at_radec(coordstring,
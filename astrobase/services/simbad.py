@@ -94,9 +94,13 @@ import numpy as np
 
 import random
 
-# to do the queries
-import requests
-import requests.exceptions
+from ..lazyload import lazy_module
+
+# to do the queries. this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+# this pools connections to the TAP service and retries failed requests
+from . import transport
 
 # to read the XML returned by the TAP service
 from xml.dom.minidom import parseString
@@ -250,8 +254,8 @@ def tap_query(querystr,
 
             try:
 
-                resreq = requests.get(status_url,
-                                      timeout=timeout)
+                resreq = transport.get(status_url,
+                                       timeout=timeout)
 
                 resreq.raise_for_status()
 
@@ -341,7 +345,7 @@ def tap_query(querystr,
 
         try:
 
-            resreq = requests.get(result_url, timeout=timeout)
+            resreq = transport.get(result_url, timeout=timeout)
             resreq.raise_for_status()
 
             if cachefname.endswith('.gz'):
@@ -476,9 +480,9 @@ def tap_query(querystr,
 
                 try:
 
-                    req = requests.post(tapurl,
-                                        data=inputparams,
-                                        timeout=timeout)
+                    req = transport.post(tapurl,
+                                         data=inputparams,
+                                         timeout=timeout)
                     resp_status = req.status_code
                     req.raise_for_status()
 
@@ -651,7 +655,7 @@ def tap_query(querystr,
 
                     try:
 
-                        resreq = requests.get(status_url, timeout=timeout)
+                        resreq = transport.get(status_url, timeout=timeout)
                         resreq.raise_for_status()
 
                         # parse the response XML and get the job status
@@ -712,7 +716,7 @@ def tap_query(querystr,
 
             try:
 
-                resreq = requests.get(result_url, timeout=timeout)
+                resreq = transport.get(result_url, timeout=timeout)
                 resreq.raise_for_status()
 
                 if cachefname.endswith('.gz'):
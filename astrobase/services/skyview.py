@@ -84,18 +84,27 @@ import hashlib
 import time
 import re
 import json
+import threading
+from collections import OrderedDict
 
 import numpy as np
 
-# to do the queries
-import requests
-import requests.exceptions
+from ..lazyload import lazy_module, lazy_object
+
+# to do the queries. this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+# for pooled connections and retries when fetching stamps
+from . import transport
+
 try:
     from urllib.parse import urljoin
 except:
     from urlparse import urljoin
 
-import astropy.io.fits as pyfits
+# to read the FITS stamps
+pyfits = lazy_module('astropy.io.fits')
+WCS = lazy_object('astropy.wcs', 'WCS')
 
 ###################
 ## FORM SETTINGS ##
@@ -161,7 +170,9 @@ def get_stamp(ra, decl,
 
     formparams = SKYVIEW_PARAMS.copy()
     formparams['Position'] = formposition
-    formparams['survey'][0] = survey
+    # copy the survey list so we don't change the module-level default, which
+    # may be in use by other threads at the same time
+    formparams['survey'] = [survey] + SKYVIEW_PARAMS['survey'][1:]
     formparams['scaling'] = formscaling
     formparams['pixels'] = ['%s' % sizepix]
 
@@ -203,7 +214,7 @@ def get_stamp(ra, decl,
                     scaling,
                     sizepix)
                 )
-            req = requests.get(SKYVIEW_URL, params=formparams, timeout=timeout)
+            req = transport.get(SKYVIEW_URL, params=formparams, timeout=timeout)
             req.raise_for_status()
 
             # get the text of the response, this includes the locations of the
@@ -223,11 +234,14 @@ def get_stamp(ra, decl,
                     if verbose:
                         LOGINFO('getting %s' % fullfitsurl)
 
-                    fitsreq = requests.get(fullfitsurl, timeout=timeout)
+                    fitsreq = transport.get(fullfitsurl, timeout=timeout)
 
                     with gzip.open(cachefname,'wb') as outfd:
                         outfd.write(fitsreq.content)
 
+                    _note_cache_download(cachedir,
+                                         os.path.getsize(cachefname))
+
             else:
                 LOGERROR('no FITS URLs found in query results for %s' %
                          formposition)
@@ -253,6 +267,9 @@ def get_stamp(ra, decl,
     # DONE WITH FETCHING STUFF
     #
 
+    if provenance == 'cache':
+        _touch_cached(cachefname)
+
     # make sure the returned file is OK
     try:
         stampfits = pyfits.open(cachefname)
@@ -279,3 +296,522 @@ def get_stamp(ra, decl,
     }
 
     return retdict
+
+
+
+def get_stamps(ras,
+               decls,
+               survey='DSS2 Red',
+               scaling='Linear',
+               sizepix=300,
+               forcefetch=False,
+               cachedir='~/.astrobase/stamp-cache',
+               timeout=10.0,
+               verbose=False,
+               nworkers=None):
+    '''This gets FITS cutouts for many coordinates at once.
+
+    ras, decls are lists or arrays of decimal equatorial coordinates for the
+    cutout centers. The stamps are fetched at the same time using up to nworkers
+    threads of the shared services transport (see transport.py), which also
+    takes care of rate-limiting requests to SkyView. Stamps already in cachedir
+    aren't fetched again unless forcefetch is True.
+
+    The other kwargs are the same as for get_stamp.
+
+    Returns a list of the dicts returned by get_stamp, one per coordinate, in
+    the same order as ras, decls. Failed requests get None.
+
+    '''
+
+    # make the cachedir here so the threads don't race to do it
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    def _stamp_worker(coords):
+        return get_stamp(coords[0], coords[1],
+                         survey=survey,
+                         scaling=scaling,
+                         sizepix=sizepix,
+                         forcefetch=forcefetch,
+                         cachedir=cachedir,
+                         timeout=timeout,
+                         verbose=verbose)
+
+    return transport.batch(_stamp_worker,
+                           list(zip(ras, decls)),
+                           nworkers=nworkers)
+
+
+
+##############################
+## FIELD MOSAIC STAMP CACHE ##
+##############################
+
+# most objects in a field are within a few arcminutes of each other, so instead
+# of getting a separate stamp for each object, we can get larger mosaic cutouts
+# of the field on a fixed grid and cut out a stamp for each object from the
+# mosaic covering it. mosaics are stored uncompressed in the stamp cache so they
+# can be memory-mapped.
+
+# the default size of each mosaic in degrees and pixels. the pixel scale of the
+# stamps cut from a mosaic is the same as that of the mosaic, 3 arcsec/px by
+# default, so a 300 x 300 px stamp covers 15 x 15 arcmin.
+MOSAIC_SIZEDEG = 1.0
+MOSAIC_SIZEPIX = 1200
+
+# the max size of the stamp cache in MB. when it gets larger than this, the
+# least recently used files in it are removed. if None, there is no limit.
+STAMP_CACHE_MAXSIZE = 2048.0
+
+# the mosaics we've opened in this process, most recently used last
+MOSAIC_OPEN_MAX = 8
+MOSAIC_OPEN = OrderedDict()
+
+# the size of each cache directory in bytes we've seen so far
+STAMP_CACHE_SIZES = {}
+
+MOSAIC_LOCK = threading.Lock()
+
+
+def mosaic_for_coords(ra, decl,
+                      mosaicsizedeg=MOSAIC_SIZEDEG,
+                      stampsizedeg=0.25):
+    '''This finds the mosaic that covers a stamp centered at ra, decl.
+
+    The mosaics are centered on a grid with a spacing in Dec set so that any
+    stamp of size stampsizedeg will fit entirely in one mosaic of size
+    mosaicsizedeg. The number of mosaics along each Dec band is set so their
+    spacing in RA is about the same.
+
+    Returns a tuple of the form:
+
+    ((Dec band index, RA index), RA of mosaic center, Dec of mosaic center)
+
+    '''
+
+    step = 0.9*(mosaicsizedeg - stampsizedeg)
+
+    idecl = int(np.round((decl + 90.0)/step))
+    declcenter = min(max(-90.0 + idecl*step, -90.0), 90.0)
+
+    # the RA spacing is set by the edge of the Dec band closest to the pole
+    edgedecl = min(abs(declcenter) + step/2.0, 90.0)
+    nra = max(int(np.ceil(360.0*np.cos(np.radians(edgedecl))/step)), 1)
+
+    ira = int(np.round((ra % 360.0)/(360.0/nra))) % nra
+    racenter = ira*360.0/nra
+
+    return (idecl, ira), racenter, declcenter
+
+
+
+def _touch_cached(cachefname):
+    '''
+    This marks a cached file as used, so it's kept longer by prune_stamp_cache.
+
+    '''
+
+    try:
+        os.utime(cachefname, None)
+    except OSError:
+        pass
+
+
+
+def prune_stamp_cache(cachedir='~/.astrobase/stamp-cache',
+                      maxsizemb=None):
+    '''This removes the least recently used files from the stamp cache.
+
+    Files are removed, oldest first by their last use, until the total size of
+    the cache is less than maxsizemb. If maxsizemb is None, uses
+    STAMP_CACHE_MAXSIZE. If that's also None, nothing is removed.
+
+    Returns a dict of the form:
+
+    {'nfiles': number of files left in the cache,
+     'sizemb': size of the files left in the cache in MB,
+     'removed': list of files removed}
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+
+    if maxsizemb is None:
+        maxsizemb = STAMP_CACHE_MAXSIZE
+
+    cachedfiles = []
+
+    for root, dirs, files in os.walk(cachedir):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            try:
+                fstat = os.stat(fpath)
+                cachedfiles.append((fstat.st_mtime, fstat.st_size, fpath))
+            except OSError:
+                pass
+
+    cachedfiles.sort()
+    cachesize = sum(x[1] for x in cachedfiles)
+    removed = []
+
+    if maxsizemb is not None:
+
+        maxsize = maxsizemb*1024.0*1024.0
+
+        while cachedfiles and cachesize > maxsize:
+
+            fmtime, fsize, fpath = cachedfiles.pop(0)
+
+            try:
+                os.remove(fpath)
+                removed.append(fpath)
+            except OSError:
+                pass
+
+            cachesize = cachesize - fsize
+
+        if removed:
+            LOGINFO('removed %s least recently used files from '
+                    'stamp cache: %s' % (len(removed), cachedir))
+
+    with MOSAIC_LOCK:
+        STAMP_CACHE_SIZES[os.path.abspath(cachedir)] = cachesize
+
+    return {'nfiles':len(cachedfiles),
+            'sizemb':cachesize/1024.0/1024.0,
+            'removed':removed}
+
+
+
+def _note_cache_download(cachedir, nbytes):
+    '''This keeps track of the cache size, and prunes the cache if it's too big.
+
+    The cache directory is only listed the first time this is called for it
+    in this process, and again when it needs to be pruned.
+
+    '''
+
+    if STAMP_CACHE_MAXSIZE is None:
+        return
+
+    cachedir = os.path.abspath(cachedir)
+
+    with MOSAIC_LOCK:
+        cachesize = STAMP_CACHE_SIZES.get(cachedir)
+        if cachesize is not None:
+            cachesize = cachesize + nbytes
+            STAMP_CACHE_SIZES[cachedir] = cachesize
+
+    if cachesize is None:
+        cachesize = prune_stamp_cache(cachedir)['sizemb']*1024.0*1024.0
+
+    if cachesize > STAMP_CACHE_MAXSIZE*1024.0*1024.0:
+        prune_stamp_cache(cachedir)
+
+
+
+def get_mosaic(racenter,
+               declcenter,
+               survey='DSS2 Red',
+               scaling='Linear',
+               mosaicsizedeg=MOSAIC_SIZEDEG,
+               mosaicsizepix=MOSAIC_SIZEPIX,
+               forcefetch=False,
+               cachedir='~/.astrobase/stamp-cache',
+               timeout=10.0,
+               verbose=True):
+    '''This gets a mosaic cutout from SkyView and puts it in the stamp cache.
+
+    racenter, declcenter are the center of the mosaic, usually one of the grid
+    centers from mosaic_for_coords. mosaicsizedeg and mosaicsizepix are the size
+    of the mosaic in degrees and pixels. The rest of the kwargs are the same as
+    for get_stamp.
+
+    Mosaics are written uncompressed to the mosaics subdirectory of cachedir.
+
+    Returns the path to the mosaic FITS or None if it couldn't be fetched.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+
+    mosaicdir = os.path.join(cachedir, 'mosaics')
+    if not os.path.exists(mosaicdir):
+        try:
+            os.makedirs(mosaicdir)
+        except OSError:
+            pass
+
+    formposition = '%.4f, %.4f' % (racenter, declcenter)
+
+    cachekey = '%s-%s-%s-%.4f-%s' % (formposition, survey, scaling,
+                                     mosaicsizedeg, mosaicsizepix)
+    cachekey = hashlib.sha256(cachekey.encode()).hexdigest()
+    cachefname = os.path.join(mosaicdir, 'mosaic-%s.fits' % cachekey)
+
+    if not forcefetch and os.path.exists(cachefname):
+        _touch_cached(cachefname)
+        return cachefname
+
+    formparams = SKYVIEW_PARAMS.copy()
+    formparams['Position'] = [formposition]
+    formparams['survey'] = [survey] + SKYVIEW_PARAMS['survey'][1:]
+    formparams['scaling'] = [scaling]
+    formparams['pixels'] = ['%s' % mosaicsizepix]
+    formparams['size'] = ['%.4f' % mosaicsizedeg]
+
+    try:
+
+        if verbose:
+            LOGINFO('submitting mosaic request for %s, %s, %s, %.2f deg' %
+                    (formposition, survey, scaling, mosaicsizedeg))
+
+        req = transport.get(SKYVIEW_URL, params=formparams, timeout=timeout)
+        req.raise_for_status()
+
+        fitsurls = FITS_REGEX.findall(req.text)
+
+        if not fitsurls:
+            LOGERROR('no FITS URLs found in query results for mosaic at %s' %
+                     formposition)
+            return None
+
+        fitsreq = transport.get(urljoin(FITS_BASEURL, fitsurls[0]),
+                                timeout=timeout)
+        fitsreq.raise_for_status()
+
+        # write to a temp file first so other processes never see a partial
+        # mosaic, then move it into place
+        tempfname = '%s.tmp-%s' % (cachefname, os.getpid())
+        with open(tempfname,'wb') as outfd:
+            outfd.write(fitsreq.content)
+        os.rename(tempfname, cachefname)
+
+    except requests.exceptions.Timeout as e:
+        LOGERROR('SkyView mosaic request for %s did not '
+                 'complete within %s seconds' % (formposition, timeout))
+        return None
+
+    except Exception as e:
+        LOGEXCEPTION('SkyView mosaic request for %s failed' % formposition)
+        return None
+
+    # forget any older version of this mosaic we have open
+    with MOSAIC_LOCK:
+        oldmosaic = MOSAIC_OPEN.pop(cachefname, None)
+    if oldmosaic is not None:
+        oldmosaic[0].close()
+
+    _note_cache_download(cachedir, os.path.getsize(cachefname))
+
+    return cachefname
+
+
+
+def _open_mosaic(mosaicfile):
+    '''This opens a mosaic FITS with its data memory-mapped.
+
+    Returns a tuple of (HDUList, data, header, WCS). The last few mosaics used
+    are kept open.
+
+    '''
+
+    with MOSAIC_LOCK:
+        if mosaicfile in MOSAIC_OPEN:
+            MOSAIC_OPEN[mosaicfile] = MOSAIC_OPEN.pop(mosaicfile)
+            return MOSAIC_OPEN[mosaicfile]
+
+    hdulist = pyfits.open(mosaicfile, memmap=True)
+    header = hdulist[0].header
+    mosaic = (hdulist, hdulist[0].data, header, WCS(header))
+
+    closed = []
+
+    with MOSAIC_LOCK:
+        MOSAIC_OPEN[mosaicfile] = mosaic
+        while len(MOSAIC_OPEN) > MOSAIC_OPEN_MAX:
+            closed.append(MOSAIC_OPEN.popitem(last=False)[1])
+
+    for oldmosaic in closed:
+        oldmosaic[0].close()
+
+    return mosaic
+
+
+
+def get_stamp_from_mosaic(ra, decl,
+                          survey='DSS2 Red',
+                          scaling='Linear',
+                          sizepix=300,
+                          mosaicsizedeg=MOSAIC_SIZEDEG,
+                          mosaicsizepix=MOSAIC_SIZEPIX,
+                          forcefetch=False,
+                          cachedir='~/.astrobase/stamp-cache',
+                          timeout=10.0,
+                          verbose=True):
+    '''This gets a stamp centered at ra, decl cut out from a field mosaic.
+
+    The mosaic covering ra, decl is fetched from SkyView if it's not in the
+    stamp cache already (see get_mosaic and mosaic_for_coords), then a stamp of
+    sizepix x sizepix pixels is cut out of it around ra, decl. The stamp has the
+    pixel scale of the mosaic: mosaicsizedeg/mosaicsizepix deg/px.
+
+    If the stamp doesn't fit entirely in the grid mosaic, which can happen near
+    the poles, a mosaic the size of the stamp centered at ra, decl is fetched
+    instead.
+
+    Returns a dict like the one from get_stamp, with the extra keys 'stamp' for
+    the stamp image array and 'header' for its FITS header, including the WCS
+    for the stamp. 'fitsfile' is the mosaic the stamp was cut from.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+
+    stampsizedeg = sizepix*mosaicsizedeg/mosaicsizepix
+
+    mosaickey, racenter, declcenter = mosaic_for_coords(
+        ra, decl,
+        mosaicsizedeg=mosaicsizedeg,
+        stampsizedeg=stampsizedeg
+    )
+
+    for thissizedeg, thissizepix in ((mosaicsizedeg, mosaicsizepix),
+                                     (stampsizedeg, sizepix)):
+
+        mosaicfile = get_mosaic(racenter, declcenter,
+                                survey=survey,
+                                scaling=scaling,
+                                mosaicsizedeg=thissizedeg,
+                                mosaicsizepix=thissizepix,
+                                forcefetch=forcefetch,
+                                cachedir=cachedir,
+                                timeout=timeout,
+                                verbose=verbose)
+
+        if mosaicfile is None:
+            return None
+
+        try:
+            hdulist, data, header, wcs = _open_mosaic(mosaicfile)
+        except Exception as e:
+            LOGEXCEPTION('could not open mosaic %s, removing it' % mosaicfile)
+            os.remove(mosaicfile)
+            return None
+
+        xcenter, ycenter = wcs.all_world2pix([[ra, decl]], 0)[0]
+        xmin = int(np.round(xcenter)) - sizepix//2
+        ymin = int(np.round(ycenter)) - sizepix//2
+
+        if (xmin >= 0 and ymin >= 0 and
+            xmin + sizepix <= data.shape[1] and
+            ymin + sizepix <= data.shape[0]):
+            break
+
+        if verbose:
+            LOGWARNING('stamp for (%.3f, %.3f) does not fit in '
+                       'mosaic %s, getting a separate stamp' %
+                       (ra, decl, repr(mosaickey)))
+
+        racenter, declcenter = ra, decl
+        mosaickey = None
+
+    else:
+
+        LOGERROR('could not cut out a stamp for (%.3f, %.3f)' % (ra, decl))
+        return None
+
+    _touch_cached(mosaicfile)
+
+    # copy the stamp out of the memory-mapped mosaic and shift the WCS
+    # reference pixel to match
+    stamp = np.array(data[ymin:ymin+sizepix, xmin:xmin+sizepix])
+    stampheader = header.copy()
+    stampheader['NAXIS1'] = sizepix
+    stampheader['NAXIS2'] = sizepix
+    stampheader['CRPIX1'] = header['CRPIX1'] - xmin
+    stampheader['CRPIX2'] = header['CRPIX2'] - ymin
+
+    return {
+        'params':{'ra':ra,
+                  'decl':decl,
+                  'survey':survey,
+                  'scaling':scaling,
+                  'sizepix':sizepix,
+                  'mosaic':mosaickey,
+                  'mosaicsizedeg':mosaicsizedeg,
+                  'mosaicsizepix':mosaicsizepix},
+        'provenance':'mosaic',
+        'fitsfile':mosaicfile,
+        'stamp':stamp,
+        'header':stampheader
+    }
+
+
+
+def get_mosaics(ras,
+                decls,
+                survey='DSS2 Red',
+                scaling='Linear',
+                sizepix=300,
+                mosaicsizedeg=MOSAIC_SIZEDEG,
+                mosaicsizepix=MOSAIC_SIZEPIX,
+                forcefetch=False,
+                cachedir='~/.astrobase/stamp-cache',
+                timeout=10.0,
+                verbose=False,
+                nworkers=None):
+    '''This gets all the mosaics needed for stamps at many coordinates.
+
+    Each mosaic is only fetched once, no matter how many of the coordinates it
+    covers. The mosaics are fetched at the same time using up to nworkers
+    threads of the shared services transport. The kwargs are the same as for
+    get_stamp_from_mosaic. Use this to fill the stamp cache before getting the
+    stamps themselves with get_stamp_from_mosaic.
+
+    Returns a list of the paths to the mosaic covering each coordinate, in the
+    same order as ras, decls. Failed mosaics get None.
+
+    '''
+
+    if '~' in cachedir:
+        cachedir = os.path.expanduser(cachedir)
+    if not os.path.exists(os.path.join(cachedir, 'mosaics')):
+        os.makedirs(os.path.join(cachedir, 'mosaics'))
+
+    stampsizedeg = sizepix*mosaicsizedeg/mosaicsizepix
+
+    objmosaics = [mosaic_for_coords(ra, decl,
+                                    mosaicsizedeg=mosaicsizedeg,
+                                    stampsizedeg=stampsizedeg)
+                  for ra, decl in zip(ras, decls)]
+
+    uniqmosaics = sorted(set((x[1], x[2]) for x in objmosaics))
+
+    if verbose:
+        LOGINFO('getting %s mosaics covering %s objects' %
+                (len(uniqmosaics), len(objmosaics)))
+
+    def _mosaic_worker(center):
+        return get_mosaic(center[0], center[1],
+                          survey=survey,
+                          scaling=scaling,
+                          mosaicsizedeg=mosaicsizedeg,
+                          mosaicsizepix=mosaicsizepix,
+                          forcefetch=forcefetch,
+                          cachedir=cachedir,
+                          timeout=timeout,
+                          verbose=verbose)
+
+    mosaicfiles = dict(zip(uniqmosaics,
+                           transport.batch(_mosaic_worker,
+                                           uniqmosaics,
+                                           nworkers=nworkers)))
+
+    return [mosaicfiles[(x[1], x[2])] for x in objmosaics]
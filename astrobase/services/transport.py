@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''transport - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT. See the LICENSE file for more details.
+
+This contains the HTTP transport shared by the modules in astrobase.services.
+Instead of calling requests.get/requests.post directly, these modules use the
+get/post functions below, which provide:
+
+- a single requests.Session per process with a pool of kept-alive connections,
+  so repeated calls to the same service don't pay for a new TCP/TLS handshake
+  every time.
+
+- per-host rate limits, so we don't hammer any of the services (or their
+  mirrors) when running lots of requests at once.
+
+- retries with exponential backoff for connection errors and for 429/5xx
+  responses. Timeouts, dropped connections, and most 5xx responses are only
+  retried for GET and HEAD requests, since a POST that timed out or got a
+  502/504 from a gateway may have gone through anyway (e.g. a TAP async job
+  submission). POSTs are only retried for 429 responses and 503 responses with
+  a Retry-After header, which mean the server didn't act on the request.
+
+- a bounded thread pool for running many requests at once. This is used by the
+  batch functions in the other services modules, e.g. skyview.get_stamps and
+  dust.extinction_queries.
+
+Use it like so:
+
+from astrobase.services import transport
+
+# drop-in replacements for requests.get and requests.post
+resp = transport.get(url, params={...}, timeout=10.0)
+resp = transport.post(url, data={...}, timeout=10.0)
+
+# run func on all items using the shared thread pool
+results = transport.batch(func, items, nworkers=8)
+
+Exceptions are the usual ones from requests, so existing error handling for
+requests.exceptions.Timeout, HTTPError, etc. works the same way as before.
+
+To change the settings for all services, make a new ServiceTransport and pass it
+to set_transport:
+
+transport.set_transport(transport.ServiceTransport(maxretries=5,
+                                                   ratelimits={'host':1.0}))
+
+'''
+
+#############
+## LOGGING ##
+#############
+
+import logging
+from datetime import datetime
+from traceback import format_exc
+
+# setup a logger
+LOGGER = None
+LOGMOD = __name__
+DEBUG = False
+
+def set_logger_parent(parent_name):
+    globals()['LOGGER'] = logging.getLogger('%s.%s' % (parent_name, LOGMOD))
+
+def LOGDEBUG(message):
+    if LOGGER:
+        LOGGER.debug(message)
+    elif DEBUG:
+        print('[%s - DBUG] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGINFO(message):
+    if LOGGER:
+        LOGGER.info(message)
+    else:
+        print('[%s - INFO] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGERROR(message):
+    if LOGGER:
+        LOGGER.error(message)
+    else:
+        print('[%s - ERR!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGWARNING(message):
+    if LOGGER:
+        LOGGER.warning(message)
+    else:
+        print('[%s - WRN!] %s' % (
+            datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            message)
+        )
+
+def LOGEXCEPTION(message):
+    if LOGGER:
+        LOGGER.exception(message)
+    else:
+        print(
+            '[%s - EXC!] %s\nexception was: %s' % (
+                datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                message, format_exc()
+                )
+            )
+
+
+#############
+## IMPORTS ##
+#############
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from ..lazyload import lazy_module
+
+# this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+
+############
+## CONFIG ##
+############
+
+# the max number of connections kept open to each host
+POOL_MAXSIZE = 16
+
+# the max number of requests in flight at any time for a transport
+MAX_CONCURRENT = 16
+
+# the default number of threads used to run batches of requests
+MAX_WORKERS = 8
+
+# the number of times to retry a request and the backoff between retries in
+# seconds. the n-th retry waits for BACKOFF_FACTOR * 2^(n-1) seconds, up to
+# BACKOFF_MAX seconds
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 30.0
+
+# these response status codes are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# these response status codes mean the server didn't act on the request, so
+# they're retried for non-idempotent requests too. 503 is only retried if the
+# response has a Retry-After header.
+NOT_ACTED_STATUSES = (429, 503)
+
+# these request methods are safe to retry after a timeout or any status in
+# RETRY_STATUSES
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# the min time in seconds between the start of requests to each host. hosts
+# not in here use DEFAULT_RATE_LIMIT.
+RATE_LIMITS = {
+    'skyview.gsfc.nasa.gov':0.2,
+    'irsa.ipac.caltech.edu':0.2,
+    'gea.esac.esa.int':0.2,
+    'gaia.ari.uni-heidelberg.de':0.2,
+    'tapvizier.u-strasbg.fr':0.2,
+    'simbad.u-strasbg.fr':0.2,
+    'simbad.harvard.edu':0.2,
+    'stev.oapd.inaf.it':1.0,
+}
+DEFAULT_RATE_LIMIT = 0.0
+
+
+
+#######################
+## SERVICE TRANSPORT ##
+#######################
+
+def _connect_failed(exc):
+    '''This returns True if exc means the connection was never made.
+
+    These requests never reached the server, so it's safe to send them again
+    whatever their method is.
+
+    '''
+
+    # requests and urllib3 are always loaded by the time we get here
+    from urllib3.exceptions import ConnectTimeoutError
+
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+
+    # requests wraps urllib3's MaxRetryError, which has the actual error in its
+    # reason attribute. NewConnectionError is a subclass of ConnectTimeoutError.
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+
+class ServiceTransport(object):
+    '''This is a pooled, rate-limited, retrying HTTP transport.
+
+    One of these is shared by all services in a process (see get_transport
+    below), but they can also be made separately, e.g. for testing.
+
+    maxworkers is the default number of threads used by the batch method.
+
+    maxconcurrent is the max number of requests in flight at any time across
+    all threads using this transport.
+
+    poolsize is the max number of connections kept open to each host.
+
+    maxretries, backoff, and backoffmax control retries as described for
+    MAX_RETRIES, BACKOFF_FACTOR, and BACKOFF_MAX above.
+
+    ratelimits is a dict of the form {host: min seconds between requests} that
+    overrides the default RATE_LIMITS. Set defaultratelimit to apply a limit to
+    all other hosts.
+
+    '''
+
+    def __init__(self,
+                 maxworkers=MAX_WORKERS,
+                 maxconcurrent=MAX_CONCURRENT,
+                 poolsize=POOL_MAXSIZE,
+                 maxretries=MAX_RETRIES,
+                 backoff=BACKOFF_FACTOR,
+                 backoffmax=BACKOFF_MAX,
+                 ratelimits=None,
+                 defaultratelimit=DEFAULT_RATE_LIMIT):
+        '''
+        This sets up the transport. The session is made on first use.
+
+        '''
+
+        self.maxworkers = maxworkers
+        self.maxconcurrent = maxconcurrent
+        self.poolsize = poolsize
+        self.maxretries = maxretries
+        self.backoff = backoff
+        self.backoffmax = backoffmax
+
+        self.ratelimits = RATE_LIMITS.copy()
+        if ratelimits:
+            self.ratelimits.update(ratelimits)
+        self.defaultratelimit = defaultratelimit
+
+        # this is used to make a new session after a fork
+        self.pid = os.getpid()
+        self._session = None
+        self._sessionlock = threading.Lock()
+
+        # these handle the rate limits and the bound on concurrent requests
+        self._ratelock = threading.Lock()
+        self._nextrequest = {}
+        self._inflight = threading.BoundedSemaphore(maxconcurrent)
+
+        self.stats = {'requests':0,
+                      'retries':0,
+                      'failures':0}
+
+
+    @property
+    def session(self):
+        '''
+        This returns the requests.Session, making it if needed.
+
+        '''
+
+        with self._sessionlock:
+
+            if self._session is None or self.pid != os.getpid():
+
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.poolsize,
+                    pool_maxsize=self.poolsize,
+                    max_retries=0
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                self._session = session
+                self.pid = os.getpid()
+
+        return self._session
+
+
+    def _wait_for_host(self, host):
+        '''This waits until we're allowed to send a request to host.
+
+        Each caller reserves the next slot for the host under the lock, then
+        sleeps outside it, so waiting threads don't block requests to other
+        hosts.
+
+        '''
+
+        interval = self.ratelimits.get(host, self.defaultratelimit)
+
+        if not interval or interval <= 0.0:
+            return
+
+        with self._ratelock:
+            now = time.time()
+            starttime = max(now, self._nextrequest.get(host, 0.0))
+            self._nextrequest[host] = starttime + interval
+
+        if starttime > now:
+            time.sleep(starttime - now)
+
+
+    def _count(self, key):
+        '''
+        This updates the request stats for this transport.
+
+        '''
+
+        with self._ratelock:
+            self.stats[key] += 1
+
+
+    def _backoff_time(self, attempt, resp=None):
+        '''This returns the time to wait before retrying a request.
+
+        If the response has a Retry-After header in seconds, this is used if
+        it's longer than the usual backoff.
+
+        '''
+
+        waittime = min(self.backoff*(2.0**attempt), self.backoffmax)
+
+        if resp is not None and 'Retry-After' in resp.headers:
+            try:
+                waittime = min(max(waittime,
+                                   float(resp.headers['Retry-After'])),
+                               self.backoffmax)
+            except ValueError:
+                pass
+
+        return waittime
+
+
+    def _retryable_status(self, resp, idempotent):
+        '''
+        This returns True if a request that got resp back can be sent again.
+
+        '''
+
+        if resp.status_code not in RETRY_STATUSES:
+            return False
+
+        if idempotent:
+            return True
+
+        return (resp.status_code in NOT_ACTED_STATUSES and
+                (resp.status_code != 503 or 'Retry-After' in resp.headers))
+
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        '''This sends a request using the shared session.
+
+        All kwargs are passed to requests.Session.request. Returns the
+        requests.Response. If the response still has a retryable status code
+        after all retries, it's returned anyway so the caller can handle it with
+        raise_for_status as usual. Connection errors and timeouts are raised
+        after all retries fail.
+
+        If idempotent is None, it's True for the methods in IDEMPOTENT_METHODS.
+        Non-idempotent requests are not retried after timeouts, and are only
+        retried for 429 responses and 503 responses with a Retry-After header.
+        Set idempotent=True for e.g. a POST that only runs a query, to retry it
+        like a GET.
+
+        '''
+
+        method = method.upper()
+        host = urlparse(url).netloc
+        attempt = 0
+
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        while True:
+
+            self._wait_for_host(host)
+
+            try:
+
+                self._count('requests')
+
+                with self._inflight:
+                    resp = self.session.request(method, url, **kwargs)
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+
+                # errors while connecting mean nothing was sent, so they're
+                # always safe to retry. other connection errors and timeouts
+                # are only retried if idempotent
+                retryable = idempotent or _connect_failed(e)
+
+                if not retryable or attempt >= self.maxretries:
+                    self._count('failures')
+                    raise
+
+                waittime = self._backoff_time(attempt)
+                LOGWARNING('%s %s failed with %s, retrying in %.1f sec' %
+                           (method, url, e.__class__.__name__, waittime))
+
+            else:
+
+                if (attempt >= self.maxretries or
+                    not self._retryable_status(resp, idempotent)):
+                    return resp
+
+                waittime = self._backoff_time(attempt, resp=resp)
+                LOGWARNING('%s %s returned status %s, retrying in %.1f sec' %
+                           (method, url, resp.status_code, waittime))
+                resp.close()
+
+            self._count('retries')
+            attempt += 1
+            time.sleep(waittime)
+
+
+    def get(self, url, params=None, **kwargs):
+        '''
+        This sends a GET request. See request for details.
+
+        '''
+
+        return self.request('GET', url, params=params, **kwargs)
+
+
+    def post(self, url, data=None, **kwargs):
+        '''
+        This sends a POST request. See request for details.
+
+        '''
+
+        return self.request('POST', url, data=data, **kwargs)
+
+
+    def batch(self, func, items, nworkers=None):
+        '''This runs func on each of the items using a pool of threads.
+
+        func should use this transport (or the module-level get/post functions)
+        to make its requests, so it gets the connection pool, rate limits, and
+        retries.
+
+        nworkers is the number of threads to use. If None, uses
+        self.maxworkers.
+
+        Returns a list of results in the same order as items. Items for which
+        func raised an exception get None.
+
+        '''
+
+        items = list(items)
+
+        if len(items) == 0:
+            return []
+
+        if not nworkers:
+            nworkers = self.maxworkers
+        nworkers = max(min(nworkers, len(items)), 1)
+
+        def _batch_worker(item):
+            try:
+                return func(item)
+            except Exception as e:
+                LOGEXCEPTION('batch request failed for item: %r' % (item,))
+                return None
+
+        if nworkers == 1:
+            return [_batch_worker(x) for x in items]
+
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            results = list(executor.map(_batch_worker, items))
+
+        return results
+
+
+    def close(self):
+        '''
+        This closes the session and all of its pooled connections.
+
+        '''
+
+        with self._sessionlock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+
+##################################
+## THE SHARED SERVICE TRANSPORT ##
+##################################
+
+# this is the transport shared by all services in this process
+TRANSPORT = None
+TRANSPORT_LOCK = threading.Lock()
+
+
+def get_transport():
+    '''This returns the transport shared by all services in this process.
+
+    The transport is made on first use. Worker processes forked from a process
+    that already has one get their own session on first use.
+
+    '''
+
+    global TRANSPORT
+
+    with TRANSPORT_LOCK:
+        if TRANSPORT is None:
+            TRANSPORT = ServiceTransport()
+
+    return TRANSPORT
+
+
+
+def set_transport(transport):
+    '''This replaces the transport shared by all services in this process.
+
+    Returns the previous transport, which is not closed.
+
+    '''
+
+    global TRANSPORT
+
+    with TRANSPORT_LOCK:
+        oldtransport = TRANSPORT
+        TRANSPORT = transport
+
+    return oldtransport
+
+
+
+def get(url, params=None, **kwargs):
+    '''
+    This is a drop-in replacement for requests.get using the shared transport.
+
+    '''
+
+    return get_transport().get(url, params=params, **kwargs)
+
+
+
+def post(url, data=None, **kwargs):
+    '''
+    This is a drop-in replacement for requests.post using the shared transport.
+
+    '''
+
+    return get_transport().post(url, data=data, **kwargs)
+
+
+
+def batch(func, items, nworkers=None):
+    '''
+    This runs func on each of the items using the shared transport's threads.
+
+    '''
+
+    return get_transport().batch(func, items, nworkers=nworkers)
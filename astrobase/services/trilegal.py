@@ -101,13 +101,17 @@ import re
 
 import numpy as np
 
-# to do the queries
-import requests
-import requests.exceptions
+from ..lazyload import lazy_module, lazy_object
+
+# to do the queries. this is imported on first use to keep import times down
+requests = lazy_module('requests')
+
+# all HTTP requests go through this
+from . import transport
 
 # to convert to/from galactic coords
-from astropy.coordinates import SkyCoord
-from astropy import units as u
+SkyCoord = lazy_object('astropy.coordinates', 'SkyCoord')
+u = lazy_module('astropy.units')
 
 
 ###################
@@ -684,9 +688,9 @@ def query_galcoords(gal_lon,
 
             posturl = TRILEGAL_POSTURL.format(formversion=trilegal_version)
 
-            req = requests.post(posturl,
-                                data=trilegal_params,
-                                timeout=timeout)
+            req = transport.post(posturl,
+                                 data=trilegal_params,
+                                 timeout=timeout)
             resp = req.text
 
             # get the URL of the result file
@@ -725,7 +729,7 @@ def query_galcoords(gal_lon,
 
                     try:
 
-                        resreq = requests.get(resultfileurl)
+                        resreq = transport.get(resultfileurl)
                         resreq.raise_for_status()
 
                         if verbose:
@@ -86,6 +86,7 @@ except:
 import time
 import os.path
 import os
+import hashlib
 
 import multiprocessing as mp
 
@@ -396,64 +397,197 @@ def jd_corr(jd,
      # this assumes that the target is very far away
      src_unitvector = np.array([cosdec*cosra,cosdec*sinra,sindec])
 
-     # Convert epochs to astropy.time.Time
-     ## Assume JD(UTC)
-     if (obslon is None) or (obslat is None) or (obsalt is None):
-         t = astime.Time(jd, scale='utc', format='jd')
-     else:
-         t = astime.Time(jd, scale='utc', format='jd',
-                         location=('%.5fd' % obslon,
-                                   '%.5fd' % obslat,
-                                   obsalt))
-
-     # Get Earth-Moon barycenter position
-     ## NB: jplephem uses Barycentric Dynamical Time, e.g. JD(TDB)
-     ## and gives positions relative to solar system barycenter
-     barycenter_earthmoon = jplkernel[0,3].compute(t.tdb.jd)
-
-     # Get Moon position vectors from the center of Earth to the Moon
-     # this means we get the following vectors from the ephemerides
-     # Earth Barycenter (3) -> Moon (301)
-     # Earth Barycenter (3) -> Earth (399)
-     # so the final vector is [3,301] - [3,399]
-     # units are in km
-     moonvector = (jplkernel[3,301].compute(t.tdb.jd) -
-                   jplkernel[3,399].compute(t.tdb.jd))
-
-     # Compute Earth position vectors (this is for the center of the earth with
-     # respect to the solar system barycenter)
-     # all these units are in km
-     pos_earth = (barycenter_earthmoon - moonvector * 1.0/(1.0+EMRAT))
-
-     if jd_type == 'bjd':
-
-         # Compute BJD correction
-         ## Assume source vectors parallel at Earth and Solar System
-         ## Barycenter
-         ## i.e. source is at infinity
-         # the romer_delay correction is (r.dot.n)/c where:
-         # r is the vector from SSB to earth center
-         # n is the unit vector from
-         correction_seconds = np.dot(pos_earth.T, src_unitvector)/CLIGHT_KPS
-         correction_days = correction_seconds/SEC_P_DAY
-
-     elif jd_type == 'hjd':
-
-         # Compute HJD correction via Sun ephemeris
-
-         # this is the position vector of the center of the sun in km
-         # Solar System Barycenter (0) -> Sun (10)
-         pos_sun = jplkernel[0,10].compute(t.tdb.jd)
-
-         # this is the vector from the center of the sun to the center of the
-         # earth
-         sun_earth_vec = pos_earth - pos_sun
-
-         # calculate the heliocentric correction
-         correction_seconds = np.dot(sun_earth_vec.T, src_unitvector)/CLIGHT_KPS
-         correction_days = correction_seconds/SEC_P_DAY
+     tdbjd, posvec = _jd_corr_vectors(jd,
+                                      obslon=obslon,
+                                      obslat=obslat,
+                                      obsalt=obsalt,
+                                      jd_type=jd_type)
+
+     # Compute the BJD or HJD correction
+     ## Assume source vectors parallel at Earth and Solar System
+     ## Barycenter
+     ## i.e. source is at infinity
+     # the romer_delay correction is (r.dot.n)/c where:
+     # r is the vector from SSB (or the sun) to earth center
+     # n is the unit vector from
+     correction_seconds = np.dot(posvec.T, src_unitvector)/CLIGHT_KPS
+     correction_days = correction_seconds/SEC_P_DAY
 
      # TDB is the appropriate time scale for these ephemerides
-     new_jd = t.tdb.jd + correction_days
+     new_jd = tdbjd + correction_days
 
      return new_jd
+
+
+
+def _jd_corr_vectors(jd,
+                     obslon=None,
+                     obslat=None,
+                     obsalt=None,
+                     jd_type='bjd'):
+    """This gets the JD(TDB) and the position vector for the Romer delay.
+
+    For jd_type = 'bjd', the position vector is from the solar system
+    barycenter to the center of the Earth. For jd_type = 'hjd', it's from the
+    center of the Sun to the center of the Earth. The vectors are in km and have
+    shape (3,) + jd.shape.
+
+    Returns a tuple of (tdbjd, posvec).
+
+    """
+
+    # Convert epochs to astropy.time.Time
+    ## Assume JD(UTC)
+    if (obslon is None) or (obslat is None) or (obsalt is None):
+        t = astime.Time(jd, scale='utc', format='jd')
+    else:
+        t = astime.Time(jd, scale='utc', format='jd',
+                        location=('%.5fd' % obslon,
+                                  '%.5fd' % obslat,
+                                  obsalt))
+
+    tdbjd = t.tdb.jd
+
+    # Get Earth-Moon barycenter position
+    ## NB: jplephem uses Barycentric Dynamical Time, e.g. JD(TDB)
+    ## and gives positions relative to solar system barycenter
+    barycenter_earthmoon = jplkernel[0,3].compute(tdbjd)
+
+    # Get Moon position vectors from the center of Earth to the Moon
+    # this means we get the following vectors from the ephemerides
+    # Earth Barycenter (3) -> Moon (301)
+    # Earth Barycenter (3) -> Earth (399)
+    # so the final vector is [3,301] - [3,399]
+    # units are in km
+    moonvector = (jplkernel[3,301].compute(tdbjd) -
+                  jplkernel[3,399].compute(tdbjd))
+
+    # Compute Earth position vectors (this is for the center of the earth with
+    # respect to the solar system barycenter)
+    # all these units are in km
+    pos_earth = (barycenter_earthmoon - moonvector * 1.0/(1.0+EMRAT))
+
+    if jd_type == 'bjd':
+
+        return tdbjd, pos_earth
+
+    elif jd_type == 'hjd':
+
+        # this is the position vector of the center of the sun in km
+        # Solar System Barycenter (0) -> Sun (10)
+        pos_sun = jplkernel[0,10].compute(tdbjd)
+
+        # this is the vector from the center of the sun to the center of the
+        # earth
+        return tdbjd, pos_earth - pos_sun
+
+    else:
+
+        raise ValueError('unknown jd_type: %s' % jd_type)
+
+
+
+def jd_corr_batch(jd,
+                  ra,
+                  dec,
+                  obslon=None,
+                  obslat=None,
+                  obsalt=None,
+                  jd_type='bjd',
+                  cachedir=None):
+    """Returns BJD_TDB or HJD_TDB for input JD_UTC for many targets at once.
+
+    This is a batch version of jd_corr for converting the frame times of a
+    whole field. The JPL ephemeris is evaluated only once for each unique JD in
+    jd, and the Romer delays for all targets are then calculated with a single
+    matrix product of the target unit vectors and the Earth position vectors.
+    The results are the same as calling jd_corr for each target.
+
+    jd is an array of JD(UTC) values shared by all targets, e.g. the frame
+    times of an observing run. ra and dec are arrays of target coordinates in
+    decimal degrees. obslon, obslat, obsalt are the location of the observatory
+    (used for all targets), and jd_type is either 'bjd' or 'hjd', as in
+    jd_corr.
+
+    If cachedir is not None, the Earth position vectors and JD(TDB) values for
+    the unique JDs are cached there in an npz file keyed by the hash of the JD
+    array and the observatory location, so converting more targets observed at
+    the same times later skips the ephemeris evaluation entirely.
+
+    Returns an array of shape (len(ra),) + jd.shape with the corrected JDs for
+    each target. If ra and dec are scalars, returns an array with the same
+    shape as jd. The output has len(ra) x len(jd) elements, so convert very
+    large fields in chunks of targets if memory is tight.
+
+    Returns None if the JPL kernel isn't available.
+
+    """
+
+    if not HAVEKERNEL:
+        LOGERROR('no JPL kernel available, can\'t continue!')
+        return None
+
+    jd = np.asarray(jd, dtype=np.float64)
+    uniqjd, jdinds = np.unique(jd.ravel(), return_inverse=True)
+
+    cachefile = None
+    tdbjd, posvec = None, None
+
+    if cachedir is not None:
+
+        cachekey = hashlib.sha256(
+            uniqjd.tobytes() +
+            ('%s-%s-%s-%s-%s' % (obslon, obslat, obsalt, jd_type,
+                                 os.path.basename(planetdatafile))).encode()
+        ).hexdigest()
+        cachefile = os.path.join(cachedir, 'jdcorr-%s.npz' % cachekey)
+
+        if os.path.exists(cachefile):
+
+            try:
+                with np.load(cachefile) as npzf:
+                    tdbjd, posvec = npzf['tdbjd'], npzf['posvec']
+                LOGINFO('using cached ephemeris vectors from: %s' % cachefile)
+            except Exception as e:
+                LOGEXCEPTION('could not read cached ephemeris vectors '
+                             'from: %s, recalculating' % cachefile)
+                tdbjd, posvec = None, None
+
+    if tdbjd is None:
+
+        tdbjd, posvec = _jd_corr_vectors(uniqjd,
+                                         obslon=obslon,
+                                         obslat=obslat,
+                                         obsalt=obsalt,
+                                         jd_type=jd_type)
+
+        if cachefile is not None:
+
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+
+            # write to a temp file first so a parallel reader never sees a
+            # partially written cache file
+            tempfile = '%s.tmp-%s.npz' % (cachefile[:-4], os.getpid())
+            np.savez(tempfile, tdbjd=tdbjd, posvec=posvec)
+            os.rename(tempfile, cachefile)
+
+    # these are the target unit vectors, one row per target
+    rarad = np.radians(np.atleast_1d(np.asarray(ra, dtype=np.float64)))
+    decrad = np.radians(np.atleast_1d(np.asarray(dec, dtype=np.float64)))
+    src_unitvectors = np.column_stack((np.cos(decrad)*np.cos(rarad),
+                                       np.cos(decrad)*np.sin(rarad),
+                                       np.sin(decrad)))
+
+    # this gets the Romer delays for all targets and unique JDs at once
+    new_jd = np.dot(src_unitvectors, posvec)
+    new_jd /= CLIGHT_KPS*SEC_P_DAY
+    new_jd += tdbjd
+
+    # expand the unique JDs back out to the input JDs
+    new_jd = new_jd[:, jdinds].reshape((rarad.size,) + jd.shape)
+
+    if np.ndim(ra) == 0 and np.ndim(dec) == 0:
+        return new_jd[0]
+    else:
+        return new_jd
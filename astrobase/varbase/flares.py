@@ -93,7 +93,10 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     zeros_like as npzeros_like, full_like as npfull_like, all as npall, \
     correlate as npcorrelate
 
-from scipy.signal import savgol_filter
+from ..lazyload import lazy_object
+
+# this is imported on first use to keep import times down
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
 
 
 ###########################
@@ -114,14 +114,17 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     correlate as npcorrelate, nonzero as npnonzero, diag as npdiag, \
     diff as npdiff, concatenate as npconcatenate
 
-from scipy.optimize import leastsq as spleastsq, minimize as spminimize
-from scipy.interpolate import LSQUnivariateSpline
-from scipy.signal import savgol_filter
 from numpy.polynomial.legendre import Legendre, legval
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from ..lazyload import lazy_module, lazy_object, use_agg_backend
+
+# these are imported on first use to keep import times down
+spleastsq = lazy_object('scipy.optimize', 'leastsq')
+spminimize = lazy_object('scipy.optimize', 'minimize')
+LSQUnivariateSpline = lazy_object('scipy.interpolate', 'LSQUnivariateSpline')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
+
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
 
 from ..lcmath import sigclip_magseries
 
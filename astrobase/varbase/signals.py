@@ -88,13 +88,14 @@ from numpy import nan as npnan, sum as npsum, abs as npabs, \
     argsort as npargsort, cos as npcos, sin as npsin, tan as nptan, \
     where as npwhere, linspace as nplinspace, \
     zeros_like as npzeros_like, full_like as npfull_like, all as npall, \
-    correlate as npcorrelate
+    correlate as npcorrelate, nonzero as npnonzero, nanargmax as npnanargmax
 
 import os
-import matplotlib
-matplotlib.use('Agg')
 
-import matplotlib.pyplot as plt
+from ..lazyload import lazy_module, use_agg_backend
+
+# this is imported on first use to keep import times down
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
 
 try:
     from cStringIO import StringIO as strio
@@ -106,7 +107,8 @@ except:
 ## LOCAL IMPORTS ##
 ###################
 
-from ..periodbase.zgls import pgen_lsp
+from ..periodbase import get_frequency_grid, LSPMETHODS
+from ..periodbase.zgls import glsp_prepare, glsp_evaluate
 from .lcfit import _fourier_func, fourier_fit_magseries, spline_fit_magseries
 from ..lcmath import sigclip_magseries, phase_magseries
 
@@ -323,6 +325,184 @@ def prewhiten_magseries(times, mags, errs,
 
 
 
+def _get_prewhiten_omegas(stimes,
+                          startp=None,
+                          endp=None,
+                          autofreq=True,
+                          stepsize=1.0e-4):
+    '''This gets the angular frequency grid to use for pre-whitening.
+
+    This uses the same logic as periodbase.zgls.pgen_lsp so the periodograms
+    calculated during pre-whitening are on the same grid.
+
+    '''
+
+    if startp:
+        endf = 1.0/startp
+    else:
+        endf = 1.0/0.1
+
+    if endp:
+        startf = 1.0/endp
+    else:
+        startf = 1.0/(stimes.max() - stimes.min())
+
+    if not autofreq:
+        return 2.0*MPI*nparange(startf, endf, stepsize)
+    else:
+        return 2.0*MPI*get_frequency_grid(stimes,
+                                          minfreq=startf,
+                                          maxfreq=endf)
+
+
+
+def _fourier_whiten_fixedpoints(times, mags, errs, period,
+                                fourierorder=3,
+                                fourierparams=None,
+                                magsarefluxes=False,
+                                sigclip=30.0):
+    '''This fits a Fourier series at period and subtracts it from mags.
+
+    Unlike prewhiten_magseries, this does not sigma-clip or re-sort the input
+    mag series, so the whitened mags correspond point-by-point to the input
+    times. This lets us reuse any periodogram terms that depend only on the
+    times and errs (see periodbase.zgls.glsp_prepare).
+
+    Returns the whitened mags and the Fourier params used, or (None, None) if
+    the fit failed.
+
+    '''
+
+    fit = fourier_fit_magseries(times, mags, errs, period,
+                                fourierorder=fourierorder,
+                                fourierparams=fourierparams,
+                                magsarefluxes=magsarefluxes,
+                                sigclip=sigclip,
+                                verbose=False)
+
+    fitparams = fit['fitinfo']['finalparams']
+    if fitparams is None:
+        return None, None
+
+    # the fit phases the series at its earliest time, so use the same epoch
+    mintime = npmin(fit['magseries']['times'])
+    phase = (times - mintime)/period - npfloor((times - mintime)/period)
+
+    # subtract everything but the median mag (see prewhiten_magseries)
+    wmags = mags - (_fourier_func(fitparams, phase, mags) - npmedian(mags))
+
+    return wmags, fitparams
+
+
+
+def _get_whitening_rounds(stimes, smags, serrs,
+                          pfmethod='gls',
+                          pfkwargs=None,
+                          nrounds=5,
+                          fourierorder=3,
+                          initfparams=None,
+                          magsarefluxes=False,
+                          sigclip=30.0,
+                          nworkers=None,
+                          startp=None,
+                          endp=None,
+                          autofreq=True,
+                          stepsize=1.0e-4):
+    '''This is a generator for the rounds of an iterative pre-whitening.
+
+    stimes, smags, serrs must already be finite and sigma-clipped. These points
+    are kept fixed through all of the rounds.
+
+    Each round yields a tuple of:
+
+    (periods, lspvals, bestperiod, bestlspval, wmags, whitenparams)
+
+    where periods and lspvals are the periodogram found for the current mags,
+    wmags are the mags whitened at bestperiod and whitenparams are the Fourier
+    params used for the whitening (None if the fit failed, in which case the
+    iteration stops).
+
+    If pfmethod is 'gls', the frequency grid and all of the data-independent
+    trig sums are computed once (periodbase.zgls.glsp_prepare), and only the
+    data-dependent terms are recomputed for each round. For any other
+    pfmethod in periodbase.LSPMETHODS, the period-finder is run on the
+    whitened mags in each round with sigclip=None so the points stay the same.
+
+    '''
+
+    if pfkwargs is None:
+        pfkwargs = {}
+
+    wmags = smags
+
+    if pfmethod == 'gls':
+
+        omegas = _get_prewhiten_omegas(stimes,
+                                       startp=startp,
+                                       endp=endp,
+                                       autofreq=autofreq,
+                                       stepsize=stepsize)
+        glspstate = glsp_prepare(stimes, serrs, omegas)
+        periods = glspstate['periods']
+
+    for roundind in range(nrounds + 1):
+
+        if pfmethod == 'gls':
+
+            lspvals = glsp_evaluate(glspstate, wmags)
+
+            try:
+                bestind = npnanargmax(lspvals)
+            except ValueError:
+                LOGERROR('round %s: no finite periodogram values, '
+                         'stopping here' % roundind)
+                return
+
+            bestperiod, bestlspval = periods[bestind], lspvals[bestind]
+
+        else:
+
+            kwargs = pfkwargs.copy()
+            kwargs.update({'magsarefluxes':magsarefluxes,
+                           'sigclip':None,
+                           'nworkers':nworkers,
+                           'verbose':False})
+            lspres = LSPMETHODS[pfmethod](stimes, wmags, serrs, **kwargs)
+
+            periods, lspvals = lspres['periods'], lspres['lspvals']
+            bestperiod, bestlspval = lspres['bestperiod'], lspres['bestlspval']
+
+            if not npisfinite(bestperiod):
+                LOGERROR('round %s: no finite best period, '
+                         'stopping here' % roundind)
+                return
+
+        LOGINFO('round %s: period = %.6f' % (roundind, bestperiod))
+
+        # the last round only needs the periodogram
+        if roundind == nrounds:
+            yield periods, lspvals, bestperiod, bestlspval, wmags, None
+            return
+
+        nextwmags, whitenparams = _fourier_whiten_fixedpoints(
+            stimes, wmags, serrs, bestperiod,
+            fourierorder=fourierorder,
+            fourierparams=initfparams,
+            magsarefluxes=magsarefluxes,
+            sigclip=sigclip
+        )
+
+        yield periods, lspvals, bestperiod, bestlspval, wmags, whitenparams
+
+        if nextwmags is None:
+            LOGERROR('round %s: Fourier fit failed, '
+                     'stopping here' % roundind)
+            return
+
+        wmags = nextwmags
+
+
+
 def gls_prewhiten(times, mags, errs,
                   startp_gls=None,
                   endp_gls=None,
@@ -341,126 +521,70 @@ def gls_prewhiten(times, mags, errs,
     whitens the time series with the best period, and repeats until nbestpeaks
     are done.
 
+    The frequency grid and the data-independent periodogram terms are only
+    calculated once for the sigma-clipped mag series; each round after that only
+    recomputes the terms that depend on the whitened mags.
+
+    nworkers has no effect: no process pool is used anymore, and the kwarg is
+    only accepted so that existing calls keep working.
+
+    Returns the list of best periods found in each round (nbestpeaks + 1 of
+    them: the first is the best period before any whitening). If plotfits is a
+    filename, returns a tuple of this list and the path to the plot.
+
     '''
 
     stimes, smags, serrs = sigclip_magseries(times, mags, errs,
                                              sigclip=sigclip,
                                              magsarefluxes=magsarefluxes)
 
-    # now start the cycle by doing an GLS on the initial timeseries
-    gls = pgen_lsp(stimes, smags, serrs,
-                   magsarefluxes=magsarefluxes,
-                   startp=startp_gls,
-                   endp=endp_gls,
-                   autofreq=autofreq,
-                   sigclip=sigclip,
-                   stepsize=stepsize,
-                   nworkers=nworkers)
-
-    LOGINFO('round %s: period = %.6f' % (0, gls['bestperiod']))
+    # get rid of zero errs
+    nzind = npnonzero(serrs)
+    stimes, smags, serrs = stimes[nzind], smags[nzind], serrs[nzind]
 
     if plotfits and isinstance(plotfits, str):
-
-        plt.figure(figsize=(20,6*nbestpeaks))
-
         nplots = nbestpeaks + 1
-
-        # periodogram
-        plt.subplot(nplots,3,1)
-        plt.plot(gls['periods'],gls['lspvals'])
-        plt.xlabel('period [days]')
-        plt.ylabel('GLS power')
-        plt.xscale('log')
-        plt.title('round 0, best period = %.6f' % gls['bestperiod'])
-
-        # unphased LC
-        plt.subplot(nplots,3,2)
-        plt.plot(stimes, smags,
-                 linestyle='none', marker='o',ms=1.0,rasterized=True)
-        if not magsarefluxes:
-            plt.gca().invert_yaxis()
-            plt.ylabel('magnitude')
-        else:
-            plt.ylabel('flux')
-        plt.xlabel('JD')
-        plt.title('unphased LC before whitening')
-
-        # phased LC
-        plt.subplot(nplots,3,3)
-        phased = phase_magseries(stimes, smags,
-                                 gls['bestperiod'], stimes.min())
-
-        plt.plot(phased['phase'], phased['mags'],
-                 linestyle='none', marker='o',ms=1.0,rasterized=True)
-        if not magsarefluxes:
-            plt.ylabel('magnitude')
-            plt.gca().invert_yaxis()
-        else:
-            plt.ylabel('flux')
-        plt.xlabel('phase')
-        plt.title('phased LC before whitening: P = %.6f' % gls['bestperiod'])
-
-
-    # set up the initial times, mags, errs, period
-    wtimes, wmags, werrs = stimes, smags, serrs
-    wperiod = gls['bestperiod']
+        plt.figure(figsize=(20,6*nplots))
 
     # start the best periods list
     bestperiods = []
 
-    # now go through the rest of the cycles
-    for fitind in range(nbestpeaks):
-
-        wfseries = fourier_fit_magseries(wtimes, wmags, werrs, wperiod,
-                                         fourierorder=fourierorder,
-                                         fourierparams=initfparams,
-                                         magsarefluxes=magsarefluxes,
-                                         sigclip=sigclip)
-
-        wffitparams = wfseries['fitinfo']['finalparams']
-
-        wseries = prewhiten_magseries(wtimes, wmags, werrs,
-                                      wperiod,
-                                      wffitparams,
-                                      magsarefluxes=magsarefluxes,
-                                      sigclip=sigclip)
-
-
-        LOGINFO('round %s: period = %.6f' % (fitind+1, wperiod))
-        bestperiods.append(wperiod)
-
-        # update the mag series with whitened version
-        wtimes, wmags, werrs = (
-            wseries['wtimes'], wseries['wmags'], wseries['werrs']
-        )
-
-        # redo the periodogram
-        wgls = pgen_lsp(wtimes, wmags, werrs,
-                        magsarefluxes=magsarefluxes,
-                        startp=startp_gls,
-                        endp=endp_gls,
-                        autofreq=autofreq,
-                        sigclip=sigclip,
-                        stepsize=stepsize,
-                        nworkers=nworkers)
-        wperiod = wgls['bestperiod']
+    for roundind, roundresult in enumerate(
+            _get_whitening_rounds(stimes, smags, serrs,
+                                  pfmethod='gls',
+                                  nrounds=nbestpeaks,
+                                  fourierorder=fourierorder,
+                                  initfparams=initfparams,
+                                  magsarefluxes=magsarefluxes,
+                                  sigclip=sigclip,
+                                  startp=startp_gls,
+                                  endp=endp_gls,
+                                  autofreq=autofreq,
+                                  stepsize=stepsize)
+    ):
+
+        periods, lspvals, wperiod, wlspval, wmags, _ = roundresult
         bestperiods.append(wperiod)
 
         # make plots if requested
         if plotfits and isinstance(plotfits, str):
 
+            if roundind == 0:
+                lctitle = 'LC before whitening'
+            else:
+                lctitle = 'LC after whitening'
+
             # periodogram
-            plt.subplot(nplots,3,4+fitind*3)
-            plt.plot(wgls['periods'],wgls['lspvals'])
+            plt.subplot(nplots,3,1+roundind*3)
+            plt.plot(periods,lspvals)
             plt.xlabel('period [days]')
-            plt.ylabel('LSP power')
+            plt.ylabel('GLS power')
             plt.xscale('log')
-            plt.title('round %s, best period = %.6f' % (fitind+1,
-                                                        wgls['bestperiod']))
+            plt.title('round %s, best period = %.6f' % (roundind, wperiod))
 
             # unphased LC
-            plt.subplot(nplots,3,5+fitind*3)
-            plt.plot(wtimes, wmags,
+            plt.subplot(nplots,3,2+roundind*3)
+            plt.plot(stimes, wmags,
                      linestyle='none', marker='o',ms=1.0,rasterized=True)
             if not magsarefluxes:
                 plt.gca().invert_yaxis()
@@ -468,11 +592,11 @@ def gls_prewhiten(times, mags, errs,
             else:
                 plt.ylabel('flux')
             plt.xlabel('JD')
-            plt.title('unphased LC after whitening')
+            plt.title('unphased %s' % lctitle)
 
             # phased LC
-            plt.subplot(nplots,3,6+fitind*3)
-            wphased = phase_magseries(wtimes, wmags,
+            plt.subplot(nplots,3,3+roundind*3)
+            wphased = phase_magseries(stimes, wmags,
                                       wperiod, stimes.min())
 
             plt.plot(wphased['phase'], wphased['mags'],
@@ -483,8 +607,7 @@ def gls_prewhiten(times, mags, errs,
             else:
                 plt.ylabel('flux')
             plt.xlabel('phase')
-            plt.title('phased LC after whitening: P = %.6f' % wperiod)
-
+            plt.title('phased %s: P = %.6f' % (lctitle, wperiod))
 
 
     # in the end, write out the plot
@@ -501,6 +624,95 @@ def gls_prewhiten(times, mags, errs,
 
 
 
+def iterative_prewhiten(times, mags, errs,
+                        pfmethod='gls',
+                        pfkwargs=None,
+                        nbestpeaks=5,
+                        fourierorder=3,
+                        initfparams=None,
+                        sigclip=30.0,
+                        magsarefluxes=False,
+                        nworkers=None):
+    '''This runs an iterative peak-removal and refit with any period-finder.
+
+    In each round, this runs the period-finder, fits a Fourier series at the
+    best period, subtracts it from the mag series, and then runs the
+    period-finder again on the whitened mag series. This is repeated
+    nbestpeaks times.
+
+    pfmethod is one of the keys in periodbase.LSPMETHODS ('gls', 'bls', 'pdm',
+    'aov', 'mav', 'acf', 'win'). pfkwargs is a dict of kwargs to pass to the
+    period-finder (e.g. startp, endp, autofreq, stepsize). The mag series is
+    sigma-clipped once at the start, and the same points are used for all
+    rounds. For 'gls', the frequency grid and the data-independent terms are
+    reused between rounds (see gls_prewhiten).
+
+    Returns a dict of the form:
+
+    {'method': pfmethod,
+     'bestperiods': list of best periods, one per round,
+     'bestlspvals': list of best periodogram values, one per round,
+     'whitenparams': list of Fourier params subtracted in each round,
+     'lspresults': list of (periods, lspvals) tuples, one per round,
+     'times', 'mags', 'errs': the final whitened mag series}
+
+    '''
+
+    if pfmethod not in LSPMETHODS:
+        LOGERROR('unknown period-finder method: %s' % pfmethod)
+        return None
+
+    if pfkwargs is None:
+        pfkwargs = {}
+
+    stimes, smags, serrs = sigclip_magseries(times, mags, errs,
+                                             sigclip=sigclip,
+                                             magsarefluxes=magsarefluxes)
+
+    # get rid of zero errs
+    nzind = npnonzero(serrs)
+    stimes, smags, serrs = stimes[nzind], smags[nzind], serrs[nzind]
+
+    # pull out the frequency grid kwargs for GLS
+    glskwargs = {}
+    if pfmethod == 'gls':
+        for key in ('startp','endp','autofreq','stepsize'):
+            if key in pfkwargs:
+                glskwargs[key] = pfkwargs[key]
+
+    bestperiods, bestlspvals, whitenparams, lspresults = [], [], [], []
+    wmags = smags
+
+    for roundresult in _get_whitening_rounds(stimes, smags, serrs,
+                                             pfmethod=pfmethod,
+                                             pfkwargs=pfkwargs,
+                                             nrounds=nbestpeaks,
+                                             fourierorder=fourierorder,
+                                             initfparams=initfparams,
+                                             magsarefluxes=magsarefluxes,
+                                             sigclip=sigclip,
+                                             nworkers=nworkers,
+                                             **glskwargs):
+
+        periods, lspvals, bestperiod, bestlspval, wmags, wparams = roundresult
+
+        bestperiods.append(bestperiod)
+        bestlspvals.append(bestlspval)
+        lspresults.append((periods, lspvals))
+        if wparams is not None:
+            whitenparams.append(wparams)
+
+    return {'method':pfmethod,
+            'bestperiods':bestperiods,
+            'bestlspvals':bestlspvals,
+            'whitenparams':whitenparams,
+            'lspresults':lspresults,
+            'times':stimes,
+            'mags':wmags,
+            'errs':serrs}
+
+
+
 def mask_signal(times, mags, errs,
                 signalperiod,
                 signalepoch,
@@ -87,13 +87,18 @@ from numpy import isfinite as npisfinite, median as npmedian, \
     abs as npabs, pi as MPI
 from numpy.linalg import lstsq
 
-from scipy.optimize import leastsq
-from scipy.signal import medfilt, savgol_filter
-import scipy.interpolate as spi
-from astropy.convolution import convolve, Gaussian1DKernel
+from ..lazyload import lazy_module, lazy_object
+
+# these are imported on first use to keep import times down
+leastsq = lazy_object('scipy.optimize', 'leastsq')
+medfilt = lazy_object('scipy.signal', 'medfilt')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
+spi = lazy_module('scipy.interpolate')
+convolve = lazy_object('astropy.convolution', 'convolve')
+Gaussian1DKernel = lazy_object('astropy.convolution', 'Gaussian1DKernel')
 
 # for random forest EPD
-from sklearn.ensemble import RandomForestRegressor
+RandomForestRegressor = lazy_object('sklearn.ensemble', 'RandomForestRegressor')
 
 from ..lcmath import sigclip_magseries_with_extparams
 
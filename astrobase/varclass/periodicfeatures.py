@@ -79,9 +79,14 @@ def LOGEXCEPTION(message):
 
 from time import time as unixtime
 from itertools import combinations
+from hashlib import sha1
 
 import numpy as np
-from scipy.signal import argrelmin, argrelmax
+from ..lazyload import lazy_object
+
+# these are imported on first use to keep import times down
+argrelmin = lazy_object('scipy.signal', 'argrelmin')
+argrelmax = lazy_object('scipy.signal', 'argrelmax')
 
 
 ###################
@@ -95,6 +100,206 @@ from ..periodbase.zgls import specwindow_lsp
 from .varfeatures import lightcurve_ptp_measures
 
 
+################################
+## PER-OBJECT FEATURE CONTEXT ##
+################################
+
+def _hashable(value):
+    '''
+    This turns lists, tuples, and arrays into nested tuples for cache keys.
+
+    '''
+
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_hashable(x) for x in value)
+    else:
+        return value
+
+
+
+def _array_digest(value):
+    '''This returns a hash of an array's contents for cache keys.
+
+    This is used instead of id(value) so a cached result can't be returned for
+    a different array that ends up at the address of one that's been garbage
+    collected. Returns None if value is None.
+
+    '''
+
+    if value is None:
+        return None
+
+    value = np.ascontiguousarray(value)
+    return (value.dtype.str,
+            value.shape,
+            sha1(value.view(np.uint8).ravel()).hexdigest())
+
+
+
+class PeriodicFeatureContext(object):
+    '''This holds the light curve of an object and things calculated from it.
+
+    The functions that calculate periodic features below can all take one of
+    these as their context kwarg. When they do, the cleaned light curve, its
+    MAD and point-to-point measures, the sigma-clipped light curves, the phased
+    light curves, and the model fits are calculated the first time they're
+    needed and reused afterwards. This way, if several period-finders find the
+    same period (or one finds twice the period of another), the light curve is
+    only phased and fit once for that period.
+
+    Make one of these for each light curve (i.e. for each object and magcol).
+
+    times, mags, errs are the light curve. Non-finite points and points with
+    zero errs are removed.
+
+    magsarefluxes is the default used for sigma-clipping.
+
+    The ncomputed attribute is a dict of how many times each kind of thing was
+    actually calculated, which is useful to check how much was reused.
+
+    '''
+
+    def __init__(self, times, mags, errs, magsarefluxes=False):
+        '''
+        This filters the light curve and sets up the cache.
+
+        '''
+
+        finind = np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs)
+        ftimes, fmags, ferrs = times[finind], mags[finind], errs[finind]
+
+        nzind = np.nonzero(ferrs)
+        self.times = ftimes[nzind]
+        self.mags = fmags[nzind]
+        self.errs = ferrs[nzind]
+
+        self.magsarefluxes = magsarefluxes
+        self.cache = {}
+        self.ncomputed = {}
+
+
+    def cached(self, key, func, *args, **kwargs):
+        '''
+        This returns the cached value for key, calling func to get it if needed.
+
+        key is a tuple whose first element is the kind of thing being cached.
+
+        '''
+
+        if key not in self.cache:
+            self.cache[key] = func(*args, **kwargs)
+            self.ncomputed[key[0]] = self.ncomputed.get(key[0], 0) + 1
+
+        return self.cache[key]
+
+
+    def lightcurve_mad(self):
+        '''
+        This returns the MAD of the unphased light curve.
+
+        '''
+
+        def _mad():
+            median = np.median(self.mags)
+            return np.median(np.abs(self.mags - median))
+
+        return self.cached(('mad',), _mad)
+
+
+    def ptp_measures(self, period=None):
+        '''
+        This returns the point-to-point measures for the unphased light curve,
+        or for the light curve phased at period if that's given.
+
+        '''
+
+        if period is None:
+            return self.cached(('ptp', None),
+                               lightcurve_ptp_measures,
+                               self.times, self.mags, self.errs)
+
+        else:
+            phasedlc = self.phased(period)
+            return self.cached(('ptp', period),
+                               lightcurve_ptp_measures,
+                               phasedlc['phase'],
+                               phasedlc['mags'],
+                               phasedlc['errs'])
+
+
+    def phased(self, period, epoch=None):
+        '''
+        This returns the light curve phased at period and sorted by phase, not
+        wrapped. If epoch is None, the earliest time is used.
+
+        '''
+
+        if epoch is None:
+            epoch = self.times.min()
+
+        return self.cached(('phased', period, epoch),
+                           lcmath.phase_magseries_with_errs,
+                           self.times, self.mags, self.errs,
+                           period, epoch,
+                           wrap=False)
+
+
+    def sigclipped(self, sigclip, magsarefluxes=None):
+        '''
+        This returns the sigma-clipped times, mags, errs.
+
+        '''
+
+        if magsarefluxes is None:
+            magsarefluxes = self.magsarefluxes
+
+        return self.cached(('sigclip', _hashable(sigclip), magsarefluxes),
+                           lcmath.sigclip_magseries,
+                           self.times, self.mags, self.errs,
+                           sigclip=sigclip,
+                           magsarefluxes=magsarefluxes)
+
+
+    def fit(self, fitfunc, fitarg, sigclip=10.0, **fitkwargs):
+        '''This runs an lcfit fitting function on the sigma-clipped light curve.
+
+        fitfunc is one of the astrobase.varbase.lcfit *_fit_magseries
+        functions, fitarg is its period or initial fit params arg, and fitkwargs
+        are any other kwargs for it. The light curve is sigma-clipped here (and
+        the clipped light curve is reused) so fitfunc gets sigclip=None.
+
+        The transit and EB fitting functions update their params list with the
+        epoch they find. This is done for fitarg as well, even when the fit
+        comes from the cache.
+
+        '''
+
+        magsarefluxes = fitkwargs.get('magsarefluxes', self.magsarefluxes)
+
+        key = ('fit',
+               fitfunc.__name__,
+               _hashable(fitarg),
+               _hashable(sigclip),
+               tuple(sorted((x, _hashable(fitkwargs[x])) for x in fitkwargs
+                            if x != 'verbose')))
+
+        def _fit():
+            stimes, smags, serrs = self.sigclipped(sigclip,
+                                                   magsarefluxes=magsarefluxes)
+            fitargcopy = list(fitarg) if isinstance(fitarg, list) else fitarg
+            fitdict = fitfunc(stimes, smags, serrs, fitargcopy,
+                              sigclip=None, **fitkwargs)
+            return fitdict, fitargcopy
+
+        fitdict, updatedfitarg = self.cached(key, _fit)
+
+        if isinstance(fitarg, list):
+            fitarg[:] = updatedfitarg
+
+        return fitdict
+
+
+
 ###################################
 ## FEATURE CALCULATION FUNCTIONS ##
 ###################################
@@ -107,7 +312,8 @@ def lcfit_features(times, mags, errs, period,
                    ebparams=[-0.2,0.3,0.7,0.5],
                    sigclip=10.0,
                    magsarefluxes=False,
-                   verbose=True):
+                   verbose=True,
+                   context=None):
     '''
     This calculates various features related to fitting models to light curves.
 
@@ -115,19 +321,47 @@ def lcfit_features(times, mags, errs, period,
     - calculates the redchisq for fourier, EB, and planet transit fits
     - calculates the redchisq for fourier, EB, planet transit fits w/2 x period
 
+    If context is a PeriodicFeatureContext for this light curve, the fits are
+    taken from it (and added to it) and times, mags, errs can be None.
+
     '''
 
-    # get the finite values
-    finind = np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs)
-    ftimes, fmags, ferrs = times[finind], mags[finind], errs[finind]
+    if context is None:
+        context = PeriodicFeatureContext(times, mags, errs,
+                                         magsarefluxes=magsarefluxes)
+
+    featkey = ('lcfit_features',
+               period,
+               fourierorder,
+               _hashable(transitparams),
+               _hashable(ebparams),
+               _hashable(sigclip),
+               magsarefluxes)
+
+    return dict(context.cached(featkey,
+                               _lcfit_features,
+                               context,
+                               period,
+                               fourierorder,
+                               transitparams,
+                               ebparams,
+                               sigclip,
+                               magsarefluxes,
+                               verbose))
+
+
+
+def _lcfit_features(context, period, fourierorder, transitparams, ebparams,
+                    sigclip, magsarefluxes, verbose):
+    '''
+    This does the work for lcfit_features.
+
+    '''
 
-    # get nonzero errors
-    nzind = np.nonzero(ferrs)
-    ftimes, fmags, ferrs = ftimes[nzind], fmags[nzind], ferrs[nzind]
+    ftimes, fmags, ferrs = context.times, context.mags, context.errs
 
     # get the MAD of the unphased light curve
-    lightcurve_median = np.median(fmags)
-    lightcurve_mad = np.median(np.abs(fmags - lightcurve_median))
+    lightcurve_mad = context.lightcurve_mad()
 
     #
     # fourier fit
@@ -139,11 +373,11 @@ def lcfit_features(times, mags, errs, period,
     # phi_ij are also used as periodic variability features
 
     # do the fit
-    ffit = lcfit.fourier_fit_magseries(ftimes, fmags, ferrs, period,
-                                       fourierorder=fourierorder,
-                                       sigclip=sigclip,
-                                       magsarefluxes=magsarefluxes,
-                                       verbose=verbose)
+    ffit = context.fit(lcfit.fourier_fit_magseries, period,
+                       fourierorder=fourierorder,
+                       sigclip=sigclip,
+                       magsarefluxes=magsarefluxes,
+                       verbose=verbose)
 
     # get the coeffs and redchisq
     fourier_fitcoeffs = ffit['fitinfo']['finalparams']
@@ -258,11 +492,11 @@ def lcfit_features(times, mags, errs, period,
                    ebparams[3]]
 
     # do the planet and EB fit with this period
-    planet_fit = lcfit.traptransit_fit_magseries(ftimes, fmags, ferrs,
-                                                 planetfitparams,
-                                                 sigclip=sigclip,
-                                                 magsarefluxes=magsarefluxes,
-                                                 verbose=verbose)
+    planet_fit = context.fit(lcfit.traptransit_fit_magseries,
+                             planetfitparams,
+                             sigclip=sigclip,
+                             magsarefluxes=magsarefluxes,
+                             verbose=verbose)
 
     planetfit_finalparams = planet_fit['fitinfo']['finalparams']
     planetfit_chisq = planet_fit['fitchisq']
@@ -293,11 +527,11 @@ def lcfit_features(times, mags, errs, period,
                                            planet_residual_median))
 
 
-    eb_fit = lcfit.gaussianeb_fit_magseries(ftimes, fmags, ferrs,
-                                            ebfitparams,
-                                            sigclip=sigclip,
-                                            magsarefluxes=magsarefluxes,
-                                            verbose=verbose)
+    eb_fit = context.fit(lcfit.gaussianeb_fit_magseries,
+                         ebfitparams,
+                         sigclip=sigclip,
+                         magsarefluxes=magsarefluxes,
+                         verbose=verbose)
 
     ebfit_finalparams = eb_fit['fitinfo']['finalparams']
     ebfit_chisq = eb_fit['fitchisq']
@@ -329,11 +563,11 @@ def lcfit_features(times, mags, errs, period,
 
     # do the EB fit with 2 x period
     ebfitparams[0] = ebfitparams[0]*2.0
-    eb_fitx2 = lcfit.gaussianeb_fit_magseries(ftimes, fmags, ferrs,
-                                              ebfitparams,
-                                              sigclip=sigclip,
-                                              magsarefluxes=magsarefluxes,
-                                              verbose=verbose)
+    eb_fitx2 = context.fit(lcfit.gaussianeb_fit_magseries,
+                           ebfitparams,
+                           sigclip=sigclip,
+                           magsarefluxes=magsarefluxes,
+                           verbose=verbose)
 
     ebfitx2_finalparams = eb_fitx2['fitinfo']['finalparams']
     ebfitx2_chisq = eb_fitx2['fitchisq']
@@ -403,7 +637,8 @@ def periodogram_features(pgramlist, times, mags, errs,
                          sampling_peak_multiplier=5.0,
                          sampling_startp=None,
                          sampling_endp=None,
-                         verbose=True):
+                         verbose=True,
+                         context=None):
     '''This calculates various periodogram features (for each periodogram).
 
     pgramlist is a list of dicts returned by any of the periodfinding methods in
@@ -432,25 +667,27 @@ def periodogram_features(pgramlist, times, mags, errs,
     a spectral window LSP and this must be obtained from the times, mags, errs
     directly by running periodbase.specwindow_lsp.
 
+    If context is a PeriodicFeatureContext for this light curve, the spectral
+    window LSP is taken from it (or added to it) if it must be calculated.
+
     '''
     # run the sampling peak periodogram if necessary
     pfmethodlist = [pgram['method'] for pgram in pgramlist]
 
     if 'win' not in pfmethodlist:
 
-        # get the finite values
-        finind = np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs)
-        ftimes, fmags, ferrs = times[finind], mags[finind], errs[finind]
-
-        # get nonzero errors
-        nzind = np.nonzero(ferrs)
-        ftimes, fmags, ferrs = ftimes[nzind], fmags[nzind], ferrs[nzind]
-
-        sampling_lsp = specwindow_lsp(times, mags, errs,
-                                      startp=sampling_startp,
-                                      endp=sampling_endp,
-                                      sigclip=sigclip,
-                                      verbose=verbose)
+        if context is None:
+            context = PeriodicFeatureContext(times, mags, errs)
+
+        sampling_lsp = context.cached(
+            ('specwindow', sampling_startp, sampling_endp, _hashable(sigclip)),
+            specwindow_lsp,
+            context.times, context.mags, context.errs,
+            startp=sampling_startp,
+            endp=sampling_endp,
+            sigclip=sigclip,
+            verbose=verbose
+        )
 
     else:
         sampling_lsp = pgramlist[pfmethodlist.index('win')]
@@ -678,7 +915,8 @@ def phasedlc_features(times,
                       period,
                       nbrtimes=None,
                       nbrmags=None,
-                      nbrerrs=None):
+                      nbrerrs=None,
+                      context=None):
     '''This calculates various phased LC features for the object.
 
     If nbrtimes, nbrmags, and nbrerrs are all not None, they should
@@ -686,52 +924,68 @@ def phasedlc_features(times,
     within some small number x FWHM of telescope to check for blending) will
     also calculate extra features based on neighbor phased LC.
 
+    If context is a PeriodicFeatureContext for this light curve, the phased
+    light curves are taken from it (and added to it) and times, mags, errs can
+    be None.
+
+    '''
+
+    if context is None:
+        context = PeriodicFeatureContext(times, mags, errs)
+
+    featkey = ('phasedlc_features',
+               period,
+               _array_digest(nbrtimes),
+               _array_digest(nbrmags),
+               _array_digest(nbrerrs))
+
+    return dict(context.cached(featkey,
+                               _phasedlc_features,
+                               context,
+                               period,
+                               nbrtimes,
+                               nbrmags,
+                               nbrerrs))
+
+
+
+def _phasedlc_features(context, period, nbrtimes, nbrmags, nbrerrs):
     '''
-    # get the finite values
-    finind = np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs)
-    ftimes, fmags, ferrs = times[finind], mags[finind], errs[finind]
+    This does the work for phasedlc_features.
 
-    # get nonzero errors
-    nzind = np.nonzero(ferrs)
-    ftimes, fmags, ferrs = ftimes[nzind], fmags[nzind], ferrs[nzind]
+    '''
+
+    ftimes = context.times
 
     # only operate on LC if enough points
     if ftimes.size > 49:
 
         # get the MAD of the unphased light curve
-        lightcurve_median = np.median(fmags)
-        lightcurve_mad = np.median(np.abs(fmags - lightcurve_median))
+        lightcurve_mad = context.lightcurve_mad()
 
         # get p2p for raw lightcurve
-        p2p_unphasedlc = lightcurve_ptp_measures(ftimes, fmags, ferrs)
+        p2p_unphasedlc = context.ptp_measures()
         inveta_unphasedlc = 1.0/p2p_unphasedlc['eta_normal']
 
         # phase the light curve with the given period, assume epoch is
         # times.min()
-        phasedlc = lcmath.phase_magseries_with_errs(ftimes, fmags, ferrs,
-                                                    period, ftimes.min(),
-                                                    wrap=False)
+        phasedlc = context.phased(period)
 
         phase = phasedlc['phase']
         pmags = phasedlc['mags']
-        perrs = phasedlc['errs']
 
         # get ptp measures for best period
-        ptp_bestperiod = lightcurve_ptp_measures(phase,pmags,perrs)
+        ptp_bestperiod = context.ptp_measures(period)
 
         # phase the light curve with the given periodx2, assume epoch is
         # times.min()
-        phasedlc = lcmath.phase_magseries_with_errs(ftimes, fmags, ferrs,
-                                                    period*2.0, ftimes.min(),
-                                                    wrap=False)
+        phasedlc = context.phased(period*2.0)
 
         phasex2 = phasedlc['phase']
         pmagsx2 = phasedlc['mags']
-        perrsx2 = phasedlc['errs']
-
 
         # get ptp measures for best periodx2
-        ptp_bestperiodx2 = lightcurve_ptp_measures(phasex2,pmagsx2,perrsx2)
+        ptp_bestperiodx2 = context.ptp_measures(period*2.0)
 
         # eta_phasedlc_bestperiod - calculate eta for the phased LC with best
         # period
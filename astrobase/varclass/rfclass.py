@@ -93,6 +93,9 @@ import os.path
 import os
 import shutil
 import itertools
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 try:
     import cPickle as pickle
@@ -113,20 +116,31 @@ import numpy.random as npr
 RANDSEED = 0xdecaff
 npr.seed(RANDSEED)
 
-from scipy.stats import randint as sp_randint
+NCPUS = mp.cpu_count()
+
+from ..lazyload import lazy_module, lazy_object, use_agg_backend
+
+# these are imported on first use to keep import times down
+sp_randint = lazy_object('scipy.stats', 'randint')
 
 # scikit imports
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import KFold, StratifiedKFold, RandomizedSearchCV
-from sklearn.model_selection import train_test_split
+RandomForestClassifier = lazy_object('sklearn.ensemble',
+                                     'RandomForestClassifier')
+KFold = lazy_object('sklearn.model_selection', 'KFold')
+StratifiedKFold = lazy_object('sklearn.model_selection', 'StratifiedKFold')
+RandomizedSearchCV = lazy_object('sklearn.model_selection',
+                                 'RandomizedSearchCV')
+train_test_split = lazy_object('sklearn.model_selection', 'train_test_split')
 
 from operator import itemgetter
-from sklearn.metrics import r2_score, median_absolute_error, \
-    precision_score, recall_score, confusion_matrix, f1_score
+r2_score = lazy_object('sklearn.metrics', 'r2_score')
+median_absolute_error = lazy_object('sklearn.metrics', 'median_absolute_error')
+precision_score = lazy_object('sklearn.metrics', 'precision_score')
+recall_score = lazy_object('sklearn.metrics', 'recall_score')
+confusion_matrix = lazy_object('sklearn.metrics', 'confusion_matrix')
+f1_score = lazy_object('sklearn.metrics', 'f1_score')
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+plt = lazy_module('matplotlib.pyplot', onload=use_agg_backend)
 
 
 #######################
@@ -501,6 +515,9 @@ def apply_rf_classifier(classifier,
 
     outpickle is the pickle of the result dict generated by this function.
 
+    This collects all the features into memory before classifying them. Use
+    stream_rf_classifier instead for large numbers of objects.
+
     '''
 
     if isinstance(classifier,str) and os.path.exists(classifier):
@@ -570,6 +587,370 @@ def apply_rf_classifier(classifier,
 
 
 
+##############################
+## STREAMING CLASSIFICATION ##
+##############################
+
+def _read_feature_chunk(task):
+    '''This reads one chunk of features for stream_rf_classifier.
+
+    task[0] is either a list of varfeatures pickles or a (npyfile, start, stop)
+    tuple pointing to rows in a columnar feature file made by
+    write_feature_columns. Features missing for an object are set to NaN.
+
+    Returns a tuple of (objectids, feature array of shape nobjects x
+    nfeatures).
+
+    '''
+
+    source, magcol, featurenames = task
+
+    if isinstance(source, tuple):
+
+        npyfile, start, stop = source
+        columns = np.load(npyfile, mmap_mode='r')[start:stop]
+
+        objectids = np.array(columns['objectid'])
+        featarray = np.column_stack(
+            [np.array(columns[x], dtype=np.float64) for x in featurenames]
+        )
+        return objectids, featarray
+
+    objectids = []
+    featarray = np.full((len(source), len(featurenames)), np.nan)
+
+    for ind, pkl in enumerate(source):
+
+        try:
+
+            with open(pkl,'rb') as infd:
+                varf = pickle.load(infd)
+
+            thisfeatures = varf[magcol]
+            objectids.append(varf['objectid'])
+
+            for find, feature in enumerate(featurenames):
+                if thisfeatures.get(feature) is not None:
+                    featarray[ind, find] = thisfeatures[feature]
+
+        except Exception:
+            LOGEXCEPTION('could not read features from %s' % pkl)
+            objectids.append(None)
+
+    objectids = np.array(objectids, dtype=object)
+    ok = objectids != None
+
+    return objectids[ok].astype(str), featarray[ok]
+
+
+
+def _feature_chunk_tasks(features, magcol, featurenames, pklglob,
+                         maxobjects, chunksize):
+    '''
+    This makes the chunk reader tasks for a pickle dir or columnar file.
+
+    '''
+
+    if os.path.isdir(features):
+
+        pklist = sorted(glob.glob(os.path.join(features, pklglob)))
+        if maxobjects:
+            pklist = pklist[:maxobjects]
+
+        return [(pklist[x:x+chunksize], magcol, featurenames)
+                for x in range(0, len(pklist), chunksize)]
+
+    else:
+
+        nrows = np.load(features, mmap_mode='r').shape[0]
+        if maxobjects:
+            nrows = min(nrows, maxobjects)
+
+        return [((features, x, min(x+chunksize, nrows)), magcol, featurenames)
+                for x in range(0, nrows, chunksize)]
+
+
+
+def _iter_feature_chunks(tasks, nworkers, maxpending):
+    '''This yields the feature chunks in order, reading ahead in parallel.
+
+    No more than maxpending chunks are read ahead of the one being yielded, so
+    the memory used stays bounded no matter how many objects there are.
+
+    '''
+
+    if nworkers is None or nworkers < 2:
+        for task in tasks:
+            yield _read_feature_chunk(task)
+        return
+
+    tasks = iter(tasks)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+
+        for task in itertools.islice(tasks, maxpending):
+            pending.append(executor.submit(_read_feature_chunk, task))
+
+        while pending:
+
+            chunk = pending.popleft().result()
+
+            for task in itertools.islice(tasks, 1):
+                pending.append(executor.submit(_read_feature_chunk, task))
+
+            yield chunk
+
+
+
+def _widen_objectid_column(outfile, columns, nrows, objectidlen):
+    '''This rewrites a columnar feature file with a wider objectid field.
+
+    columns is the open memmap of outfile, and nrows is the number of rows
+    written to it so far. Returns the memmap of the rewritten file.
+
+    '''
+
+    dtype = [(x, ('U%s' % objectidlen if x == 'objectid' else
+                  columns.dtype[x].str))
+             for x in columns.dtype.names]
+
+    tempfile = '%s.tmp.npy' % outfile
+    widened = np.lib.format.open_memmap(tempfile,
+                                        mode='w+',
+                                        dtype=dtype,
+                                        shape=columns.shape)
+    for field in columns.dtype.names:
+        widened[field][:nrows] = columns[field][:nrows]
+
+    widened.flush()
+    del widened
+    del columns
+
+    shutil.move(tempfile, outfile)
+
+    return np.lib.format.open_memmap(outfile, mode='r+')
+
+
+
+def write_feature_columns(featuresdir,
+                          magcol,
+                          outfile,
+                          pklglob='varfeatures-*.pkl',
+                          featurestouse=NONPERIODIC_FEATURES_TO_COLLECT,
+                          maxobjects=None,
+                          chunksize=5000,
+                          nworkers=NCPUS,
+                          objectidlen=64):
+    '''This converts varfeatures pickles into a columnar feature file.
+
+    The output is a .npy file holding a structured array with an 'objectid'
+    field and one float64 field per feature. It's written chunk by chunk
+    through a memmap, so this never holds more than a few chunks of features in
+    memory. The file can be passed to stream_rf_classifier in place of the
+    varfeatures pickle directory, which is much faster when the same objects
+    are classified more than once.
+
+    featuresdir, magcol, pklglob, featurestouse, and maxobjects are the same as
+    for collect_features. Features missing for an object are written as NaN.
+
+    chunksize is the number of pickles each worker reads at a time, nworkers
+    is the number of parallel chunk readers, and objectidlen is the initial
+    width of the objectid field. If any objectid is longer than this, the
+    field is widened to fit it and the rows already written are copied over,
+    so objectids are never truncated.
+
+    Returns the path to the output file.
+
+    '''
+
+    if not featurestouse:
+        featurestouse = NONPERIODIC_FEATURES_TO_COLLECT
+
+    tasks = _feature_chunk_tasks(featuresdir, magcol, featurestouse,
+                                 pklglob, maxobjects, chunksize)
+    nobjects = sum(len(x[0]) for x in tasks)
+
+    dtype = [('objectid','U%s' % objectidlen)]
+    dtype.extend([(x, 'f8') for x in featurestouse])
+
+    LOGINFO('writing %s features for %s objects to %s' %
+            (len(featurestouse), nobjects, outfile))
+
+    columns = np.lib.format.open_memmap(outfile,
+                                        mode='w+',
+                                        dtype=dtype,
+                                        shape=(nobjects,))
+
+    nrows = 0
+    for objectids, featarray in _iter_feature_chunks(tasks, nworkers,
+                                                     2*max(nworkers, 1)):
+
+        # make room for longer objectids instead of truncating them
+        if objectids.size > 0:
+            maxidlen = int(np.char.str_len(objectids).max())
+            if maxidlen > objectidlen:
+                LOGWARNING('widening the objectid field in %s '
+                           'from %s to %s characters' %
+                           (outfile, objectidlen, maxidlen))
+                objectidlen = maxidlen
+                columns = _widen_objectid_column(outfile, columns,
+                                                 nrows, objectidlen)
+
+        rows = slice(nrows, nrows + objectids.size)
+        columns['objectid'][rows] = objectids
+        for find, feature in enumerate(featurestouse):
+            columns[feature][rows] = featarray[:,find]
+
+        nrows = nrows + objectids.size
+
+    columns.flush()
+    del columns
+
+    # drop the rows for any pickles that couldn't be read
+    if nrows < nobjects:
+        LOGWARNING('%s varfeatures pickles could not be read' %
+                   (nobjects - nrows))
+        columns = np.load(outfile)[:nrows]
+        np.save(outfile, columns)
+
+    return outfile
+
+
+
+def stream_rf_classifier(classifier,
+                         features,
+                         outfile,
+                         maxobjects=None,
+                         chunksize=5000,
+                         nworkers=NCPUS,
+                         maxpending=None):
+    '''This applies an RF classifier to features one chunk at a time.
+
+    This is the streaming version of apply_rf_classifier for use on large
+    numbers of objects. Instead of collecting all features into memory first,
+    this reads them in chunks of chunksize objects using nworkers parallel
+    readers, runs the classifier on each chunk as it arrives, and appends the
+    results to a CSV file. At most maxpending chunks (2 x nworkers by default)
+    are held in memory at any time.
+
+    classifier is the output dict or pickle from train_rf_classifier.
+
+    features is either a directory of varfeatures pickles (searched using the
+    pklglob the classifier's features were collected with) or a columnar
+    feature file made by write_feature_columns. Features that are missing for
+    an object are passed to the classifier as NaN.
+
+    outfile is the CSV file to write. It has a header line, then one line per
+    object with its objectid, the predicted label, and the probability of each
+    class. Use read_rf_classifier_results to read it back.
+
+    Returns a dict with the outfile, the number of objects and chunks
+    classified, the classes, and the feature names used.
+
+    '''
+
+    if isinstance(classifier,str) and os.path.exists(classifier):
+        with open(classifier,'rb') as infd:
+            clfdict = pickle.load(infd)
+    elif isinstance(classifier, dict):
+        clfdict = classifier
+    else:
+        LOGERROR("can't figure out the input classifier arg")
+        return None
+
+    if 'feature_names' not in clfdict:
+        LOGERROR("feature_names not present in classifier input, "
+                 "can't figure out which ones to extract from %s" % features)
+        return None
+
+    if not os.path.exists(features):
+        LOGERROR("features %s don't exist" % features)
+        return None
+
+    featurenames = clfdict['feature_names']
+    magcol = clfdict['magcol']
+    pklglob = clfdict['collect_kwargs']['pklglob']
+    bestclf = clfdict['best_classifier']
+    classes = bestclf.classes_
+
+    if not maxpending:
+        maxpending = 2*max(nworkers, 1)
+
+    tasks = _feature_chunk_tasks(features, magcol, featurenames,
+                                 pklglob, maxobjects, chunksize)
+
+    LOGINFO('classifying objects from %s in %s chunks of %s objects' %
+            (features, len(tasks), chunksize))
+
+    columns = ['objectid','predicted_label']
+    columns.extend(['prob_%s' % x for x in classes])
+
+    nobjects = 0
+    nchunks = 0
+
+    if TQDM:
+        chunkiter = tqdm(_iter_feature_chunks(tasks, nworkers, maxpending),
+                         total=len(tasks))
+    else:
+        chunkiter = _iter_feature_chunks(tasks, nworkers, maxpending)
+
+    with open(outfile,'w') as outfd:
+
+        outfd.write('%s\n' % ','.join(columns))
+
+        for objectids, featarray in chunkiter:
+
+            if objectids.size == 0:
+                continue
+
+            # predict() is the argmax of predict_proba(), so only the
+            # probabilities need to be computed
+            probs = bestclf.predict_proba(featarray)
+            labels = classes[np.argmax(probs, axis=1)]
+
+            outfd.write(
+                ''.join(
+                    '%s,%s,%s\n' % (objectid,
+                                    label,
+                                    ','.join('%.6f' % x for x in prob))
+                    for objectid, label, prob in zip(objectids, labels, probs)
+                )
+            )
+            outfd.flush()
+
+            nobjects = nobjects + objectids.size
+            nchunks = nchunks + 1
+
+    LOGINFO('classified %s objects, results in %s' % (nobjects, outfile))
+
+    return {'outfile':outfile,
+            'nobjects':nobjects,
+            'nchunks':nchunks,
+            'classes':classes,
+            'feature_names':featurenames}
+
+
+
+def read_rf_classifier_results(resultcsv):
+    '''This reads the CSV written by stream_rf_classifier.
+
+    Returns a numpy record array with one row per object.
+
+    '''
+
+    results = np.genfromtxt(resultcsv,
+                            delimiter=',',
+                            names=True,
+                            dtype=None,
+                            encoding='utf-8',
+                            autostrip=True,
+                            deletechars='')
+
+    return np.atleast_1d(results)
+
+
+
 ######################
 ## PLOTTING RESULTS ##
 ######################
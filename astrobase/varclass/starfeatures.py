@@ -105,9 +105,12 @@ import gzip
 import os.path
 
 import numpy as np
-from scipy.spatial import cKDTree, KDTree
+from ..lazyload import lazy_module, lazy_object
 
-from astropy.wcs import WCS
+# these are imported on first use to keep import times down
+sps = lazy_module('scipy.spatial')
+
+WCS = lazy_object('astropy.wcs', 'WCS')
 
 ###################
 ## LOCAL IMPORTS ##
@@ -319,7 +322,9 @@ BANDPASS_LIST = ['umag','bmag','vmag','rmag','imag',
 
 def color_features(in_objectinfo,
                    deredden=True,
-                   custom_bandpasses=None):
+                   custom_bandpasses=None,
+                   extinction_grid=False,
+                   extinction=None):
     '''Stellar colors and dereddened stellar colors using 2MASS DUST API:
 
     http://irsa.ipac.caltech.edu/applications/DUST/docs/dustProgramInterface.html
@@ -420,6 +425,25 @@ def color_features(in_objectinfo,
 
     ['sdssu-sdssg','u - g']
 
+    `extinction_grid` sets how to get the extinction for dereddening. If this
+    is False (the default), grids aren't used and the 2MASS DUST service is
+    queried for the object. If this is True, an extinction grid covering the
+    object in the default grid directory (see
+    astrobase.services.dust.make_extinction_grid) will be used if there is
+    one. If this is the path to a grid file or a grid dict from
+    dust.load_extinction_grid, that grid will be used. If the object isn't
+    covered by a grid, the 2MASS DUST service is queried for the object as
+    usual.
+
+    `extinction` is the extinction for the object if it's already known, e.g.
+    from dust.grid_extinction_queries run for a whole field at once. This is a
+    dict in the form returned by dust.extinction_query. If this is provided, no
+    grids or DUST queries are used.
+
+    The output dict's `extinction_source` key records where the extinction
+    came from: 'grid' (with the grid file in `extinction_gridfile`), 'dust', or
+    None if there wasn't any extinction to use.
+
     '''
 
     objectinfo = in_objectinfo.copy()
@@ -529,10 +553,19 @@ def color_features(in_objectinfo,
 
         try:
 
-            # first, get the extinction table for this object
-            extinction = dust.extinction_query(objectinfo['ra'],
-                                               objectinfo['decl'],
-                                               verbose=False)
+            # if we don't have the extinction already, get it from a local grid
+            # if possible, falling back to the DUST service
+            if extinction is None and extinction_grid is not False:
+                extinction = dust.grid_extinction_query(
+                    objectinfo['ra'],
+                    objectinfo['decl'],
+                    grid=(None if extinction_grid is True else extinction_grid)
+                )
+
+            if extinction is None:
+                extinction = dust.extinction_query(objectinfo['ra'],
+                                                   objectinfo['decl'],
+                                                   verbose=False)
 
         except Exception as e:
 
@@ -546,6 +579,14 @@ def color_features(in_objectinfo,
         extinction = None
         outdict['dereddened'] = False
 
+    # record where the extinction came from
+    if extinction:
+        outdict['extinction_source'] = extinction.get('provenance', 'dust')
+        outdict['extinction_gridfile'] = extinction.get('gridfile')
+    else:
+        outdict['extinction_source'] = None
+        outdict['extinction_gridfile'] = None
+
     # go through the objectdict and pick out the mags we have available from the
     # BANDPASSES_COLORS dict
 
@@ -1049,7 +1090,8 @@ def neighbor_gaia_features(objectinfo,
                            verbose=True,
                            gaia_max_timeout=180.0,
                            gaia_mirror='cds',
-                           complete_query_later=True):
+                           complete_query_later=True,
+                           gaia_fieldcache=None):
     '''Gets several neighbor and GAIA features:
 
     from the given light curve catalog:
@@ -1070,13 +1112,19 @@ def neighbor_gaia_features(objectinfo,
     object. It is similar to that produced by lcproc.make_lclist, and is used to
     carry out the spatial search required to find neighbors for this object.
 
+    gaia_fieldcache is the dict returned by gaia.get_field_catalog for the field
+    this object is in. If provided, the GAIA neighbors for this object are
+    found using the local field-level tile cache instead of running a TAP query
+    for this object alone. Objects not covered by the field cache fall back to
+    the TAP query.
+
     '''
 
     # kdtree search for neighbors in light curve catalog
     if ('ra' in objectinfo and 'decl' in objectinfo and
         objectinfo['ra'] is not None and objectinfo['decl'] is not None and
-        (isinstance(lclist_kdtree, cKDTree) or
-         isinstance(lclist_kdtree, KDTree))):
+        (isinstance(lclist_kdtree, sps.cKDTree) or
+         isinstance(lclist_kdtree, sps.KDTree))):
 
         ra, decl = objectinfo['ra'], objectinfo['decl']
 
@@ -1153,29 +1201,46 @@ def neighbor_gaia_features(objectinfo,
     if ('ra' in objectinfo and 'decl' in objectinfo and
         objectinfo['ra'] is not None and objectinfo['decl'] is not None):
 
-        gaia_result = gaia.objectlist_conesearch(
-            objectinfo['ra'],
-            objectinfo['decl'],
-            neighbor_radius_arcsec,
-            verbose=verbose,
-            maxtimeout=gaia_max_timeout,
-            gaia_mirror=gaia_mirror,
-            complete_query_later=complete_query_later
-        )
+        gaia_objlist = None
 
-        if gaia_result:
+        # use the field-level cache if we have one
+        if gaia_fieldcache is not None:
 
-            gaia_objlistf = gaia_result['result']
+            gaia_objlist = gaia.field_conesearch(
+                gaia_fieldcache,
+                objectinfo['ra'],
+                objectinfo['decl'],
+                neighbor_radius_arcsec
+            )
 
-            with gzip.open(gaia_objlistf,'rb') as infd:
+        # otherwise, run the query for this object alone
+        if gaia_objlist is None:
+
+            gaia_result = gaia.objectlist_conesearch(
+                objectinfo['ra'],
+                objectinfo['decl'],
+                neighbor_radius_arcsec,
+                verbose=verbose,
+                maxtimeout=gaia_max_timeout,
+                gaia_mirror=gaia_mirror,
+                complete_query_later=complete_query_later
+            )
 
-                gaia_objlist = np.genfromtxt(
-                    infd,
-                    names=True,
-                    delimiter=',',
-                    dtype='U20,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8',
-                    usecols=(0,1,2,3,4,5,6,7,8,9,10,11,12)
-                )
+            if gaia_result:
+
+                gaia_objlistf = gaia_result['result']
+
+                with gzip.open(gaia_objlistf,'rb') as infd:
+
+                    gaia_objlist = np.genfromtxt(
+                        infd,
+                        names=True,
+                        delimiter=',',
+                        dtype='U20,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8,f8',
+                        usecols=(0,1,2,3,4,5,6,7,8,9,10,11,12)
+                    )
+
+        if gaia_objlist is not None:
 
             gaia_objlist = np.atleast_1d(gaia_objlist)
 
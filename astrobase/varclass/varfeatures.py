@@ -78,19 +78,25 @@ def LOGEXCEPTION(message):
 
 from time import time as unixtime
 
+import numpy as np
+
 from numpy import nan as npnan, sum as npsum, abs as npabs, \
     roll as nproll, isfinite as npisfinite, std as npstd, \
     sign as npsign, sqrt as npsqrt, mean as npmean, median as npmedian, \
     array as nparray, percentile as nppercentile, \
-    polyfit as nppolyfit, var as npvar, max as npmax, min as npmin, \
+    var as npvar, max as npmax, \
     log10 as nplog10, arange as nparange, pi as MPI, floor as npfloor, \
     argsort as npargsort, cos as npcos, sin as npsin, tan as nptan, \
     where as npwhere, linspace as nplinspace, \
     zeros_like as npzeros_like, full_like as npfull_like, all as npall, \
     correlate as npcorrelate, nonzero as npnonzero, diff as npdiff, exp as npexp
 
-from scipy.stats import skew as spskew, kurtosis as spkurtosis
-from scipy.signal import savgol_filter
+from ..lazyload import lazy_object
+
+# these are imported on first use to keep import times down
+spskew = lazy_object('scipy.stats', 'skew')
+spkurtosis = lazy_object('scipy.stats', 'kurtosis')
+savgol_filter = lazy_object('scipy.signal', 'savgol_filter')
 
 
 ###################
@@ -430,65 +436,14 @@ def nonperiodic_lightcurve_features(times, mags, errs, magsarefluxes=False):
 
     '''
 
-    # remove nans first
-    finiteind = npisfinite(times) & npisfinite(mags) & npisfinite(errs)
-    ftimes, fmags, ferrs = times[finiteind], mags[finiteind], errs[finiteind]
-
-    # remove zero errors
-    nzind = npnonzero(ferrs)
-    ftimes, fmags, ferrs = ftimes[nzind], fmags[nzind], ferrs[nzind]
-
-    ndet = len(fmags)
-
-    if ndet > 9:
-
-        # calculate the moments
-        moments = lightcurve_moments(ftimes, fmags, ferrs)
-
-        # calculate the flux measures
-        fluxmeasures = lightcurve_flux_measures(ftimes, fmags, ferrs,
-                                                magsarefluxes=magsarefluxes)
-
-        # calculate the point-to-point measures
-        ptpmeasures = lightcurve_ptp_measures(ftimes, fmags, ferrs)
-
-        # get the length in time
-        mintime, maxtime = npmin(ftimes), npmax(ftimes)
-        timelength = maxtime - mintime
+    features = nonperiodic_features_batch(times, mags, errs,
+                                          offsets=[0, len(mags)],
+                                          magsarefluxes=magsarefluxes)
 
-        # get the amplitude
-        series_amplitude = 0.5*(npmax(fmags) - npmin(fmags))
-
-        # calculate the linear fit to the entire mag series
-        fitcoeffs = nppolyfit(ftimes, fmags, 1, w=1.0/(ferrs*ferrs))
-        series_linear_slope = fitcoeffs[1]
-
-        # roll fmags by 1
-        rolled_fmags = nproll(fmags,1)
-
-        # calculate the magnitude ratio (from the WISE paper)
-        series_magratio = (
-            (npmax(fmags) - moments['median']) / (npmax(fmags) - npmin(fmags) )
-        )
-
-        # this is the dictionary returned containing all the measures
-        measures = {
-            'ndet':fmags.size,
-            'mintime':mintime,
-            'maxtime':maxtime,
-            'timelength':timelength,
-            'amplitude':series_amplitude,
-            'ndetobslength_ratio':ndet/timelength,
-            'linear_fit_slope':series_linear_slope,
-            'magnitude_ratio':series_magratio,
-        }
-        if moments:
-            measures.update(moments)
-        if ptpmeasures:
-            measures.update(ptpmeasures)
-        if fluxmeasures:
-            measures.update(fluxmeasures)
+    if features['ndet'][0] > 9:
 
+        measures = _batch_features_to_dict(features, 0)
+        del measures['stetsonj'], measures['stetsonk']
         return measures
 
     else:
@@ -583,6 +538,493 @@ def gilliland_cdpp(times, mags, errs,
 
 
 
+##########################
+## FUSED FEATURE KERNEL ##
+##########################
+
+# the percentiles used for the mag and flux percentile features
+FEATURE_PERCENTILES = [5.0,10,17.5,25,32.5,40,60,67.5,75,82.5,90,95]
+
+
+# The functions below work on many light curves at once. The light curves are
+# concatenated into single arrays, and segids gives the index of the light
+# curve that each point belongs to. The segids are sorted, so each light curve
+# is a contiguous run of points (a segment) starting at starts[k] with
+# counts[k] points.
+
+def _segment_sort(values, segids, starts, counts):
+    '''This sorts values within each segment.
+
+    When all segments are the same length, this is a single sort along the rows
+    of a 2-D array. Otherwise, long segments are sorted one by one and many
+    short ones are sorted together with lexsort, which is faster for them.
+
+    '''
+
+    if values.size == 0:
+        return values
+
+    elif npall(counts == counts[0]):
+        return np.sort(values.reshape(counts.size, counts[0]), axis=1).ravel()
+
+    elif values.size >= 32*counts.size:
+        sortedvals = np.empty_like(values)
+        for start, count in zip(starts, counts):
+            sortedvals[start:start+count] = np.sort(values[start:start+count])
+        return sortedvals
+
+    else:
+        return values[np.lexsort((values, segids))]
+
+
+
+def _segment_starts(counts):
+    '''
+    This returns the index of the first point of each segment.
+
+    '''
+    return np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+
+
+
+def _segment_sums(values, segids, nsegs):
+    '''
+    This sums values within each segment.
+
+    '''
+    return np.bincount(segids, weights=values, minlength=nsegs)
+
+
+
+def _segment_reduce(ufunc, values, starts, counts):
+    '''
+    This applies ufunc.reduceat to each non-empty segment. Empty ones get NaN.
+
+    '''
+
+    out = np.full(counts.size, npnan)
+    nonempty = counts > 0
+
+    if values.size > 0:
+        out[nonempty] = ufunc.reduceat(values, starts[nonempty])
+
+    return out
+
+
+
+def _segment_ends(values, starts, counts):
+    '''
+    This returns the first and last values in each segment.
+
+    '''
+
+    if values.size == 0:
+        return np.full(counts.size, npnan), np.full(counts.size, npnan)
+
+    first = values[np.clip(starts, 0, values.size - 1)]
+    last = values[np.clip(starts + counts - 1, 0, values.size - 1)]
+
+    return first, last
+
+
+
+def _segment_median(sortedvals, starts, counts):
+    '''This returns the median of each segment of the segment-sorted values.
+
+    This gives the same result as np.median: the middle value for odd counts,
+    and the mean of the two middle values for even counts.
+
+    '''
+
+    if sortedvals.size == 0:
+        return np.full(counts.size, npnan)
+
+    upper = np.clip(starts + counts//2, 0, sortedvals.size - 1)
+    lower = np.clip(upper - 1 + counts % 2, 0, sortedvals.size - 1)
+
+    return 0.5*(sortedvals[lower] + sortedvals[upper])
+
+
+
+def _segment_percentiles(sortedvals, starts, counts, percentiles):
+    '''This returns the percentiles of each segment of sorted values.
+
+    This uses the same linear interpolation (and the same way of doing it) as
+    np.percentile.
+
+    '''
+
+    percentiles = nparray(percentiles)
+
+    if sortedvals.size == 0:
+        return np.full((counts.size, percentiles.size), npnan)
+
+    virtual = (counts[:,None] - 1)*(percentiles/100.0)[None,:]
+    lower = npfloor(virtual)
+    gamma = virtual - lower
+
+    lower = lower.astype(np.int64)
+    upper = np.minimum(lower + 1, counts[:,None] - 1)
+
+    lowval = sortedvals[np.clip(starts[:,None] + lower,
+                                0, sortedvals.size - 1)]
+    highval = sortedvals[np.clip(starts[:,None] + upper,
+                                 0, sortedvals.size - 1)]
+    diff = highval - lowval
+
+    return npwhere(gamma >= 0.5,
+                   highval - diff*(1.0 - gamma),
+                   lowval + diff*gamma)
+
+
+
+def _nonperiodic_features_kernel(ftimes, fmags, ferrs, segids, nsegs,
+                                 magsarefluxes=False,
+                                 stetson_weightbytimediff=True):
+    '''This calculates all non-periodic features for many light curves at once.
+
+    The times, mags, and errs must be finite with non-zero errs, and
+    concatenated in segment order (see the note above). Each light curve's mags
+    are sorted only once, and the sorted mags, the median, and the residuals
+    from the median are shared by all of the features that need them. The
+    features match those from the separate functions above.
+
+    Returns a dict with an array of length nsegs for each feature (nsegs x 12
+    for the percentile features). Light curves with 9 or fewer points have NaN
+    for all features.
+
+    '''
+
+    counts = np.bincount(segids, minlength=nsegs)
+    starts = _segment_starts(counts)
+    fcounts = counts.astype(np.float64)
+
+    sums = lambda x: _segment_sums(x, segids, nsegs)
+
+    # pairs of consecutive points that are in the same light curve. pair i is
+    # the points (i, i+1).
+    pairs = segids[1:] == segids[:-1]
+    pairsegs = segids[1:][pairs]
+    paircounts = np.bincount(pairsegs, minlength=nsegs)
+    pairstarts = _segment_starts(paircounts)
+
+    with np.errstate(all='ignore'):
+
+        #
+        # everything that comes from the sorted mags
+        #
+        smags = _segment_sort(fmags, segids, starts, counts)
+        series_median = _segment_median(smags, starts, counts)
+        magmin, magmax = _segment_ends(smags, starts, counts)
+        mag_percentiles = _segment_percentiles(smags, starts, counts,
+                                               FEATURE_PERCENTILES)
+
+        resid = fmags - series_median[segids]
+        series_mad = _segment_median(
+            _segment_sort(npabs(resid), segids, starts, counts),
+            starts, counts
+        )
+        series_stdev = 1.483*series_mad
+
+        beyond1std = (
+            (fmags > (series_median + series_stdev)[segids]) |
+            (fmags < (series_median - series_stdev)[segids])
+        )
+        series_beyond1std = sums(beyond1std)/fcounts
+
+        invvar = 1.0/(ferrs*ferrs)
+        series_wmean = sums(fmags*invvar)/sums(invvar)
+
+        # skew and kurtosis as in scipy.stats (biased, Fisher kurtosis)
+        series_mean = sums(fmags)/fcounts
+        dev = fmags - series_mean[segids]
+        m2 = sums(dev*dev)/fcounts
+        m3 = sums(dev*dev*dev)/fcounts
+        m4 = sums(dev*dev*dev*dev)/fcounts
+        zerovar = m2 <= (np.finfo(np.float64).resolution*series_mean)**2
+        series_skew = npwhere(zerovar, npnan, m3/m2**1.5)
+        series_kurtosis = npwhere(zerovar, npnan, m4/(m2*m2) - 3.0)
+
+        #
+        # the flux measures. fluxes go down as mags go up, so the sorted fluxes
+        # are the sorted mags reversed within each light curve.
+        #
+        if magsarefluxes:
+            sfluxes = smags
+        else:
+            revind = (2*starts + counts - 1)[segids] - nparange(fmags.size)
+            sfluxes = 10.0**(-0.4*smags[revind])
+
+        flux_median = _segment_median(sfluxes, starts, counts)
+        fluxmin, fluxmax = _segment_ends(sfluxes, starts, counts)
+        flux_percent_amplitude = (
+            np.maximum(npabs(fluxmin), npabs(fluxmax))/flux_median
+        )
+        flux_percentiles = _segment_percentiles(sfluxes, starts, counts,
+                                                FEATURE_PERCENTILES)
+        frat_595 = flux_percentiles[:,-1] - flux_percentiles[:,0]
+        frat_1090 = flux_percentiles[:,-2] - flux_percentiles[:,1]
+        frat_175825 = flux_percentiles[:,-3] - flux_percentiles[:,2]
+        frat_2575 = flux_percentiles[:,-4] - flux_percentiles[:,3]
+        frat_325675 = flux_percentiles[:,-5] - flux_percentiles[:,4]
+        frat_4060 = flux_percentiles[:,-6] - flux_percentiles[:,5]
+
+        #
+        # the Stetson indices
+        #
+        sigma_i = (fcounts/(fcounts - 1.0))[segids]*resid/ferrs
+        stetsonk = (
+            sums(npabs(sigma_i))/(npsqrt(sums(sigma_i*sigma_i))) *
+            (fcounts**(-0.5))
+        )
+
+        timediffs = npdiff(ftimes)
+
+        if stetson_weightbytimediff:
+            deltat = _segment_median(
+                _segment_sort(timediffs[pairs], pairsegs,
+                              pairstarts, paircounts),
+                pairstarts,
+                paircounts
+            )
+            weights_i = npexp(-timediffs/deltat[segids[1:]])
+            products = (weights_i*sigma_i[1:]*sigma_i[:-1])[pairs]
+        else:
+            products = (sigma_i[1:]*sigma_i[:-1])[pairs]
+
+        stetsonj = (
+            _segment_sums(npsign(products)*npsqrt(npabs(products)),
+                          pairsegs, nsegs)/fcounts
+        )
+
+        #
+        # the point-to-point measures. these drop points that are followed by
+        # one at the same time (and the last point of each light curve).
+        #
+        keep = np.zeros(fmags.size, dtype=np.bool_)
+        keep[:-1] = pairs & (timediffs != 0.0)
+
+        ptimes, pmags, psegids = ftimes[keep], fmags[keep], segids[keep]
+        pcounts = np.bincount(psegids, minlength=nsegs)
+        pstarts = _segment_starts(pcounts)
+        pfcounts = pcounts.astype(np.float64)
+
+        ppairs = psegids[1:] == psegids[:-1]
+        ppairsegs = psegids[1:][ppairs]
+        ppaircounts = np.bincount(ppairsegs, minlength=nsegs)
+        ppairstarts = _segment_starts(ppaircounts)
+        psums = lambda x: _segment_sums(x, ppairsegs, nsegs)
+
+        p2p_magdiffs = npdiff(pmags)[ppairs]
+        p2p_abs_magdiffs = npabs(p2p_magdiffs)
+        p2p_squared_magdiffs = p2p_magdiffs*p2p_magdiffs
+
+        pmedian = _segment_median(
+            _segment_sort(pmags, psegids, pstarts, pcounts),
+            pstarts, pcounts
+        )
+        robstd = _segment_median(
+            _segment_sort(npabs(pmags - pmedian[psegids]), psegids,
+                          pstarts, pcounts),
+            pstarts, pcounts
+        )*1.483
+        robvar = robstd*robstd
+
+        pmean = _segment_sums(pmags, psegids, nsegs)/pfcounts
+        pdev = pmags - pmean[psegids]
+        pvar = _segment_sums(pdev*pdev, psegids, nsegs)/pfcounts
+
+        eta_robust = _segment_median(
+            _segment_sort(p2p_abs_magdiffs, ppairsegs,
+                          ppairstarts, ppaircounts),
+            ppairstarts, ppaircounts
+        )/robvar
+        eta_robust = eta_robust/(pfcounts - 1.0)
+
+        eta_normal = psums(p2p_squared_magdiffs)/pvar
+        eta_normal = eta_normal/(pfcounts - 1.0)
+
+        ptimediffs = npdiff(ptimes)[ppairs]
+        timeweights = 1.0/(ptimediffs*ptimediffs)
+        sum_timeweights = psums(timeweights)
+
+        ptmin = _segment_reduce(np.minimum, ptimes, pstarts, pcounts)
+        ptmax = _segment_reduce(np.maximum, ptimes, pstarts, pcounts)
+        ptfirst, ptlast = _segment_ends(ptimes, pstarts, pcounts)
+
+        eta_uneven_normal = (
+            (psums(timeweights*p2p_squared_magdiffs) /
+             (pvar * sum_timeweights)) *
+            (sum_timeweights/ppaircounts) *
+            (ptmax - ptmin)*(ptmax - ptmin)
+        )
+        eta_uneven_robust = (
+            (psums(timeweights*p2p_abs_magdiffs) /
+             (robvar * sum_timeweights)) *
+            _segment_median(_segment_sort(timeweights, ppairsegs,
+                                          ppairstarts, ppaircounts),
+                            ppairstarts, ppaircounts) *
+            (ptlast - ptfirst)*(ptlast - ptfirst)
+        )
+
+        #
+        # the rest of the features
+        #
+        mintime = _segment_reduce(np.minimum, ftimes, starts, counts)
+        maxtime = _segment_reduce(np.maximum, ftimes, starts, counts)
+        timelength = maxtime - mintime
+
+        # this is the same weighted linear fit as np.polyfit(ftimes, fmags, 1,
+        # w=1.0/(ferrs*ferrs)), which minimizes sum((w*resid)**2), done around
+        # the weighted mean time. np.polyfit returns [slope, intercept] and the
+        # linear_fit_slope feature has always been the second coefficient.
+        fitweights = invvar*invvar
+        sum_fitweights = sums(fitweights)
+        tbar = sums(fitweights*ftimes)/sum_fitweights
+        ybar = sums(fitweights*fmags)/sum_fitweights
+        tdev = ftimes - tbar[segids]
+        fitslope = (
+            sums(fitweights*tdev*(fmags - ybar[segids])) /
+            sums(fitweights*tdev*tdev)
+        )
+        fitintercept = ybar - fitslope*tbar
+
+        features = {
+            'mintime':mintime,
+            'maxtime':maxtime,
+            'timelength':timelength,
+            'amplitude':0.5*(magmax - magmin),
+            'ndetobslength_ratio':fcounts/timelength,
+            'linear_fit_slope':fitintercept,
+            'magnitude_ratio':(magmax - series_median)/(magmax - magmin),
+            'median':series_median,
+            'wmean':series_wmean,
+            'mad':series_mad,
+            'stdev':series_stdev,
+            'skew':series_skew,
+            'kurtosis':series_kurtosis,
+            'beyond1std':series_beyond1std,
+            'mag_percentiles':mag_percentiles,
+            'mag_iqr':mag_percentiles[:,8] - mag_percentiles[:,3],
+            'eta_normal':eta_normal,
+            'eta_robust':eta_robust,
+            'eta_uneven_normal':eta_uneven_normal,
+            'eta_uneven_robust':eta_uneven_robust,
+            'flux_median':flux_median,
+            'flux_percent_amplitude':flux_percent_amplitude,
+            'flux_percentiles':flux_percentiles,
+            'flux_percentile_ratio_mid20':frat_4060/frat_595,
+            'flux_percentile_ratio_mid35':frat_325675/frat_595,
+            'flux_percentile_ratio_mid50':frat_2575/frat_595,
+            'flux_percentile_ratio_mid65':frat_175825/frat_595,
+            'flux_percentile_ratio_mid80':frat_1090/frat_595,
+            'percent_difference_flux_percentile':-2.5*nplog10(
+                frat_595/flux_median
+            ),
+            'stetsonj':stetsonj,
+            'stetsonk':stetsonk,
+        }
+
+    # light curves with too few points don't get any features
+    toofew = counts <= 9
+    for key in features:
+        features[key][toofew] = npnan
+
+    features['ndet'] = counts
+
+    return features
+
+
+
+def nonperiodic_features_batch(times, mags, errs,
+                               offsets=None,
+                               magsarefluxes=False,
+                               stetson_weightbytimediff=True):
+    '''This calculates the non-periodic features for many light curves at once.
+
+    The light curves can be given in two ways:
+
+    - if offsets is None, mags and errs are K x N arrays for K light curves
+      with N points each. times can be K x N as well, or a single array of N
+      times shared by all of them. errs can also be a scalar.
+
+    - if offsets is given, times, mags, and errs are 1-D arrays of the light
+      curves concatenated one after the other, and offsets is an array of K + 1
+      indices into them, so light curve k is the points from offsets[k] to
+      offsets[k+1]. The light curves can then have different lengths.
+
+    Non-finite points and points with zero errs are removed from each light
+    curve first, as in all_nonperiodic_features.
+
+    Returns a dict with the same keys as the all_nonperiodic_features dict,
+    where each value is an array with one element per light curve, or a K x 12
+    array for the mag_percentiles and flux_percentiles. Light curves with 9 or
+    fewer points have NaN for all of their features. The 'ndet' key has the
+    number of points used for each light curve.
+
+    '''
+
+    mags = np.asarray(mags, dtype=np.float64)
+
+    if offsets is None:
+
+        mags = np.atleast_2d(mags)
+        nlcs, npts = mags.shape
+
+        times = np.broadcast_to(np.asarray(times, dtype=np.float64),
+                                mags.shape).ravel()
+        errs = np.broadcast_to(np.asarray(errs, dtype=np.float64),
+                               mags.shape).ravel()
+        mags = mags.ravel()
+        segids = np.repeat(nparange(nlcs), npts)
+
+    else:
+
+        offsets = np.asarray(offsets, dtype=np.int64)
+        nlcs = offsets.size - 1
+
+        if (nlcs < 1 or offsets[0] < 0 or offsets[-1] > mags.size or
+            np.any(npdiff(offsets) < 0)):
+            LOGERROR('offsets must be an increasing array of indices '
+                     'into the light curve arrays')
+            return None
+
+        ptslice = slice(offsets[0], offsets[-1])
+        times = np.asarray(times, dtype=np.float64)[ptslice]
+        errs = np.broadcast_to(np.asarray(errs, dtype=np.float64),
+                               mags.shape)[ptslice]
+        mags = mags[ptslice]
+        segids = np.repeat(nparange(nlcs), npdiff(offsets))
+
+    # remove nans and zero errors first
+    finiteind = (npisfinite(times) & npisfinite(mags) & npisfinite(errs) &
+                 (errs != 0.0))
+
+    return _nonperiodic_features_kernel(times[finiteind],
+                                        mags[finiteind],
+                                        errs[finiteind],
+                                        segids[finiteind],
+                                        nlcs,
+                                        magsarefluxes=magsarefluxes,
+                                        stetson_weightbytimediff=(
+                                            stetson_weightbytimediff
+                                        ))
+
+
+
+def _batch_features_to_dict(features, ind):
+    '''
+    This pulls out the features for a single light curve from a batch dict.
+
+    '''
+
+    lcfeatures = {key:val[ind] for key, val in features.items()}
+    lcfeatures['ndet'] = int(lcfeatures['ndet'])
+
+    return lcfeatures
+
+
+
 #####################
 ## ROLLUP FUNCTION ##
 #####################
@@ -594,25 +1036,26 @@ def all_nonperiodic_features(times, mags, errs,
     '''
     This rolls up the functions above and returns a single dict.
 
+    All of the features are calculated in one pass by the fused kernel above,
+    which sorts the light curve once and shares the median, residuals and
+    percentiles between the features. Use nonperiodic_features_batch to get
+    the features for many light curves at once.
+
     NOTE: this doesn't calculate the CDPP; that's a separate function.
 
     '''
 
-    # remove nans first
-    finiteind = npisfinite(times) & npisfinite(mags) & npisfinite(errs)
-    ftimes, fmags, ferrs = times[finiteind], mags[finiteind], errs[finiteind]
-
-    # remove zero errors
-    nzind = npnonzero(ferrs)
-    ftimes, fmags, ferrs = ftimes[nzind], fmags[nzind], ferrs[nzind]
+    features = nonperiodic_features_batch(
+        times, mags, errs,
+        offsets=[0, len(mags)],
+        magsarefluxes=magsarefluxes,
+        stetson_weightbytimediff=stetson_weightbytimediff
+    )
 
-    xfeatures = nonperiodic_lightcurve_features(times, mags, errs,
-                                                magsarefluxes=magsarefluxes)
-    stetj = stetson_jindex(ftimes, fmags, ferrs,
-                           weightbytimediff=stetson_weightbytimediff)
-    stetk = stetson_kindex(fmags, ferrs)
+    if features['ndet'][0] > 9:
+        return _batch_features_to_dict(features, 0)
 
-    xfeatures.update({'stetsonj':stetj,
-                      'stetsonk':stetk})
-
-    return xfeatures
+    else:
+        LOGERROR('not enough detections in this magseries '
+                 'to calculate non-periodic features')
+        return None
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''bench_checkplot.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This benchmarks making lots of checkplot PNGs with astrobase.checkplot:
+
+- checkplot_png with a new figure for every checkplot (the default)
+- checkplot_png with fastplot=True, which reuses a figure template per worker
+  and decimates the points per pixel column before drawing
+
+This makes fake light curves and fake periodograms (a noise floor plus a peak
+at the period of the fake variable) so only making the checkplots is timed, not
+the period-finding. The epoch is fixed to min(times) so no light curve fits are
+done either.
+
+The default mode is slow, so it's only timed for the first --nslow checkplots
+and its time for all --ncheckplots is extrapolated from that.
+
+Run it like so:
+
+$ python benchmarks/bench_checkplot.py --ncheckplots 1000 --ndet 50000 \
+    --nworkers 4
+
+'''
+
+from __future__ import print_function
+import os
+import os.path
+import time
+import argparse
+import tempfile
+import shutil
+from multiprocessing import Pool
+
+import numpy as np
+
+from astrobase import checkplot
+
+
+###########################################
+## MAKING FAKE LCS AND PERIODOGRAM INFOS ##
+###########################################
+
+def make_fake_lc(ndet, seed):
+    '''
+    This makes a fake sinusoidal variable LC with a few outliers.
+
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    period = rng.uniform(0.5, 10.0)
+    times = np.sort(rng.uniform(0.0, 300.0, size=ndet)) + 2455000.0
+    mags = (12.0 +
+            rng.uniform(0.01, 0.1)*np.sin(2.0*np.pi*times/period) +
+            rng.normal(0.0, 0.01, size=ndet))
+    mags[rng.integers(0, ndet, size=ndet//1000 + 1)] += 0.3
+    errs = np.full(ndet, 0.01)
+
+    return times, mags, errs, period
+
+
+
+def make_fake_lspinfo(period, nperiods, seed):
+    '''
+    This makes a fake GLS periodogram with its peak at period.
+
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    periods = np.linspace(0.1, 100.0, nperiods)
+    lspvals = rng.uniform(0.0, 0.1, size=nperiods)
+    lspvals = lspvals + 0.8*np.exp(-0.5*((periods - period)/0.01)**2)
+
+    nbestperiods = [period, period*2.0, period*0.5, period*3.0, period/3.0]
+    nbestlspvals = [0.9, 0.4, 0.3, 0.2, 0.1]
+
+    return {'periods':periods,
+            'lspvals':lspvals,
+            'bestperiod':period,
+            'nbestperiods':nbestperiods,
+            'nbestlspvals':nbestlspvals,
+            'method':'gls'}
+
+
+
+############
+## TIMING ##
+############
+
+def checkplot_worker(task):
+    '''
+    This makes a single checkplot PNG.
+
+    task is a tuple of (index, outdir, ndet, nperiods, fastplot).
+
+    '''
+
+    index, outdir, ndet, nperiods, fastplot = task
+
+    times, mags, errs, period = make_fake_lc(ndet, index)
+    lspinfo = make_fake_lspinfo(period, nperiods, index)
+
+    # only making the checkplot is timed
+    start = time.time()
+    checkplot.checkplot_png(
+        lspinfo, times, mags, errs,
+        outfile=os.path.join(outdir, 'checkplot-%06i.png' % index),
+        varepoch=None,
+        verbose=False,
+        fastplot=fastplot
+    )
+    return time.time() - start
+
+
+
+def time_checkplots(ncheckplots, outdir, ndet, nperiods,
+                    fastplot, nworkers):
+    '''
+    This makes ncheckplots checkplot PNGs and returns the total wall time and
+    the mean time for each checkplot.
+
+    '''
+
+    tasks = [(x, outdir, ndet, nperiods, fastplot)
+             for x in range(ncheckplots)]
+
+    start = time.time()
+
+    if nworkers > 1:
+        pool = Pool(nworkers)
+        plottimes = pool.map(checkplot_worker, tasks)
+        pool.close()
+        pool.join()
+    else:
+        plottimes = [checkplot_worker(x) for x in tasks]
+
+    return time.time() - start, np.mean(plottimes)
+
+
+
+def main():
+    '''
+    This runs the benchmarks.
+
+    '''
+
+    aparser = argparse.ArgumentParser(
+        description='benchmark making checkplot PNGs with astrobase.checkplot'
+    )
+    aparser.add_argument('--ncheckplots', action='store', type=int,
+                         default=1000,
+                         help='number of checkplots to make in fastplot mode')
+    aparser.add_argument('--nslow', action='store', type=int, default=20,
+                         help=('number of checkplots to make with a new '
+                               'figure each time'))
+    aparser.add_argument('--ndet', action='store', type=int, default=50000,
+                         help='number of points in each fake LC')
+    aparser.add_argument('--nperiods', action='store', type=int,
+                         default=100000,
+                         help='number of periods in each fake periodogram')
+    aparser.add_argument('--nworkers', action='store', type=int, default=1,
+                         help='number of worker processes to use')
+    args = aparser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+
+    try:
+
+        print('ndet = %s, nperiods = %s, nworkers = %s\n' %
+              (args.ndet, args.nperiods, args.nworkers))
+
+        if args.nslow > 0:
+            slowtotal, slowmean = time_checkplots(args.nslow,
+                                                  tempdir,
+                                                  args.ndet,
+                                                  args.nperiods,
+                                                  False,
+                                                  args.nworkers)
+            print('new figure each time:  %s checkplots in %.1f sec '
+                  '(%.3f sec each, ~%.1f sec for %s)' %
+                  (args.nslow, slowtotal, slowmean,
+                   slowtotal*args.ncheckplots/args.nslow, args.ncheckplots))
+
+        fasttotal, fastmean = time_checkplots(args.ncheckplots,
+                                              tempdir,
+                                              args.ndet,
+                                              args.nperiods,
+                                              True,
+                                              args.nworkers)
+        print('fastplot=True:         %s checkplots in %.1f sec '
+              '(%.3f sec each)' %
+              (args.ncheckplots, fasttotal, fastmean))
+
+    finally:
+
+        shutil.rmtree(tempdir)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''bench_lcparse.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This benchmarks the text and CSV light curve readers in astrobase.hatsurveys:
+
+- hatlc.read_csvlc (bulk parser vs. the standalone per-value parser)
+- k2hat.read_csv_lightcurve
+- texthatlc.read_original_textlc (pre-2012 .tfalc and post-2012 formats)
+
+We don't ship real light curves, so this writes fake ones with the same layout,
+column types, and typical sizes (a few 10^4 rows) as the real ones to a
+temporary directory and times reading them.
+
+Run it like so:
+
+$ python benchmarks/bench_lcparse.py --ndet 50000 --repeats 3
+
+'''
+
+from __future__ import print_function
+import os
+import os.path
+import gzip
+import time
+import argparse
+import tempfile
+import shutil
+
+import numpy as np
+
+from astrobase.hatsurveys import hatlc, k2hat, texthatlc
+
+
+####################################
+## WRITING FAKE LIGHT CURVE FILES ##
+####################################
+
+# these are the columns used for the fake HAT CSV LC
+HATLC_COLUMNS = (
+    ['rjd','bjd','net','stf','cfn','cfs','ccd','prj','fld','frt',
+     'flt','flv','cid','cvn','exp','tid','mph','iha','izd',
+     'xcc','ycc','bgv','bge','fsv','fdv','fkv'] +
+    ['%s_%03i' % (x, y) for y in range(3)
+     for x in ('aim','aie','aiq','arm','aep','atf')]
+)
+
+# these are the columns used for the fake K2 CSV LC
+K2LC_COLUMNS = (
+    ['BJD','BGV','BGE','FRN','XCC','YCC','ARC'] +
+    ['%s%02i' % (x, y) for y in range(3)
+     for x in ('IM','IE','IQ','EP','EQ','TF','CF')]
+)
+
+
+def _fake_value(col, caster, ndet, rng):
+    '''
+    This makes fake values as strings for a column.
+
+    '''
+
+    if caster is float:
+        vals = ['%.5f' % x for x in rng.normal(10.0, 1.0, size=ndet)]
+    elif caster is int:
+        vals = ['%i' % x for x in rng.integers(0, 1000, size=ndet)]
+    else:
+        vals = [('G','X','C')[x] for x in rng.integers(0, 3, size=ndet)]
+
+    return vals
+
+
+
+def write_fake_hatcsvlc(outfile, ndet, rng):
+    '''
+    This writes a fake HAT CSV LC with ndet rows.
+
+    '''
+
+    casters = [hatlc._get_csvlc_caster(x) for x in HATLC_COLUMNS]
+    colvals = [_fake_value(x, y, ndet, rng)
+               for x, y in zip(HATLC_COLUMNS, casters)]
+
+    header = [
+        '# OBJECT',
+        '# objectid = HAT-123-0001234; hatid = HAT-123-0001234',
+        '# ra = 123.45; decl = -12.34; ndet = %s' % ndet,
+        '',
+        '# METADATA',
+        '# datarelease = 1; lcversion = 1; lastupdated = 1500000000.0',
+        '',
+        '# CAMFILTERS',
+        '# 1 - r - SDSS r',
+        '',
+        '# PHOTAPERTURES',
+        '# 000 - 1.95 px',
+        '# 001 - 2.35 px',
+        '# 002 - 2.95 px',
+        '',
+        '# COLUMNS',
+    ] + ['# %03i - %s - column %s' % (x, y, y)
+         for x, y in enumerate(HATLC_COLUMNS)] + [
+        '',
+        '# LIGHTCURVE',
+    ]
+
+    rows = [','.join(x) for x in zip(*colvals)]
+
+    with gzip.open(outfile,'wb') as outfd:
+        outfd.write(('\n'.join(header + rows) + '\n').encode())
+
+    return outfile
+
+
+
+def write_fake_k2csvlc(outfile, ndet, rng):
+    '''
+    This writes a fake K2 CSV LC with ndet rows.
+
+    '''
+
+    casters = [k2hat.COLUMNDEFS[x][2] for x in K2LC_COLUMNS]
+    colvals = [_fake_value(x, y, ndet, rng)
+               for x, y in zip(K2LC_COLUMNS, casters)]
+
+    header = [
+        '# METADATA',
+        '# objectid = HAT-K2-0001, kepid = 201234567, '
+        'ucac4id = 123-456789, kepmag = 12.3',
+        '# ra = 123.45, decl = -12.34, ndet = %s, k2campaign = 1' % ndet,
+        '# fovccd = 1, fovchannel = 2, fovmodule = 3',
+        '# qualflag = 0, bjdoffset = 2454833.0, napertures = 3',
+        '# aperpixradius = 1.0,1.5,2.0',
+        '',
+        '# COLUMNS',
+    ] + ['# %02i - %s - column %s' % (x, y, y)
+         for x, y in enumerate(K2LC_COLUMNS)] + [
+        '',
+        '# LIGHTCURVE',
+    ]
+
+    rows = [','.join(x) for x in zip(*colvals)]
+
+    with gzip.open(outfile,'wb') as outfd:
+        outfd.write(('\n'.join(header + rows) + '\n').encode())
+
+    return outfile
+
+
+
+def write_fake_textlc(outfile, ndet, rng, post2012=False):
+    '''
+    This writes a fake original HAT text LC (pre-2012 .tfalc or post-2012).
+
+    '''
+
+    if post2012:
+        casters = ([str, str, str, float] +
+                   [float, float, str]*3 +
+                   [float]*9 + [float]*7 + [float, float, float])
+    else:
+        casters = [str, float] + [float, float, str]*3 + [float]*9
+
+    colvals = [_fake_value(None, x, ndet, rng) for x in casters]
+
+    # make the str columns look like the real thing
+    colvals[0] = ['1-%06i_5' % x for x in range(ndet)]
+    if post2012:
+        colvals[0] = ['HAT-123-0001234']*ndet
+        colvals[1] = ['1-%06i_5' % x for x in range(ndet)]
+        colvals[2] = ['G123']*ndet
+
+    header = ['# HAT text light curve'] * 10
+    rows = [' '.join(x) for x in zip(*colvals)]
+
+    with open(outfile,'w') as outfd:
+        outfd.write('\n'.join(header + rows) + '\n')
+
+    return outfile
+
+
+
+############
+## TIMING ##
+############
+
+def time_reader(func, lcfile, repeats, **kwargs):
+    '''
+    This returns the best time of repeats calls to func(lcfile).
+
+    '''
+
+    times = []
+
+    for _ in range(repeats):
+        start = time.time()
+        func(lcfile, **kwargs)
+        times.append(time.time() - start)
+
+    return min(times)
+
+
+
+def main():
+    '''
+    This runs the benchmarks.
+
+    '''
+
+    aparser = argparse.ArgumentParser(
+        description='benchmark the astrobase.hatsurveys text/CSV LC readers'
+    )
+    aparser.add_argument('--ndet', action='store', type=int, default=50000,
+                         help='number of rows in each fake LC')
+    aparser.add_argument('--repeats', action='store', type=int, default=3,
+                         help='number of times to read each LC')
+    args = aparser.parse_args()
+
+    # keep the readers quiet
+    for module in (hatlc, k2hat, texthatlc):
+        module.LOGINFO = lambda message: None
+
+    rng = np.random.default_rng(42)
+    tempdir = tempfile.mkdtemp()
+
+    try:
+
+        hatcsv = write_fake_hatcsvlc(
+            os.path.join(tempdir, 'HAT-123-0001234-hatlc.csv.gz'),
+            args.ndet, rng
+        )
+        k2csv = write_fake_k2csvlc(
+            os.path.join(tempdir, 'HAT-K2-0001.csv.gz'),
+            args.ndet, rng
+        )
+        pretfalc = write_fake_textlc(
+            os.path.join(tempdir, 'HAT-123-0001234.tfalc'),
+            args.ndet, rng
+        )
+        posttfalc = write_fake_textlc(
+            os.path.join(tempdir, 'HAT-123-0001234-post2012.tfalc'),
+            args.ndet, rng, post2012=True
+        )
+
+        print('ndet = %s, best of %s reads\n' % (args.ndet, args.repeats))
+
+        bulktime = time_reader(hatlc.read_csvlc, hatcsv, args.repeats)
+
+        # compare against the per-value parser used when hatlc is standalone
+        bulkparser = hatlc.parse_lc_columns
+        hatlc.parse_lc_columns = None
+        try:
+            slowtime = time_reader(hatlc.read_csvlc, hatcsv, args.repeats)
+        finally:
+            hatlc.parse_lc_columns = bulkparser
+
+        print('hatlc.read_csvlc (bulk):               %.3f sec' % bulktime)
+        print('hatlc.read_csvlc (per-value):          %.3f sec' % slowtime)
+        print('hatlc.read_csvlc (bulk, 3 columns):    %.3f sec' %
+              time_reader(hatlc.read_csvlc, hatcsv, args.repeats,
+                          usecols=['rjd','aep_000','aie_000']))
+        print('k2hat.read_csv_lightcurve:             %.3f sec' %
+              time_reader(k2hat.read_csv_lightcurve, k2csv, args.repeats))
+        print('texthatlc.read_original_textlc (pre):  %.3f sec' %
+              time_reader(texthatlc.read_original_textlc, pretfalc,
+                          args.repeats))
+        print('texthatlc.read_original_textlc (post): %.3f sec' %
+              time_reader(texthatlc.read_original_textlc, posttfalc,
+                          args.repeats))
+
+    finally:
+
+        shutil.rmtree(tempdir)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,688 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''bench_suite.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This is a benchmark suite for the hot paths in astrobase.periodbase,
+astrobase.lcmath, astrobase.checkplot, and astrobase.lcproc. It times:
+
+- periodbase: pgen_lsp, stellingwerf_pdm, aov_periodfind, aovhm_periodfind,
+  bls_serial_pfind, bls_parallel_pfind, macf_period_find
+- lcmath: sigclip_magseries, time_bin_magseries(_with_errs),
+  phase_bin_magseries(_with_errs)
+- checkplot: checkplot_pickle (using a precomputed GLS periodogram)
+- lcproc: runpf (GLS, PDM, AoVMH, and the spectral window periodogram)
+
+on synthetic light curves with the cadences, nightly/quarterly gaps, and sizes
+of real survey LCs:
+
+- hatnet: 3.5 minute cadence, 8 hour nights, 80 nights (~10^4 points)
+- hatpi: 30 second cadence, 8 hour nights, 30 nights (~3 x 10^4 points)
+- kepler: 29.4 minute long cadence, 90 day quarters with 1 day gaps between
+  them, 16 quarters (~7 x 10^4 points)
+
+The full-size LCs take a long time to run through the slower period-finders, so
+use --scale to shorten the time baselines (and the frequency grids along with
+them) for quick checks. Only the function calls themselves are timed; making
+the LCs and any inputs the functions need is done beforehand.
+
+The results are written to a JSON file along with the astrobase version, git
+commit, and machine info. Two of these can then be compared to look for
+regressions.
+
+Run it like so:
+
+$ python benchmarks/bench_suite.py run --out before.json --scale 0.1
+$ (... make changes ...)
+$ python benchmarks/bench_suite.py run --out after.json --scale 0.1
+$ python benchmarks/bench_suite.py compare before.json after.json
+
+Use --surveys and --benchmarks to run only some of them, e.g.:
+
+$ python benchmarks/bench_suite.py run --out gls.json --surveys hatnet \
+    --benchmarks pgen_lsp sigclip_magseries
+
+Each benchmarked call's return value is checked. If a call fails or returns
+None (e.g. checkplot_pickle with too few points at a small --scale), the
+benchmark is marked as failed in the JSON instead of recording the time it
+took to fail.
+
+The compare mode exits with status 1 if any benchmark got slower by more than
+--threshold (a fraction, 0.1 by default) or failed in the new results, so it
+can be used in CI.
+
+'''
+
+from __future__ import print_function
+import os
+import os.path
+import sys
+import time
+import json
+import pickle
+import socket
+import platform
+import argparse
+import tempfile
+import shutil
+import subprocess
+from datetime import datetime
+from multiprocessing import cpu_count
+
+import numpy as np
+
+import astrobase
+from astrobase import lcmath, periodbase, checkplot, lcproc
+from astrobase.periodbase import zgls, spdm, saov, smav, kbls, macf
+from astrobase.varclass import starfeatures
+
+
+###############################
+## SYNTHETIC SURVEY LC SPECS ##
+###############################
+
+# cadence is in minutes, all other times are in days. blocklen is the length of
+# each observing block (a night or a Kepler quarter), blockgap is the gap
+# between blocks, and nblocks is the number of blocks. endp is the longest
+# period to search.
+SURVEYS = {
+    'hatnet':{'cadence':3.5,
+              'blocklen':0.33,
+              'blockgap':0.67,
+              'nblocks':80,
+              'magerr':0.01,
+              'endp':None},
+    'hatpi':{'cadence':0.5,
+             'blocklen':0.33,
+             'blockgap':0.67,
+             'nblocks':30,
+             'magerr':0.02,
+             'endp':None},
+    'kepler':{'cadence':29.4,
+              'blocklen':90.0,
+              'blockgap':1.0,
+              'nblocks':16,
+              'magerr':0.0005,
+              'endp':100.0},
+}
+
+
+
+def make_survey_lc(survey, scale=1.0, seed=42):
+    '''
+    This makes a fake LC for the survey with a sinusoidal variable signal, a
+    transit, red-ish noise, and a few outliers.
+
+    scale multiplies the number of observing blocks (or the length of each
+    block if there's only one) to make shorter or longer LCs.
+
+    Returns a dict with times, mags, errs, period, and epoch.
+
+    '''
+
+    spec = SURVEYS[survey]
+    rng = np.random.RandomState(seed)
+
+    nblocks = max(int(round(spec['nblocks']*scale)), 1)
+    blocklen = spec['blocklen']
+    if spec['nblocks']*scale < 1.0:
+        blocklen = blocklen*spec['nblocks']*scale
+
+    cadence = spec['cadence']/1440.0
+    blocktimes = np.arange(0.0, blocklen, cadence)
+    blockstarts = np.arange(nblocks)*(spec['blocklen'] + spec['blockgap'])
+
+    times = (blockstarts[:,None] + blocktimes[None,:]).ravel() + 2455000.0
+
+    # drop ~5% of the points to simulate bad frames
+    times = times[rng.uniform(size=times.size) > 0.05]
+    ndet = times.size
+
+    period, epoch = 3.1415926, times.min() + 0.3
+    phase = ((times - epoch)/period) % 1.0
+
+    mags = (12.0 + 0.05*np.sin(2.0*np.pi*phase) +
+            rng.normal(0.0, spec['magerr'], size=ndet))
+
+    # a box transit 1% deep, lasting 5% of the period
+    mags[(phase > 0.5) & (phase < 0.55)] += 0.01
+
+    # a slow trend and some outliers
+    mags = mags + 0.002*np.sin(2.0*np.pi*(times - times.min())/30.0)
+    outliers = rng.randint(0, ndet, size=ndet//500 + 1)
+    mags[outliers] += rng.choice([-1.0, 1.0], size=outliers.size)*0.5
+
+    errs = np.full(ndet, spec['magerr'])
+
+    return {'times':times,
+            'mags':mags,
+            'errs':errs,
+            'period':period,
+            'epoch':epoch,
+            'endp':spec['endp']}
+
+
+
+def read_bench_lc(lcfile):
+    '''
+    This reads the pickled LCs written for the runpf benchmark.
+
+    '''
+
+    with open(lcfile,'rb') as infd:
+        return pickle.load(infd)
+
+
+
+################
+## BENCHMARKS ##
+################
+
+# each of these takes the LC dict, a work directory, and the number of workers
+# to use, does any setup that shouldn't be timed, and returns a function with no
+# args that runs the thing to time
+
+def setup_pgen_lsp(lc, workdir, nworkers):
+    return lambda: periodbase.pgen_lsp(lc['times'], lc['mags'], lc['errs'],
+                                       endp=lc['endp'],
+                                       nworkers=nworkers,
+                                       verbose=False)
+
+def setup_stellingwerf_pdm(lc, workdir, nworkers):
+    return lambda: periodbase.stellingwerf_pdm(lc['times'], lc['mags'],
+                                               lc['errs'],
+                                               endp=lc['endp'],
+                                               nworkers=nworkers,
+                                               verbose=False)
+
+def setup_aov_periodfind(lc, workdir, nworkers):
+    return lambda: periodbase.aov_periodfind(lc['times'], lc['mags'],
+                                             lc['errs'],
+                                             endp=lc['endp'],
+                                             nworkers=nworkers,
+                                             verbose=False)
+
+def setup_aovhm_periodfind(lc, workdir, nworkers):
+    return lambda: periodbase.aovhm_periodfind(lc['times'], lc['mags'],
+                                               lc['errs'],
+                                               endp=lc['endp'],
+                                               nworkers=nworkers,
+                                               verbose=False)
+
+def setup_bls_serial_pfind(lc, workdir, nworkers):
+    return lambda: periodbase.bls_serial_pfind(lc['times'], lc['mags'],
+                                               lc['errs'],
+                                               startp=0.5,
+                                               endp=lc['endp'] or 100.0,
+                                               verbose=False)
+
+def setup_bls_parallel_pfind(lc, workdir, nworkers):
+    return lambda: periodbase.bls_parallel_pfind(lc['times'], lc['mags'],
+                                                 lc['errs'],
+                                                 startp=0.5,
+                                                 endp=lc['endp'] or 100.0,
+                                                 nworkers=nworkers,
+                                                 verbose=False)
+
+def setup_macf_period_find(lc, workdir, nworkers):
+    return lambda: periodbase.macf_period_find(lc['times'], lc['mags'],
+                                               lc['errs'],
+                                               verbose=False)
+
+def setup_sigclip_magseries(lc, workdir, nworkers):
+    return lambda: lcmath.sigclip_magseries(lc['times'], lc['mags'],
+                                            lc['errs'],
+                                            sigclip=[10.0, 3.0],
+                                            iterative=True)
+
+def setup_time_bin_magseries(lc, workdir, nworkers):
+    return lambda: lcmath.time_bin_magseries(lc['times'], lc['mags'],
+                                             binsize=1800.0)
+
+def setup_time_bin_magseries_with_errs(lc, workdir, nworkers):
+    return lambda: lcmath.time_bin_magseries_with_errs(lc['times'],
+                                                       lc['mags'],
+                                                       lc['errs'],
+                                                       binsize=1800.0)
+
+def setup_phase_bin_magseries(lc, workdir, nworkers):
+    phased = lcmath.phase_magseries(lc['times'], lc['mags'],
+                                    lc['period'], lc['epoch'],
+                                    wrap=False, sort=True)
+    return lambda: lcmath.phase_bin_magseries(phased['phase'],
+                                              phased['mags'],
+                                              binsize=0.002)
+
+def setup_phase_bin_magseries_with_errs(lc, workdir, nworkers):
+    phased = lcmath.phase_magseries_with_errs(lc['times'], lc['mags'],
+                                              lc['errs'],
+                                              lc['period'], lc['epoch'],
+                                              wrap=False, sort=True)
+    return lambda: lcmath.phase_bin_magseries_with_errs(phased['phase'],
+                                                        phased['mags'],
+                                                        phased['errs'],
+                                                        binsize=0.002)
+
+def setup_checkplot_pickle(lc, workdir, nworkers):
+
+    lspinfo = periodbase.pgen_lsp(lc['times'], lc['mags'], lc['errs'],
+                                  endp=lc['endp'],
+                                  nworkers=nworkers,
+                                  verbose=False)
+    outfile = os.path.join(workdir, 'checkplot-bench.pkl')
+
+    return lambda: checkplot.checkplot_pickle([lspinfo],
+                                              lc['times'],
+                                              lc['mags'],
+                                              lc['errs'],
+                                              varepoch=lc['epoch'],
+                                              outfile=outfile,
+                                              returndict=True,
+                                              verbose=False)
+
+def setup_runpf(lc, workdir, nworkers):
+
+    lcfile = os.path.join(workdir, 'bench-lc.pkl')
+    with open(lcfile,'wb') as outfd:
+        pickle.dump({'objectid':'bench-lc',
+                     'objectinfo':{'ra':10.0, 'decl':-20.0},
+                     'time':lc['times'],
+                     'mag':lc['mags'],
+                     'err':lc['errs']}, outfd, pickle.HIGHEST_PROTOCOL)
+
+    lcproc.register_custom_lcformat('bench-pkl', '*bench-lc.pkl',
+                                    read_bench_lc,
+                                    ['time'], ['mag'], ['err'])
+
+    pfkwargs = [{'endp':lc['endp']} for _ in range(4)]
+
+    return lambda: lcproc.runpf(lcfile, workdir,
+                                lcformat='bench-pkl',
+                                pfmethods=['gls','pdm','mav','win'],
+                                pfkwargs=pfkwargs,
+                                nworkers=nworkers)
+
+
+
+# these are in the order they're run
+BENCHMARKS = [
+    ('pgen_lsp', setup_pgen_lsp),
+    ('stellingwerf_pdm', setup_stellingwerf_pdm),
+    ('aov_periodfind', setup_aov_periodfind),
+    ('aovhm_periodfind', setup_aovhm_periodfind),
+    ('bls_serial_pfind', setup_bls_serial_pfind),
+    ('bls_parallel_pfind', setup_bls_parallel_pfind),
+    ('macf_period_find', setup_macf_period_find),
+    ('sigclip_magseries', setup_sigclip_magseries),
+    ('time_bin_magseries', setup_time_bin_magseries),
+    ('time_bin_magseries_with_errs', setup_time_bin_magseries_with_errs),
+    ('phase_bin_magseries', setup_phase_bin_magseries),
+    ('phase_bin_magseries_with_errs', setup_phase_bin_magseries_with_errs),
+    ('checkplot_pickle', setup_checkplot_pickle),
+    ('runpf', setup_runpf),
+]
+
+
+
+#############
+## RUNNING ##
+#############
+
+def check_result(result):
+    '''
+    This returns why a benchmarked call's result is bad, or None if it's OK.
+
+    '''
+
+    if result is None:
+        return 'returned None'
+
+    # checkplot_pickle returns (checkplotdict, picklefile) with returndict=True
+    if isinstance(result, tuple) and result and isinstance(result[0], dict):
+        result = result[0]
+
+    # checkplot_pickle still writes a pickle if it fails, but sets its status
+    if (isinstance(result, dict) and
+        str(result.get('status', '')).startswith('failed')):
+        return result['status']
+
+    # the period-finders return nan best periods if they couldn't run
+    if (isinstance(result, dict) and 'bestperiod' in result and
+        not np.isfinite(result['bestperiod'])):
+        return 'no finite best period'
+
+    return None
+
+
+
+def quiet_astrobase():
+    '''
+    This turns off the INFO and WARNING messages from the modules we time, so
+    logging to the terminal isn't timed along with everything else.
+
+    '''
+
+    for module in (lcmath, checkplot, lcproc, periodbase,
+                   zgls, spdm, saov, smav, kbls, macf, starfeatures):
+        module.LOGINFO = lambda message: None
+        module.LOGWARNING = lambda message: None
+
+    # the fake LCs don't have coordinates or magnitudes, so checkplot_pickle
+    # can't get any star features for them. these aren't useful errors here.
+    starfeatures.LOGERROR = lambda message: None
+
+
+
+def get_environment():
+    '''
+    This returns info about the astrobase version and machine.
+
+    '''
+
+    try:
+        commit = subprocess.check_output(
+            ['git','rev-parse','--short','HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT
+        ).decode().strip()
+    except Exception as e:
+        commit = None
+
+    return {'astrobase':astrobase.__version__,
+            'commit':commit,
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'platform':platform.platform(),
+            'machine':platform.machine(),
+            'hostname':socket.gethostname(),
+            'ncpus':cpu_count()}
+
+
+
+def run_benchmarks(surveys,
+                   benchnames,
+                   repeats=3,
+                   scale=1.0,
+                   nworkers=1):
+    '''
+    This runs the benchmarks in benchnames for the LCs of each survey in
+    surveys.
+
+    Returns a dict of results keyed by '<survey>/<benchmark>', each of which is
+    a dict with the number of points in the LC and the times for each repeat.
+    Benchmarks that raised an exception or returned a bad result (see
+    check_result) are stopped, and get a dict with failed = True and the error
+    instead.
+
+    '''
+
+    results = {}
+
+    for survey in surveys:
+
+        lc = make_survey_lc(survey, scale=scale)
+        print('%s: %s points over %.1f days' %
+              (survey, lc['times'].size, lc['times'].max() - lc['times'].min()))
+
+        for benchname, setupfunc in BENCHMARKS:
+
+            if benchname not in benchnames:
+                continue
+
+            key = '%s/%s' % (survey, benchname)
+            workdir = tempfile.mkdtemp()
+            error = None
+
+            try:
+
+                benchfunc = setupfunc(lc, workdir, nworkers)
+
+                times = []
+                for _ in range(repeats):
+                    start = time.time()
+                    result = benchfunc()
+                    times.append(time.time() - start)
+
+                    error = check_result(result)
+                    if error is not None:
+                        break
+
+            except Exception as e:
+                error = '%s: %s' % (e.__class__.__name__, e)
+
+            finally:
+                shutil.rmtree(workdir)
+
+            if error is not None:
+
+                results[key] = {'ndet':int(lc['times'].size),
+                                'failed':True,
+                                'error':error}
+                print('  %-30s FAILED: %s' % (benchname, error))
+                continue
+
+            results[key] = {'ndet':int(lc['times'].size),
+                            'times':times,
+                            'min':min(times),
+                            'median':float(np.median(times))}
+
+            print('  %-30s %10.3f sec (best of %s)' %
+                  (benchname, min(times), repeats))
+
+    return results
+
+
+
+###############
+## COMPARING ##
+###############
+
+def compare_results(oldresults, newresults, threshold=0.1, mintime=0.01):
+    '''
+    This compares two benchmark result dicts from the JSON files.
+
+    A benchmark is flagged as a regression if its best time in the new results
+    is more than (1 + threshold) times its best time in the old results, and
+    also slower by more than mintime seconds (so tiny noisy benchmarks aren't
+    flagged). It's flagged as an improvement if it's faster by the same
+    amounts.
+
+    Returns a list of dicts, one per benchmark in both results, with keys:
+    name, old, new, ratio, status ('regression', 'improvement', 'failed', or
+    'ok'), and sizechanged (True if the LC sizes differ, in which case the
+    timings aren't comparable).
+
+    If a benchmark failed in the new results, its status is 'failed'. If it only
+    failed in the old results, its status is 'ok'. In both cases, the times for
+    the failed runs and the ratio are None.
+
+    '''
+
+    comparison = []
+
+    for name in sorted(set(oldresults) & set(newresults)):
+
+        old, new = oldresults[name], newresults[name]
+
+        if old.get('failed') or new.get('failed'):
+            comparison.append({'name':name,
+                               'old':None if old.get('failed') else old['min'],
+                               'new':None if new.get('failed') else new['min'],
+                               'ratio':None,
+                               'status':('failed' if new.get('failed')
+                                         else 'ok'),
+                               'sizechanged':old['ndet'] != new['ndet']})
+            continue
+
+        ratio = new['min']/old['min'] if old['min'] > 0.0 else np.inf
+
+        if (ratio > 1.0 + threshold) and (new['min'] - old['min'] > mintime):
+            status = 'regression'
+        elif ((ratio < 1.0/(1.0 + threshold)) and
+              (old['min'] - new['min'] > mintime)):
+            status = 'improvement'
+        else:
+            status = 'ok'
+
+        comparison.append({'name':name,
+                           'old':old['min'],
+                           'new':new['min'],
+                           'ratio':ratio,
+                           'status':status,
+                           'sizechanged':old['ndet'] != new['ndet']})
+
+    return comparison
+
+
+
+def print_comparison(oldjson, newjson, comparison):
+    '''
+    This prints the comparison table and a summary. Returns the number of
+    regressions and failures.
+
+    '''
+
+    for label, benchjson in (('old', oldjson), ('new', newjson)):
+        env = benchjson['environment']
+        print('%s: astrobase %s (commit %s) on %s, run at %s' %
+              (label, env['astrobase'], env['commit'],
+               env['hostname'], benchjson['date']))
+
+    if oldjson['environment']['hostname'] != newjson['environment']['hostname']:
+        print('\nWARNING: these were run on different machines')
+
+    print('\n%-45s %10s %10s %8s' %
+          ('benchmark', 'old (s)', 'new (s)', 'ratio'))
+
+    for item in comparison:
+        flag = {'regression':'  <-- SLOWER',
+                'improvement':'  faster',
+                'failed':'  <-- FAILED',
+                'ok':''}[item['status']]
+        if item['sizechanged']:
+            flag = flag + '  (LC size changed)'
+        print('%-45s %10s %10s %8s%s' %
+              (item['name'],
+               'failed' if item['old'] is None else '%.3f' % item['old'],
+               'failed' if item['new'] is None else '%.3f' % item['new'],
+               '-' if item['ratio'] is None else '%.2f' % item['ratio'],
+               flag))
+
+    oldonly = set(oldjson['results']) - set(newjson['results'])
+    newonly = set(newjson['results']) - set(oldjson['results'])
+    if oldonly:
+        print('\nonly in old results: %s' % ', '.join(sorted(oldonly)))
+    if newonly:
+        print('\nonly in new results: %s' % ', '.join(sorted(newonly)))
+
+    nregressions = len([x for x in comparison if x['status'] == 'regression'])
+    nimprovements = len([x for x in comparison
+                         if x['status'] == 'improvement'])
+    nfailed = len([x for x in comparison if x['status'] == 'failed'])
+    print('\n%s regressions, %s failed, %s improvements, %s unchanged' %
+          (nregressions, nfailed, nimprovements,
+           len(comparison) - nregressions - nfailed - nimprovements))
+
+    return nregressions + nfailed
+
+
+
+##########
+## MAIN ##
+##########
+
+def main():
+    '''
+    This runs or compares the benchmarks.
+
+    '''
+
+    aparser = argparse.ArgumentParser(
+        description=('benchmark the astrobase periodbase, lcmath, '
+                     'checkplot, and lcproc hot paths')
+    )
+    subparsers = aparser.add_subparsers(dest='command')
+
+    runparser = subparsers.add_parser('run', help='run the benchmarks')
+    runparser.add_argument('--out', action='store', required=True,
+                           help='the JSON file to write the results to')
+    runparser.add_argument('--surveys', action='store', nargs='+',
+                           choices=sorted(SURVEYS.keys()),
+                           default=['hatnet','hatpi','kepler'],
+                           help='which survey LCs to use')
+    runparser.add_argument('--benchmarks', action='store', nargs='+',
+                           choices=[x[0] for x in BENCHMARKS],
+                           default=[x[0] for x in BENCHMARKS],
+                           help='which benchmarks to run')
+    runparser.add_argument('--repeats', action='store', type=int, default=3,
+                           help='number of times to run each benchmark')
+    runparser.add_argument('--scale', action='store', type=float, default=1.0,
+                           help=('multiply the time baseline of each '
+                                 'survey LC by this'))
+    runparser.add_argument('--nworkers', action='store', type=int, default=1,
+                           help='number of workers for the parallel functions')
+
+    cmpparser = subparsers.add_parser('compare',
+                                      help='compare two benchmark JSON files')
+    cmpparser.add_argument('oldjson', help='the results from before')
+    cmpparser.add_argument('newjson', help='the results from after')
+    cmpparser.add_argument('--threshold', action='store', type=float,
+                           default=0.1,
+                           help=('flag a benchmark as a regression if it gets '
+                                 'slower by more than this fraction'))
+    cmpparser.add_argument('--mintime', action='store', type=float,
+                           default=0.01,
+                           help=('ignore changes smaller than this many '
+                                 'seconds'))
+
+    args = aparser.parse_args()
+
+    if args.command == 'run':
+
+        quiet_astrobase()
+
+        results = run_benchmarks(args.surveys,
+                                 args.benchmarks,
+                                 repeats=args.repeats,
+                                 scale=args.scale,
+                                 nworkers=args.nworkers)
+
+        benchjson = {'date':datetime.utcnow().isoformat(),
+                     'environment':get_environment(),
+                     'args':{'surveys':args.surveys,
+                             'benchmarks':args.benchmarks,
+                             'repeats':args.repeats,
+                             'scale':args.scale,
+                             'nworkers':args.nworkers},
+                     'results':results}
+
+        with open(args.out,'w') as outfd:
+            json.dump(benchjson, outfd, indent=2, sort_keys=True)
+
+        print('\nwrote results to %s' % args.out)
+
+    elif args.command == 'compare':
+
+        with open(args.oldjson,'r') as infd:
+            oldjson = json.load(infd)
+        with open(args.newjson,'r') as infd:
+            newjson = json.load(infd)
+
+        comparison = compare_results(oldjson['results'],
+                                     newjson['results'],
+                                     threshold=args.threshold,
+                                     mintime=args.mintime)
+        nbad = print_comparison(oldjson, newjson, comparison)
+
+        if nbad > 0:
+            sys.exit(1)
+
+    else:
+
+        aparser.print_help()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -108,6 +108,7 @@ setup(
         'console_scripts':[
             'checkplotserver=astrobase.cpserver.checkplotserver:main',
             'checkplotlist=astrobase.cpserver.checkplotlist:main',
+            'lcpbatch=astrobase.lcproc_batch:main',
         ],
     },
     include_package_data=True,
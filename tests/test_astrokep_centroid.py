@@ -0,0 +1,178 @@
+'''test_astrokep_centroid.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the batched Legendre detrending and the centroid offsets in
+astrobase.astrokep against fitting each series and each transit by itself.
+
+'''
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+from numpy.polynomial.legendre import Legendre
+
+from astrobase import astrokep
+
+
+def make_series(nseries=6, seed=42):
+    '''
+    This makes a few smooth series with noise on a cadence grid with gaps.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+
+    times = np.concatenate((np.arange(100.0, 110.0, 0.02),
+                            np.arange(112.0, 118.0, 0.02)))
+    phase = (times - times.min())/(times.max() - times.min())
+
+    series = np.array([
+        rng.uniform(-1.0, 1.0)*phase**2 + rng.uniform(-1.0, 1.0)*phase +
+        rng.normal(0.0, 0.01, size=times.size)
+        for x in range(nseries)
+    ])
+    errs = np.full_like(series, 0.01)
+
+    return times, series, errs
+
+
+
+def test_legendre_detrend_batch():
+    '''
+    Tests that the batched fits match Legendre.fit per series and timegroup.
+
+    '''
+
+    times, series, errs = make_series()
+
+    # knock out some points in two of the series
+    series[1, 10:20] = np.nan
+    series[4, 600:610] = np.nan
+
+    dtr = astrokep.legendre_detrend_batch(times, series, errs=errs,
+                                          mingap=0.5)
+    assert dtr['fits'].shape == series.shape
+    assert len(dtr['groups']) == 2
+
+    for group, legdeg in zip(dtr['groups'], dtr['legendredegs']):
+
+        assert legdeg == astrokep._get_legendre_deg_ctd(times[group].size)
+
+        for ind in range(series.shape[0]):
+
+            gtimes, gseries = times[group], series[ind, group]
+            ok = np.isfinite(gseries)
+            expected = Legendre.fit(gtimes[ok], gseries[ok], legdeg)(gtimes)
+
+            assert np.allclose(dtr['fits'][ind, group], expected,
+                               rtol=0.0, atol=1.0e-8)
+
+    # the single-series wrapper gives the same thing
+    fit_y, chisq, redchisq = astrokep._legendre_dtr(times[:500],
+                                                    series[0,:500],
+                                                    errs[0,:500],
+                                                    legendredeg=5)
+    expected = Legendre.fit(times[:500], series[0,:500], 5)(times[:500])
+    assert np.allclose(fit_y, expected, rtol=0.0, atol=1.0e-8)
+    assert np.isclose(
+        chisq, np.sum(((expected - series[0,:500])/errs[0,:500])**2)
+    )
+
+    # a short series is still fit, even with fewer points than the degree
+    fit_y, chisq, redchisq = astrokep._legendre_dtr(times[:4],
+                                                    series[0,:4] + 500.0,
+                                                    errs[0,:4],
+                                                    legendredeg=5)
+    assert np.allclose(fit_y, series[0,:4] + 500.0, rtol=0.0, atol=1.0e-8)
+
+
+
+def test_legendre_detrend_short_group():
+    '''
+    Tests that a timegroup with fewer points than the degree is still fit.
+
+    '''
+
+    times, series, errs = make_series(nseries=2)
+
+    # add a short timegroup with a big offset, like a raw centroid
+    times = np.concatenate((times, 120.0 + np.arange(4)*0.02))
+    series = np.concatenate((series + 500.0,
+                             500.0 + np.array([[0.1, 0.2, 0.15, 0.3],
+                                               [0.0, -0.1, 0.1, 0.05]])),
+                            axis=1)
+    errs = np.full_like(series, 0.01)
+
+    # and knock out a point from the first series there
+    series[0, -2] = np.nan
+
+    dtr = astrokep.legendre_detrend_batch(times, series, errs=errs,
+                                          mingap=0.5)
+    assert len(dtr['groups']) == 3
+    assert dtr['legendredegs'][-1] == 4
+
+    for ind in range(series.shape[0]):
+
+        group = dtr['groups'][-1]
+        gtimes, gseries = times[group], series[ind, group]
+        ok = np.isfinite(gseries)
+
+        # Legendre.fit warns that the fit is poorly conditioned here
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            expected = Legendre.fit(gtimes[ok], gseries[ok], 4)(gtimes)
+
+        # the residuals are tiny, not the raw values
+        resid = (series[ind] - dtr['fits'][ind])[group][ok]
+        assert np.abs(resid).max() < 1.0e-8
+        assert np.allclose(dtr['fits'][ind, group][ok], expected[ok],
+                           rtol=0.0, atol=1.0e-8)
+
+    assert np.isfinite(dtr['chisq']).all()
+
+
+
+def test_get_centroid_offsets():
+    '''
+    Tests the centroid offsets against selecting points for each transit.
+
+    '''
+
+    times, series, errs = make_series(nseries=4)
+    lcd = {'quarter':np.full(times.size, 3),
+           'ctd_dtr':{'times':times,
+                      'ctd_x':series[0],
+                      'fit_ctd_x':series[1],
+                      'ctd_y':series[2],
+                      'fit_ctd_y':series[3]}}
+
+    # includes transits in and next to the gap and one off the end
+    t_ing_egr = [(101.0, 101.2), (105.51, 105.73), (109.9, 110.1),
+                 (111.5, 112.3), (117.9, 118.5)]
+
+    cd = astrokep.get_centroid_offsets(lcd, t_ing_egr,
+                                       oot_buffer_time=0.1,
+                                       sample_factor=3)
+    assert sorted(cd.keys()) == list(range(len(t_ing_egr)))
+
+    resid_x = (series[0] - series[1])*3.98
+    resid_y = (series[2] - series[3])*3.98
+
+    for ind, (t_ing, t_egr) in enumerate(t_ing_egr):
+
+        winlen = 3*(t_egr - t_ing)
+        in_tra = (times > t_ing) & (times < t_egr)
+        oot = (
+            ((times < t_ing - 0.1) & (times > t_ing - 0.1 - winlen)) |
+            ((times > t_egr + 0.1) & (times < t_egr + 0.1 + winlen))
+        )
+
+        assert np.array_equal(cd[ind]['in_tra_times'], times[in_tra])
+        assert np.array_equal(cd[ind]['oot_times'], times[oot])
+        assert np.allclose(cd[ind]['ctd_x_in_tra'], resid_x[in_tra])
+        assert np.allclose(cd[ind]['ctd_y_in_tra'], resid_y[in_tra])
+        assert np.allclose(cd[ind]['ctd_x_oot'], resid_x[oot])
+        assert np.allclose(cd[ind]['ctd_y_oot'], resid_y[oot])
+        assert cd[ind]['npts_in_tra'] == in_tra.sum()
+        assert cd[ind]['npts_oot'] == oot.sum()
@@ -0,0 +1,191 @@
+'''test_astrokep_consolidate.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests consolidating and stitching Kepler light curves across quarters in
+astrobase.astrokep, using small fake Kepler light curve FITS files.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+
+import numpy as np
+
+from astrobase import astrokep
+
+
+# the flux level and time range for each fake quarter
+QUARTERS = {1:(1000.0, 100.0), 2:(1200.0, 190.0), 3:(900.0, 280.0)}
+
+
+def write_fake_kepler_lc(outfile, keplerid, quarter, ndet=200):
+    '''This writes a fake Kepler light curve FITS for a single quarter.
+
+    The times are in reverse order within the file to test the sorting.
+
+    '''
+
+    from astropy.io import fits
+
+    fluxlevel, tstart = QUARTERS[quarter]
+    rng = np.random.RandomState(quarter)
+
+    times = (tstart + np.arange(ndet)*0.02)[::-1]
+    fluxes = fluxlevel*(1.0 + 0.001*rng.normal(size=ndet))
+
+    cols = []
+    for key in astrokep.LCDATAKEYS:
+        if key == 'TIME':
+            cols.append(fits.Column(name=key, format='D', array=times))
+        elif key in ('CADENCENO', 'SAP_QUALITY'):
+            cols.append(fits.Column(name=key, format='J',
+                                    array=np.zeros(ndet, dtype=np.int32)))
+        else:
+            cols.append(fits.Column(name=key, format='E',
+                                    array=rng.normal(size=ndet)))
+
+    for key in astrokep.LCSAPKEYS + astrokep.LCPDCKEYS:
+        if key.endswith('_ERR'):
+            arr = np.full(ndet, 0.001*fluxlevel)
+        else:
+            arr = fluxes
+        cols.append(fits.Column(name=key, format='E', array=arr))
+
+    lchdu = fits.BinTableHDU.from_columns(cols)
+    for key in astrokep.LCHEADERKEYS:
+        lchdu.header[key] = 1.0
+    lchdu.header['TIMESYS'] = 'TDB'
+    lchdu.header['OBJECT'] = 'KIC %s' % keplerid
+    lchdu.header['KEPLERID'] = keplerid
+    lchdu.header['PDCMETHD'] = 'msMAP'
+
+    tophdu = fits.PrimaryHDU()
+    for key in astrokep.LCTOPKEYS:
+        tophdu.header[key] = 1.0
+    tophdu.header['QUARTER'] = quarter
+    tophdu.header['SEASON'] = quarter % 4
+    tophdu.header['OBSMODE'] = 'long cadence'
+    tophdu.header['CHANNEL'] = 10 + quarter
+    del tophdu.header['CAMPAIGN']
+
+    aphdu = fits.ImageHDU(np.ones((5,5), dtype=np.int32))
+    aphdu.header['NPIXSAP'] = 9
+    aphdu.header['NPIXMISS'] = 0
+    aphdu.header['CDELT1'] = -0.001103
+    aphdu.header['CDELT2'] = 0.001103
+
+    fits.HDUList([tophdu, lchdu, aphdu]).writeto(outfile)
+    return outfile
+
+
+
+def make_lcfitsdir(lcfitsdir, keplerids):
+    '''
+    This writes quarters 3, 1, 2 for each Kepler ID into nested directories.
+
+    '''
+
+    for keplerid in keplerids:
+        for quarter in (3, 1, 2):
+            qdir = os.path.join(lcfitsdir, 'q%s' % quarter)
+            if not os.path.exists(qdir):
+                os.makedirs(qdir)
+            write_fake_kepler_lc(
+                os.path.join(qdir, 'kplr%09i-2010%03i_llc.fits' %
+                             (keplerid, quarter)),
+                keplerid, quarter
+            )
+
+    return lcfitsdir
+
+
+
+def test_consolidate_and_stitch(tmpdir):
+    '''
+    Tests that quarters are read once, sorted by time, and stitched.
+
+    '''
+
+    lcfitsdir = make_lcfitsdir(os.path.join(str(tmpdir), 'lcs'), [1234567])
+
+    lcd = astrokep.consolidate_kepler_fitslc(1234567, lcfitsdir,
+                                             normalize=False,
+                                             nworkers=2)
+
+    assert lcd['time'].size == 600
+    assert np.all(np.diff(lcd['time']) > 0.0)
+    assert lcd['quarter'] == [1, 2, 3]
+    assert lcd['lcinfo']['channel'] == [11, 12, 13]
+    assert lcd['time'].dtype.isnative
+
+    # each column stays with its time after sorting
+    for quarter, (fluxlevel, tstart) in QUARTERS.items():
+        qind = lcd['lc_quarter'] == quarter
+        assert qind.sum() == 200
+        assert np.all(lcd['lc_channel'][qind] == 10 + quarter)
+        assert np.allclose(np.median(lcd['sap']['sap_flux'][qind]),
+                           fluxlevel, rtol=1.0e-3)
+        assert lcd['time'][qind].min() == tstart
+
+    # stitching takes out the flux level offsets between the quarters
+    stitched = astrokep.stitch_kepler_lcdict(lcd)
+    assert stitched['stitchinfo']['quarters'] == [1, 2, 3]
+    for quarter in QUARTERS:
+        qind = stitched['lc_quarter'] == quarter
+        assert np.allclose(np.median(stitched['pdc']['pdcsap_flux'][qind]),
+                           1000.0, rtol=1.0e-3)
+        assert np.allclose(stitched['pdc']['pdcsap_flux_err'][qind],
+                           1.0, rtol=1.0e-3)
+
+    # normalize=True stitches the quarters to 1.0
+    normalized = astrokep.consolidate_kepler_fitslc(1234567, lcfitsdir)
+    assert np.allclose(np.median(normalized['sap']['sap_flux']), 1.0,
+                       rtol=1.0e-3)
+
+
+
+def test_parallel_consolidate(tmpdir):
+    '''
+    Tests consolidating many Kepler IDs into pickles and npz files.
+
+    '''
+
+    keplerids = [1000001, 1000002, 1000003]
+    lcfitsdir = make_lcfitsdir(os.path.join(str(tmpdir), 'lcs'), keplerids)
+
+    pklresults = astrokep.parallel_consolidate_kepler_fitslc(
+        keplerids + [9999999],
+        lcfitsdir,
+        os.path.join(str(tmpdir), 'pkl'),
+        nworkers=2
+    )
+    npzresults = astrokep.parallel_consolidate_kepler_fitslc(
+        None,
+        lcfitsdir,
+        os.path.join(str(tmpdir), 'npz'),
+        outformat='npz',
+        nworkers=2
+    )
+
+    assert pklresults[9999999] is None
+    assert sorted(npzresults) == keplerids
+
+    for keplerid in keplerids:
+
+        pkllcd = astrokep.read_kepler_pklc(pklresults[keplerid])
+        npzlcd = astrokep.read_kepler_npzlc(npzresults[keplerid])
+
+        assert npzlcd['objectid'] == pkllcd['objectid'] == 'KIC %s' % keplerid
+        assert npzlcd['quarter'] == pkllcd['quarter']
+        assert npzlcd['stitchinfo'] == pkllcd['stitchinfo']
+        for col in pkllcd['columns']:
+            if '.' in col:
+                key, subkey = col.split('.')
+                assert np.array_equal(npzlcd[key][subkey],
+                                      pkllcd[key][subkey],
+                                      equal_nan=True)
+            else:
+                # lc_campaign is all nans for Kepler light curves
+                assert np.array_equal(npzlcd[col], pkllcd[col],
+                                      equal_nan=True)
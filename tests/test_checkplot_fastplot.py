@@ -0,0 +1,256 @@
+'''test_checkplot_fastplot.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the fastplot mode of the plotting functions in astrobase.plotbase and
+astrobase.checkplot, which reuses figure templates and decimates points per
+pixel column before drawing.
+
+'''
+from __future__ import print_function
+
+import io
+import os.path
+
+import numpy as np
+
+from astrobase import plotbase, checkplot
+from astrobase.lcmath import phase_magseries
+
+
+def make_lightcurve(ndet=20000, seed=42):
+    '''
+    This makes a sinusoidal LC with some outliers.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    times = np.sort(rng.uniform(0.0, 100.0, size=ndet)) + 2455000.0
+    mags = (12.0 + 0.1*np.sin(2.0*np.pi*times/3.3) +
+            rng.normal(0.0, 0.02, size=ndet))
+    mags[::997] += 0.3
+    errs = np.full(ndet, 0.02)
+
+    return times, mags, errs
+
+
+
+def make_lspinfo(seed=42):
+    '''
+    This makes a fake periodogram with a peak at 3.3 days.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    periods = np.linspace(0.2, 50.0, 50000)
+    lspvals = (rng.uniform(0.0, 0.1, size=periods.size) +
+               0.8*np.exp(-0.5*((periods - 3.3)/0.01)**2))
+
+    return {'periods':periods,
+            'lspvals':lspvals,
+            'bestperiod':3.3,
+            'nbestperiods':[3.3, 6.6, 1.65, 9.9, 1.1],
+            'nbestlspvals':[0.9, 0.4, 0.3, 0.2, 0.1],
+            'method':'gls'}
+
+
+
+def read_png(pngbytes):
+    '''
+    This returns a PNG as an array of RGB values.
+
+    '''
+
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(pngbytes)).convert('RGB'),
+                      dtype=np.int64)
+
+
+
+def test_decimate_points():
+    '''
+    Tests that decimation keeps the min, median, and max in each column.
+
+    '''
+
+    rng = np.random.RandomState(42)
+    xvals = rng.uniform(0.0, 10.0, size=10000)
+    yvals = rng.normal(size=10000)
+    xvals[10] = np.nan
+
+    dx, dy = plotbase.decimate_points(xvals, yvals, 100, xlim=(0.0, 10.0))
+
+    assert dx.size <= 300
+    assert np.all(np.isfinite(dx))
+
+    # the points are in their original order
+    keepinds = np.where(np.isin(xvals, dx))[0]
+    assert np.array_equal(xvals[keepinds], dx)
+
+    cols = np.floor(np.nan_to_num(xvals, nan=-1.0)/0.1).astype(int)
+    dcols = np.floor(dx/0.1).astype(int)
+
+    for col in range(100):
+        colmags = yvals[cols == col]
+        assert dy[dcols == col].min() == colmags.min()
+        assert dy[dcols == col].max() == colmags.max()
+        assert np.median(colmags) - 0.2 < np.median(dy[dcols == col])
+        assert np.median(dy[dcols == col]) < np.median(colmags) + 0.2
+
+    # points outside xlim are dropped
+    dx, dy = plotbase.decimate_points(xvals, yvals, 100, xlim=(2.0, 4.0))
+    assert dx.min() >= 2.0 and dx.max() <= 4.0
+
+    # few points are kept as they are
+    dx, dy = plotbase.decimate_points(xvals[:50], yvals[:50], 100)
+    assert np.array_equal(dx, xvals[:50][np.isfinite(xvals[:50])])
+
+    # log-spaced columns
+    periods = np.linspace(0.1, 100.0, 100000)
+    dx, dy = plotbase.decimate_points(periods, np.sin(periods), 200, logx=True)
+    assert dx.size <= 600
+    assert np.all(np.diff(dx) > 0.0)
+    assert dx[0] < 0.11 and dx[-1] > 95.0
+
+
+
+def test_fastplot_looks_the_same():
+    '''
+    Tests that a decimated phased LC plot looks like one with all the points.
+
+    '''
+
+    times, mags, errs = make_lightcurve()
+
+    fastout = io.BytesIO()
+    plotbase.plot_phased_mag_series(times, mags, 3.3,
+                                    errs=errs,
+                                    epoch=times.min(),
+                                    normto=False,
+                                    phasebin=0.01,
+                                    outfile=fastout,
+                                    fastplot=True)
+
+    template = plotbase.PLOT_TEMPLATES['phasedlc']
+    points = template['artists']['points']
+    envelope = template['artists']['envelope']
+    assert points.get_xdata().size + envelope.get_xdata().size < times.size
+
+    # redraw the same template with all of the points
+    phased = phase_magseries(times, mags, 3.3, times.min(),
+                             wrap=True, sort=True)
+    points.set_data(phased['phase'], phased['mags'])
+    envelope.set_data([], [])
+    fullout = io.BytesIO()
+    template['fig'].savefig(fullout, dpi=100, format='png')
+
+    fastimg = read_png(fastout.getvalue())
+    fullimg = read_png(fullout.getvalue())
+    assert fastimg.shape == fullimg.shape
+
+    different = np.abs(fastimg - fullimg).max(axis=2) > 64
+    assert different.mean() < 0.01
+
+
+
+def test_fastplot_reuses_templates(tmpdir):
+    '''
+    Tests that the plotbase functions reuse their figures in fastplot mode.
+
+    '''
+
+    times, mags, errs = make_lightcurve()
+    lspinfo = make_lspinfo()
+
+    for ind in range(2):
+
+        msplot = plotbase.plot_mag_series(
+            times, mags, errs=errs,
+            out=os.path.join(str(tmpdir), 'ms-%s.png' % ind),
+            segmentmingap=None,
+            fastplot=True
+        )
+        assert os.path.exists(msplot)
+
+        period, epoch, phplot = plotbase.plot_phased_mag_series(
+            times, mags, 3.3, errs=errs, epoch=times.min(),
+            outfile=os.path.join(str(tmpdir), 'ph-%s.png' % ind),
+            fastplot=True
+        )
+        assert os.path.exists(phplot)
+        assert period == 3.3 and epoch == times.min()
+
+        lspplot = plotbase.plot_periodbase_lsp(
+            lspinfo,
+            outfile=os.path.join(str(tmpdir), 'lsp-%s.png' % ind),
+            fastplot=True
+        )
+        assert os.path.exists(lspplot)
+
+        if ind == 0:
+            figs = dict((x, plotbase.PLOT_TEMPLATES[x]['fig'])
+                        for x in ('magseries','phasedlc','lsp'))
+
+    for key in ('magseries','phasedlc','lsp'):
+        assert plotbase.PLOT_TEMPLATES[key]['fig'] is figs[key]
+
+    # the annotations from the first periodogram were removed
+    lspax = plotbase.PLOT_TEMPLATES['lsp']['axes'][0]
+    assert len(lspax.texts) == len(lspinfo['nbestperiods'])
+
+
+
+def test_fast_checkplot_png(tmpdir):
+    '''
+    Tests checkplot_png and twolsp_checkplot_png in fastplot mode.
+
+    '''
+
+    lspinfo = make_lspinfo()
+    lspinfo2 = make_lspinfo(seed=1)
+    lspinfo2['method'] = 'pdm'
+
+    for ind in range(2):
+
+        times, mags, errs = make_lightcurve(seed=ind)
+
+        cpf = checkplot.checkplot_png(
+            lspinfo, times, mags, errs,
+            outfile=os.path.join(str(tmpdir), 'checkplot-%s.png' % ind),
+            varepoch=None,
+            xliminsetmode=True,
+            bestperiodhighlight='#adff2f' if ind == 0 else None,
+            verbose=False,
+            fastplot=True
+        )
+        assert os.path.exists(cpf)
+
+        twocpf = checkplot.twolsp_checkplot_png(
+            lspinfo, lspinfo2, times, mags, errs,
+            outfile=os.path.join(str(tmpdir), 'twolsp-%s.png' % ind),
+            varepoch=None,
+            verbose=False,
+            fastplot=True
+        )
+        assert os.path.exists(twocpf)
+
+    template = plotbase.PLOT_TEMPLATES[('checkplot', 1)]
+    fig, axes = template['fig'], template['axes']
+
+    # the insets from the first checkplot were removed, and only the ones for
+    # the last one are left
+    assert len(fig.axes) == 9 + 7
+
+    # the highlight was reset
+    assert axes[2].get_facecolor() == template['facecolor']
+
+    # the phased LC tiles have the right titles
+    assert axes[2].get_title().startswith('Generalized L-S best period: ')
+    assert axes[3].get_title().startswith(
+        'Generalized L-S best period x 0.5: 1.650000 d'
+    )
+    assert axes[8].get_title().startswith('Generalized L-S peak 5: 1.100000')
+
+    twotemplate = plotbase.PLOT_TEMPLATES[('checkplot', 2)]
+    assert twotemplate['axes'][6].get_title().startswith(
+        'Stellingwerf PDM best period: 3.300000 d'
+    )
@@ -0,0 +1,196 @@
+'''test_dust_grid.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the offline extinction grids in astrobase.services.dust using a
+synthetic grid, so no DUST queries are made.
+
+'''
+from __future__ import print_function
+
+import os.path
+
+import numpy as np
+import pytest
+
+from astrobase import lcproc
+from astrobase.services import dust
+from astrobase.varclass import starfeatures
+
+
+FILTERS = ['CTIO B', 'CTIO V', '2MASS J']
+A_OVER_EBV_SF11 = [3.641, 2.682, 0.723]
+A_OVER_EBV_SFD98 = [4.325, 3.240, 0.902]
+
+
+def synthetic_ebv(ras, decls):
+    '''
+    This is a smooth E(B-V) that's linear in RA and Dec.
+
+    '''
+
+    return 0.05 + 0.01*ras + 0.02*decls
+
+
+
+@pytest.fixture
+def gridfile(tmpdir):
+    '''
+    This writes a synthetic grid across RA = 0 from 359.0 to 1.0, Dec 9 to 11.
+
+    '''
+
+    noderas = 359.0 + np.arange(21)*0.1
+    nodedecls = 9.0 + np.arange(11)*0.2
+    gridras, griddecls = np.meshgrid(noderas, nodedecls)
+    ebv = synthetic_ebv(gridras - 359.0, griddecls)
+
+    outfile = dust.write_extinction_grid(
+        os.path.join(str(tmpdir), 'dust-grids', 'grid.npz'),
+        359.0, 0.1,
+        9.0, 0.2,
+        ebv, 0.86*ebv,
+        FILTERS, A_OVER_EBV_SF11, A_OVER_EBV_SFD98
+    )
+
+    yield outfile
+
+    dust.EXTINCTION_GRIDS.clear()
+    dust.EXTINCTION_GRID_FILES.clear()
+
+
+
+def test_extinction_from_grid(gridfile):
+    '''
+    Tests the vectorized interpolation, including across RA = 0.
+
+    '''
+
+    rng = np.random.RandomState(42)
+    ras = rng.uniform(359.0, 361.0, size=1000) % 360.0
+    decls = rng.uniform(9.0, 11.0, size=1000)
+
+    extinction = dust.extinction_from_grid(gridfile, ras, decls)
+    expected = synthetic_ebv((ras - 359.0) % 360.0, decls)
+
+    assert extinction['inside'].all()
+    assert np.allclose(extinction['ebv']['sf11'], expected)
+    assert np.allclose(extinction['ebv']['sfd98'], 0.86*expected)
+
+    for filt, coeff in zip(FILTERS, A_OVER_EBV_SF11):
+        assert np.allclose(extinction['Amag'][filt]['sf11'], coeff*expected)
+
+    # points outside the grid get nans
+    extinction = dust.extinction_from_grid(gridfile,
+                                           [2.0, 0.0, 0.0],
+                                           [10.0, 8.0, 10.0])
+    assert extinction['inside'].tolist() == [False, False, True]
+    assert np.isnan(extinction['ebv']['sf11'][:2]).all()
+
+
+
+def test_color_features_with_grid(gridfile, monkeypatch):
+    '''
+    Tests that color_features uses a grid in the grid directory if told to.
+
+    '''
+
+    # this stands in for the DUST service
+    dustqueries = []
+
+    def fake_query(ra, decl, **kwargs):
+        dustqueries.append((ra, decl))
+        return {'Amag':{x:{'sf11':0.0, 'sfd98':0.0} for x in FILTERS}}
+
+    monkeypatch.setattr(dust, 'extinction_query', fake_query)
+    monkeypatch.setattr(dust, 'EXTINCTION_GRID_DIR',
+                        os.path.dirname(gridfile))
+
+    objectinfo = {'ra':0.25, 'decl':10.1, 'bmag':12.0, 'vmag':11.5}
+    grid = dust.find_extinction_grid(objectinfo['ra'],
+                                     objectinfo['decl'],
+                                     griddir=os.path.dirname(gridfile))
+    assert grid['gridfile'] == os.path.abspath(gridfile)
+
+    # by default, grids aren't used even if there's one covering the object
+    colorfeat = starfeatures.color_features(objectinfo)
+    assert dustqueries == [(0.25, 10.1)]
+    assert colorfeat['extinction_source'] == 'dust'
+    assert colorfeat['extinction_gridfile'] is None
+    assert colorfeat['extinction_bmag'] == 0.0
+
+    # the grid is found in the grid directory, or can be given directly
+    colorfeat = starfeatures.color_features(objectinfo, extinction_grid=True)
+    assert colorfeat == starfeatures.color_features(objectinfo,
+                                                    extinction_grid=grid)
+    assert colorfeat == starfeatures.color_features(objectinfo,
+                                                    extinction_grid=gridfile)
+    assert len(dustqueries) == 1
+    ebv = synthetic_ebv(1.25, 10.1)
+
+    assert colorfeat['dereddened']
+    assert colorfeat['extinction_source'] == 'grid'
+    assert colorfeat['extinction_gridfile'] == os.path.abspath(gridfile)
+    assert np.allclose(colorfeat['extinction_bmag'], 3.641*ebv)
+    assert np.allclose(colorfeat['dered_vmag'], 11.5 - 2.682*ebv)
+    assert np.allclose(colorfeat['bmag-vmag'],
+                       0.5 - (3.641 - 2.682)*ebv)
+
+    # nothing covers this object, so we get the usual DUST query
+    assert dust.grid_extinction_query(120.0, -40.0, grid=grid) is None
+
+
+
+def test_grid_extinction_queries(gridfile, monkeypatch):
+    '''
+    Tests getting the extinction for a whole field at once.
+
+    '''
+
+    # count the grid file reads
+    nloads = []
+    npload = np.load
+
+    def counting_load(*args, **kwargs):
+        nloads.append(args[0])
+        return npload(*args, **kwargs)
+
+    monkeypatch.setattr(np, 'load', counting_load)
+
+    griddir = os.path.dirname(gridfile)
+    ras = np.array([0.25, 120.0, 359.5, np.nan, 0.9])
+    decls = np.array([10.1, -40.0, 9.5, 10.0, 10.9])
+
+    results = dust.grid_extinction_queries(ras, decls, griddir=griddir)
+
+    assert [x is None for x in results] == [False, True, False, True, False]
+    for ra, decl, result in zip(ras, decls, results):
+        if result is not None:
+            assert result == dust.grid_extinction_query(ra, decl,
+                                                        griddir=griddir)
+            assert np.allclose(result['ebv']['sf11'],
+                               synthetic_ebv((ra - 359.0) % 360.0, decl))
+
+    # the grid is only read once
+    assert len(nloads) == 1
+
+    # and read again if it changes
+    os.utime(gridfile, (0.0, 0.0))
+    dust.grid_extinction_queries(ras, decls, griddir=griddir)
+    assert len(nloads) == 2
+
+    # the lcproc starfeatures drivers use this for all LCs in an lclist
+    kdt_dict = {'objects':{'lcfname':np.array(['/lcs/obj-%s.pkl' % x
+                                               for x in range(5)]),
+                           'ra':ras,
+                           'decl':decls}}
+    monkeypatch.setattr(dust, 'EXTINCTION_GRID_DIR', griddir)
+
+    extinctions = lcproc._starfeatures_extinctions(
+        kdt_dict, ['/elsewhere/obj-4.pkl', '/lcs/obj-1.pkl',
+                   '/lcs/unknown.pkl', '/lcs/obj-0.pkl'],
+        extinction_grid=True
+    )
+    assert extinctions[0] == results[4]
+    assert extinctions[1] is None
+    assert extinctions[2] is None
+    assert extinctions[3] == results[0]
@@ -0,0 +1,150 @@
+'''test_fakelcs_batch.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the batch light curve models in astrobase.lcmodels and the batch
+light curve generators in astrobase.fakelcs.generation.
+
+'''
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from astrobase.lcmodels import transits, eclipses, flares, sinusoidal
+from astrobase.fakelcs import generation
+
+
+TIMES = np.sort(np.random.RandomState(42).uniform(0.0, 30.0, size=2000))
+ZEROS = np.zeros_like(TIMES)
+
+
+def in_time_order(modelmags, ptimes):
+    '''
+    This puts the phase-sorted output of the single LC models in time order.
+
+    '''
+
+    return modelmags[np.argsort(ptimes)]
+
+
+
+def test_batch_models_match_single():
+    '''
+    Tests each batch model against its single light curve model row by row.
+
+    '''
+
+    for vartype in ('planet', 'EB', 'flare', 'RRab'):
+
+        batch = generation.generate_lightcurve_batch(vartype, TIMES, 10)
+        params = batch['params']
+        assert batch['mags'].shape == (10, TIMES.size)
+
+        for ind in range(10):
+
+            if vartype == 'planet':
+                single = in_time_order(*transits.trapezoid_transit_func(
+                    [params[x][ind] for x in ('transitperiod',
+                                              'transitepoch',
+                                              'transitdepth',
+                                              'transitduration',
+                                              'ingressduration')],
+                    TIMES, ZEROS, ZEROS
+                )[0:3:2])
+
+            elif vartype == 'EB':
+                single = in_time_order(*eclipses.invgauss_eclipses_func(
+                    [params[x][ind] for x in ('period',
+                                              'epoch',
+                                              'pdepth',
+                                              'pduration',
+                                              'depthratio',
+                                              'secphase')],
+                    TIMES, ZEROS, ZEROS
+                )[0:3:2])
+
+            elif vartype == 'flare':
+                single = ZEROS.copy()
+                for flareind in range(params['nflares'][ind]):
+                    single = flares.flare_model(
+                        [params[x][ind, flareind] for x in ('amplitude',
+                                                            'peaktime',
+                                                            'risestdev',
+                                                            'decayconst')],
+                        TIMES, single, ZEROS
+                    )[0]
+
+            else:
+                order = params['fourierorder'][ind]
+                single = in_time_order(*sinusoidal.sine_series_sum(
+                    [params['period'][ind],
+                     params['epoch'][ind],
+                     params['fourieramps'][ind,:order],
+                     params['fourierphases'][ind,:order]],
+                    TIMES, ZEROS, ZEROS
+                )[0:3:2])
+
+            assert np.allclose(batch['mags'][ind], single), vartype
+
+
+
+@pytest.mark.parametrize('vartype', sorted(generation.VARTYPE_LCGEN_MAP))
+def test_batch_param_distributions(vartype):
+    '''
+    Tests that the batch params come from the single LC generator's defaults.
+
+    '''
+
+    batch = generation.generate_lightcurve_batch(vartype, TIMES, 500,
+                                                 magsarefluxes=True)
+    paramdists = generation._default_paramdists(
+        generation.VARTYPE_LCGEN_MAP[vartype]
+    )
+
+    assert batch['vartype'] == vartype
+    assert np.all(batch['varamplitude'] > 0.0)
+
+    if vartype == 'flare':
+        assert np.all(np.isnan(batch['varperiod']))
+        assert batch['params']['nflares'].min() >= paramdists['nflares'][0]
+        assert batch['params']['nflares'].max() < paramdists['nflares'][1]
+        return
+
+    perioddist = paramdists['transitperiod' if vartype == 'planet'
+                            else 'period']
+    pmin, pmax = perioddist.support()
+    assert np.all((batch['varperiod'] >= pmin) & (batch['varperiod'] <= pmax))
+    assert np.all(batch['params']['epoch' if vartype != 'planet'
+                                  else 'transitepoch'] >= TIMES.min())
+
+    # the single LC generators give the same kind of dict
+    single = generation.VARTYPE_LCGEN_MAP[vartype](TIMES)
+    assert single['mags'].shape == TIMES.shape
+    assert set(single['params']).issubset(set(batch['params']))
+
+
+
+def test_batch_chunks_and_timebases():
+    '''
+    Tests generating in chunks and with a separate time base for each LC.
+
+    '''
+
+    timebases = np.sort(
+        np.random.RandomState(1).uniform(0.0, 10.0, size=(25, 300)), axis=1
+    )
+
+    chunks = list(generation.generate_lightcurve_batch('rotator',
+                                                       timebases,
+                                                       25,
+                                                       chunksize=10))
+    assert [x['mags'].shape for x in chunks] == [(10, 300),
+                                                 (10, 300),
+                                                 (5, 300)]
+    assert np.array_equal(chunks[2]['times'], timebases[20:])
+
+    epochs = np.concatenate([x['params']['epoch'] for x in chunks])
+    assert np.all((epochs >= timebases.min(axis=1)) &
+                  (epochs <= timebases.max(axis=1)))
+
+    assert generation.generate_lightcurve_batch('unknown', TIMES, 5) is None
@@ -0,0 +1,134 @@
+'''test_fakelcs_gridsearch.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the vectorized variable index grid search in astrobase.fakelcs
+against running each grid-point separately, using a small synthetic set of
+varfeatures so no light curves are needed.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import pickle
+
+import numpy as np
+
+from astrobase.fakelcs import recovery
+
+
+def make_simbasedir(simbasedir):
+    '''This writes a fakelcs-info.pkl and varfeatures for fake objects.
+
+    The objects are in three magbins: two with lots of objects and one with
+    only a few, so nothing in it passes the thresholds. Variables have larger
+    variable indices on average. A few objects don't have finite varfeatures.
+
+    '''
+
+    rng = np.random.RandomState(42)
+
+    nobjects = 160
+    objectids = np.array(['obj%04i' % x for x in range(nobjects)])
+    sdssr = np.concatenate((rng.uniform(10.0, 10.25, size=80),
+                            rng.uniform(12.0, 12.25, size=77),
+                            rng.uniform(14.0, 14.25, size=3)))
+    isvariable = rng.uniform(size=nobjects) < 0.3
+
+    magcols = ['aep_000', 'atf_000']
+
+    os.makedirs(os.path.join(simbasedir, 'varfeatures'))
+
+    for ind, objectid in enumerate(objectids):
+
+        features = {'objectid':objectid,
+                    'info':{'sdssr':sdssr[ind],
+                            'jmag':None, 'hmag':None, 'kmag':None}}
+
+        for magcol in magcols:
+            boost = 3.0 if isvariable[ind] else 0.0
+            features[magcol] = {
+                'median':sdssr[ind],
+                'mad':0.01,
+                'stetsonj':rng.normal(1.0 + boost, 1.0),
+                'mag_iqr':abs(rng.normal(0.02 + 0.02*boost, 0.01)),
+                'eta_normal':(np.nan if ind % 37 == 5 else
+                              1.0/abs(rng.normal(0.5 + 0.5*boost, 0.3))),
+            }
+
+        with open(os.path.join(simbasedir, 'varfeatures',
+                               'varfeatures-%s.pkl' % objectid), 'wb') as outfd:
+            pickle.dump(features, outfd, pickle.HIGHEST_PROTOCOL)
+
+    # variability_threshold labels the occupied magbins in order from the
+    # first magbin, so these are the medians it finds
+    magbins = recovery.VARTHRESH_MAGBINS
+    binmedians = [(magbins[x] + magbins[x+1])/2.0 for x in range(3)]
+
+    siminfo = {'objectid':objectids,
+               'lcfpath':[],
+               'isvariable':isvariable,
+               'sdssr':sdssr,
+               'ndet':np.full(nobjects, 1000),
+               'timecols':['rjd','rjd'],
+               'magcols':magcols,
+               'errcols':['aie_000','aie_000'],
+               'magrms':{magcols[0]:{'binned_sdssr_median':binmedians}}}
+
+    with open(os.path.join(simbasedir, 'fakelcs-info.pkl'), 'wb') as outfd:
+        pickle.dump(siminfo, outfd, pickle.HIGHEST_PROTOCOL)
+
+    return simbasedir
+
+
+
+def test_vectorized_gridsearch(tmpdir):
+    '''
+    Tests that the vectorized grid search gives the same results.
+
+    '''
+
+    simbasedir = make_simbasedir(os.path.join(str(tmpdir), 'sim'))
+    kwargs = {'stetson_stdev_range':[0.5, 4.0],
+              'inveta_stdev_range':[0.5, 4.0],
+              'iqr_stdev_range':[0.5, 4.0],
+              'ngridpoints':4,
+              'ngridworkers':2}
+
+    slow = recovery.variable_index_gridsearch_magbin(simbasedir,
+                                                     vectorized=False,
+                                                     **kwargs)
+    fast = recovery.variable_index_gridsearch_magbin(simbasedir,
+                                                     vectorized=True,
+                                                     **kwargs)
+
+    assert len(fast['recovery']) == len(slow['recovery']) == 3
+
+    nfound = 0
+
+    for slowbin, fastbin in zip(slow['recovery'], fast['recovery']):
+
+        assert len(slowbin) == len(fastbin) == 64
+
+        for slowres, fastres in zip(slowbin, fastbin):
+
+            assert slowres is not None
+            assert sorted(slowres) == sorted(fastres)
+
+            for key in slowres:
+                if key in slowres['magcols']:
+                    assert sorted(slowres[key]) == sorted(fastres[key])
+                    for stat in slowres[key]:
+                        np.testing.assert_equal(fastres[key][stat],
+                                                slowres[key][stat])
+                    nfound += slowres[key]['stet_truepositives']
+                else:
+                    np.testing.assert_equal(fastres[key], slowres[key])
+
+    # make sure we actually tested some recovered objects
+    assert nfound > 0
+
+    with open(os.path.join(simbasedir,
+                           'fakevar-recovery-per-magbin.pkl'),'rb') as infd:
+        saved = pickle.load(infd)
+    assert len(saved['recovery']) == 3
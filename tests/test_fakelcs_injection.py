@@ -0,0 +1,122 @@
+'''test_fakelcs_injection.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the in-memory injection-recovery engine in astrobase.fakelcs.
+
+'''
+from __future__ import print_function
+
+import os.path
+
+import numpy as np
+
+from astrobase.fakelcs import injection
+
+
+RNG = np.random.RandomState(42)
+TIMEBASES = [np.sort(RNG.uniform(0.0, 20.0, size=400)),
+             np.sort(RNG.uniform(0.0, 30.0, size=300))]
+NOISEMODELS = [{'mag':11.0, 'sigma':0.002},
+               {'mag':14.0, 'sigma':0.02}]
+PFKWARGS = [{'startp':0.3, 'endp':1.0, 'autofreq':False,
+             'stepsize':1.0e-3}]
+
+
+def test_inject_trial_seeding():
+    '''
+    Tests that each trial's light curve depends only on its seed.
+
+    '''
+
+    seed = injection.trial_seed(42, 7)
+    assert seed == injection.trial_seed(42, 7)
+    assert seed != injection.trial_seed(42, 8)
+
+    lc1 = injection.inject_trial(TIMEBASES[0], NOISEMODELS[0], 'RRab', seed)
+    injection.inject_trial(TIMEBASES[0], NOISEMODELS[0], 'RRab', seed + 1)
+    lc2 = injection.inject_trial(TIMEBASES[0], NOISEMODELS[0], 'RRab', seed)
+
+    assert np.array_equal(lc1['mags'], lc2['mags'])
+    assert lc1['varperiod'] == lc2['varperiod']
+    assert np.all(lc1['errs'] == 0.002)
+
+    # no injection gives just the noise
+    lc3 = injection.inject_trial(TIMEBASES[0], NOISEMODELS[0], None, seed)
+    assert np.isnan(lc3['varperiod'])
+    assert abs(np.median(lc3['mags']) - 11.0) < 0.001
+
+
+
+def test_run_injection_recovery(tmpdir):
+    '''
+    Tests the streamed result table, including parallel runs and resuming.
+
+    '''
+
+    resultcsv = os.path.join(str(tmpdir), 'injrec.csv')
+
+    injection.run_injection_recovery(TIMEBASES,
+                                     NOISEMODELS,
+                                     ['RRab', None],
+                                     resultcsv,
+                                     ntrials=3,
+                                     randomseed=42,
+                                     pfmethods=['gls'],
+                                     pfkwargs=PFKWARGS,
+                                     period_tolerance=5.0e-3,
+                                     nworkers=2,
+                                     trialsperchunk=4)
+    results = injection.read_injrec_results(resultcsv)
+
+    assert results.size == 2*2*2*3
+    assert results['trial'].tolist() == list(range(24))
+    assert set(results['vartype']) == {'RRab', 'none'}
+
+    injected = results[results['vartype'] == 'RRab']
+    assert np.isfinite(injected['actual_period']).all()
+
+    # these short time grids only get periods to within a few parts in 1000
+    assert injected['recovered'].sum() >= injected.size - 1
+
+    notinjected = results[results['vartype'] == 'none']
+    assert (notinjected['best_status'] == 'not_variable').all()
+    assert not notinjected['recovered'].any()
+
+    # any trial can be rerun by itself to get the same result
+    row = injected[5]
+    lcdict = injection.inject_trial(TIMEBASES[row['timebase']],
+                                    NOISEMODELS[row['noisemodel']],
+                                    'RRab',
+                                    row['seed'])
+    assert np.isclose(lcdict['varperiod'], row['actual_period'])
+
+    # drop the last few rows and leave a partial row like a crashed run would,
+    # then make sure only those are rerun
+    with open(resultcsv) as infd:
+        lines = infd.readlines()
+    with open(resultcsv,'w') as outfd:
+        outfd.writelines(lines[:-5])
+        outfd.write(lines[-5][:len(lines[-5])//2])
+
+    injection.run_injection_recovery(TIMEBASES,
+                                     NOISEMODELS,
+                                     ['RRab', None],
+                                     resultcsv,
+                                     ntrials=3,
+                                     randomseed=42,
+                                     pfmethods=['gls'],
+                                     pfkwargs=PFKWARGS,
+                                     period_tolerance=5.0e-3,
+                                     nworkers=1)
+    resumed = injection.read_injrec_results(resultcsv)
+
+    with open(resultcsv) as infd:
+        resumedlines = infd.readlines()
+    assert len(resumedlines) == len(lines)
+    assert len(set(len(x.split(',')) for x in resumedlines)) == 1
+
+    assert resumed.size == results.size
+    assert np.array_equal(resumed['best_period'], results['best_period'],
+                          equal_nan=True)
+    assert np.array_equal(resumed['actual_period'], results['actual_period'],
+                          equal_nan=True)
@@ -0,0 +1,243 @@
+'''test_gaia_fieldcache.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the field-level GAIA tile cache in astrobase.services.gaia against a
+local stand-in for the GAIA TAP service that serves a fake catalog.
+
+'''
+from __future__ import print_function
+
+import re
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+import numpy as np
+import pytest
+
+from astrobase.services import gaia
+
+
+#######################
+## FAKE TAP STAND-IN ##
+#######################
+
+# a fake catalog of sources around (150.0, 20.0)
+RNG = np.random.RandomState(42)
+NFAKE = 4000
+FAKE_CATALOG = {
+    'source_id':np.arange(NFAKE) + 1000000000000000,
+    'ra':RNG.uniform(149.2, 150.8, size=NFAKE),
+    'dec':RNG.uniform(19.2, 20.8, size=NFAKE),
+}
+for col in gaia.FIELD_TILE_COLUMNS[3:]:
+    FAKE_CATALOG[col] = RNG.normal(size=NFAKE)
+
+RANGE_REGEX = re.compile(
+    r'ra >= ([0-9.-]+) and \S+ < ([0-9.-]+) and '
+    r'\S+ >= ([0-9.-]+) and \S+ (<=?) ([0-9.-]+)'
+)
+
+UWS_JOB = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink">'
+    '<uws:jobId>{jobid}</uws:jobId>'
+    '<uws:phase>COMPLETED</uws:phase>'
+    '<uws:results><uws:result id="result" xlink:href="{resulturl}" '
+    'rows="{nrows}"/></uws:results>'
+    '</uws:job>'
+)
+
+
+def run_fake_query(query):
+    '''
+    This returns the CSV for the RA/Dec range query used for tiles.
+
+    '''
+
+    ramin, ramax, decmin, decop, decmax = RANGE_REGEX.search(query).groups()
+    ra, dec = FAKE_CATALOG['ra'], FAKE_CATALOG['dec']
+
+    decind = dec <= float(decmax) if decop == '<=' else dec < float(decmax)
+    ind = ((ra >= float(ramin)) & (ra < float(ramax)) &
+           (dec >= float(decmin)) & decind)
+
+    lines = [','.join(gaia.FIELD_TILE_COLUMNS)]
+    for row in np.where(ind)[0]:
+        lines.append(','.join(
+            ['%i' % FAKE_CATALOG['source_id'][row]] +
+            ['%.12f' % FAKE_CATALOG[x][row]
+             for x in gaia.FIELD_TILE_COLUMNS[1:]]
+        ))
+
+    return '\n'.join(lines) + '\n', int(ind.sum())
+
+
+
+class FakeTAPHandler(BaseHTTPRequestHandler):
+    '''
+    This handles the async TAP job protocol: submit, job status, result.
+
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        params = parse_qs(self.rfile.read(length).decode())
+
+        with self.server.lock:
+            jobid = 'job%s' % len(self.server.jobs)
+            self.server.jobs[jobid] = params['QUERY'][0]
+
+        self.send_response(303)
+        self.send_header('Location', '/tap/async/%s' % jobid)
+        self.end_headers()
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        jobid = parts[2]
+        result, nrows = run_fake_query(self.server.jobs[jobid])
+
+        if len(parts) == 3:
+            body = UWS_JOB.format(
+                jobid=jobid,
+                resulturl='http://127.0.0.1:%s/tap/async/%s/results/result' %
+                (self.server.server_port, jobid),
+                nrows=nrows
+            )
+        else:
+            body = result
+
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+class FakeTAPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+@pytest.fixture
+def fake_tap(monkeypatch):
+    '''
+    This starts the fake TAP service and points gaia.GAIA_URLS at it.
+
+    '''
+
+    server = FakeTAPServer(('127.0.0.1', 0), FakeTAPHandler)
+    server.jobs = {}
+    server.lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    monkeypatch.setattr(
+        gaia, 'GAIA_URLS',
+        {'local':{'url':'http://127.0.0.1:%s/tap/async' % server.server_port,
+                  'table':'gaiadr2.gaia_source',
+                  'phasekeyword':'uws:phase',
+                  'resultkeyword':'uws:result'}}
+    )
+    gaia.FIELD_TILE_CACHE.clear()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    gaia.FIELD_TILE_CACHE.clear()
+
+
+
+###########
+## TESTS ##
+###########
+
+def test_field_tiles_for_coords():
+    '''
+    Tests the tiles found for cones near the RA wrap and the poles.
+
+    '''
+
+    # a small cone in the middle of a tile
+    assert gaia.field_tiles_for_coords(10.25, 0.25, 10.0,
+                                       tilesize=0.5) == [(20, 180)]
+
+    # a cone straddling RA = 0 gets the tiles on both sides
+    tiles = gaia.field_tiles_for_coords(0.01, 0.25, 60.0, tilesize=0.5)
+    assert tiles == [(0, 180), (719, 180)]
+
+    # a cone near the pole is wider in RA
+    tiles = gaia.field_tiles_for_coords(10.0, 89.9, 60.0, tilesize=0.5)
+    assert 20 < len(tiles) < 720
+
+    # a cone around the pole gets the whole ring of tiles
+    tiles = gaia.field_tiles_for_coords(10.0, 89.99, 60.0, tilesize=0.5)
+    assert len(tiles) == 720
+    assert set(x[1] for x in tiles) == {359}
+
+
+
+def test_field_conesearch(fake_tap, tmpdir):
+    '''
+    Tests cone searches from the field cache against a brute-force search.
+
+    '''
+
+    radius = 120.0
+    ras = FAKE_CATALOG['ra'][:500]
+    decls = FAKE_CATALOG['dec'][:500]
+
+    fieldcat = gaia.get_field_catalog(ras, decls, radius,
+                                      cachedir=str(tmpdir),
+                                      verbose=False)
+
+    # one TAP job per tile, and far fewer tiles than objects
+    assert not fieldcat['failedtiles']
+    assert len(fake_tap.jobs) == len(fieldcat['tiles'])
+    assert len(fieldcat['tiles']) <= 16
+
+    for ind in range(0, 500, 25):
+
+        objlist = gaia.field_conesearch(fieldcat, ras[ind], decls[ind], radius)
+
+        # do the same search by brute force
+        xyz = gaia._radecl_to_xyz(FAKE_CATALOG['ra'], FAKE_CATALOG['dec'])
+        cxyz = gaia._radecl_to_xyz(ras[ind], decls[ind])[0]
+        dist = np.degrees(2.0*np.arcsin(
+            np.sqrt(((xyz - cxyz)**2).sum(axis=1))/2.0
+        ))*3600.0
+        expected = np.where(dist <= radius)[0]
+        expected = expected[np.argsort(dist[expected])]
+
+        assert objlist['source_id'].tolist() == [
+            '%i' % x for x in FAKE_CATALOG['source_id'][expected]
+        ]
+        assert np.allclose(objlist['dist_arcsec'], dist[expected], atol=1.0e-4)
+
+        # the object itself comes first
+        assert objlist['dist_arcsec'][0] < 1.0e-4
+
+    # a cone outside the field isn't covered
+    assert gaia.field_conesearch(fieldcat, 200.0, -30.0, radius) is None
+
+    # getting the field again uses the cached tiles
+    njobs = len(fake_tap.jobs)
+    gaia.get_field_catalog(ras, decls, radius,
+                           cachedir=str(tmpdir),
+                           verbose=False)
+    assert len(fake_tap.jobs) == njobs
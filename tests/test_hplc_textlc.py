@@ -0,0 +1,213 @@
+'''test_hplc_textlc.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests reading, finding, and concatenating HATPI text LCs in
+astrobase.hatsurveys.hplc, using a few small synthetic text LCs.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import gzip
+
+import numpy as np
+
+from astrobase.hatsurveys import hplc
+
+
+def make_textlc(lcfile, nrows, ccd=5, tstart=56000.0, seed=42):
+    '''
+    This writes a synthetic HATPI TFA text LC with nrows detections.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    times = np.sort(tstart + rng.uniform(0.0, 10.0, size=nrows))
+    hatid = hplc.HATIDREGEX.findall(lcfile)[0]
+
+    lines = ['# a comment line']
+
+    for ind, rjd in enumerate(times):
+
+        row = ['%.7f' % rjd,
+               '1-%06d%s_%s' % (400000 + ind, 'ab'[ind % 2], ccd),
+               hatid]
+        row.extend('%.3f' % x for x in rng.uniform(100.0, 2000.0, size=9))
+
+        for aperture in range(3):
+            row.extend(['%.3f' % rng.uniform(1000.0, 2000.0),
+                        '%.3f' % rng.uniform(1.0, 10.0),
+                        '%.5f' % (10.0 + rng.normal(0.0, 0.01)),
+                        '%.5f' % rng.uniform(0.001, 0.01),
+                        'G' if ind % 7 else 'X'])
+
+        row.extend('%.5f' % (10.0 + rng.normal(0.0, 0.01)) for x in range(4))
+        lines.append(' '.join(row))
+
+    with gzip.open(lcfile,'wb') as outfd:
+        outfd.write(('\n'.join(lines) + '\n').encode())
+
+    return lcfile
+
+
+
+def old_read_textlc(lcfile):
+    '''
+    This parses the text LC columns the way read_hatpi_textlc used to.
+
+    '''
+
+    thiscoldefs = hplc._get_textlc_coldefs(lcfile)
+
+    with gzip.open(lcfile,'rb') as infd:
+        lclines = infd.read().decode().split('\n')
+
+    lclines = [x.split() for x in lclines if ('#' not in x and len(x) > 0)]
+    lccols = list(zip(*lclines))
+
+    return {x[0]:np.array([x[1](y) for y in col])
+            for (x, col) in zip(thiscoldefs, lccols)}
+
+
+
+def test_read_hatpi_textlc(tmpdir):
+    '''
+    Tests that the bulk reader parses the LC column-for-column like before.
+
+    '''
+
+    lcfile = make_textlc(
+        os.path.join(str(tmpdir), 'HAT-123-0001234_5.tfalc.TF1.gz'), 50
+    )
+
+    lcdict = hplc.read_hatpi_textlc(lcfile)
+    oldlcdict = old_read_textlc(lcfile)
+
+    assert lcdict['objectid'] == 'HAT-123-0001234'
+    assert lcdict['objectinfo']['ndet'] == 50
+    assert lcdict['objectinfo']['stations'] == ['HP1']
+    assert lcdict['columns'][-5:] == ['itf1','stf','cfn','cfs','ccd']
+
+    for col in oldlcdict:
+        assert lcdict[col].dtype.kind == oldlcdict[col].dtype.kind, col
+        assert (lcdict[col] == oldlcdict[col]).all(), col
+
+    assert (lcdict['ccd'] == 5).all()
+    assert list(lcdict['cfs'][:2]) == ['a','b']
+
+    # a bad row makes it fall back to the line-by-line parser
+    with gzip.open(lcfile,'rb') as infd:
+        lclines = infd.read().decode().split('\n')
+    lclines[3] = lclines[3] + ' extra'
+
+    badlcfile = os.path.join(str(tmpdir), 'HAT-123-0001235_5.tfalc.TF1.gz')
+    with gzip.open(badlcfile,'wb') as outfd:
+        outfd.write('\n'.join(lclines).encode())
+
+    badlcdict = hplc.read_hatpi_textlc(badlcfile)
+    assert badlcdict['objectinfo']['ndet'] == 50
+    assert np.array_equal(badlcdict['rjd'], lcdict['rjd'])
+
+    # long str values aren't truncated by the bulk parser
+    with gzip.open(lcfile,'rb') as infd:
+        lclines = [x.split() for x in infd.read().decode().split('\n')]
+    lclines[2][1] = lclines[2][1] + '-' + 'x'*40
+    lclines = [' '.join(x) for x in lclines]
+
+    longlcfile = os.path.join(str(tmpdir), 'HAT-123-0001237_5.tfalc.TF1.gz')
+    with gzip.open(longlcfile,'wb') as outfd:
+        outfd.write('\n'.join(lclines).encode())
+
+    longlcdict = hplc.read_hatpi_textlc(longlcfile)
+    assert longlcdict['frk'][1] == lcdict['frk'][1] + '-' + 'x'*40
+    assert np.array_equal(longlcdict['frk'][2:], lcdict['frk'][2:])
+    assert np.array_equal(longlcdict['irm1'], lcdict['irm1'])
+
+    # an LC with no detections
+    emptylcfile = make_textlc(
+        os.path.join(str(tmpdir), 'HAT-123-0001236_5.tfalc.TF1.gz'), 0
+    )
+    emptylcdict = hplc.read_hatpi_textlc(emptylcfile)
+    assert emptylcdict['objectinfo']['ndet'] == 0
+    assert emptylcdict['rjd'].size == 0
+
+
+
+def test_concatenate_textlcs(tmpdir):
+    '''
+    Tests finding and concatenating the text LCs for a few objects.
+
+    '''
+
+    ccddirs = [os.path.join(str(tmpdir), 'ccd%s' % x) for x in (5, 6)]
+    for ccddir in ccddirs:
+        os.makedirs(ccddir)
+
+    # the second CCD's LC starts earlier, so the concatenated LC must be sorted
+    lcfiles = [
+        make_textlc(os.path.join(ccddirs[0],
+                                 'HAT-123-0001234_5.tfalc.TF1.gz'),
+                    40, ccd=5, tstart=56005.0, seed=1),
+        make_textlc(os.path.join(ccddirs[1],
+                                 'HAT-123-0001234_6.tfalc.TF1.gz'),
+                    30, ccd=6, tstart=56000.0, seed=2),
+        make_textlc(os.path.join(ccddirs[1],
+                                 'HAT-123-0005678_6.tfalc.TF1.gz'),
+                    20, ccd=6, seed=3),
+        make_textlc(os.path.join(ccddirs[1],
+                                 'HAT-123-0001234_6.tfalc.TF2.gz'),
+                    20, ccd=6, seed=4),
+    ]
+
+    objectlcs = hplc.find_textlcs_for_objectids(
+        str(tmpdir),
+        ['HAT-123-0001234','HAT-123-0005678','HAT-123-0009999']
+    )
+    assert sorted(objectlcs['HAT-123-0001234']) == sorted(lcfiles[:2])
+    assert objectlcs['HAT-123-0005678'] == [lcfiles[2]]
+    assert objectlcs['HAT-123-0009999'] == []
+
+    # without recursion, nothing is found in the top directory
+    assert hplc.find_textlcs_for_objectids(
+        str(tmpdir), ['HAT-123-0001234'], recursive=False
+    ) == {'HAT-123-0001234':[]}
+
+    clcdict = hplc.concatenate_textlcs(lcfiles[:2])
+
+    assert clcdict['objectinfo']['ndet'] == 70
+    assert clcdict['nconcatenated'] == 2
+    assert clcdict['objectinfo']['stations'] == ['HP1']
+    assert np.all(np.diff(clcdict['rjd']) >= 0.0)
+
+    for col in clcdict['columns']:
+        assert clcdict[col].size == 70, col
+
+    # the rows stay together after sorting
+    assert (clcdict['ccd'][clcdict['lcn'] == 0] == 5).all()
+    assert (clcdict['ccd'][clcdict['lcn'] == 1] == 6).all()
+    assert np.array_equal(np.sort(clcdict['rjd'][clcdict['lcn'] == 1]),
+                          old_read_textlc(lcfiles[1])['rjd'])
+
+    # the mag columns are normalized per LC
+    for lcn in (0, 1):
+        assert abs(np.median(clcdict['irm1'][clcdict['lcn'] == lcn])) < 1.0e-8
+
+    # LCs with different columns are skipped
+    clcdict = hplc.concatenate_textlcs([lcfiles[0], lcfiles[3]])
+    assert clcdict['nconcatenated'] == 1
+    assert clcdict['objectinfo']['ndet'] == 40
+
+    # the parallel driver writes one pickle per object that has LCs
+    outdir = os.path.join(str(tmpdir), 'pklcs')
+    results = hplc.parallel_concat_lcdir(
+        str(tmpdir),
+        ['HAT-123-0001234','HAT-123-0009999'],
+        outdir=outdir,
+        nworkers=2
+    )
+    assert results['HAT-123-0009999'] is None
+
+    pklcdict = hplc.read_hatpi_pklc(results['HAT-123-0001234'])
+    assert pklcdict['objectinfo']['ndet'] == 70
+    assert np.all(np.diff(pklcdict['rjd']) >= 0.0)
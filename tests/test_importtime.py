@@ -0,0 +1,170 @@
+'''test_importtime.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the following:
+
+- checks that importing the main astrobase modules doesn't pull in heavy
+  dependencies (matplotlib, astropy, sklearn, PIL, scipy.stats, etc.)
+- runs `python -X importtime` on these modules in a fresh interpreter and fails
+  if the cumulative import time is above a budget
+
+The import time budget (in seconds) can be changed by setting the
+ASTROBASE_IMPORT_BUDGET environment variable.
+
+'''
+from __future__ import print_function
+import os
+import sys
+import subprocess
+
+import pytest
+
+
+############
+## CONFIG ##
+############
+
+# these are the modules to check
+MODULES = [
+    'astrobase.lcproc',
+    'astrobase.checkplot',
+    'astrobase.periodbase',
+    'astrobase.varclass.varfeatures',
+    'astrobase.varclass.periodicfeatures',
+    'astrobase.varclass.starfeatures',
+    'astrobase.varclass.rfclass',
+    'astrobase.services.gaia',
+    'astrobase.services.simbad',
+    'astrobase.services.skyview',
+    'astrobase.services.dust',
+    'astrobase.services.trilegal',
+]
+
+# none of these should be imported just by importing the modules above
+HEAVY_MODULES = [
+    'matplotlib',
+    'astropy',
+    'sklearn',
+    'PIL',
+    'scipy.stats',
+    'scipy.signal',
+    'scipy.spatial',
+    'requests',
+]
+
+# the import time budget in seconds. this includes importing numpy.
+IMPORT_BUDGET = float(os.environ.get('ASTROBASE_IMPORT_BUDGET', 1.0))
+
+
+#######################
+## UTILITY FUNCTIONS ##
+#######################
+
+def get_import_time(module):
+    '''
+    This runs `python -X importtime -c 'import module'` in a fresh interpreter
+    and returns the cumulative import time for module in seconds.
+
+    '''
+
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stdout, stderr = proc.communicate()
+    assert proc.returncode == 0, stderr.decode()
+
+    # the importtime lines look like:
+    # import time: self [us] | cumulative | imported package
+    total = 0
+    for line in stderr.decode().split('\n'):
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        try:
+            cumulative = int(fields[1].strip())
+        except ValueError:
+            continue
+        # top-level imports have no leading indent in the package column
+        if not fields[2].startswith('  '):
+            total += cumulative
+
+    return total/1.0e6
+
+
+def get_loaded_heavy_modules(module):
+    '''
+    This imports module in a fresh interpreter and returns the list of heavy
+    modules that ended up in sys.modules.
+
+    '''
+
+    code = (
+        'import sys; import %s; '
+        'print("HEAVY:" + ",".join(x for x in %r if x in sys.modules))' %
+        (module, HEAVY_MODULES)
+    )
+    stdout = subprocess.check_output([sys.executable, '-c', code])
+    for line in stdout.decode().split('\n'):
+        if line.startswith('HEAVY:'):
+            return [x for x in line[6:].strip().split(',') if x]
+
+
+###########
+## TESTS ##
+###########
+
+@pytest.mark.skipif(sys.version_info < (3,7),
+                    reason='python -X importtime needs Python 3.7+')
+@pytest.mark.parametrize('module', MODULES)
+def test_import_time_budget(module):
+    '''
+    Tests that the module imports within the time budget.
+
+    '''
+
+    importtime = get_import_time(module)
+    print('%s import time: %.3f sec' % (module, importtime))
+    assert importtime < IMPORT_BUDGET, (
+        '%s took %.3f sec to import, budget is %.3f sec' %
+        (module, importtime, IMPORT_BUDGET)
+    )
+
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_no_heavy_imports(module):
+    '''
+    Tests that importing the module doesn't import any heavy dependencies.
+
+    '''
+
+    loaded = get_loaded_heavy_modules(module)
+    assert loaded == [], (
+        'importing %s also imported: %s' % (module, ', '.join(loaded))
+    )
+
+
+
+def test_lazy_objects_resolve():
+    '''
+    Tests that the lazy proxies resolve to the real objects and pickle OK.
+
+    '''
+
+    import pickle
+    from astrobase.lazyload import lazy_object, lazy_module, resolve, \
+        is_loaded
+
+    sqrt = lazy_object('math', 'sqrt')
+    assert not is_loaded(sqrt)
+    assert sqrt(4.0) == 2.0
+    assert is_loaded(sqrt)
+
+    unpickled = pickle.loads(pickle.dumps(sqrt))
+    assert unpickled(9.0) == 3.0
+
+    json = lazy_module('json')
+    assert json.loads('[1]') == [1]
+    assert resolve(json) is sys.modules['json']
@@ -0,0 +1,104 @@
+'''test_lcparse.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the bulk text/CSV LC parser in astrobase.hatsurveys.lcparse against
+the per-value casting rules used by the HAT LC readers.
+
+'''
+from __future__ import print_function
+
+import numpy as np
+
+from astrobase.hatsurveys.hatlc import smartcast
+from astrobase.hatsurveys.lcparse import parse_lc_columns
+
+
+COLUMNS = ['rjd','stf','aiq_000','aep_000']
+CASTERS = [float, int, str, float]
+
+
+def slow_parse(datalines, delimiter=','):
+    '''
+    This parses the lines the way hatlc.read_csvlc used to.
+
+    '''
+
+    lccolumns = list(zip(*[x.split(delimiter) for x in datalines]))
+    return {col:np.array([smartcast(x, caster) for x in lccolumns[ind]])
+            for ind, (col, caster) in enumerate(zip(COLUMNS, CASTERS))}
+
+
+
+def check_same(coldict, refdict):
+    '''
+    This checks if the two dicts of columns are identical, dtypes included.
+
+    '''
+
+    assert sorted(coldict.keys()) == sorted(refdict.keys())
+
+    for col in refdict:
+        assert coldict[col].dtype == refdict[col].dtype, col
+        if refdict[col].dtype.kind == 'f':
+            assert np.array_equal(coldict[col], refdict[col], equal_nan=True)
+        else:
+            assert (coldict[col] == refdict[col]).all()
+
+
+
+def test_parse_clean_rows():
+    '''
+    Tests the bulk parser on clean rows.
+
+    '''
+
+    datalines = ['56000.1,5,G,10.1',
+                 '56000.2,6,X,10.2',
+                 '56000.3,7,GG,10.3']
+
+    check_same(parse_lc_columns(datalines, COLUMNS, CASTERS),
+               slow_parse(datalines))
+
+
+
+def test_parse_bad_values():
+    '''
+    Tests that bad values are handled the same way as smartcast.
+
+    '''
+
+    # an empty float, a float in the int column, and an empty str
+    datalines = ['56000.1,5,G,',
+                 '56000.2,6.5,,10.2',
+                 ',7,X,nan']
+
+    check_same(parse_lc_columns(datalines, COLUMNS, CASTERS),
+               slow_parse(datalines))
+
+
+
+def test_parse_usecols_and_guess():
+    '''
+    Tests column selection and guessing column types.
+
+    '''
+
+    datalines = ['HAT-123-0001234 1 10.5 G',
+                 'HAT-123-0001234 2 10.6 G',
+                 'HAT-123-0001234 3 nan X']
+
+    coldict = parse_lc_columns(datalines,
+                               ['hatid','cfn','mag','flag'],
+                               [None, None, None, None],
+                               delimiter=None,
+                               usecols=['cfn','mag'])
+
+    assert sorted(coldict.keys()) == ['cfn','mag']
+    assert coldict['cfn'].dtype == np.int64
+    assert coldict['mag'].dtype == np.float64
+    assert np.isnan(coldict['mag'][-1])
+
+    # the first row guess is wrong here, so this should fall back to str
+    coldict = parse_lc_columns(['1', '2', 'x'], ['col'], [None],
+                               delimiter=None)
+    assert coldict['col'].tolist() == ['1', '2', 'x']
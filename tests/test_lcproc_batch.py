@@ -0,0 +1,149 @@
+'''test_lcproc_batch.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the following:
+
+- the SQLite task queue used by lcpbatch workers
+- running a worker on a few fake light curves with a custom lcformat
+
+'''
+from __future__ import print_function
+import os.path
+import json
+import pickle
+
+import numpy as np
+
+from astrobase import lcproc_batch
+
+
+#######################
+## UTILITY FUNCTIONS ##
+#######################
+
+def make_fake_lcs(lcdir, nlcs=3):
+    '''
+    This writes some fake sinusoidal LCs as pickles and a lcformat JSON for
+    them. Returns the list of LC files and the path to the lcformat JSON.
+
+    '''
+
+    lcfiles = []
+
+    for ind in range(nlcs):
+
+        times = np.sort(np.random.uniform(0.0, 30.0, size=1000))
+        mags = (10.0 + 0.1*np.sin(2.0*np.pi*times/1.2345) +
+                np.random.normal(0.0, 0.01, size=times.size))
+
+        lcdict = {'objectid':'fake-%s' % ind,
+                  'objectinfo':{'ra':10.0, 'decl':-20.0},
+                  'time':times,
+                  'mag':mags,
+                  'err':np.full_like(times, 0.01)}
+
+        lcf = os.path.join(lcdir, 'fake-%s-test.pkl' % ind)
+        with open(lcf,'wb') as outfd:
+            pickle.dump(lcdict, outfd)
+        lcfiles.append(lcf)
+
+    formatjson = os.path.join(lcdir, 'fake-pkl.json')
+    with open(formatjson,'w') as outfd:
+        json.dump({'fileglob':'*-test.pkl',
+                   'timecols':['time'],
+                   'magcols':['mag'],
+                   'errcols':['err'],
+                   'magsarefluxes':False,
+                   'lcreader_module':'astrobase.lcproc_batch',
+                   'lcreader_func':'read_pklc',
+                   'lcreader_kwargs':None,
+                   'lcnorm_module':None,
+                   'lcnorm_func':None,
+                   'lcnorm_kwargs':None}, outfd)
+
+    return lcfiles, formatjson
+
+
+
+###########
+## TESTS ##
+###########
+
+def test_local_queue_retries(tmpdir):
+    '''
+    Tests that tasks are claimed once and retried up to maxattempts.
+
+    '''
+
+    queue = lcproc_batch.LocalTaskQueue(str(tmpdir.join('queue.sqlite')),
+                                        maxattempts=2)
+    assert queue.add_tasks('cp-png', [['a.pkl'], ['b.pkl']]) == 2
+
+    task1 = queue.get_task('worker-1')
+    task2 = queue.get_task('worker-2')
+    assert task1['args'] == ['a.pkl']
+    assert task2['args'] == ['b.pkl']
+    assert queue.get_task('worker-3') is None
+
+    queue.finish_task(task1['taskid'], 'a.png')
+
+    # the failed task goes back into the queue once, then fails for good
+    queue.fail_task(task2['taskid'], 'oops')
+    retry = queue.get_task('worker-1')
+    assert retry['taskid'] == task2['taskid']
+    assert retry['attempts'] == 2
+    queue.fail_task(retry['taskid'], 'oops again')
+
+    status = queue.get_status()
+    assert status['done'] == 1
+    assert status['failed'] == 1
+    assert status['queued'] == 0
+
+    failed = queue.get_results(status='failed')
+    assert failed[0]['error'] == 'oops again'
+    assert queue.get_results()[0]['result'] == 'a.png'
+
+
+
+def test_worker_runs_tasks(tmpdir):
+    '''
+    Tests that a worker processes periodfind and timebin tasks from the queue.
+
+    '''
+
+    lcdir = tmpdir.mkdir('lcs')
+    outdir = tmpdir.mkdir('out')
+    lcfiles, formatjson = make_fake_lcs(str(lcdir))
+    queuefile = str(tmpdir.join('queue.sqlite'))
+
+    nadded = lcproc_batch.enqueue_tasks(
+        queuefile,
+        'periodfind',
+        lcfiles,
+        outdir=str(outdir),
+        taskkwargs={'pfmethods':['gls'], 'pfkwargs':[{}]}
+    )
+    assert nadded == len(lcfiles)
+
+    nadded = lcproc_batch.enqueue_tasks(queuefile,
+                                        'timebin',
+                                        lcfiles[:1],
+                                        binsizesec=3600.0,
+                                        outdir=str(outdir))
+    assert nadded == 1
+
+    workerinfo = lcproc_batch.run_worker(queuefile,
+                                         lcformat=formatjson,
+                                         tasktypes=['periodfind','timebin'],
+                                         maxidle=0.0,
+                                         pollinterval=0.1)
+    assert workerinfo['nsucceeded'] == len(lcfiles) + 1
+    assert workerinfo['nfailed'] == 0
+
+    queue = lcproc_batch.get_task_queue(queuefile)
+    results = queue.get_results(tasktype='periodfind')
+    assert len(results) == len(lcfiles)
+
+    with open(results[0]['result'],'rb') as infd:
+        pfresult = pickle.load(infd)
+    assert abs(pfresult['mag']['gls']['bestperiod'] - 1.2345) < 1.0e-2
@@ -0,0 +1,149 @@
+'''test_lcproc_instrument.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the instrumentation of the lcproc drivers in
+astrobase.lcproc_instrument, using a few fake LCs in a custom lcformat.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import csv
+import glob
+import pickle
+
+import numpy as np
+
+from astrobase import lcproc, lcproc_instrument
+
+
+def read_fakelc(lcfile):
+    '''
+    This reads the fake LC pickles.
+
+    '''
+
+    with open(lcfile,'rb') as infd:
+        return pickle.load(infd)
+
+
+
+def make_fake_lcs(lcdir, nlcs=4):
+    '''
+    This writes some fake sinusoidal LCs as pickles.
+
+    '''
+
+    lcfiles = []
+    rng = np.random.RandomState(42)
+
+    for ind in range(nlcs):
+
+        times = np.sort(rng.uniform(0.0, 10.0, size=500))
+        mags = (10.0 + 0.1*np.sin(2.0*np.pi*times/1.2345) +
+                rng.normal(0.0, 0.01, size=times.size))
+
+        lcdict = {'objectid':'fake-%s' % ind,
+                  'objectinfo':{'ra':10.0, 'decl':-20.0},
+                  'time':times,
+                  'mag':mags,
+                  'err':np.full_like(times, 0.01)}
+
+        lcf = os.path.join(lcdir, 'fake-%s-instr.pkl' % ind)
+        with open(lcf,'wb') as outfd:
+            pickle.dump(lcdict, outfd)
+        lcfiles.append(lcf)
+
+    lcproc.register_custom_lcformat('fake-instr', '*-instr.pkl',
+                                    read_fakelc,
+                                    ['time'], ['mag'], ['err'])
+
+    return lcfiles
+
+
+
+def test_instrumented_parallel_pf(tmpdir):
+    '''
+    Tests that parallel_pf records per-stage timings from its workers.
+
+    '''
+
+    lcfiles = make_fake_lcs(str(tmpdir))
+    pfdir = os.path.join(str(tmpdir), 'pf')
+    reportdir = os.path.join(str(tmpdir), 'report')
+
+    lcproc_instrument.enable_instrumentation(reportdir, profilefraction=1.0)
+
+    try:
+        results = lcproc.parallel_pf(lcfiles, pfdir,
+                                     lcformat='fake-instr',
+                                     pfmethods=['gls','pdm'],
+                                     pfkwargs=[{'startp':1.0,'endp':2.0},
+                                               {'startp':1.0,'endp':2.0}],
+                                     nperiodworkers=1,
+                                     ncontrolworkers=2,
+                                     excludeprocessed=False)
+    finally:
+        lcproc_instrument.disable_instrumentation()
+
+    assert all(os.path.exists(x) for x in results)
+
+    report = lcproc_instrument.make_run_report(reportdir)
+
+    runpf = report['drivers']['runpf']
+    assert runpf['nobjects'] == len(lcfiles)
+    assert runpf['nfailed'] == 0
+    assert runpf['counters']['ndet'] == 500*len(lcfiles)
+    assert runpf['bytesread'] == sum(os.path.getsize(x) for x in lcfiles)
+    assert runpf['byteswritten'] == sum(os.path.getsize(x) for x in results)
+    assert runpf['procpeakrss_mb'] > 0.0
+    assert 0.0 <= runpf['peakrssgrowth_mb'] <= runpf['procpeakrss_mb']
+
+    for stagename in ('read','normalize','pf-gls','pf-pdm','write'):
+        assert runpf['stages'][stagename]['calls'] == len(lcfiles)
+
+    # the stages account for most of the time for each object
+    stagewall = sum(x['wall'] for x in runpf['stages'].values())
+    assert stagewall <= runpf['wall']['total']
+    assert stagewall > 0.5*runpf['wall']['total']
+
+    # the driver itself has a single record covering all the objects
+    driver = report['drivers']['parallel_pf']
+    assert driver['nobjects'] == 1
+    assert driver['wall']['total'] >= runpf['wall']['max']
+
+    # every object was profiled
+    assert len(runpf['profiles']) == len(lcfiles)
+    assert all(os.path.exists(x) for x in runpf['profiles'])
+
+    with open(report['outcsv'],'r') as infd:
+        rows = list(csv.DictReader(infd))
+    assert len(rows) == len(lcfiles) + 1
+    assert 'stage_pf-gls_wall' in rows[0]
+
+
+
+def test_instrumentation_off(tmpdir):
+    '''
+    Tests that nothing is recorded when instrumentation is off.
+
+    '''
+
+    lcfiles = make_fake_lcs(str(tmpdir), nlcs=1)
+    reportdir = os.path.join(str(tmpdir), 'report')
+
+    lcproc_instrument.enable_instrumentation(reportdir)
+    lcproc_instrument.disable_instrumentation()
+
+    assert lcproc_instrument.stage('read') is lcproc_instrument._NULLCONTEXT
+
+    pf = lcproc.runpf(lcfiles[0], str(tmpdir),
+                      lcformat='fake-instr',
+                      pfmethods=['gls'],
+                      pfkwargs=[{'startp':1.0,'endp':2.0}],
+                      nworkers=1)
+    assert os.path.exists(pf)
+
+    assert glob.glob(os.path.join(reportdir, 'records-*.jsonl')) == []
+    assert lcproc_instrument.make_run_report(reportdir) is None
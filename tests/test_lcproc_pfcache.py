@@ -0,0 +1,187 @@
+'''test_lcproc_pfcache.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the period-finder result cache in astrobase.lcproc_pfcache and its
+use by lcproc.runpf.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import pickle
+
+import numpy as np
+
+from astrobase import lcproc, lcproc_instrument, lcproc_pfcache
+
+
+def read_fakelc(lcfile):
+    '''
+    This reads the fake LC pickles.
+
+    '''
+
+    with open(lcfile,'rb') as infd:
+        return pickle.load(infd)
+
+
+
+def make_fake_lc(lcdir, seed=42):
+    '''
+    This writes a fake sinusoidal LC as a pickle.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+
+    times = np.sort(rng.uniform(0.0, 10.0, size=500))
+    mags = (10.0 + 0.1*np.sin(2.0*np.pi*times/1.2345) +
+            rng.normal(0.0, 0.01, size=times.size))
+
+    lcdict = {'objectid':'fake-pfcache',
+              'objectinfo':{'ra':10.0, 'decl':-20.0},
+              'time':times,
+              'mag':mags,
+              'err':np.full_like(times, 0.01)}
+
+    lcf = os.path.join(lcdir, 'fake-pfcache.pkl')
+    with open(lcf,'wb') as outfd:
+        pickle.dump(lcdict, outfd)
+
+    lcproc.register_custom_lcformat('fake-pfcache', '*-pfcache.pkl',
+                                    read_fakelc,
+                                    ['time'], ['mag'], ['err'])
+
+    return lcf
+
+
+
+def run_cached_pf(lcfile, outdir, cachedir, reportdir, pdmendp=2.0):
+    '''
+    This runs GLS and PDM on the LC with the cache and returns the results and
+    the cache hits and misses.
+
+    '''
+
+    lcproc_instrument.enable_instrumentation(reportdir)
+
+    try:
+        pf = lcproc.runpf(lcfile, outdir,
+                          lcformat='fake-pfcache',
+                          pfmethods=['gls','pdm'],
+                          pfkwargs=[{'startp':1.0,'endp':2.0},
+                                    {'startp':1.0,'endp':pdmendp}],
+                          nworkers=1,
+                          pfcachedir=cachedir)
+    finally:
+        lcproc_instrument.disable_instrumentation()
+
+    report = lcproc_instrument.make_run_report(reportdir)
+    counters = report['drivers']['runpf']['counters']
+
+    # clear out the records for the next run
+    for recf in os.listdir(reportdir):
+        os.remove(os.path.join(reportdir, recf))
+
+    with open(pf,'rb') as infd:
+        pfresults = pickle.load(infd)
+
+    return (pfresults,
+            counters.get('pfcache-hit', 0),
+            counters.get('pfcache-miss', 0))
+
+
+
+def test_runpf_cache(tmpdir):
+    '''
+    Tests that runpf reuses cached results and reruns changed period-finders.
+
+    '''
+
+    lcfile = make_fake_lc(str(tmpdir))
+    outdir = os.path.join(str(tmpdir), 'pf')
+    os.makedirs(outdir)
+    cachedir = os.path.join(str(tmpdir), 'cache')
+    reportdir = os.path.join(str(tmpdir), 'report')
+
+    first, nhit, nmiss = run_cached_pf(lcfile, outdir, cachedir, reportdir)
+    assert (nhit, nmiss) == (0, 2)
+    assert lcproc_pfcache.inspect_pfcache(cachedir)['nentries'] == 2
+
+    # a rerun gets everything from the cache
+    second, nhit, nmiss = run_cached_pf(lcfile, outdir, cachedir, reportdir)
+    assert (nhit, nmiss) == (2, 0)
+
+    for pfmkey in ('0-gls','1-pdm'):
+        assert np.array_equal(first['mag'][pfmkey]['lspvals'],
+                              second['mag'][pfmkey]['lspvals'])
+        assert (first['mag'][pfmkey]['bestperiod'] ==
+                second['mag'][pfmkey]['bestperiod'])
+
+    # changing the PDM kwargs only reruns PDM
+    third, nhit, nmiss = run_cached_pf(lcfile, outdir, cachedir, reportdir,
+                                       pdmendp=3.0)
+    assert (nhit, nmiss) == (1, 1)
+    assert third['mag']['1-pdm']['periods'].max() > 2.0
+
+    cacheinfo = lcproc_pfcache.inspect_pfcache(cachedir)
+    assert cacheinfo['nentries'] == 3
+    assert cacheinfo['nobjects'] == 1
+    assert cacheinfo['nsuperseded'] == 1
+    assert cacheinfo['methods']['pdm']['nentries'] == 2
+
+    # dry runs don't remove anything
+    pruned = lcproc_pfcache.prune_pfcache(cachedir, keeplatest=1, dryrun=True)
+    assert pruned['nremoved'] == 1
+    assert lcproc_pfcache.inspect_pfcache(cachedir)['nentries'] == 3
+
+    pruned = lcproc_pfcache.prune_pfcache(cachedir, keeplatest=1)
+    assert pruned['nremoved'] == 1
+    cacheinfo = lcproc_pfcache.inspect_pfcache(cachedir)
+    assert cacheinfo['nentries'] == 2
+    assert cacheinfo['nsuperseded'] == 0
+
+    # the latest PDM result is the one left in the cache
+    fourth, nhit, nmiss = run_cached_pf(lcfile, outdir, cachedir, reportdir,
+                                        pdmendp=3.0)
+    assert (nhit, nmiss) == (2, 0)
+
+    # pruning everything removes the empty directories too
+    pruned = lcproc_pfcache.prune_pfcache(cachedir, maxsize_gb=0.0)
+    assert pruned['nremoved'] == 2
+    assert os.listdir(cachedir) == []
+
+
+
+def test_pfcache_key():
+    '''
+    Tests that the cache key changes when the LC or the kwargs change.
+
+    '''
+
+    rng = np.random.RandomState(42)
+    times = np.sort(rng.uniform(0.0, 10.0, size=100))
+    mags = rng.normal(10.0, 0.01, size=100)
+    errs = np.full_like(times, 0.01)
+
+    key = lcproc_pfcache.get_pfcache_key(times, mags, errs, 'gls',
+                                         {'startp':1.0, 'nworkers':4})
+
+    # the number of workers doesn't change the result
+    assert key == lcproc_pfcache.get_pfcache_key(
+        times, mags, errs, 'gls', {'nworkers':1, 'startp':1.0}
+    )
+
+    changedmags = mags.copy()
+    changedmags[10] += 0.001
+
+    assert key != lcproc_pfcache.get_pfcache_key(
+        times, changedmags, errs, 'gls', {'startp':1.0}
+    )
+    assert key != lcproc_pfcache.get_pfcache_key(
+        times, mags, errs, 'gls', {'startp':1.1}
+    )
+    assert key != lcproc_pfcache.get_pfcache_key(
+        times, mags, errs, 'pdm', {'startp':1.0}
+    )
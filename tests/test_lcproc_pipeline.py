@@ -0,0 +1,341 @@
+'''test_lcproc_pipeline.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the resumable pipeline runner in astrobase.lcproc_pipeline, using a
+few fake LCs in a custom lcformat.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import pickle
+
+import numpy as np
+
+from astrobase import lcproc, lcproc_pipeline
+
+
+def read_fakelc(lcfile):
+    '''
+    This reads the fake LC pickles.
+
+    '''
+
+    with open(lcfile,'rb') as infd:
+        return pickle.load(infd)
+
+
+
+def make_fake_lcs(lcdir, nlcs=3):
+    '''
+    This writes some fake sinusoidal LCs as pickles.
+
+    '''
+
+    lcfiles = []
+    rng = np.random.RandomState(42)
+
+    for ind in range(nlcs):
+
+        times = np.sort(rng.uniform(0.0, 10.0, size=300 + 100*ind))
+        mags = (10.0 + 0.1*np.sin(2.0*np.pi*times/1.2345) +
+                rng.normal(0.0, 0.01, size=times.size))
+
+        lcdict = {'objectid':'fake-%s' % ind,
+                  'objectinfo':{'ra':10.0, 'decl':-20.0},
+                  'time':times,
+                  'mag':mags,
+                  'err':np.full_like(times, 0.01)}
+
+        # these are the external parameters used by EPD
+        for col in ('fsv','fdv','fkv','xcc','ycc','bgv','bge','iha','izd'):
+            lcdict[col] = rng.normal(0.0, 1.0, size=times.size)
+
+        lcf = os.path.join(lcdir, 'fake-%s-pipe.pkl' % ind)
+        with open(lcf,'wb') as outfd:
+            pickle.dump(lcdict, outfd)
+        lcfiles.append(lcf)
+
+    lcproc.register_custom_lcformat('fake-pipe', '*-pipe.pkl',
+                                    read_fakelc,
+                                    ['time'], ['mag'], ['err'])
+
+    return lcfiles
+
+
+
+def flaky_stage(lcfile, upstream, outdir=None, failfor=(), lcformat=None):
+    '''
+    This fails for the objects in failfor, and writes a marker file otherwise.
+
+    '''
+
+    if os.path.basename(lcfile) in failfor:
+        raise ValueError('failing on purpose for %s' % lcfile)
+
+    outfile = os.path.join(outdir,
+                           os.path.basename(lcfile).replace('.pkl','.txt'))
+    with open(outfile,'w') as outfd:
+        outfd.write('%s\n' % upstream['periodfind'])
+
+    return outfile
+
+
+
+def count_stage(lcfile, upstream, lcformat=None):
+    '''
+    This returns the stages done before it for this object.
+
+    '''
+
+    return sorted(upstream.keys())
+
+
+
+lcproc_pipeline.register_pipeline_stage('flaky', flaky_stage,
+                                        needs=('periodfind',), outdir=True)
+lcproc_pipeline.register_pipeline_stage('count', count_stage)
+
+
+PIPE_KWARGS = {'varfeatures':{'mindet':100},
+               'periodfind':{'pfmethods':['gls'],
+                             'pfkwargs':[{'startp':1.0,'endp':2.0}]}}
+
+
+
+def test_pipeline_resume(tmpdir):
+    '''
+    Tests that a pipeline run can be stopped and resumed.
+
+    '''
+
+    lcfiles = make_fake_lcs(str(tmpdir))
+    outdir = os.path.join(str(tmpdir), 'out')
+    manifestf = os.path.join(str(tmpdir), 'run.sqlite')
+
+    manifest = lcproc_pipeline.create_pipeline(
+        manifestf, lcfiles, outdir,
+        stages=['varfeatures','periodfind','count'],
+        lcformat='fake-pipe',
+        stagekwargs=PIPE_KWARGS
+    )
+    assert manifest.config['dependencies'] == {
+        'varfeatures':[], 'periodfind':['varfeatures'], 'count':['periodfind']
+    }
+
+    # stop after a few tasks
+    status = lcproc_pipeline.run_pipeline(manifestf, nworkers=2, maxtasks=4)
+    assert status['nobjects'] == 3
+    assert sum(status['stages']['varfeatures'].values()) == 3
+    assert sum(x.get('done', 0) for x in status['stages'].values()) == 4
+
+    # the largest LCs go first, and move on to periodfind as soon as they can
+    assert status['stages']['periodfind'].get('done', 0) >= 1
+    done = [x['lcfile'] for x in manifest.get_results(stage='varfeatures')]
+    assert os.path.abspath(lcfiles[1]) in done
+    assert os.path.abspath(lcfiles[2]) in done
+
+    # pretend a runner died while running a task
+    claimed = manifest.claim_tasks(1, 'dead-runner')
+    assert len(claimed) == 1
+
+    status = lcproc_pipeline.run_pipeline(manifestf, nworkers=2)
+    assert status['ncomplete'] == 3
+
+    results = manifest.get_results()
+    assert len(results) == 9
+
+    for result in results:
+        if (result['objectind'] == claimed[0]['objectind'] and
+            result['stage'] == claimed[0]['stage']):
+            assert result['attempts'] == 2
+        else:
+            assert result['attempts'] == 1
+
+    for result in manifest.get_results(stage='periodfind'):
+        assert os.path.exists(result['outputs'])
+        assert result['inputs']['upstream']['varfeatures'] == (
+            os.path.join(outdir, 'varfeatures',
+                         os.path.basename(result['outputs']).replace(
+                             'periodfinding','varfeatures'
+                         ))
+        )
+
+    for result in manifest.get_results(stage='count'):
+        assert result['outputs'] == ['periodfind', 'varfeatures']
+
+    # missing outputs are made again along with the stages depending on them
+    vfresult, pfresult = [x for x in manifest.get_results()
+                          if x['objectind'] == 1][:2]
+    os.remove(vfresult['outputs'])
+    os.utime(pfresult['outputs'], (0.0, 0.0))
+
+    status = lcproc_pipeline.run_pipeline(manifestf, nworkers=2)
+    assert status['ncomplete'] == 3
+    assert os.path.exists(vfresult['outputs'])
+    assert os.path.getmtime(pfresult['outputs']) > 0.0
+
+    # adding the same LCs again doesn't do anything
+    manifest = lcproc_pipeline.create_pipeline(manifestf, lcfiles, outdir)
+    assert manifest.get_status()['nobjects'] == 3
+
+
+
+def test_pipeline_detrending(tmpdir):
+    '''
+    Tests that the stages after epd work on the EPD LCs.
+
+    '''
+
+    lcfiles = make_fake_lcs(str(tmpdir))
+    outdir = os.path.join(str(tmpdir), 'out')
+    manifestf = os.path.join(str(tmpdir), 'run.sqlite')
+
+    manifest = lcproc_pipeline.create_pipeline(
+        manifestf, lcfiles, outdir,
+        stages=['epd','varfeatures','periodfind','count'],
+        lcformat='fake-pipe',
+        stagekwargs=PIPE_KWARGS
+    )
+    assert manifest.config['dependencies'] == {
+        'epd':[], 'varfeatures':['epd'],
+        'periodfind':['varfeatures'], 'count':['periodfind']
+    }
+
+    status = lcproc_pipeline.run_pipeline(manifestf, nworkers=2)
+    assert status['ncomplete'] == 3
+
+    epdmagcol = 'epd.mag.mags'
+
+    for result in manifest.get_results(stage='epd'):
+
+        epd = result['outputs']
+        assert epd['lcformat'] == 'pipeline-epd-fake-pipe'
+        assert epd['magcols'] == [epdmagcol]
+
+        # the per-magcol EPD LCs are collected into one pickle
+        lcdict = lcproc.read_pklc(epd['lcfile'])
+        assert os.path.dirname(epd['lcfile']) == str(tmpdir)
+        assert lcdict['epd']['mag']['mags'].size == lcdict['time'].size
+        assert not os.path.exists(
+            os.path.join(str(tmpdir),
+                         '%s-epd-mag-pklc.pkl' % lcdict['objectid'])
+        )
+
+    for result in manifest.get_results(stage='varfeatures'):
+        varfeatures = lcproc.read_pklc(result['outputs'])
+        assert varfeatures[epdmagcol]['ndet'] > 0
+        assert 'mag' not in varfeatures
+
+    for result in manifest.get_results(stage='periodfind'):
+        pfresult = lcproc.read_pklc(result['outputs'])
+        assert pfresult['lcfbasename'].endswith('-pipeline-epd-pklc.pkl')
+        assert pfresult[epdmagcol]['pfmethods'] == ['0-gls']
+        assert abs(pfresult[epdmagcol]['0-gls']['bestperiod'] - 1.2345) < 0.05
+
+    for result in manifest.get_results(stage='count'):
+        assert result['outputs'] == ['epd', 'periodfind', 'varfeatures']
+
+    # stages that don't depend on epd work on the original LCs
+    manifest = lcproc_pipeline.create_pipeline(
+        os.path.join(str(tmpdir), 'run2.sqlite'), lcfiles,
+        os.path.join(str(tmpdir), 'out2'),
+        stages=['epd','varfeatures'],
+        lcformat='fake-pipe',
+        stagekwargs=PIPE_KWARGS,
+        dependencies={'varfeatures':[]}
+    )
+    status = lcproc_pipeline.run_pipeline(manifest, nworkers=2)
+    assert status['ncomplete'] == 3
+
+    for result in manifest.get_results(stage='varfeatures'):
+        assert result['inputs']['upstream'] == {}
+        assert 'mag' in lcproc.read_pklc(result['outputs'])
+
+    # with epd and tfa, TFA is applied to the EPD mags and the later stages
+    # use the TFA mags
+    manifest = lcproc_pipeline.create_pipeline(
+        os.path.join(str(tmpdir), 'run3.sqlite'), lcfiles,
+        os.path.join(str(tmpdir), 'out3'),
+        stages=['epd','tfa','varfeatures','periodfind','checkplot'],
+        lcformat='fake-pipe'
+    )
+    assert manifest.config['dependencies'] == {
+        'epd':[], 'tfa':['epd'], 'varfeatures':['tfa'],
+        'periodfind':['varfeatures'], 'checkplot':['periodfind']
+    }
+
+    # the TFA LC is used over the EPD LC, and magcols picks from it
+    def detrended(stage):
+        return {'lcfile':'/lcs/fake-0-pipeline-%s-pklc.pkl' % stage,
+                'lcformat':'pipeline-%s-fake-pipe' % stage,
+                'baselcformat':'fake-pipe',
+                'basemagcols':['mag','sap.flux'],
+                'timecols':['%s.mag.times' % stage, '%s.sap-flux.times' % stage],
+                'magcols':['%s.mag.mags' % stage, '%s.sap-flux.mags' % stage],
+                'errcols':['%s.mag.errs' % stage, '%s.sap-flux.errs' % stage]}
+
+    lcinput = lcproc_pipeline._stage_lcinput(
+        lcfiles[0], {'epd':detrended('epd'), 'tfa':detrended('tfa')},
+        'fake-pipe', None, ['sap.flux'], None
+    )
+    assert lcinput == ('/lcs/fake-0-pipeline-tfa-pklc.pkl',
+                       'pipeline-tfa-fake-pipe',
+                       ['tfa.sap-flux.times'],
+                       ['tfa.sap-flux.mags'],
+                       ['tfa.sap-flux.errs'])
+    assert 'pipeline-tfa-fake-pipe' in lcproc.LCFORM
+
+    assert lcproc_pipeline._stage_lcinput(
+        lcfiles[0], {'periodfind':'/out/pf.pkl'},
+        'fake-pipe', None, None, None
+    ) == (lcfiles[0], 'fake-pipe', None, None, None)
+def test_pipeline_failures(tmpdir):
+    '''
+    Tests retries, skipped stages, and retrying failed stages.
+
+    '''
+
+    lcfiles = make_fake_lcs(str(tmpdir))
+    outdir = os.path.join(str(tmpdir), 'out')
+    manifestf = os.path.join(str(tmpdir), 'run.sqlite')
+
+    # flaky needs periodfind to be in the pipeline
+    assert lcproc_pipeline.create_pipeline(
+        manifestf, lcfiles, outdir, stages=['varfeatures','flaky'],
+        lcformat='fake-pipe',
+    ) is None
+
+    kwargs = dict(PIPE_KWARGS)
+    kwargs['flaky'] = {'failfor':[os.path.basename(lcfiles[1])]}
+
+    lcproc_pipeline.create_pipeline(
+        manifestf, lcfiles, outdir,
+        stages=['periodfind','flaky','count'],
+        lcformat='fake-pipe',
+        stagekwargs=kwargs,
+        maxattempts=2
+    )
+
+    status = lcproc_pipeline.run_pipeline(manifestf, nworkers=2)
+    assert status['ncomplete'] == 2
+    assert status['stages']['flaky'] == {'done':2, 'failed':1}
+    assert status['stages']['count'] == {'done':2, 'skipped':1}
+
+    manifest = lcproc_pipeline.PipelineManifest(manifestf)
+    failed = manifest.get_results(status='failed')
+    assert len(failed) == 1
+    assert failed[0]['attempts'] == 2
+    assert 'failing on purpose' in failed[0]['error']
+
+    # fix the stage and retry
+    config = manifest.config
+    config['stagekwargs']['flaky']['failfor'] = []
+    manifest.set_config(config)
+
+    assert manifest.retry_failed() == 1
+
+    status = lcproc_pipeline.run_pipeline(manifest, nworkers=2)
+    assert status['ncomplete'] == 3
+    assert status['stages']['count'] == {'done':3}
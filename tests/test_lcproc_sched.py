@@ -0,0 +1,219 @@
+'''test_lcproc_sched.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the task scheduler for the lcproc parallel drivers in
+astrobase.lcproc_sched.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+import time
+import pickle
+
+import numpy as np
+
+from astrobase import lcproc, lcproc_sched
+
+
+def timed_worker(task):
+    '''
+    This returns the task's index and when it started.
+
+    '''
+
+    index, sleeptime = task
+    start = time.time()
+    time.sleep(sleeptime)
+    return index, start
+
+
+
+def nested_worker(task):
+    '''
+    This returns the task as the worker got it.
+
+    '''
+
+    return task
+
+
+
+def read_fakelc(lcfile):
+    '''
+    This reads the fake LC pickles.
+
+    '''
+
+    with open(lcfile,'rb') as infd:
+        return pickle.load(infd)
+
+
+
+def make_fake_lcs(lcdir, ndets=(100, 3000, 300, 1000)):
+    '''
+    This writes some fake sinusoidal LCs as pickles and returns an lclist dict
+    for them like the one made by lcproc.make_lclist.
+
+    '''
+
+    lcfiles = []
+    rng = np.random.RandomState(42)
+
+    for ind, ndet in enumerate(ndets):
+
+        times = np.sort(rng.uniform(0.0, 10.0, size=ndet))
+        mags = (10.0 + 0.1*np.sin(2.0*np.pi*times/1.2345) +
+                rng.normal(0.0, 0.01, size=times.size))
+
+        lcdict = {'objectid':'fake-%s' % ind,
+                  'objectinfo':{'ra':10.0, 'decl':-20.0},
+                  'time':times,
+                  'mag':mags,
+                  'err':np.full_like(times, 0.01)}
+
+        lcf = os.path.join(lcdir, 'fake-%s-sched.pkl' % ind)
+        with open(lcf,'wb') as outfd:
+            pickle.dump(lcdict, outfd)
+        lcfiles.append(lcf)
+
+    lcproc.register_custom_lcformat('fake-sched', '*-sched.pkl',
+                                    read_fakelc,
+                                    ['time'], ['mag'], ['err'])
+
+    lclistdict = {'lcformat':'fake-sched',
+                  'objects':{'lcfname':np.array(lcfiles),
+                             'objectid':np.array(['fake-%s' % x for x in
+                                                  range(len(ndets))]),
+                             'mag.ndet':np.array(ndets)}}
+
+    return lcfiles, lclistdict
+
+
+
+def test_costs(tmpdir):
+    '''
+    Tests getting task costs from lclist dicts, pickles, and file lists.
+
+    '''
+
+    lcfiles, lclistdict = make_fake_lcs(str(tmpdir))
+
+    files, costs = lcproc_sched.get_lclist_costs(lclistdict)
+    assert files == lcfiles
+    assert np.array_equal(costs, [100, 3000, 300, 1000])
+
+    lclistpkl = os.path.join(str(tmpdir), 'lclist.pkl')
+    with open(lclistpkl,'wb') as outfd:
+        pickle.dump(lclistdict, outfd)
+
+    files, costs = lcproc_sched.get_lclist_costs(lclistpkl)
+    assert files == lcfiles
+    assert np.array_equal(costs, [100, 3000, 300, 1000])
+
+    # file sizes are used for plain lists and for missing files
+    files, costs = lcproc_sched.get_lclist_costs(
+        lcfiles + ['/nonexistent-sched.pkl']
+    )
+    assert files[:4] == lcfiles
+    assert list(np.argsort(costs[:4])) == [0, 2, 3, 1]
+    assert costs[4] == 0.0
+
+    assert list(lcproc_sched.order_by_cost([1, 5, 5, 3])) == [1, 2, 3, 0]
+
+    # one task is more than a quarter of the total
+    assert list(lcproc_sched.split_by_cost([1, 10, 2, 3], 4)) == [
+        False, True, False, False
+    ]
+    assert not np.any(lcproc_sched.split_by_cost([1, 10, 2, 3], 1))
+
+
+
+def test_run_tasks_order():
+    '''
+    Tests that tasks run largest first and results come back in input order.
+
+    '''
+
+    tasks = [(x, 0.01) for x in range(6)]
+    costs = [1.0, 6.0, 2.0, 5.0, 3.0, 4.0]
+
+    for maxworkertasks in (None, 10):
+
+        results = lcproc_sched.run_tasks(timed_worker, tasks, costs, 1,
+                                         maxworkertasks=maxworkertasks)
+
+        assert [x[0] for x in results] == list(range(6))
+
+        startorder = [x[0] for x in sorted(results, key=lambda y: y[1])]
+        assert startorder == [1, 3, 5, 4, 2, 0]
+
+    # the static scheduler keeps the input order
+    lcproc_sched.set_scheduler('static')
+
+    try:
+        results = lcproc_sched.run_tasks(timed_worker, tasks, costs, 1)
+    finally:
+        lcproc_sched.set_scheduler('dynamic')
+
+    startorder = [x[0] for x in sorted(results, key=lambda y: y[1])]
+    assert startorder == list(range(6))
+
+
+
+def test_run_nested_tasks():
+    '''
+    Tests that expensive tasks get all of the cores.
+
+    '''
+
+    tasks = [(x, None) for x in range(5)]
+    costs = [10.0, 100.0, 20.0, 10.0, 10.0]
+
+    results = lcproc_sched.run_nested_tasks(
+        nested_worker, tasks, costs, 2, 2,
+        lambda task, nworkers: (task[0], nworkers)
+    )
+
+    assert results == [(0, 1), (1, 4), (2, 1), (3, 1), (4, 1)]
+
+
+
+def test_parallel_pf_lclist(tmpdir):
+    '''
+    Tests parallel_pf with an lclist dict and mixed LC sizes.
+
+    '''
+
+    lcfiles, lclistdict = make_fake_lcs(str(tmpdir))
+    pfdir = os.path.join(str(tmpdir), 'pf')
+
+    results = lcproc.parallel_pf(lclistdict, pfdir,
+                                 lcformat='fake-sched',
+                                 pfmethods=['gls'],
+                                 pfkwargs=[{'startp':1.0,'endp':2.0}],
+                                 nperiodworkers=2,
+                                 ncontrolworkers=2,
+                                 excludeprocessed=False)
+
+    assert results == [os.path.join(pfdir, 'periodfinding-fake-%s.pkl' % x)
+                       for x in range(len(lcfiles))]
+
+    for pff in results:
+        with open(pff,'rb') as infd:
+            pfresult = pickle.load(infd)
+        assert abs(pfresult['mag']['0-gls']['bestperiod'] - 1.2345) < 0.05
+
+    # the list slicing still works the same way
+    results = lcproc.parallel_pf(lcfiles, pfdir,
+                                 lcformat='fake-sched',
+                                 pfmethods=['gls'],
+                                 pfkwargs=[{'startp':1.0,'endp':2.0}],
+                                 nperiodworkers=1,
+                                 ncontrolworkers=2,
+                                 liststartindex=1,
+                                 listmaxobjects=2,
+                                 excludeprocessed=False)
+    assert results == [os.path.join(pfdir, 'periodfinding-fake-%s.pkl' % x)
+                       for x in (1, 2)]
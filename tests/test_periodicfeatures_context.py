@@ -0,0 +1,155 @@
+'''test_periodicfeatures_context.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests that the periodic features calculated with a shared
+PeriodicFeatureContext are the same as those calculated without one, and that
+the context reuses phased light curves and fits.
+
+'''
+from __future__ import print_function
+
+import numpy as np
+
+from astrobase.varclass import periodicfeatures
+
+
+def make_lightcurve(npts=400, period=1.2345, seed=42):
+    '''
+    This makes a sinusoidal light curve with a few bad points.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+
+    times = np.sort(rng.uniform(0.0, 20.0, size=npts))
+    mags = (12.0 + 0.05*np.sin(2.0*np.pi*times/period) +
+            rng.normal(0.0, 0.005, size=npts))
+    errs = np.full_like(mags, 0.005)
+
+    mags[10] = np.nan
+    errs[20] = 0.0
+
+    return times, mags, errs
+
+
+
+def check_same(result, expected):
+    '''
+    This compares two feature dicts.
+
+    '''
+
+    assert set(result.keys()) == set(expected.keys())
+
+    for key in expected:
+
+        if isinstance(expected[key], dict):
+            check_same(result[key], expected[key])
+        elif expected[key] is None:
+            assert result[key] is None
+        else:
+            assert np.allclose(np.asarray(result[key], dtype=np.float64),
+                               np.asarray(expected[key], dtype=np.float64),
+                               equal_nan=True), key
+
+
+
+def test_context_features():
+    '''
+    Tests that a shared context gives the same features and reuses things.
+
+    '''
+
+    times, mags, errs = make_lightcurve()
+
+    # two period-finders found the same period, one found twice that
+    periods = [1.2345, 1.2345, 2.469]
+
+    context = periodicfeatures.PeriodicFeatureContext(times, mags, errs)
+    assert context.times.size == times.size - 2
+
+    for period in periods:
+
+        expected = periodicfeatures.lcfit_features(times, mags, errs, period,
+                                                   fourierorder=3,
+                                                   verbose=False)
+        result = periodicfeatures.lcfit_features(None, None, None, period,
+                                                 fourierorder=3,
+                                                 verbose=False,
+                                                 context=context)
+        check_same(result, expected)
+
+        expected = periodicfeatures.phasedlc_features(times, mags, errs,
+                                                      period)
+        result = periodicfeatures.phasedlc_features(None, None, None, period,
+                                                    context=context)
+        check_same(result, expected)
+
+    # the light curve was sigma-clipped once. each of the two distinct periods
+    # was fit once with a Fourier series and a transit model, and twice with
+    # the EB model: at the period, then at 2 x period starting from the epoch
+    # found by the first EB fit.
+    assert context.ncomputed['sigclip'] == 1
+    assert context.ncomputed['lcfit_features'] == 2
+    assert context.ncomputed['phasedlc_features'] == 2
+    assert context.ncomputed['fit'] == 2 + 2 + 4
+
+    # the light curve was phased at 1.2345 d, 2.469 d, and 4.938 d only
+    assert context.ncomputed['phased'] == 3
+    assert context.ncomputed['ptp'] == 4
+
+    # the features returned are copies, so they can be updated safely
+    result = periodicfeatures.lcfit_features(None, None, None, periods[0],
+                                             fourierorder=3,
+                                             verbose=False,
+                                             context=context)
+    result.update({'extra':True})
+    assert 'extra' not in periodicfeatures.lcfit_features(
+        None, None, None, periods[0],
+        fourierorder=3,
+        verbose=False,
+        context=context
+    )
+
+
+
+def test_context_neighbor_keys():
+    '''
+    Tests that neighbor LCs are matched to cached results by their contents.
+
+    '''
+
+    times, mags, errs = make_lightcurve()
+    context = periodicfeatures.PeriodicFeatureContext(times, mags, errs)
+
+    nbrtimes, nbrmags, nbrerrs = make_lightcurve(seed=1)
+    first = periodicfeatures.phasedlc_features(None, None, None, 1.2345,
+                                               nbrtimes=nbrtimes,
+                                               nbrmags=nbrmags,
+                                               nbrerrs=nbrerrs,
+                                               context=context)
+
+    # copies of the same neighbor LC reuse the result
+    second = periodicfeatures.phasedlc_features(None, None, None, 1.2345,
+                                                nbrtimes=nbrtimes.copy(),
+                                                nbrmags=nbrmags.copy(),
+                                                nbrerrs=nbrerrs.copy(),
+                                                context=context)
+    check_same(second, first)
+    assert context.ncomputed['phasedlc_features'] == 1
+
+    # a different neighbor LC doesn't, even if it's put where the first one was
+    del nbrtimes, nbrmags, nbrerrs
+    nbrtimes, nbrmags, nbrerrs = make_lightcurve(period=0.5, seed=2)
+
+    expected = periodicfeatures.phasedlc_features(times, mags, errs, 1.2345,
+                                                  nbrtimes=nbrtimes,
+                                                  nbrmags=nbrmags,
+                                                  nbrerrs=nbrerrs)
+    result = periodicfeatures.phasedlc_features(None, None, None, 1.2345,
+                                                nbrtimes=nbrtimes,
+                                                nbrmags=nbrmags,
+                                                nbrerrs=nbrerrs,
+                                                context=context)
+    check_same(result, expected)
+    assert context.ncomputed['phasedlc_features'] == 2
@@ -0,0 +1,123 @@
+'''test_rfclass_stream.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the streaming classifier in astrobase.varclass.rfclass against
+classifying all collected features at once.
+
+'''
+from __future__ import print_function
+
+import os.path
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+
+from sklearn.ensemble import RandomForestClassifier
+from astrobase.varclass import rfclass
+
+
+FEATURES = ['stetsonj', 'mad', 'skew', 'eta_normal']
+
+
+def make_varfeatures(featuresdir, nobjects=120, seed=42):
+    '''
+    This writes fake varfeatures pickles, with half of the objects variable.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    labels = {}
+
+    for ind in range(nobjects):
+
+        objectid = 'obj-%04i' % ind
+        isvariable = ind % 2 == 0
+
+        feats = {x:rng.normal(2.0 if isvariable else 0.0, 1.0)
+                 for x in FEATURES}
+        labels[objectid] = isvariable
+
+        with open(os.path.join(featuresdir,
+                               'varfeatures-%s.pkl' % objectid),'wb') as outfd:
+            pickle.dump({'objectid':objectid, 'mag':feats}, outfd)
+
+    return labels
+
+
+
+def test_stream_rf_classifier(tmpdir):
+    '''
+    Tests that streaming gives the same results as apply_rf_classifier.
+
+    '''
+
+    featuresdir = str(tmpdir.mkdir('features'))
+    labels = make_varfeatures(featuresdir)
+
+    collected = rfclass.collect_features(
+        featuresdir, 'mag',
+        os.path.join(str(tmpdir), 'collected.pkl'),
+        featurestouse=FEATURES,
+        labeldict=labels
+    )
+
+    clf = RandomForestClassifier(n_estimators=20, random_state=42)
+    clf.fit(collected['features_array'], collected['labels_array'])
+    clfdict = {'feature_names':collected['availablefeatures'],
+               'magcol':'mag',
+               'collect_kwargs':collected['kwargs'],
+               'best_classifier':clf}
+
+    applied = rfclass.apply_rf_classifier(
+        clfdict, featuresdir, os.path.join(str(tmpdir), 'applied.pkl')
+    )
+    expected = {
+        objectid:(label, prob) for objectid, label, prob in
+        zip(applied['features']['objectids'],
+            applied['predicted_labels'],
+            applied['predicted_label_probs'])
+    }
+
+    # straight from the pickles, with parallel readers
+    streamed = rfclass.stream_rf_classifier(
+        clfdict, featuresdir, os.path.join(str(tmpdir), 'streamed.csv'),
+        chunksize=25, nworkers=2, maxpending=2
+    )
+    assert streamed['nobjects'] == len(labels)
+    assert streamed['nchunks'] == 5
+
+    # from a columnar feature file
+    colfile = rfclass.write_feature_columns(
+        featuresdir, 'mag', os.path.join(str(tmpdir), 'features.npy'),
+        featurestouse=FEATURES, chunksize=25, nworkers=2
+    )
+    columnar = rfclass.stream_rf_classifier(
+        clfdict, colfile, os.path.join(str(tmpdir), 'columnar.csv'),
+        chunksize=50, nworkers=1
+    )
+    assert columnar['nchunks'] == 3
+
+    for result in (streamed, columnar):
+
+        results = rfclass.read_rf_classifier_results(result['outfile'])
+        assert results.size == len(labels)
+
+        for row in results:
+            label, prob = expected[row['objectid']]
+            assert row['predicted_label'] == label
+            assert np.allclose([row['prob_0'], row['prob_1']], prob,
+                               atol=1.0e-6)
+
+    # objectids longer than objectidlen aren't truncated
+    colfile = rfclass.write_feature_columns(
+        featuresdir, 'mag', os.path.join(str(tmpdir), 'features-short.npy'),
+        featurestouse=FEATURES, chunksize=25, nworkers=2, objectidlen=4
+    )
+    columns = np.load(colfile)
+    assert columns['objectid'].tolist() == sorted(labels.keys())
+    assert np.array_equal(columns['stetsonj'],
+                          np.load(os.path.join(str(tmpdir),
+                                               'features.npy'))['stetsonj'])
@@ -0,0 +1,320 @@
+'''test_services_transport.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the shared HTTP transport in astrobase.services.transport and the
+batch functions built on it against a local stand-in server.
+
+'''
+from __future__ import print_function
+
+import io
+import time
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+import numpy as np
+import pytest
+
+from astrobase.services import transport, skyview
+
+
+###########################
+## LOCAL STAND-IN SERVER ##
+###########################
+
+def fake_fits():
+    '''
+    This makes a small FITS image to serve as a SkyView stamp.
+
+    '''
+
+    from astropy.io import fits
+
+    outfd = io.BytesIO()
+    fits.PrimaryHDU(np.zeros((10,10), dtype=np.float32)).writeto(outfd)
+    return outfd.getvalue()
+
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''This serves a few endpoints for the tests:
+
+    /ok         -> 200
+    /flaky      -> 503 for the first two requests, then 200
+    POST /post/<status>[/retryafter] -> <status> for the first request, then
+                                        200 (with a Retry-After header if asked)
+    /slow       -> 200 after 0.1 sec
+    /skyview    -> a fake SkyView query result page
+    /fits/*     -> a fake FITS stamp
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.nconnections += 1
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        with self.server.lock:
+            self.server.nrequests += 1
+            self.server.inflight += 1
+            self.server.maxinflight = max(self.server.maxinflight,
+                                          self.server.inflight)
+
+        try:
+
+            if self.path.startswith('/flaky'):
+                with self.server.lock:
+                    self.server.nflaky += 1
+                    nflaky = self.server.nflaky
+                if nflaky <= 2:
+                    self.send_body(503, b'try again')
+                else:
+                    self.send_body(200, b'ok')
+
+            elif self.path.startswith('/slow'):
+                time.sleep(0.1)
+                self.send_body(200, b'ok')
+
+            elif self.path.startswith('/skyview'):
+                self.send_body(
+                    200,
+                    b'<a href="/tempspace/fits/skv123456789.fits">FITS</a>'
+                )
+
+            elif self.path.startswith('/tempspace/fits'):
+                self.send_body(200, self.server.fits)
+
+            else:
+                self.send_body(200, b'ok')
+
+        finally:
+            with self.server.lock:
+                self.server.inflight -= 1
+
+
+
+    def do_POST(self):
+
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with self.server.lock:
+            self.server.nposts += 1
+            nposts = self.server.nposts
+
+        pathelems = self.path.strip('/').split('/')
+
+        if nposts == 1:
+            self.send_response(int(pathelems[1]))
+            if 'retryafter' in pathelems:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '5')
+            self.end_headers()
+            self.wfile.write(b'error')
+        else:
+            self.send_body(200, b'ok')
+
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+@pytest.fixture
+def standin():
+    '''
+    This starts the stand-in server and returns it along with its base URL.
+
+    '''
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.lock = threading.Lock()
+    server.nconnections = 0
+    server.nrequests = 0
+    server.nflaky = 0
+    server.nposts = 0
+    server.inflight = 0
+    server.maxinflight = 0
+    server.fits = fake_fits()
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server, 'http://127.0.0.1:%s' % server.server_port
+
+    server.shutdown()
+    server.server_close()
+
+
+
+###########
+## TESTS ##
+###########
+
+def test_pooled_connections(standin):
+    '''
+    Tests that requests to the same host reuse connections.
+
+    '''
+
+    server, baseurl = standin
+    client = transport.ServiceTransport(backoff=0.01)
+
+    for _ in range(10):
+        resp = client.get(baseurl + '/ok', timeout=5.0)
+        assert resp.text == 'ok'
+
+    assert server.nrequests == 10
+    assert server.nconnections == 1
+    client.close()
+
+
+
+def test_retry_with_backoff(standin):
+    '''
+    Tests that 5xx responses are retried until they succeed or we give up.
+
+    '''
+
+    server, baseurl = standin
+
+    client = transport.ServiceTransport(backoff=0.01)
+    resp = client.get(baseurl + '/flaky', timeout=5.0)
+    assert resp.status_code == 200
+    assert client.stats['retries'] == 2
+
+    # with fewer retries, we get the last bad response back
+    server.nflaky = 0
+    client = transport.ServiceTransport(backoff=0.01, maxretries=1)
+    resp = client.get(baseurl + '/flaky', timeout=5.0)
+    assert resp.status_code == 503
+
+
+
+def test_post_retries(standin):
+    '''
+    Tests that POSTs are only retried if the server didn't act on them.
+
+    '''
+
+    server, baseurl = standin
+    client = transport.ServiceTransport(backoff=0.01)
+
+    # the gateway errors may have gone through, so they're not retried
+    for status in (500, 502, 503, 504):
+        server.nposts = 0
+        resp = client.post(baseurl + '/post/%s' % status,
+                           data={'query':'x'}, timeout=5.0)
+        assert resp.status_code == status
+        assert server.nposts == 1
+
+    # these mean the request wasn't acted on
+    for path in ('/post/429', '/post/503/retryafter'):
+        server.nposts = 0
+        resp = client.post(baseurl + path, data={'query':'x'}, timeout=5.0)
+        assert resp.status_code == 200
+        assert server.nposts == 2
+
+    # a POST can be marked as safe to retry
+    server.nposts = 0
+    resp = client.post(baseurl + '/post/502', data={'query':'x'},
+                       idempotent=True, timeout=5.0)
+    assert resp.status_code == 200
+    assert server.nposts == 2
+
+    # connections that were never made are always retried
+    client = transport.ServiceTransport(backoff=0.01, maxretries=2)
+    with pytest.raises(transport.requests.exceptions.ConnectionError):
+        client.post('http://127.0.0.1:1/post', data={'query':'x'},
+                    timeout=5.0)
+    assert client.stats['retries'] == 2
+
+    client.close()
+
+
+
+def test_rate_limit_and_concurrency(standin):
+    '''
+    Tests the per-host rate limit and the bound on requests in flight.
+
+    '''
+
+    server, baseurl = standin
+    host = baseurl.replace('http://','')
+
+    client = transport.ServiceTransport(ratelimits={host:0.05})
+    start = time.time()
+    results = client.batch(
+        lambda x: client.get(baseurl + '/ok', timeout=5.0).status_code,
+        range(10),
+        nworkers=4
+    )
+    assert results == [200]*10
+    assert time.time() - start >= 0.44
+
+    client = transport.ServiceTransport(maxconcurrent=2)
+    client.batch(lambda x: client.get(baseurl + '/slow', timeout=5.0),
+                 range(8),
+                 nworkers=8)
+    assert server.maxinflight <= 2
+
+    # failing items get None, and results stay in order
+    results = client.batch(lambda x: 1.0/x, [1, 0, 2])
+    assert results == [1.0, None, 0.5]
+
+
+
+def test_skyview_get_stamps(standin, monkeypatch, tmpdir):
+    '''
+    Tests the SkyView batch stamp function against the stand-in server.
+
+    '''
+
+    server, baseurl = standin
+
+    monkeypatch.setattr(skyview, 'SKYVIEW_URL', baseurl + '/skyview')
+    monkeypatch.setattr(skyview, 'FITS_BASEURL', baseurl)
+    oldtransport = transport.set_transport(transport.ServiceTransport())
+
+    try:
+
+        ras, decls = [10.0, 20.0, 30.0, 40.0], [-5.0, 5.0, 15.0, 25.0]
+        stamps = skyview.get_stamps(ras, decls,
+                                    cachedir=str(tmpdir),
+                                    nworkers=4)
+
+        assert [x['params']['ra'] for x in stamps] == ras
+        assert all(x['provenance'] == 'new download' for x in stamps)
+        assert len(set(x['fitsfile'] for x in stamps)) == 4
+
+        # these are cached now
+        nrequests = server.nrequests
+        stamps = skyview.get_stamps(ras, decls, cachedir=str(tmpdir))
+        assert all(x['provenance'] == 'cache' for x in stamps)
+        assert server.nrequests == nrequests
+
+        # the module-level survey default isn't changed by the requests
+        assert skyview.SKYVIEW_PARAMS['survey'][0] == 'DSS2 Red'
+
+    finally:
+        transport.set_transport(oldtransport)
@@ -0,0 +1,139 @@
+'''test_signals_prewhiten.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the GLS with precomputed trig sums in astrobase.periodbase.zgls and
+the pre-whitening functions in astrobase.varbase.signals that use it.
+
+'''
+from __future__ import print_function
+
+import numpy as np
+
+from astrobase.periodbase import zgls
+from astrobase.varbase import signals
+
+
+def make_twoperiod_lc(npts=1000, periods=(1.2345, 0.4321), seed=42):
+    '''
+    This makes a light curve with two sinusoidal signals.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+
+    times = np.sort(rng.uniform(0.0, 30.0, size=npts))
+    mags = (10.0 +
+            0.1*np.sin(2.0*np.pi*times/periods[0]) +
+            0.04*np.sin(2.0*np.pi*times/periods[1] + 0.3) +
+            rng.normal(0.0, 0.005, size=npts))
+    errs = np.full_like(times, 0.005)
+
+    return times, mags, errs
+
+
+
+def test_glsp_evaluate():
+    '''
+    Tests that the precomputed GLS gives the same periodogram as pgen_lsp.
+
+    '''
+
+    times, mags, errs = make_twoperiod_lc(npts=300)
+
+    lspres = zgls.pgen_lsp(times, mags, errs,
+                           startp=0.2, endp=2.0,
+                           sigclip=None,
+                           nworkers=2,
+                           verbose=False)
+
+    omegas = 2.0*np.pi/lspres['periods']
+
+    # with and without the cached trig matrices
+    for cachetrig in (True, False):
+
+        glspstate = zgls.glsp_prepare(times, errs, omegas,
+                                      cachetrig=cachetrig,
+                                      chunksize=100)
+        lspvals = zgls.glsp_evaluate(glspstate, mags)
+
+        assert np.allclose(glspstate['periods'], lspres['periods'])
+        assert np.allclose(lspvals, lspres['lspvals'],
+                           rtol=1.0e-7, atol=1.0e-10)
+
+    # the notau form matches too
+    lspres = zgls.pgen_lsp(times, mags, errs,
+                           startp=0.2, endp=2.0,
+                           sigclip=None,
+                           nworkers=2,
+                           glspfunc=zgls.glsp_worker_notau,
+                           verbose=False)
+    lspvals = zgls.glsp_evaluate(glspstate, mags, notau=True)
+    assert np.allclose(lspvals, lspres['lspvals'],
+                       rtol=1.0e-7, atol=1.0e-10)
+
+
+
+def test_gls_prewhiten():
+    '''
+    Tests that pre-whitening recovers both of the injected periods.
+
+    '''
+
+    times, mags, errs = make_twoperiod_lc()
+
+    bestperiods = signals.gls_prewhiten(times, mags, errs,
+                                        startp_gls=0.2,
+                                        endp_gls=2.0,
+                                        nbestpeaks=2)
+
+    # one period before whitening and one per round after that
+    assert len(bestperiods) == 3
+    assert abs(bestperiods[0] - 1.2345) < 0.01
+    assert abs(bestperiods[1] - 0.4321) < 0.002
+
+
+
+def test_iterative_prewhiten():
+    '''
+    Tests iterative_prewhiten with GLS and with a non-GLS period-finder.
+
+    '''
+
+    times, mags, errs = make_twoperiod_lc()
+
+    glsres = signals.iterative_prewhiten(
+        times, mags, errs,
+        pfmethod='gls',
+        pfkwargs={'startp':0.2, 'endp':2.0},
+        nbestpeaks=2
+    )
+
+    assert glsres['method'] == 'gls'
+    assert len(glsres['bestperiods']) == 3
+    assert len(glsres['whitenparams']) == 2
+    assert abs(glsres['bestperiods'][0] - 1.2345) < 0.01
+    assert abs(glsres['bestperiods'][1] - 0.4321) < 0.002
+
+    # the same points are kept through all of the rounds
+    assert glsres['times'].size == glsres['mags'].size == glsres['errs'].size
+
+    # the first signal is mostly gone from the whitened mags
+    assert np.std(glsres['mags']) < 0.5*np.std(mags)
+
+    pdmres = signals.iterative_prewhiten(
+        times, mags, errs,
+        pfmethod='pdm',
+        pfkwargs={'startp':0.2, 'endp':2.0, 'autofreq':False,
+                  'stepsize':1.0e-3},
+        nbestpeaks=1,
+        nworkers=2
+    )
+
+    assert pdmres['method'] == 'pdm'
+    assert len(pdmres['bestperiods']) == 2
+    assert len(pdmres['lspresults']) == 2
+    assert abs(pdmres['bestperiods'][0] - 1.2345) < 0.01
+    assert abs(pdmres['bestperiods'][1] - 0.4321) < 0.002
+
+    assert signals.iterative_prewhiten(times, mags, errs,
+                                       pfmethod='nope') is None
@@ -0,0 +1,224 @@
+'''test_skyview_mosaic.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the field mosaic stamp cache in astrobase.services.skyview against a
+local stand-in for SkyView that makes mosaics with a TAN WCS on demand.
+
+'''
+from __future__ import print_function
+
+import io
+import os
+import os.path
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+import numpy as np
+import pytest
+
+from astrobase.services import skyview, transport
+
+
+###########################
+## LOCAL STAND-IN SERVER ##
+###########################
+
+def fake_mosaic(ra, decl, sizedeg, sizepix):
+    '''This makes a FITS image centered at ra, decl with a TAN WCS.
+
+    Each pixel value encodes its own position: 10000*y + x.
+
+    '''
+
+    from astropy.io import fits
+
+    yy, xx = np.mgrid[0:sizepix, 0:sizepix]
+    hdu = fits.PrimaryHDU((10000.0*yy + xx).astype(np.float32))
+    header = hdu.header
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = ra
+    header['CRVAL2'] = decl
+    header['CRPIX1'] = sizepix/2.0 + 0.5
+    header['CRPIX2'] = sizepix/2.0 + 0.5
+    header['CDELT1'] = -sizedeg/sizepix
+    header['CDELT2'] = sizedeg/sizepix
+
+    outfd = io.BytesIO()
+    hdu.writeto(outfd)
+    return outfd.getvalue()
+
+
+
+class SkyViewHandler(BaseHTTPRequestHandler):
+    '''This serves the SkyView query page and the FITS it points to.
+
+    /skyview     -> a query result page with a link to /tempspace/fits/skv<N>
+    /tempspace/* -> the FITS made for query N
+
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+
+        if url.path.startswith('/skyview'):
+
+            params = parse_qs(url.query)
+            ra, decl = [float(x) for x in params['Position'][0].split(',')]
+            sizepix = int(params['pixels'][0])
+            sizedeg = float(params.get('size', [0.25])[0])
+
+            with self.server.lock:
+                fitsid = 100000000 + len(self.server.queries)
+                self.server.queries.append((ra, decl, sizedeg, sizepix))
+                self.server.fits[fitsid] = fake_mosaic(ra, decl,
+                                                       sizedeg, sizepix)
+
+            body = ('<a href="/tempspace/fits/skv%s.fits">FITS</a>' %
+                    fitsid).encode()
+
+        else:
+            fitsid = int(url.path.split('skv')[-1].replace('.fits',''))
+            body = self.server.fits[fitsid]
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+class SkyViewServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+@pytest.fixture
+def fake_skyview(monkeypatch):
+    '''
+    This starts the stand-in SkyView and points the skyview module at it.
+
+    '''
+
+    server = SkyViewServer(('127.0.0.1', 0), SkyViewHandler)
+    server.lock = threading.Lock()
+    server.queries = []
+    server.fits = {}
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    baseurl = 'http://127.0.0.1:%s' % server.server_port
+    monkeypatch.setattr(skyview, 'SKYVIEW_URL', baseurl + '/skyview')
+    monkeypatch.setattr(skyview, 'FITS_BASEURL', baseurl)
+    oldtransport = transport.set_transport(transport.ServiceTransport())
+
+    yield server
+
+    transport.set_transport(oldtransport)
+    server.shutdown()
+    server.server_close()
+
+    for mosaic in skyview.MOSAIC_OPEN.values():
+        mosaic[0].close()
+    skyview.MOSAIC_OPEN.clear()
+    skyview.STAMP_CACHE_SIZES.clear()
+
+
+
+###########
+## TESTS ##
+###########
+
+def test_stamps_from_mosaic(fake_skyview, tmpdir):
+    '''
+    Tests that nearby objects share one mosaic and get the right sub-stamps.
+
+    '''
+
+    from astropy.wcs import WCS
+
+    rng = np.random.RandomState(42)
+    ras = 150.0 + rng.uniform(-0.05, 0.05, size=20)
+    decls = 20.0 + rng.uniform(-0.05, 0.05, size=20)
+
+    mosaicfiles = skyview.get_mosaics(ras, decls,
+                                      cachedir=str(tmpdir),
+                                      mosaicsizedeg=0.5,
+                                      mosaicsizepix=600,
+                                      sizepix=100)
+    assert len(set(mosaicfiles)) == 1
+    assert len(fake_skyview.queries) == 1
+
+    for ra, decl, mosaicfile in zip(ras, decls, mosaicfiles):
+
+        stampdict = skyview.get_stamp_from_mosaic(ra, decl,
+                                                  cachedir=str(tmpdir),
+                                                  mosaicsizedeg=0.5,
+                                                  mosaicsizepix=600,
+                                                  sizepix=100,
+                                                  verbose=False)
+        assert stampdict['fitsfile'] == mosaicfile
+        assert stampdict['stamp'].shape == (100, 100)
+
+        # the object is at the center of the stamp
+        stampwcs = WCS(stampdict['header'])
+        xcenter, ycenter = stampwcs.all_world2pix([[ra, decl]], 0)[0]
+        assert abs(xcenter - 50.0) <= 0.5 and abs(ycenter - 50.0) <= 0.5
+
+        # and each stamp pixel is the mosaic pixel at the same sky position
+        mosaicpix = stampdict['stamp'][[0, 99], [0, 99]]
+        worldcorners = stampwcs.all_pix2world([[0, 0], [99, 99]], 0)
+        mosaicwcs = WCS(skyview._open_mosaic(mosaicfile)[2])
+        mx, my = np.round(mosaicwcs.all_world2pix(worldcorners, 0)).T
+        assert np.array_equal(mosaicpix, 10000.0*my + mx)
+
+    # no more queries were made for the stamps
+    assert len(fake_skyview.queries) == 1
+
+    # an object far away needs another mosaic
+    skyview.get_stamp_from_mosaic(160.0, -10.0,
+                                  cachedir=str(tmpdir),
+                                  mosaicsizedeg=0.5,
+                                  mosaicsizepix=600,
+                                  sizepix=100,
+                                  verbose=False)
+    assert len(fake_skyview.queries) == 2
+
+
+
+def test_prune_stamp_cache(tmpdir):
+    '''
+    Tests that the least recently used files are removed first.
+
+    '''
+
+    for ind in range(5):
+        fpath = os.path.join(str(tmpdir), 'stamp-%s.fits' % ind)
+        with open(fpath,'wb') as outfd:
+            outfd.write(b'0'*1024*100)
+        os.utime(fpath, (1000.0 + ind, 1000.0 + ind))
+
+    # stamp-0 was used most recently
+    os.utime(os.path.join(str(tmpdir), 'stamp-0.fits'), (2000.0, 2000.0))
+
+    pruned = skyview.prune_stamp_cache(str(tmpdir), maxsizemb=0.25)
+
+    assert pruned['nfiles'] == 2
+    assert sorted(os.path.basename(x) for x in pruned['removed']) == [
+        'stamp-1.fits', 'stamp-2.fits', 'stamp-3.fits'
+    ]
+    assert sorted(os.listdir(str(tmpdir))) == ['stamp-0.fits', 'stamp-4.fits']
@@ -0,0 +1,67 @@
+'''test_timeutils_batch.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the batch barycentric time correction in astrobase.timeutils against
+the single-object jd_corr. This needs the JPL de430 kernel, so it's skipped if
+that isn't available and can't be downloaded.
+
+'''
+from __future__ import print_function
+
+import os
+import os.path
+
+import numpy as np
+import pytest
+
+try:
+    from astrobase import timeutils
+    HAVEKERNEL = timeutils.HAVEKERNEL
+except Exception as e:
+    HAVEKERNEL = False
+
+pytestmark = pytest.mark.skipif(not HAVEKERNEL,
+                                reason='the JPL de430 kernel is not available')
+
+
+def test_jd_corr_batch_matches_jd_corr(tmpdir):
+    '''
+    Tests that jd_corr_batch gives the same BJDs and HJDs as jd_corr.
+
+    '''
+
+    rng = np.random.RandomState(42)
+
+    # frame times with some repeated JDs
+    jd = np.repeat(np.linspace(2455000.0, 2455300.0, 500), 2)
+    ras = rng.uniform(0.0, 360.0, size=20)
+    decls = rng.uniform(-90.0, 90.0, size=20)
+
+    cachedir = os.path.join(str(tmpdir), 'jdcorr-cache')
+
+    for jd_type in ('bjd','hjd'):
+
+        batch = timeutils.jd_corr_batch(jd, ras, decls,
+                                        jd_type=jd_type,
+                                        cachedir=cachedir)
+        assert batch.shape == (ras.size, jd.size)
+
+        for ra, decl, batchjd in zip(ras, decls, batch):
+            scalar = timeutils.jd_corr(jd, ra, decl, jd_type=jd_type)
+            assert np.allclose(batchjd, scalar, rtol=0.0, atol=1.0e-8)
+
+        # the second call uses the cached ephemeris vectors
+        cached = timeutils.jd_corr_batch(jd, ras, decls,
+                                         jd_type=jd_type,
+                                         cachedir=cachedir)
+        assert np.array_equal(cached, batch)
+
+    assert len(os.listdir(cachedir)) == 2
+
+    # a single target gets back an array shaped like jd
+    single = timeutils.jd_corr_batch(jd, ras[0], decls[0],
+                                     obslon=-110.0, obslat=31.0, obsalt=2300.0)
+    scalar = timeutils.jd_corr(jd, ras[0], decls[0],
+                               obslon=-110.0, obslat=31.0, obsalt=2300.0)
+    assert single.shape == jd.shape
+    assert np.allclose(single, scalar, rtol=0.0, atol=1.0e-8)
@@ -0,0 +1,152 @@
+'''test_varfeatures_fused.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the fused non-periodic feature kernel in
+astrobase.varclass.varfeatures against the separate feature functions.
+
+'''
+from __future__ import print_function
+
+import numpy as np
+
+from astrobase.varclass import varfeatures
+
+
+def separate_features(times, mags, errs, magsarefluxes=False):
+    '''
+    This gets the features by calling each of the separate functions.
+
+    '''
+
+    finiteind = (np.isfinite(times) & np.isfinite(mags) & np.isfinite(errs) &
+                 (errs != 0.0))
+    ftimes, fmags, ferrs = times[finiteind], mags[finiteind], errs[finiteind]
+
+    features = {
+        'ndet':fmags.size,
+        'mintime':ftimes.min(),
+        'maxtime':ftimes.max(),
+        'timelength':ftimes.max() - ftimes.min(),
+        'amplitude':0.5*(fmags.max() - fmags.min()),
+        'ndetobslength_ratio':fmags.size/(ftimes.max() - ftimes.min()),
+        'linear_fit_slope':np.polyfit(ftimes, fmags, 1,
+                                      w=1.0/(ferrs*ferrs))[1],
+        'magnitude_ratio':((fmags.max() - np.median(fmags)) /
+                           (fmags.max() - fmags.min())),
+        'stetsonj':varfeatures.stetson_jindex(ftimes, fmags, ferrs,
+                                              weightbytimediff=True),
+        'stetsonk':varfeatures.stetson_kindex(fmags, ferrs),
+    }
+    features.update(varfeatures.lightcurve_moments(ftimes, fmags, ferrs))
+    features.update(varfeatures.lightcurve_ptp_measures(ftimes, fmags, ferrs))
+    features.update(
+        varfeatures.lightcurve_flux_measures(ftimes, fmags, ferrs,
+                                             magsarefluxes=magsarefluxes)
+    )
+
+    return features
+
+
+
+def make_lightcurve(rng, npts):
+    '''
+    This makes a noisy sinusoid with some NaNs and repeated times.
+
+    '''
+
+    times = 2455000.0 + np.sort(rng.uniform(0.0, 30.0, size=npts))
+    times[5] = times[4]
+    mags = (12.0 + 0.1*np.sin(2.0*np.pi*times/rng.uniform(0.5, 5.0)) +
+            rng.normal(0.0, 0.01, size=npts))
+    errs = rng.uniform(0.005, 0.02, size=npts)
+    mags[7] = np.nan
+    errs[11] = 0.0
+
+    return times, mags, errs
+
+
+
+def check_features(features, expected):
+    '''
+    This compares a feature dict to the expected one.
+
+    '''
+
+    assert set(features.keys()) == set(expected.keys())
+
+    for key in expected:
+        assert np.allclose(features[key], expected[key],
+                           rtol=1.0e-7, atol=1.0e-12, equal_nan=True), key
+
+
+
+def test_all_nonperiodic_features():
+    '''
+    Tests the fused kernel for a single light curve, mags and fluxes.
+
+    '''
+
+    rng = np.random.RandomState(42)
+
+    for npts in (13, 100, 501):
+
+        times, mags, errs = make_lightcurve(rng, npts)
+
+        check_features(varfeatures.all_nonperiodic_features(times, mags, errs),
+                       separate_features(times, mags, errs))
+
+        fluxes = 10.0**(-0.4*(mags - 12.0))
+        check_features(
+            varfeatures.all_nonperiodic_features(times, fluxes, errs,
+                                                 magsarefluxes=True),
+            separate_features(times, fluxes, errs, magsarefluxes=True)
+        )
+
+    # too few points
+    assert varfeatures.all_nonperiodic_features(times[:9],
+                                                mags[:9],
+                                                errs[:9]) is None
+
+
+
+def test_nonperiodic_features_batch():
+    '''
+    Tests the batch API for equal-length and ragged light curves.
+
+    '''
+
+    rng = np.random.RandomState(7)
+
+    # equal-length light curves on a shared time grid
+    times, mags, errs = make_lightcurve(rng, 300)
+    allmags = np.array([mags + rng.normal(0.0, 0.05, size=mags.size)
+                        for x in range(5)])
+    allmags[3, 50:60] = np.nan
+
+    batch = varfeatures.nonperiodic_features_batch(times, allmags, errs)
+    assert batch['mag_percentiles'].shape == (5, 12)
+
+    for ind in range(5):
+        check_features(varfeatures._batch_features_to_dict(batch, ind),
+                       separate_features(times, allmags[ind], errs))
+
+    # ragged light curves, including ones that are too short or empty
+    lcs = [make_lightcurve(rng, npts) for npts in (40, 250, 12, 1000)]
+    lcs.insert(2, (times[:5], mags[:5], errs[:5]))
+    lcs.insert(3, (times[:0], mags[:0], errs[:0]))
+
+    offsets = np.concatenate(([0], np.cumsum([x[0].size for x in lcs])))
+    batch = varfeatures.nonperiodic_features_batch(
+        np.concatenate([x[0] for x in lcs]),
+        np.concatenate([x[1] for x in lcs]),
+        np.concatenate([x[2] for x in lcs]),
+        offsets=offsets
+    )
+
+    assert batch['ndet'].tolist()[2:4] == [5, 0]
+    assert np.all(np.isnan(batch['stetsonj'][2:4]))
+    assert np.all(np.isnan(batch['flux_percentiles'][2:4]))
+
+    for ind in (0, 1, 4, 5):
+        check_features(varfeatures._batch_features_to_dict(batch, ind),
+                       separate_features(*lcs[ind]))
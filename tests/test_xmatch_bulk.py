@@ -0,0 +1,198 @@
+'''test_xmatch_bulk.py - Waqas Bhatti (wbhatti@astro.princeton.edu) - Oct 2018
+License: MIT - see the LICENSE file for details.
+
+This tests the bulk cross-matching functions in astrobase.coordutils and their
+use for matching checkplots to external catalogs in astrobase.checkplot and
+astrobase.lcproc.
+
+'''
+from __future__ import print_function
+
+import os.path
+import pickle
+
+import numpy as np
+
+from astrobase import coordutils, checkplot, lcproc
+
+
+# a fake catalog with clumps of sources so there are multiple matches
+RNG = np.random.RandomState(42)
+CATRA = np.concatenate((RNG.uniform(359.9, 360.1, size=500) % 360.0,
+                        RNG.uniform(120.0, 120.01, size=100)))
+CATDECL = np.concatenate((RNG.uniform(-0.1, 0.1, size=500),
+                          RNG.uniform(45.0, 45.01, size=100)))
+
+
+def brute_force_matches(ra, decl, match_radius):
+    '''
+    This returns the matches in the catalog for a single target.
+
+    '''
+
+    dist = coordutils.great_circle_dist(ra, decl, CATRA, CATDECL)
+    matchinds = np.where(dist < match_radius)[0]
+    matchinds = matchinds[np.argsort(dist[matchinds])]
+
+    return matchinds, dist[matchinds]
+
+
+
+def test_xmatch_bulk():
+    '''
+    Tests the CSR match lists against matching each target by brute force.
+
+    '''
+
+    targetra = np.concatenate((CATRA[::10] + 0.001, [200.0]))
+    targetdecl = np.concatenate((CATDECL[::10], [-30.0]))
+
+    matches = coordutils.xmatch_bulk(targetra, targetdecl,
+                                     sourcera=CATRA,
+                                     sourcedecl=CATDECL,
+                                     match_radius=60.0)
+
+    assert matches['indptr'].size == targetra.size + 1
+    assert matches['nmatches'][-1] == 0
+    assert matches['nmatches'][:-1].min() > 0
+
+    for ind in range(targetra.size):
+
+        thismatch = slice(matches['indptr'][ind], matches['indptr'][ind+1])
+        expinds, expdists = brute_force_matches(targetra[ind],
+                                                targetdecl[ind],
+                                                60.0)
+
+        assert matches['indices'][thismatch].tolist() == expinds.tolist()
+        assert np.allclose(matches['distarcsec'][thismatch], expdists,
+                           atol=1.0e-6)
+
+    # the kdtree can be reused, and closestonly gets just the first match
+    kdt = coordutils.make_kdtree(CATRA, CATDECL)
+    closest = coordutils.xmatch_bulk(targetra, targetdecl,
+                                     sourcekdtree=kdt,
+                                     match_radius=60.0,
+                                     closestonly=True)
+    assert np.array_equal(closest['nmatches'],
+                          np.minimum(matches['nmatches'], 1))
+    assert np.array_equal(closest['indices'],
+                          matches['indices'][matches['indptr'][:-1][
+                              matches['nmatches'] > 0
+                          ]])
+
+
+
+def test_neighbor_graph():
+    '''
+    Tests that the neighbor graph leaves out each object itself.
+
+    '''
+
+    graph = coordutils.neighbor_graph(CATRA, CATDECL, match_radius=30.0)
+
+    for ind in range(0, CATRA.size, 25):
+
+        nbrs = graph['indices'][graph['indptr'][ind]:graph['indptr'][ind+1]]
+        expinds, expdists = brute_force_matches(CATRA[ind], CATDECL[ind], 30.0)
+
+        assert ind not in nbrs
+        assert nbrs.tolist() == [x for x in expinds if x != ind]
+
+    # objects at the same position are still each other's neighbors
+    graph = coordutils.neighbor_graph(np.array([10.0, 10.0, 10.001]),
+                                      np.array([0.0, 0.0, 0.0]),
+                                      match_radius=10.0)
+
+    assert graph['nmatches'].tolist() == [2, 2, 2]
+    assert graph['indices'][:4].tolist() == [1, 2, 0, 2]
+    assert sorted(graph['indices'][4:].tolist()) == [0, 1]
+    assert np.allclose(graph['distarcsec'], [0.0, 3.6, 0.0, 3.6, 3.6, 3.6])
+
+
+
+def write_xmatch_catalog(outfile):
+    '''
+    This writes the fake catalog in the format used for xmatch catalogs.
+
+    '''
+
+    header = (
+        '# {"name":"Fake catalog",\n'
+        '#  "columns":[\n'
+        '#    {"key":"objectid", "dtype":"U20", "name":"Object ID", '
+        '"unit":null},\n'
+        '#    {"key":"ra", "dtype":"f8", "name":"RA", "unit":"deg"},\n'
+        '#    {"key":"decl", "dtype":"f8", "name":"Dec", "unit":"deg"}\n'
+        '#  ],\n'
+        '#  "colra":"ra",\n'
+        '#  "coldec":"decl",\n'
+        '#  "description":"Fake catalog for tests"}\n'
+    )
+
+    with open(outfile,'w') as outfd:
+        outfd.write(header)
+        for ind, (ra, decl) in enumerate(zip(CATRA, CATDECL)):
+            outfd.write('obj%04i | %.8f | %.8f\n' % (ind, ra, decl))
+
+    return outfile
+
+
+
+def test_xmatch_cplist(tmpdir):
+    '''
+    Tests that matching a checkplot list at once gives the same results as
+    matching each checkplot by itself.
+
+    '''
+
+    catfile = write_xmatch_catalog(os.path.join(str(tmpdir), 'fakecat.csv'))
+    xmatchpkl = checkplot.load_xmatch_external_catalogs(
+        [catfile],
+        [['objectid','ra','decl']],
+        outfile=os.path.join(str(tmpdir), 'xmatch.pkl')
+    )
+
+    # the kdtree is saved with the catalog
+    with open(xmatchpkl,'rb') as infd:
+        xmd = pickle.load(infd)
+    assert xmd['fakecat']['kdtree'].n == CATRA.size
+
+    cplist = []
+    targetra = list(CATRA[::50] + 0.0002) + [200.0, None]
+    targetdecl = list(CATDECL[::50]) + [-30.0, None]
+
+    for ind, (ra, decl) in enumerate(zip(targetra, targetdecl)):
+        cpd = {'objectid':'target%s' % ind,
+               'objectinfo':{'objectid':'target%s' % ind,
+                             'ra':ra,
+                             'decl':decl}}
+        cplist.append(checkplot._write_checkplot_picklefile(
+            cpd,
+            outfile=os.path.join(str(tmpdir), 'checkplot-%s.pkl' % ind)
+        ))
+
+    status = lcproc.xmatch_cplist_external_catalogs(cplist, xmatchpkl,
+                                                    xmatchradiusarcsec=5.0,
+                                                    chunksize=3)
+    assert all(status[x] == x for x in cplist)
+
+    for cpf, ra, decl in zip(cplist, targetra, targetdecl):
+
+        cpd = checkplot._read_checkplot_picklefile(cpf)
+        xmr = cpd['xmatch']['fakecat']
+
+        if ra is None:
+            assert not xmr['found']
+            continue
+
+        expected = checkplot.xmatch_external_catalogs(
+            {'objectinfo':{'ra':ra, 'decl':decl}},
+            xmatchpkl,
+            xmatchradiusarcsec=5.0,
+            returndirect=True
+        )['fakecat']
+
+        assert xmr['found'] == expected['found']
+        if xmr['found']:
+            assert xmr['info'] == expected['info']
+            assert np.allclose(xmr['distarcsec'], expected['distarcsec'])